@@ -0,0 +1,256 @@
+"""
+A client for the ADB server's host protocol, spoken directly over TCP
+instead of through the adb binary. Requests are a 4-digit hex length and an
+ASCII service name, answered with OKAY or FAIL; after host:transport the
+same socket carries a device service (exec:, shell,v2,raw: or sync:) whose
+output is read as raw bytes.
+"""
+import os
+import socket
+import struct
+import threading
+
+ADB_HOST = '127.0.0.1'
+ADB_PORT = 5037
+
+# shell protocol v2 packet ids: a 1-byte id and a little-endian u32 length
+SHELL_STDOUT = 1
+SHELL_STDERR = 2
+SHELL_EXIT = 3
+SHELL_PACKET_HEADER = '<BI'
+
+# sync protocol requests and responses: a 4-byte id and a little-endian u32
+SYNC_HEADER = '<4sI'
+SYNC_STAT_FORMAT = '<4sIII'
+SYNC_MAX_DATA = 64 * 1024
+
+class AdbConnection:
+    """
+    A socket to the ADB server with helpers for the framing used by the
+    host protocol.
+    """
+
+    def __init__(self, host, port, timeout=None):
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise RuntimeError(f"Cannot connect to the ADB server at {host}:{port}: {e}")
+
+    def send_request(self, request):
+        """Sends a host request and waits for OKAY."""
+        payload = request.encode('utf-8')
+        self.sock.sendall(f"{len(payload):04x}".encode('ascii') + payload)
+        self.read_status(request)
+
+    def read_status(self, request):
+        status = self.read_exact(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise RuntimeError(f"ADB server refused '{request}': {self.read_string()}")
+        raise RuntimeError(f"Unexpected ADB server response to '{request}': {status!r}")
+
+    def read_string(self):
+        """Reads a hex length prefixed string."""
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length).decode('utf-8', errors='replace')
+
+    def read_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise RuntimeError("ADB connection closed unexpectedly.")
+            data += chunk
+        return bytes(data)
+
+    def readinto(self, buffer):
+        """Reads raw stream data; returns 0 once the service has finished."""
+        return self.sock.recv_into(buffer)
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = self.sock.recv(SYNC_MAX_DATA)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        return self.sock.recv(size)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class AdbClient:
+    """
+    Talks to one device (serial, or the only device when None) through the
+    ADB server. Every exec or shell command costs a local TCP connection
+    rather than an adb process; sync connections, which can serve any
+    number of transfers, are kept in a pool and reused.
+    """
+
+    def __init__(self, serial=None, host=ADB_HOST, port=None, timeout=None):
+        self.serial = serial if serial is not None else os.environ.get('ANDROID_SERIAL')
+        self.host = host
+        self.port = port or int(os.environ.get('ANDROID_ADB_SERVER_PORT', ADB_PORT))
+        self.timeout = timeout
+        self._sync_pool = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def available(cls, host=ADB_HOST, port=None):
+        """Returns a client if an ADB server is listening, else None."""
+        client = cls(host=host, port=port, timeout=2)
+        try:
+            client.version()
+        except RuntimeError:
+            return None
+        client.timeout = None
+        return client
+
+    def _connect(self):
+        return AdbConnection(self.host, self.port, self.timeout)
+
+    def _host_query(self, request):
+        with self._connect() as conn:
+            conn.send_request(request)
+            return conn.read_string()
+
+    def version(self):
+        """Returns the ADB server's protocol version."""
+        return int(self._host_query('host:version'), 16)
+
+    def devices(self):
+        """Returns a list of (serial, state) for the attached devices."""
+        lines = self._host_query('host:devices').splitlines()
+        return [tuple(line.split('\t', 1)) for line in lines if '\t' in line]
+
+    def _open_service(self, service):
+        conn = self._connect()
+        try:
+            conn.send_request(f'host:transport:{self.serial}' if self.serial else 'host:transport-any')
+            conn.send_request(service)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def open_exec(self, command):
+        """
+        Runs a command with the exec: service and returns the connection,
+        from which its raw stdout is read (readinto/read) until EOF.
+        """
+        return self._open_service(f'exec:{command}')
+
+    def exec_out(self, command):
+        """Runs a command with exec: and returns its stdout as bytes."""
+        with self.open_exec(command) as conn:
+            return conn.read()
+
+    def shell(self, command):
+        """
+        Runs a command with shell protocol v2, which keeps stdout and stderr
+        apart and reports the exit status. Returns (returncode, stdout,
+        stderr), the outputs as bytes.
+        """
+        stdout, stderr = bytearray(), bytearray()
+        header_size = struct.calcsize(SHELL_PACKET_HEADER)
+        with self._open_service(f'shell,v2,raw:{command}') as conn:
+            while True:
+                try:
+                    packet_id, length = struct.unpack(SHELL_PACKET_HEADER, conn.read_exact(header_size))
+                except RuntimeError:
+                    raise RuntimeError(f"Shell command ended without an exit status: {command}")
+                data = conn.read_exact(length)
+                if packet_id == SHELL_STDOUT:
+                    stdout += data
+                elif packet_id == SHELL_STDERR:
+                    stderr += data
+                elif packet_id == SHELL_EXIT:
+                    return data[0], bytes(stdout), bytes(stderr)
+
+    def _acquire_sync(self):
+        with self._lock:
+            if self._sync_pool:
+                return self._sync_pool.pop()
+        return self._open_service('sync:')
+
+    def _release_sync(self, conn):
+        with self._lock:
+            self._sync_pool.append(conn)
+
+    def _sync_request(self, conn, request_id, path):
+        payload = path.encode('utf-8')
+        conn.sock.sendall(struct.pack(SYNC_HEADER, request_id, len(payload)) + payload)
+
+    def stat(self, path):
+        """Returns (mode, size, mtime) of a device file; mode is 0 if it does not exist."""
+        conn = self._acquire_sync()
+        try:
+            self._sync_request(conn, b'STAT', path)
+            response, mode, size, mtime = struct.unpack(SYNC_STAT_FORMAT,
+                                                        conn.read_exact(struct.calcsize(SYNC_STAT_FORMAT)))
+            if response != b'STAT':
+                raise RuntimeError(f"Unexpected sync response to STAT: {response!r}")
+        except BaseException:
+            conn.close()
+            raise
+        self._release_sync(conn)
+        return mode, size, mtime
+
+    def pull(self, remote_path, f_out):
+        """
+        Copies a device file into a binary file object with the sync
+        protocol. Returns the number of bytes written.
+        """
+        conn = self._acquire_sync()
+        header_size = struct.calcsize(SYNC_HEADER)
+        buffer = memoryview(bytearray(SYNC_MAX_DATA))
+        written = 0
+        try:
+            self._sync_request(conn, b'RECV', remote_path)
+            while True:
+                response, length = struct.unpack(SYNC_HEADER, conn.read_exact(header_size))
+                if response == b'DONE':
+                    break
+                if response == b'FAIL':
+                    message = conn.read_exact(length).decode('utf-8', errors='replace')
+                    raise RuntimeError(f"Failed to pull {remote_path}: {message}")
+                if response != b'DATA' or length > SYNC_MAX_DATA:
+                    raise RuntimeError(f"Unexpected sync response while pulling {remote_path}: {response!r}")
+                received = 0
+                while received < length:
+                    n = conn.readinto(buffer[received:length])
+                    if not n:
+                        raise RuntimeError("ADB connection closed unexpectedly.")
+                    received += n
+                f_out.write(buffer[:length])
+                written += length
+        except BaseException:
+            conn.close()
+            raise
+        self._release_sync(conn)
+        return written
+
+    def close(self):
+        """Closes the pooled sync connections."""
+        with self._lock:
+            pool, self._sync_pool = self._sync_pool, []
+        for conn in pool:
+            try:
+                self._sync_request(conn, b'QUIT', '')
+            except OSError:
+                pass
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
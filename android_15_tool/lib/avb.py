@@ -0,0 +1,722 @@
+"""
+Native parsing and verification of Android Verified Boot 2.0 metadata.
+
+Handles the AvbFooter appended to partition images, standalone vbmeta
+images, the vbmeta descriptors (property, hash, hashtree, kernel cmdline and
+chain partition) and RSA signature checks, and signs images with hash or
+hashtree footers from a PEM key, without avbtool.
+"""
+import base64
+import hashlib
+import os
+import struct
+
+from android_15_tool.lib.hashtree import append_hash_tree, verify_hash_tree
+from android_15_tool.lib.stream_io import map_file, hash_file
+
+AVB_FOOTER_MAGIC = b'AVBf'
+AVB_FOOTER_SIZE = 64
+# magic, version major/minor, original_image_size, vbmeta_offset, vbmeta_size
+AVB_FOOTER_FORMAT = '!4sLLQQQ28x'
+
+AVB_MAGIC = b'AVB0'
+AVB_VBMETA_HEADER_SIZE = 256
+# magic, libavb version, auth/aux block sizes, algorithm, hash, signature,
+# public key, public key metadata and descriptor (offset, size) pairs,
+# rollback index, flags, rollback index location, release string
+AVB_VBMETA_HEADER_FORMAT = '!4sLLQQL10QQLL48s80x'
+
+AVB_DESCRIPTOR_HEADER_FORMAT = '!QQ'
+AVB_PROPERTY_DESCRIPTOR_FORMAT = '!QQ'
+AVB_HASHTREE_DESCRIPTOR_FORMAT = '!LQQQLLLQQ32sLLLL60x'
+AVB_HASH_DESCRIPTOR_FORMAT = '!Q32sLLLL60x'
+AVB_KERNEL_CMDLINE_DESCRIPTOR_FORMAT = '!LL'
+AVB_CHAIN_PARTITION_DESCRIPTOR_FORMAT = '!LLLL60x'
+
+DESCRIPTOR_TAGS = {
+    0: 'property',
+    1: 'hashtree',
+    2: 'hash',
+    3: 'kernel_cmdline',
+    4: 'chain_partition',
+}
+
+# algorithm type -> (name, hash algorithm, digest size, signature size)
+AVB_ALGORITHMS = {
+    0: ('NONE', None, 0, 0),
+    1: ('SHA256_RSA2048', 'sha256', 32, 256),
+    2: ('SHA256_RSA4096', 'sha256', 32, 512),
+    3: ('SHA256_RSA8192', 'sha256', 32, 1024),
+    4: ('SHA512_RSA2048', 'sha512', 64, 256),
+    5: ('SHA512_RSA4096', 'sha512', 64, 512),
+    6: ('SHA512_RSA8192', 'sha512', 64, 1024),
+}
+
+# DER-encoded DigestInfo prefixes for PKCS#1 v1.5 signatures
+DIGEST_INFO_PREFIXES = {
+    'sha256': bytes.fromhex('3031300d060960864801650304020105000420'),
+    'sha512': bytes.fromhex('3051300d060960864801650304020305000440'),
+}
+
+def _round_to_multiple(size, multiple):
+    """Rounds a size up to a multiple."""
+    return (size + multiple - 1) // multiple * multiple
+
+def _cstr(raw):
+    """Decodes a NUL-padded string."""
+    return bytes(raw).split(b'\x00', 1)[0].decode('utf-8', errors='replace')
+
+def decode_public_key(blob):
+    """
+    Decodes an AVB public key blob (key_num_bits, n0inv, modulus, rr).
+    Returns a tuple of (modulus, key_num_bits).
+    """
+    if len(blob) < 8:
+        raise ValueError("AVB public key is too short.")
+    key_num_bits = struct.unpack_from('!L', blob, 0)[0]
+    modulus_size = key_num_bits // 8
+    if len(blob) < 8 + 2 * modulus_size:
+        raise ValueError("AVB public key is truncated.")
+    modulus = int.from_bytes(bytes(blob[8:8 + modulus_size]), 'big')
+    return modulus, key_num_bits
+
+def rsa_verify(public_key_blob, hash_algorithm, digest, signature):
+    """
+    Checks a PKCS#1 v1.5 RSA signature (public exponent 65537) over a digest.
+    """
+    modulus, key_num_bits = decode_public_key(public_key_blob)
+    key_size = key_num_bits // 8
+    if len(signature) != key_size:
+        return False
+    decrypted = pow(int.from_bytes(bytes(signature), 'big'), 65537, modulus).to_bytes(key_size, 'big')
+    digest_info = DIGEST_INFO_PREFIXES[hash_algorithm] + digest
+    expected = b'\x00\x01' + b'\xff' * (key_size - len(digest_info) - 3) + b'\x00' + digest_info
+    return decrypted == expected
+
+def parse_footer(buf):
+    """
+    Parses the AvbFooter in the last 64 bytes of a buffer.
+    Returns a dict, or None if there is no footer.
+    """
+    if len(buf) < AVB_FOOTER_SIZE:
+        return None
+    (magic, version_major, version_minor, original_image_size, vbmeta_offset,
+     vbmeta_size) = struct.unpack_from(AVB_FOOTER_FORMAT, buf, len(buf) - AVB_FOOTER_SIZE)
+    if magic != AVB_FOOTER_MAGIC:
+        return None
+    return {
+        'version_major': version_major,
+        'version_minor': version_minor,
+        'original_image_size': original_image_size,
+        'vbmeta_offset': vbmeta_offset,
+        'vbmeta_size': vbmeta_size,
+    }
+
+def _parse_descriptor(tag, body):
+    """Parses the body of a single vbmeta descriptor into a dict."""
+    descriptor = {'tag': tag, 'type': DESCRIPTOR_TAGS.get(tag, 'unknown')}
+
+    if tag == 0:
+        key_size, value_size = struct.unpack_from(AVB_PROPERTY_DESCRIPTOR_FORMAT, body, 0)
+        offset = struct.calcsize(AVB_PROPERTY_DESCRIPTOR_FORMAT)
+        descriptor['key'] = bytes(body[offset:offset + key_size]).decode('utf-8', errors='replace')
+        offset += key_size + 1
+        descriptor['value'] = bytes(body[offset:offset + value_size])
+
+    elif tag == 1:
+        (dm_verity_version, image_size, tree_offset, tree_size, data_block_size,
+         hash_block_size, fec_num_roots, fec_offset, fec_size, hash_algorithm,
+         name_size, salt_size, digest_size, flags) = struct.unpack_from(
+            AVB_HASHTREE_DESCRIPTOR_FORMAT, body, 0)
+        offset = struct.calcsize(AVB_HASHTREE_DESCRIPTOR_FORMAT)
+        descriptor.update({
+            'dm_verity_version': dm_verity_version,
+            'image_size': image_size,
+            'tree_offset': tree_offset,
+            'tree_size': tree_size,
+            'data_block_size': data_block_size,
+            'hash_block_size': hash_block_size,
+            'fec_num_roots': fec_num_roots,
+            'fec_offset': fec_offset,
+            'fec_size': fec_size,
+            'hash_algorithm': _cstr(hash_algorithm),
+            'flags': flags,
+        })
+        descriptor['partition_name'] = bytes(body[offset:offset + name_size]).decode('utf-8', errors='replace')
+        offset += name_size
+        descriptor['salt'] = bytes(body[offset:offset + salt_size])
+        offset += salt_size
+        descriptor['root_digest'] = bytes(body[offset:offset + digest_size])
+
+    elif tag == 2:
+        (image_size, hash_algorithm, name_size, salt_size, digest_size,
+         flags) = struct.unpack_from(AVB_HASH_DESCRIPTOR_FORMAT, body, 0)
+        offset = struct.calcsize(AVB_HASH_DESCRIPTOR_FORMAT)
+        descriptor.update({
+            'image_size': image_size,
+            'hash_algorithm': _cstr(hash_algorithm),
+            'flags': flags,
+        })
+        descriptor['partition_name'] = bytes(body[offset:offset + name_size]).decode('utf-8', errors='replace')
+        offset += name_size
+        descriptor['salt'] = bytes(body[offset:offset + salt_size])
+        offset += salt_size
+        descriptor['digest'] = bytes(body[offset:offset + digest_size])
+
+    elif tag == 3:
+        flags, cmdline_size = struct.unpack_from(AVB_KERNEL_CMDLINE_DESCRIPTOR_FORMAT, body, 0)
+        offset = struct.calcsize(AVB_KERNEL_CMDLINE_DESCRIPTOR_FORMAT)
+        descriptor['flags'] = flags
+        descriptor['kernel_cmdline'] = bytes(body[offset:offset + cmdline_size]).decode('utf-8', errors='replace')
+
+    elif tag == 4:
+        (rollback_index_location, name_size, public_key_size,
+         flags) = struct.unpack_from(AVB_CHAIN_PARTITION_DESCRIPTOR_FORMAT, body, 0)
+        offset = struct.calcsize(AVB_CHAIN_PARTITION_DESCRIPTOR_FORMAT)
+        descriptor.update({
+            'rollback_index_location': rollback_index_location,
+            'flags': flags,
+        })
+        descriptor['partition_name'] = bytes(body[offset:offset + name_size]).decode('utf-8', errors='replace')
+        offset += name_size
+        descriptor['public_key'] = bytes(body[offset:offset + public_key_size])
+
+    return descriptor
+
+def parse_descriptors(buf):
+    """
+    Parses a packed list of vbmeta descriptors.
+    """
+    descriptors = []
+    offset = 0
+    header_size = struct.calcsize(AVB_DESCRIPTOR_HEADER_FORMAT)
+    while offset + header_size <= len(buf):
+        tag, num_bytes_following = struct.unpack_from(AVB_DESCRIPTOR_HEADER_FORMAT, buf, offset)
+        body_start = offset + header_size
+        if num_bytes_following % 8 or body_start + num_bytes_following > len(buf):
+            raise ValueError(f"Invalid vbmeta descriptor at offset {offset}.")
+        descriptors.append(_parse_descriptor(tag, buf[body_start:body_start + num_bytes_following]))
+        offset = body_start + num_bytes_following
+    return descriptors
+
+class VBMeta:
+    """
+    A parsed vbmeta image: header, descriptors and signing material.
+    """
+
+    def __init__(self, buf):
+        if len(buf) < AVB_VBMETA_HEADER_SIZE or bytes(buf[:4]) != AVB_MAGIC:
+            raise ValueError("Invalid vbmeta image: incorrect magic.")
+
+        fields = struct.unpack_from(AVB_VBMETA_HEADER_FORMAT, buf, 0)
+        (_, libavb_major, libavb_minor, auth_size, aux_size, algorithm_type,
+         hash_offset, hash_size, signature_offset, signature_size,
+         public_key_offset, public_key_size, public_key_metadata_offset,
+         public_key_metadata_size, descriptors_offset, descriptors_size,
+         rollback_index, flags, rollback_index_location, release_string) = fields
+
+        if algorithm_type not in AVB_ALGORITHMS:
+            raise ValueError(f"Unknown vbmeta algorithm type: {algorithm_type}")
+        if AVB_VBMETA_HEADER_SIZE + auth_size + aux_size > len(buf):
+            raise ValueError("vbmeta image is truncated.")
+
+        self.header = {
+            'required_libavb_version': f"{libavb_major}.{libavb_minor}",
+            'authentication_data_block_size': auth_size,
+            'auxiliary_data_block_size': aux_size,
+            'algorithm': AVB_ALGORITHMS[algorithm_type][0],
+            'algorithm_type': algorithm_type,
+            'rollback_index': rollback_index,
+            'flags': flags,
+            'rollback_index_location': rollback_index_location,
+            'release_string': _cstr(release_string),
+        }
+        self.size = AVB_VBMETA_HEADER_SIZE + auth_size + aux_size
+
+        auth = buf[AVB_VBMETA_HEADER_SIZE:AVB_VBMETA_HEADER_SIZE + auth_size]
+        aux = buf[AVB_VBMETA_HEADER_SIZE + auth_size:self.size]
+
+        def block(data, offset, size, name):
+            if offset + size > len(data):
+                raise ValueError(f"vbmeta {name} lies outside its block.")
+            return bytes(data[offset:offset + size])
+
+        self.hash = block(auth, hash_offset, hash_size, 'hash')
+        self.signature = block(auth, signature_offset, signature_size, 'signature')
+        self.public_key = block(aux, public_key_offset, public_key_size, 'public key')
+        self.public_key_metadata = block(aux, public_key_metadata_offset, public_key_metadata_size,
+                                         'public key metadata')
+        self.descriptors = parse_descriptors(block(aux, descriptors_offset, descriptors_size, 'descriptors'))
+
+        # The signed data is the header followed by the auxiliary block
+        self._signed_data = bytes(buf[:AVB_VBMETA_HEADER_SIZE]) + bytes(aux)
+
+    @property
+    def properties(self):
+        """Returns the property descriptors as a dict of key -> bytes."""
+        return {d['key']: d['value'] for d in self.descriptors if d['type'] == 'property'}
+
+    def property_string(self, key):
+        """Returns a property value as a string, or None."""
+        value = self.properties.get(key)
+        if value is None:
+            return None
+        return value.rstrip(b'\x00').decode('utf-8', errors='replace')
+
+    def build_property(self, name):
+        """
+        Looks up a com.android.build.<partition>.<name> property, preferring
+        the partition described by this vbmeta's own hash/hashtree descriptor.
+        """
+        partitions = [d['partition_name'] for d in self.descriptors if d['type'] in ('hash', 'hashtree')]
+        for partition in partitions:
+            value = self.property_string(f"com.android.build.{partition}.{name}")
+            if value is not None:
+                return value
+        for key in self.properties:
+            if key.startswith('com.android.build.') and key.endswith(f'.{name}'):
+                return self.property_string(key)
+        return None
+
+    @property
+    def public_key_digest(self):
+        """The SHA-1 of the embedded public key, as printed by avbtool."""
+        return hashlib.sha1(self.public_key).hexdigest() if self.public_key else None
+
+    def verify_signature(self):
+        """
+        Verifies the vbmeta hash and RSA signature against the embedded key.
+        Returns True for a valid signature, False otherwise. Unsigned
+        (algorithm NONE) vbmeta images are reported as False.
+        """
+        _, hash_algorithm, _, _ = AVB_ALGORITHMS[self.header['algorithm_type']]
+        if hash_algorithm is None or not self.public_key:
+            return False
+        digest = hashlib.new(hash_algorithm, self._signed_data).digest()
+        if digest != self.hash:
+            return False
+        return rsa_verify(self.public_key, hash_algorithm, digest, self.signature)
+
+def parse_avb_metadata(buf):
+    """
+    Finds and parses AVB metadata in a buffer: either an AvbFooter pointing
+    at an embedded vbmeta, or a standalone vbmeta image.
+    Returns a tuple of (footer or None, VBMeta), or (None, None) if absent.
+    """
+    footer = parse_footer(buf)
+    if footer:
+        start = footer['vbmeta_offset']
+        end = start + footer['vbmeta_size']
+        if end > len(buf):
+            raise ValueError("AVB footer points past the end of the image.")
+        return footer, VBMeta(buf[start:end])
+    if bytes(buf[:4]) == AVB_MAGIC:
+        return None, VBMeta(buf)
+    return None, None
+
+class AvbImage:
+    """
+    Reads the AVB footer and vbmeta of a partition or vbmeta image and
+    verifies it against the image data.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.footer = None
+        self.vbmeta = None
+
+    def parse(self):
+        """
+        Parses the footer and vbmeta. Raises RuntimeError if the image has no
+        AVB metadata.
+        """
+        try:
+            with map_file(self.filepath) as view:
+                self.footer, self.vbmeta = parse_avb_metadata(view)
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error processing AVB metadata: {e}")
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {self.filepath}")
+        if self.vbmeta is None:
+            raise RuntimeError(f"No AVB footer or vbmeta found in {self.filepath}")
+        return self.vbmeta
+
+    def _image_for_partition(self, partition_name, image_dir):
+        """
+        Returns the image holding a partition's data: this image when it
+        carries a footer for that partition, else <image_dir>/<name>.img.
+        """
+        own = [d['partition_name'] for d in self.vbmeta.descriptors if d['type'] in ('hash', 'hashtree')]
+        if self.footer and own == [partition_name]:
+            return self.filepath
+        candidate = os.path.join(image_dir or os.path.dirname(self.filepath), f"{partition_name}.img")
+        if os.path.abspath(candidate) != os.path.abspath(self.filepath) and os.path.exists(candidate):
+            return candidate
+        if self.footer and partition_name in own:
+            return self.filepath
+        return None
+
+    def _verify_hash_descriptor(self, descriptor, image_dir):
+        """Streams a partition image through its hash descriptor's digest."""
+        path = self._image_for_partition(descriptor['partition_name'], image_dir)
+        if path is None:
+            return 'missing', "image not found"
+        try:
+            hasher = hashlib.new(descriptor['hash_algorithm'], descriptor['salt'])
+            hash_file(path, hasher, 0, descriptor['image_size'])
+        except ValueError as e:
+            return 'mismatch', str(e)
+        if hasher.digest() != descriptor['digest']:
+            return 'mismatch', f"digest {hasher.hexdigest()} does not match"
+        return 'ok', path
+
+    def _verify_hashtree_descriptor(self, descriptor, image_dir):
+        """Rebuilds a partition's dm-verity hash tree and compares it."""
+        path = self._image_for_partition(descriptor['partition_name'], image_dir)
+        if path is None:
+            return 'missing', "image not found"
+        return verify_hash_tree(path, descriptor)
+
+    def _verify_chain_descriptor(self, descriptor, image_dir):
+        """
+        Checks that a chained partition is signed with the expected key.
+        Returns (status, detail, chained AvbImage); the image is None
+        unless the check passed.
+        """
+        path = os.path.join(image_dir or os.path.dirname(self.filepath),
+                            f"{descriptor['partition_name']}.img")
+        if not os.path.exists(path):
+            return 'missing', "image not found", None
+        chained = AvbImage(path)
+        try:
+            chained.parse()
+        except RuntimeError as e:
+            return 'mismatch', str(e), None
+        if chained.vbmeta.public_key != descriptor['public_key']:
+            return 'mismatch', "signed with a different key than the chain descriptor expects", None
+        if not chained.vbmeta.verify_signature():
+            return 'mismatch', "invalid vbmeta signature", None
+        return 'ok', path, chained
+
+    def verify(self, image_dir=None, _chain=frozenset()):
+        """
+        Verifies the vbmeta signature and every hash, hashtree and chain
+        partition descriptor. Partition images other than this one are looked up as
+        <image_dir>/<partition_name>.img. A chained partition's own
+        descriptors are verified too and reported as '<partition>: <check>'.
+        Returns a list of (check, status, detail) tuples where status is one
+        of 'ok', 'mismatch', 'missing' or 'skipped'.
+        """
+        if self.vbmeta is None:
+            self.parse()
+        # Images already on the chain, so a chain that loops back stops
+        chain = _chain | {os.path.abspath(self.filepath)}
+
+        results = []
+        if self.vbmeta.header['algorithm_type'] == 0:
+            results.append(('vbmeta signature', 'skipped', 'unsigned (algorithm NONE)'))
+        elif self.vbmeta.verify_signature():
+            results.append(('vbmeta signature', 'ok', f"key sha1 {self.vbmeta.public_key_digest}"))
+        else:
+            results.append(('vbmeta signature', 'mismatch', 'invalid signature'))
+
+        for descriptor in self.vbmeta.descriptors:
+            name = descriptor.get('partition_name')
+            if descriptor['type'] == 'hash':
+                status, detail = self._verify_hash_descriptor(descriptor, image_dir)
+                results.append((f"hash: {name}", status, detail))
+            elif descriptor['type'] == 'chain_partition':
+                status, detail, chained = self._verify_chain_descriptor(descriptor, image_dir)
+                results.append((f"chain: {name}", status, detail))
+                if chained is not None and os.path.abspath(chained.filepath) not in chain:
+                    # The chain line already covers the chained vbmeta's signature
+                    for check, status, detail in chained.verify(image_dir, chain)[1:]:
+                        results.append((f"{name}: {check}", status, detail))
+            elif descriptor['type'] == 'hashtree':
+                status, detail = self._verify_hashtree_descriptor(descriptor, image_dir)
+                results.append((f"hashtree: {name}", status, detail))
+        return results
+
+AVB_BLOCK_SIZE = 4096
+AVB_RELEASE_STRING = 'android_15_tool 1.0'
+
+def _der_read(buf, offset):
+    """
+    Reads one DER TLV. Returns a tuple of (tag, value, next_offset).
+    """
+    if offset + 2 > len(buf):
+        raise ValueError("Truncated DER data.")
+    tag = buf[offset]
+    length = buf[offset + 1]
+    offset += 2
+    if length & 0x80:
+        num_bytes = length & 0x7f
+        if not num_bytes or offset + num_bytes > len(buf):
+            raise ValueError("Invalid DER length.")
+        length = int.from_bytes(buf[offset:offset + num_bytes], 'big')
+        offset += num_bytes
+    if offset + length > len(buf):
+        raise ValueError("Truncated DER data.")
+    return tag, buf[offset:offset + length], offset + length
+
+def _der_sequence(buf):
+    """Returns the list of (tag, value) elements of a DER SEQUENCE."""
+    tag, body, _ = _der_read(buf, 0)
+    if tag != 0x30:
+        raise ValueError("Expected a DER SEQUENCE.")
+    elements = []
+    offset = 0
+    while offset < len(body):
+        tag, value, offset = _der_read(body, offset)
+        elements.append((tag, value))
+    return elements
+
+def load_private_key(key_path):
+    """
+    Loads an unencrypted RSA private key from a PEM file in PKCS#1
+    ("RSA PRIVATE KEY") or PKCS#8 ("PRIVATE KEY") form.
+    Returns a dict with the modulus, exponents and CRT parameters.
+    """
+    with open(key_path, 'r') as f:
+        pem = f.read()
+
+    blocks = {}
+    label = None
+    for line in pem.splitlines():
+        line = line.strip()
+        if line.startswith('-----BEGIN '):
+            label = line[len('-----BEGIN '):].rstrip('-')
+            blocks[label] = []
+        elif line.startswith('-----END '):
+            label = None
+        elif label:
+            blocks[label].append(line)
+
+    if 'RSA PRIVATE KEY' in blocks:
+        der = base64.b64decode(''.join(blocks['RSA PRIVATE KEY']))
+    elif 'PRIVATE KEY' in blocks:
+        elements = _der_sequence(base64.b64decode(''.join(blocks['PRIVATE KEY'])))
+        if len(elements) < 3 or elements[2][0] != 0x04:
+            raise ValueError("Unsupported PKCS#8 private key.")
+        der = elements[2][1]
+    else:
+        raise ValueError(f"No unencrypted RSA private key found in {key_path}")
+
+    elements = _der_sequence(der)
+    if len(elements) < 9 or any(tag != 0x02 for tag, _ in elements[:9]):
+        raise ValueError("Malformed RSA private key.")
+    n, e, d, p, q, dp, dq, qinv = (int.from_bytes(value, 'big') for _, value in elements[1:9])
+    return {'n': n, 'e': e, 'd': d, 'p': p, 'q': q, 'dp': dp, 'dq': dq, 'qinv': qinv,
+            'num_bits': n.bit_length()}
+
+def encode_public_key(modulus):
+    """
+    Encodes an RSA modulus as an AVB public key blob: key_num_bits, n0inv,
+    the modulus and R^2 mod n, as used by libavb's Montgomery arithmetic.
+    """
+    num_bits = modulus.bit_length()
+    b = 2 ** 32
+    n0inv = b - pow(modulus % b, -1, b)
+    rr = pow(2, 2 * num_bits, modulus)
+    return (struct.pack('!LL', num_bits, n0inv) + modulus.to_bytes(num_bits // 8, 'big')
+            + rr.to_bytes(num_bits // 8, 'big'))
+
+def rsa_sign(key, hash_algorithm, digest):
+    """
+    Produces a PKCS#1 v1.5 signature over a digest using the CRT form of the
+    private key.
+    """
+    key_size = key['num_bits'] // 8
+    digest_info = DIGEST_INFO_PREFIXES[hash_algorithm] + digest
+    padded = b'\x00\x01' + b'\xff' * (key_size - len(digest_info) - 3) + b'\x00' + digest_info
+    m = int.from_bytes(padded, 'big')
+    m1 = pow(m, key['dp'], key['p'])
+    m2 = pow(m, key['dq'], key['q'])
+    h = key['qinv'] * (m1 - m2) % key['p']
+    return (m2 + h * key['q']).to_bytes(key_size, 'big')
+
+def _pad_descriptor(tag, body):
+    """Wraps a descriptor body with its header, padded to 8 bytes."""
+    body += b'\x00' * (-len(body) % 8)
+    return struct.pack(AVB_DESCRIPTOR_HEADER_FORMAT, tag, len(body)) + body
+
+def encode_property_descriptor(key, value):
+    """Encodes a property descriptor."""
+    key = key.encode('utf-8') if isinstance(key, str) else key
+    value = value.encode('utf-8') if isinstance(value, str) else value
+    return _pad_descriptor(0, struct.pack(AVB_PROPERTY_DESCRIPTOR_FORMAT, len(key), len(value))
+                           + key + b'\x00' + value + b'\x00')
+
+def encode_hash_descriptor(partition_name, image_size, hash_algorithm, salt, digest, flags=0):
+    """Encodes a hash descriptor."""
+    name = partition_name.encode('utf-8')
+    body = struct.pack(AVB_HASH_DESCRIPTOR_FORMAT, image_size, hash_algorithm.encode('ascii'),
+                       len(name), len(salt), len(digest), flags)
+    return _pad_descriptor(2, body + name + salt + digest)
+
+def encode_hashtree_descriptor(partition_name, tree, flags=0):
+    """
+    Encodes a hashtree descriptor from the dict returned by
+    hashtree.append_hash_tree.
+    """
+    name = partition_name.encode('utf-8')
+    body = struct.pack(AVB_HASHTREE_DESCRIPTOR_FORMAT, tree['dm_verity_version'], tree['image_size'],
+                       tree['tree_offset'], tree['tree_size'], tree['data_block_size'],
+                       tree['hash_block_size'], 0, 0, 0, tree['hash_algorithm'].encode('ascii'),
+                       len(name), len(tree['salt']), len(tree['root_digest']), flags)
+    return _pad_descriptor(1, body + name + tree['salt'] + tree['root_digest'])
+
+def _resolve_algorithm(algorithm, key):
+    """
+    Picks the algorithm type for a key: the named algorithm if given,
+    SHA256 with the key's size otherwise, NONE without a key.
+    """
+    if key is None:
+        if algorithm not in (None, 'NONE'):
+            raise ValueError(f"Algorithm {algorithm} requires a signing key.")
+        return 0
+    if algorithm is None:
+        algorithm = f"SHA256_RSA{key['num_bits']}"
+    for algorithm_type, (name, _, _, signature_size) in AVB_ALGORITHMS.items():
+        if name == algorithm:
+            if algorithm_type and signature_size * 8 != key['num_bits']:
+                raise ValueError(f"Algorithm {algorithm} does not match a {key['num_bits']}-bit key.")
+            return algorithm_type
+    raise ValueError(f"Unknown AVB algorithm: {algorithm}")
+
+def build_vbmeta(descriptors, key=None, algorithm=None, rollback_index=0, flags=0,
+                 rollback_index_location=0, release_string=AVB_RELEASE_STRING):
+    """
+    Builds a vbmeta image from encoded descriptors, signed with the key
+    returned by load_private_key (or unsigned without a key).
+    """
+    algorithm_type = _resolve_algorithm(algorithm, key)
+    _, hash_algorithm, hash_size, signature_size = AVB_ALGORITHMS[algorithm_type]
+
+    descriptors = b''.join(descriptors)
+    public_key = encode_public_key(key['n']) if algorithm_type else b''
+    aux = descriptors + public_key
+    aux += b'\x00' * (-len(aux) % 64)
+    auth_size = _round_to_multiple(hash_size + signature_size, 64)
+
+    header = struct.pack(
+        AVB_VBMETA_HEADER_FORMAT, AVB_MAGIC, 1, 0, auth_size, len(aux), algorithm_type,
+        0, hash_size, hash_size, signature_size,
+        len(descriptors), len(public_key), len(descriptors) + len(public_key), 0,
+        0, len(descriptors),
+        rollback_index, flags, rollback_index_location, release_string.encode('utf-8')[:47])
+
+    auth = b''
+    if algorithm_type:
+        digest = hashlib.new(hash_algorithm, header + aux).digest()
+        auth = digest + rsa_sign(key, hash_algorithm, digest)
+    auth += b'\x00' * (auth_size - len(auth))
+    return header + auth + aux
+
+def read_footer_metadata(f):
+    """
+    Returns the footer and vbmeta already at the end of an open image, so
+    re-signing can keep its original size and properties.
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size < AVB_FOOTER_SIZE:
+        return None, None, size
+    f.seek(size - AVB_FOOTER_SIZE)
+    footer = parse_footer(f.read(AVB_FOOTER_SIZE))
+    if footer is None:
+        return None, None, size
+    f.seek(footer['vbmeta_offset'])
+    return footer, VBMeta(f.read(footer['vbmeta_size'])), size
+
+def _write_footer(f, original_image_size, vbmeta_offset, vbmeta, partition_size):
+    """
+    Writes vbmeta at vbmeta_offset and the AVB footer at the end of the
+    partition. Anything stale between them is dropped by truncating, which
+    leaves a hole instead of rewriting the image.
+    """
+    vbmeta_end = vbmeta_offset + len(vbmeta)
+    if partition_size is None:
+        partition_size = _round_to_multiple(vbmeta_end, AVB_BLOCK_SIZE) + AVB_BLOCK_SIZE
+    if vbmeta_end > partition_size - AVB_FOOTER_SIZE:
+        raise ValueError(f"Image and vbmeta ({vbmeta_end} bytes) do not fit in a {partition_size} byte partition.")
+
+    f.truncate(vbmeta_offset)
+    f.seek(vbmeta_offset)
+    f.write(vbmeta)
+    f.truncate(partition_size)
+    f.seek(partition_size - AVB_FOOTER_SIZE)
+    f.write(struct.pack(AVB_FOOTER_FORMAT, AVB_FOOTER_MAGIC, 1, 0, original_image_size,
+                        vbmeta_offset, len(vbmeta)))
+    return partition_size
+
+def _carried_properties(vbmeta, props):
+    """Keeps properties from a previous signature unless overridden."""
+    merged = dict(vbmeta.properties) if vbmeta else {}
+    for key, value in (props or {}).items():
+        merged[key] = value.encode('utf-8') if isinstance(value, str) else value
+    return [encode_property_descriptor(k, v) for k, v in merged.items()]
+
+def add_hash_footer(image_path, partition_name, key_path=None, algorithm=None, partition_size=None,
+                    salt=None, hash_algorithm='sha256', props=None, rollback_index=0, flags=0,
+                    rollback_index_location=0):
+    """
+    Signs an image in place with a hash descriptor, like
+    'avbtool add_hash_footer'. The digest is computed in a single streaming
+    pass over the image. An existing footer is reused: the original image
+    size, vbmeta offset and (unless given) partition size and properties are
+    kept, so re-signing never touches the image data.
+    Returns the new footer dict.
+    """
+    key = load_private_key(key_path) if key_path else None
+    if salt is None:
+        salt = os.urandom(hashlib.new(hash_algorithm).digest_size)
+
+    with open(image_path, 'r+b') as f:
+        footer, old_vbmeta, size = read_footer_metadata(f)
+        original_image_size = footer['original_image_size'] if footer else size
+        if partition_size is None and footer:
+            partition_size = size
+
+        hasher = hashlib.new(hash_algorithm, salt)
+        hash_file(image_path, hasher, 0, original_image_size)
+        descriptors = [encode_hash_descriptor(partition_name, original_image_size, hash_algorithm,
+                                              salt, hasher.digest())]
+        descriptors += _carried_properties(old_vbmeta, props)
+        vbmeta = build_vbmeta(descriptors, key, algorithm, rollback_index, flags, rollback_index_location)
+
+        vbmeta_offset = _round_to_multiple(original_image_size, AVB_BLOCK_SIZE)
+        partition_size = _write_footer(f, original_image_size, vbmeta_offset, vbmeta, partition_size)
+
+    return {'original_image_size': original_image_size, 'vbmeta_offset': vbmeta_offset,
+            'vbmeta_size': len(vbmeta), 'partition_size': partition_size}
+
+def add_hashtree_footer(image_path, partition_name, key_path=None, algorithm=None, partition_size=None,
+                        salt=None, hash_algorithm='sha256', block_size=AVB_BLOCK_SIZE, props=None,
+                        rollback_index=0, workers=None, flags=0, rollback_index_location=0):
+    """
+    Appends a dm-verity hash tree, vbmeta and footer to an image in place,
+    like 'avbtool add_hashtree_footer'. An existing tree and footer are
+    replaced; the image data itself is only read.
+    Returns the new footer dict.
+    """
+    key = load_private_key(key_path) if key_path else None
+
+    with open(image_path, 'r+b') as f:
+        footer, old_vbmeta, size = read_footer_metadata(f)
+        original_image_size = footer['original_image_size'] if footer else size
+        if partition_size is None and footer:
+            partition_size = size
+        f.truncate(original_image_size)
+
+    tree = append_hash_tree(image_path, block_size, hash_algorithm, salt, workers)
+    descriptors = [encode_hashtree_descriptor(partition_name, tree)]
+    descriptors += _carried_properties(old_vbmeta, props)
+    vbmeta = build_vbmeta(descriptors, key, algorithm, rollback_index, flags, rollback_index_location)
+
+    with open(image_path, 'r+b') as f:
+        vbmeta_offset = _round_to_multiple(tree['tree_offset'] + tree['tree_size'], block_size)
+        partition_size = _write_footer(f, original_image_size, vbmeta_offset, vbmeta, partition_size)
+
+    return {'original_image_size': original_image_size, 'vbmeta_offset': vbmeta_offset,
+            'vbmeta_size': len(vbmeta), 'partition_size': partition_size}
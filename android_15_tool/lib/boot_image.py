@@ -1,108 +1,248 @@
 import struct
 import os
 
+from android_15_tool.lib.avb import parse_avb_metadata
+from android_15_tool.lib.ramdisk import RAMDISK_DIR, FS_CONFIG_FILE, COMPRESSION_FILE, extract_ramdisk
+from android_15_tool.lib.stream_io import map_file, write_view, iter_view_chunks
+
 def _get_padded_size(size, page_size):
     """Calculates the size padded to the page size."""
     return (size + page_size - 1) // page_size * page_size
 
+def decode_os_version(os_version):
+    """
+    Decodes the packed os_version header field.
+    Returns a tuple of (version, patch_level) strings, e.g. ("14.0.0", "2024-05").
+    """
+    version = os_version >> 11
+    patch_level = os_version & 0x7ff
+    a, b, c = (version >> 14) & 0x7f, (version >> 7) & 0x7f, version & 0x7f
+    year, month = (patch_level >> 4) + 2000, patch_level & 0xf
+    return f"{a}.{b}.{c}", f"{year:04d}-{month:02d}"
+
 class BootImage:
     """
-    Parses boot.img and recovery.img files (v3/v4).
+    Parses boot.img and recovery.img files (header versions 0 to 4).
     """
 
     BOOT_MAGIC = b'ANDROID!'
+    BOOT_NAME_SIZE = 16
     BOOT_ARGS_SIZE = 512
     BOOT_EXTRA_ARGS_SIZE = 1024
     CMDLINE_SIZE = BOOT_ARGS_SIZE + BOOT_EXTRA_ARGS_SIZE
 
+    # header_version lives at the same offset in every layout
+    HEADER_VERSION_OFFSET = 40
+
+    # v0: kernel/ramdisk/second sizes and load addresses, page_size, name, cmdline, id
+    HEADER_V0_FORMAT = '<8s10I16s512s32s1024s'
+    HEADER_V0_FIELDS = ('magic', 'kernel_size', 'kernel_addr', 'ramdisk_size', 'ramdisk_addr', 'second_size',
+                        'second_addr', 'tags_addr', 'page_size', 'header_version', 'os_version', 'name',
+                        'cmdline', 'id', 'extra_cmdline')
+    # v1 appends recovery_dtbo_size, recovery_dtbo_offset, header_size
+    HEADER_V1_FORMAT = '<IQI'
+    HEADER_V1_FIELDS = ('recovery_dtbo_size', 'recovery_dtbo_offset', 'header_size')
+    # v2 appends dtb_size, dtb_addr
+    HEADER_V2_FORMAT = '<IQ'
+    HEADER_V2_FIELDS = ('dtb_size', 'dtb_addr')
+    # v3: fixed 4096 page size, no load addresses, second stage or dtb
+    HEADER_V3_FORMAT = '<8s4I4II1536s'
+    HEADER_V3_FIELDS = ('magic', 'kernel_size', 'ramdisk_size', 'os_version', 'header_size', None, None, None,
+                        None, 'header_version', 'cmdline')
+    # v4 appends signature_size
+    HEADER_V4_FORMAT = '<I'
+    HEADER_V4_FIELDS = ('signature_size',)
+
+    HEADER_V3_PAGE_SIZE = 4096
+
     def __init__(self, filepath, page_size=4096):
         self.filepath = filepath
         self.page_size = page_size
         self.header = None
-        self.kernel = None
-        self.ramdisk = None
-        self.dtb = None
+        self.cmdline = ""
+        self.name = ""
+        self.sections = {}
+
+    @staticmethod
+    def _cstr(raw):
+        """Decodes a NUL-padded header string."""
+        return raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace')
 
-    def _parse_header(self, f):
+    def _parse_header_v0_v2(self, buf, header_version):
         """
-        Parses the boot image header (v3/v4).
+        Parses the legacy (v0/v1/v2) header, where the page size comes from
+        the header itself.
         """
-        f.seek(0)
-        magic = f.read(len(self.BOOT_MAGIC))
-        if magic != self.BOOT_MAGIC:
-            raise ValueError("Invalid boot image: incorrect magic.")
+        offset = struct.calcsize(self.HEADER_V0_FORMAT)
+        (_, kernel_size, kernel_addr, ramdisk_size, ramdisk_addr, second_size,
+         second_addr, tags_addr, page_size, _, os_version, name, cmdline,
+         _, extra_cmdline) = struct.unpack_from(self.HEADER_V0_FORMAT, buf, 0)
 
-        # Read the main part of the header (up to header_version)
-        header_v3_v4_bin = f.read(36)
-        if len(header_v3_v4_bin) < 36:
-            raise ValueError("Invalid boot image header: too short.")
+        if page_size == 0 or page_size & (page_size - 1):
+            raise ValueError(f"Invalid page size in header: {page_size}")
 
-        header_data = struct.unpack('<9I', header_v3_v4_bin)
+        self.header = {
+            'header_version': header_version,
+            'page_size': page_size,
+            'kernel_size': kernel_size,
+            'kernel_addr': kernel_addr,
+            'ramdisk_size': ramdisk_size,
+            'ramdisk_addr': ramdisk_addr,
+            'second_size': second_size,
+            'second_addr': second_addr,
+            'tags_addr': tags_addr,
+            'os_version': os_version,
+        }
+        self.name = self._cstr(name)
+        self.cmdline = self._cstr(cmdline) + self._cstr(extra_cmdline)
+
+        if header_version >= 1:
+            recovery_dtbo_size, recovery_dtbo_offset, header_size = struct.unpack_from(
+                self.HEADER_V1_FORMAT, buf, offset)
+            offset += struct.calcsize(self.HEADER_V1_FORMAT)
+            self.header.update({
+                'recovery_dtbo_size': recovery_dtbo_size,
+                'recovery_dtbo_offset': recovery_dtbo_offset,
+                'header_size': header_size,
+            })
+        if header_version >= 2:
+            dtb_size, dtb_addr = struct.unpack_from(self.HEADER_V2_FORMAT, buf, offset)
+            self.header.update({'dtb_size': dtb_size, 'dtb_addr': dtb_addr})
+
+        self.page_size = page_size
+        self._layout_sections(['kernel', 'ramdisk', 'second', 'recovery_dtbo', 'dtb'])
+
+    def _parse_header_v3_v4(self, buf, header_version):
+        """
+        Parses the GKI (v3/v4) header. The page size is fixed at 4096.
+        """
+        offset = struct.calcsize(self.HEADER_V3_FORMAT)
+        (_, kernel_size, ramdisk_size, os_version, header_size,
+         _, _, _, _, _, cmdline) = struct.unpack_from(self.HEADER_V3_FORMAT, buf, 0)
 
         self.header = {
-            'kernel_size': header_data[0],
-            'ramdisk_size': header_data[1],
-            'os_version': header_data[2],
-            'header_size': header_data[3],
-            'header_version': header_data[8],
-            'dtb_size': 0,
+            'header_version': header_version,
+            'page_size': self.HEADER_V3_PAGE_SIZE,
+            'kernel_size': kernel_size,
+            'ramdisk_size': ramdisk_size,
+            'os_version': os_version,
+            'header_size': header_size,
         }
+        self.cmdline = self._cstr(cmdline)
 
-        if self.header['header_version'] >= 4:
-            # For v4, the dtb_size is after the cmdline
-            f.seek(len(self.BOOT_MAGIC) + 36 + self.CMDLINE_SIZE)
-            dtb_size_bin = f.read(4)
-            if len(dtb_size_bin) < 4:
-                raise ValueError("Could not read dtb_size for v4 header.")
-            self.header['dtb_size'] = struct.unpack('<I', dtb_size_bin)[0]
+        if header_version >= 4:
+            self.header['signature_size'] = struct.unpack_from(
+                self.HEADER_V4_FORMAT, buf, offset)[0]
 
-        # Calculate padded sizes
-        padded_kernel_size = _get_padded_size(self.header['kernel_size'], self.page_size)
-        padded_ramdisk_size = _get_padded_size(self.header['ramdisk_size'], self.page_size)
+        self.page_size = self.HEADER_V3_PAGE_SIZE
+        self._layout_sections(['kernel', 'ramdisk', 'boot_signature'])
 
-        # Calculate offsets
-        kernel_offset = self.page_size
-        ramdisk_offset = kernel_offset + padded_kernel_size
-        dtb_offset = ramdisk_offset + padded_ramdisk_size
+    def _layout_sections(self, names):
+        """
+        Computes the page-aligned offset of every non-empty section.
+        Sections follow the header page in the given order.
+        """
+        size_keys = {'boot_signature': 'signature_size'}
+        self.sections = {}
+        offset = self.page_size
+        for name in names:
+            size = self.header.get(size_keys.get(name, f'{name}_size'), 0)
+            if size:
+                self.sections[name] = (offset, size)
+                offset += _get_padded_size(size, self.page_size)
 
-        # Read kernel
-        f.seek(kernel_offset)
-        self.kernel = f.read(self.header['kernel_size'])
+    def _parse_header(self, buf):
+        """
+        Parses the boot image header from a buffer (bytes, mmap or memoryview)
+        and computes the section layout. No section data is copied.
+        """
+        if bytes(buf[:len(self.BOOT_MAGIC)]) != self.BOOT_MAGIC:
+            raise ValueError("Invalid boot image: incorrect magic.")
+        if len(buf) < self.HEADER_VERSION_OFFSET + 4:
+            raise ValueError("Invalid boot image header: too short.")
+
+        header_version = struct.unpack_from('<I', buf, self.HEADER_VERSION_OFFSET)[0]
+        if header_version >= 3:
+            needed = struct.calcsize(self.HEADER_V3_FORMAT)
+        else:
+            needed = struct.calcsize(self.HEADER_V0_FORMAT)
+        if len(buf) < needed:
+            raise ValueError("Invalid boot image header: too short.")
 
-        # Read ramdisk
-        f.seek(ramdisk_offset)
-        self.ramdisk = f.read(self.header['ramdisk_size'])
+        if header_version >= 3:
+            self._parse_header_v3_v4(buf, header_version)
+        else:
+            self._parse_header_v0_v2(buf, header_version)
 
-        # Read DTB if it exists
-        if self.header['header_version'] >= 4 and self.header['dtb_size'] > 0:
-            f.seek(dtb_offset)
-            self.dtb = f.read(self.header['dtb_size'])
+        for name, (offset, size) in self.sections.items():
+            if offset + size > len(buf):
+                raise ValueError(f"Section '{name}' extends past the end of the image.")
 
         # For Android 15+, os_version might be in AVB footer
         if self.header['os_version'] == 0:
-            # Placeholder for AVB footer parsing logic
-            # This would involve finding and parsing the AVB metadata
-            self.header['avb_os_version'] = "parsed_from_avb"
-            self.header['avb_security_patch'] = "parsed_from_avb"
+            self._parse_avb_properties(buf)
 
+    def _parse_avb_properties(self, buf):
+        """
+        Reads the OS version and security patch level from the vbmeta
+        properties of the AVB footer, when the image carries one.
+        """
+        try:
+            _, vbmeta = parse_avb_metadata(buf)
+        except (ValueError, struct.error):
+            return
+        if vbmeta is None:
+            return
+        os_version = vbmeta.build_property('os_version')
+        security_patch = vbmeta.build_property('security_patch')
+        if os_version:
+            self.header['avb_os_version'] = os_version
+        if security_patch:
+            self.header['avb_security_patch'] = security_patch
+
+    def parse(self):
+        """
+        Parses the header and section layout without extracting anything.
+        """
+        try:
+            with map_file(self.filepath) as view:
+                self._parse_header(view)
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error processing boot image: {e}")
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {self.filepath}")
+        return self.header
 
-    def unpack(self, output_dir):
+    def unpack(self, output_dir, extract_ramdisk_files=False):
         """
-        Extracts the kernel, ramdisk, and DTB to the output directory.
+        Extracts the kernel, ramdisk, DTB and any other sections to the
+        output directory, streaming each one from a memory-mapped view of
+        the image so that memory use does not grow with image size.
+
+        With extract_ramdisk_files, the ramdisk is also decompressed and its
+        cpio archive extracted in-process into a ramdisk_root directory.
         """
         try:
-            with open(self.filepath, 'rb') as f:
-                self._parse_header(f)
-
-            if self.kernel:
-                with open(os.path.join(output_dir, 'kernel'), 'wb') as f:
-                    f.write(self.kernel)
-            if self.ramdisk:
-                with open(os.path.join(output_dir, 'ramdisk'), 'wb') as f:
-                    f.write(self.ramdisk)
-            if self.dtb:
-                with open(os.path.join(output_dir, 'dtb'), 'wb') as f:
-                    f.write(self.dtb)
+            with map_file(self.filepath) as view:
+                self._parse_header(view)
+
+                for name, (offset, size) in self.sections.items():
+                    with open(os.path.join(output_dir, name), 'wb') as f:
+                        write_view(f, view[offset:offset + size])
+
+                if extract_ramdisk_files and 'ramdisk' in self.sections:
+                    offset, size = self.sections['ramdisk']
+                    compression, _ = extract_ramdisk(
+                        iter_view_chunks(view[offset:offset + size]),
+                        os.path.join(output_dir, RAMDISK_DIR),
+                        os.path.join(output_dir, FS_CONFIG_FILE),
+                    )
+                    with open(os.path.join(output_dir, COMPRESSION_FILE), 'w') as f:
+                        f.write(compression)
+
+            if self.cmdline:
+                with open(os.path.join(output_dir, 'cmdline'), 'w') as f:
+                    f.write(self.cmdline)
 
             # Save header info for repacking
             with open(os.path.join(output_dir, 'header_info.txt'), 'w') as f:
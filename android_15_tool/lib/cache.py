@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+
+def default_cache_dir():
+    """
+    Returns the per-user cache directory ($XDG_CACHE_HOME/android_15_tool,
+    or ~/.cache/android_15_tool).
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'android_15_tool')
+
+class ResultCache:
+    """
+    A small on-disk cache of JSON results keyed by content hash.
+
+    Each result is stored in its own file under <cache_dir>/<namespace>, so
+    concurrent processes never contend on a shared index. Writes go through
+    a temporary file and an atomic rename. A cache that cannot be read or
+    written is treated as empty rather than failing the caller.
+    """
+
+    def __init__(self, namespace, cache_dir=None):
+        self.directory = os.path.join(cache_dir or default_cache_dir(), namespace)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached value for a key, or None."""
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        """Stores a JSON-serialisable value under a key."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            pass
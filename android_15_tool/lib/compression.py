@@ -0,0 +1,507 @@
+"""
+Streaming (de)compression of the formats used for Android ramdisks and kernels.
+
+Everything works on iterators of byte chunks so that callers can feed
+memoryview slices of an mmap (or pipe reads) straight through without
+buffering the whole input or output. The lz4 and zstandard Python packages
+are used when installed; LZ4 falls back to a pure-Python implementation.
+"""
+import bz2
+import lzma
+import os
+import struct
+import zlib
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from android_15_tool.lib.stream_io import ChunkReader
+
+try:
+    import lz4.block as lz4_block
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_block = None
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Upper bound for a single decompress() call, so a highly compressible
+# input chunk (e.g. zero-filled padding) cannot balloon memory use.
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+
+LZ4_LEGACY_MAGIC = 0x184C2102
+LZ4_FRAME_MAGIC = 0x184D2204
+LZ4_LEGACY_BLOCK_SIZE = 8 * 1024 * 1024
+# Linked LZ4 blocks may reference up to 64 KiB of earlier output
+LZ4_WINDOW_SIZE = 64 * 1024
+
+COMPRESSION_MAGICS = [
+    ('gzip',       b'\x1f\x8b'),
+    ('lz4_legacy', b'\x02\x21\x4c\x18'),
+    ('lz4_frame',  b'\x04\x22\x4d\x18'),
+    ('xz',         b'\xfd7zXZ\x00'),
+    ('bzip2',      b'BZh'),
+    ('zstd',       b'\x28\xb5\x2f\xfd'),
+    ('cpio',       b'070701'),
+    ('cpio',       b'070702'),
+]
+
+
+def lz4_compress_bound(size):
+    """Returns the worst-case compressed size of an LZ4 block."""
+    return size + size // 255 + 16
+
+
+def detect_compression(head):
+    """
+    Identifies the compression format from the first bytes of a stream.
+    Returns a format name ('gzip', 'lz4_legacy', 'lz4_frame', 'xz', 'lzma',
+    'bzip2', 'zstd'), 'cpio' for an uncompressed archive, or None.
+    """
+    head = bytes(head[:16])
+    for name, magic in COMPRESSION_MAGICS:
+        if head.startswith(magic):
+            return name
+    # lzma-alone has no magic; recognise the usual properties byte and a
+    # power-of-two dictionary size, as the kernel and file(1) do.
+    if len(head) >= 13 and head[0] == 0x5d:
+        dict_size = struct.unpack_from('<I', head, 1)[0]
+        if dict_size and dict_size & (dict_size - 1) == 0:
+            return 'lzma'
+    return None
+
+
+def lz4_block_decompress(src, history=b''):
+    """
+    Decompresses a raw LZ4 block in pure Python.
+    `history` is the preceding output for linked blocks; only the newly
+    produced bytes are returned.
+    """
+    out = bytearray(history)
+    start = len(out)
+    src = memoryview(src).cast('B')
+    i, n = 0, len(src)
+    while i < n:
+        token = src[i]
+        i += 1
+
+        literal_length = token >> 4
+        if literal_length == 15:
+            while True:
+                b = src[i]
+                i += 1
+                literal_length += b
+                if b != 255:
+                    break
+        out += src[i:i + literal_length]
+        i += literal_length
+        if i >= n:
+            break
+
+        offset = src[i] | (src[i + 1] << 8)
+        i += 2
+        if offset == 0 or offset > len(out):
+            raise ValueError("Corrupt LZ4 block: invalid match offset.")
+
+        match_length = token & 15
+        if match_length == 15:
+            while True:
+                b = src[i]
+                i += 1
+                match_length += b
+                if b != 255:
+                    break
+        match_length += 4
+
+        pos = len(out) - offset
+        if match_length <= offset:
+            out += out[pos:pos + match_length]
+        else:
+            # Overlapping match: the last `offset` bytes repeat
+            pattern = bytes(out[pos:])
+            repeats, remainder = divmod(match_length, offset)
+            out += pattern * repeats + pattern[:remainder]
+    return bytes(out[start:])
+
+
+def _lz4_write_length(out, length):
+    """Appends an LZ4 length extension (runs of 255 plus a remainder)."""
+    while length >= 255:
+        out.append(255)
+        length -= 255
+    out.append(length)
+
+
+def lz4_block_compress(src):
+    """
+    Compresses data into a raw LZ4 block in pure Python.
+
+    This is a greedy single-probe compressor: slower and a little larger than
+    liblz4, but deterministic and readable by any LZ4 decoder. It obeys the
+    block format end conditions (the last match starts at least 12 bytes
+    before the end and the last 5 bytes are literals).
+    """
+    src = bytes(src)
+    n = len(src)
+    out = bytearray()
+    table = {}
+    anchor = 0
+    i = 0
+    misses = 0
+    match_limit = n - 12
+    end_limit = n - 5
+
+    while i < match_limit:
+        key = src[i:i + 4]
+        ref = table.get(key)
+        table[key] = i
+        if ref is None or i - ref > 0xffff:
+            # Step faster through incompressible data, as liblz4 does
+            misses += 1
+            i += 1 + (misses >> 6)
+            continue
+        misses = 0
+
+        match_length = 4
+        while (i + match_length + 8 <= end_limit and
+               src[ref + match_length:ref + match_length + 8] == src[i + match_length:i + match_length + 8]):
+            match_length += 8
+        while i + match_length < end_limit and src[ref + match_length] == src[i + match_length]:
+            match_length += 1
+
+        literal_length = i - anchor
+        extra_match = match_length - 4
+        out.append((min(literal_length, 15) << 4) | min(extra_match, 15))
+        if literal_length >= 15:
+            _lz4_write_length(out, literal_length - 15)
+        out += src[anchor:i]
+        out += struct.pack('<H', i - ref)
+        if extra_match >= 15:
+            _lz4_write_length(out, extra_match - 15)
+
+        i += match_length
+        anchor = i
+
+    literal_length = n - anchor
+    out.append(min(literal_length, 15) << 4)
+    if literal_length >= 15:
+        _lz4_write_length(out, literal_length - 15)
+    out += src[anchor:]
+    return bytes(out)
+
+
+def _compress_lz4_block(data):
+    """Compresses one LZ4 block, using the lz4 package when available."""
+    if lz4_block is not None:
+        return lz4_block.compress(data, mode='high_compression', compression=12, store_size=False)
+    return lz4_block_compress(data)
+
+
+def _decompress_lz4_block(block, max_size, history=b''):
+    """Decompresses one LZ4 block, using the lz4 package when available."""
+    if lz4_block is not None:
+        try:
+            if history:
+                return lz4_block.decompress(bytes(block), uncompressed_size=max_size, dict=bytes(history))
+            return lz4_block.decompress(bytes(block), uncompressed_size=max_size)
+        except lz4_block.LZ4BlockError as e:
+            raise ValueError(f"Corrupt LZ4 block: {e}")
+    return lz4_block_decompress(block, history)
+
+
+def _iter_lz4_legacy(chunks):
+    """
+    Decompresses the LZ4 legacy format ('lz4 -l'): a magic number followed by
+    independently compressed 8 MiB blocks, each prefixed with its size.
+    """
+    reader = ChunkReader(chunks)
+    if struct.unpack('<I', reader.read_exact(4))[0] != LZ4_LEGACY_MAGIC:
+        raise ValueError("Invalid LZ4 legacy stream: incorrect magic.")
+
+    max_block = lz4_compress_bound(LZ4_LEGACY_BLOCK_SIZE)
+    while True:
+        size_bin = reader.read(4)
+        if len(size_bin) < 4:
+            return
+        block_size = struct.unpack('<I', size_bin)[0]
+        if block_size == LZ4_LEGACY_MAGIC:
+            # Concatenated legacy streams
+            continue
+        if block_size == 0 or block_size > max_block:
+            # Zero padding or the uncompressed-size trailer the kernel build appends
+            return
+        block = reader.read(block_size)
+        if len(block) < block_size:
+            # A trailer that happened to look like a plausible block size
+            return
+        yield _decompress_lz4_block(block, LZ4_LEGACY_BLOCK_SIZE)
+
+
+def _iter_lz4_frame_native(chunks):
+    """Decompresses LZ4 frames using the lz4 package."""
+    decompressor = lz4_frame.LZ4FrameDecompressor()
+    for chunk in chunks:
+        data = bytes(chunk)
+        while data:
+            if decompressor.eof:
+                decompressor = lz4_frame.LZ4FrameDecompressor()
+            try:
+                out = decompressor.decompress(data)
+            except RuntimeError as e:
+                # lz4.frame has no exception type of its own
+                raise ValueError(f"Corrupt LZ4 frame: {e}")
+            data = decompressor.unused_data if decompressor.eof else b''
+            if out:
+                yield out
+
+
+def _iter_lz4_frame(chunks):
+    """
+    Decompresses one or more concatenated LZ4 frames.
+    """
+    if lz4_frame is not None:
+        yield from _iter_lz4_frame_native(chunks)
+        return
+
+    reader = ChunkReader(chunks)
+    block_sizes = {4: 64 * 1024, 5: 256 * 1024, 6: 1024 * 1024, 7: 4 * 1024 * 1024}
+    while not reader.at_eof():
+        magic = struct.unpack('<I', reader.read_exact(4))[0]
+        if 0x184D2A50 <= magic <= 0x184D2A5F:
+            # Skippable frame
+            reader.skip(struct.unpack('<I', reader.read_exact(4))[0])
+            continue
+        if magic != LZ4_FRAME_MAGIC:
+            # Trailing padding after the last frame
+            return
+
+        flg, bd = reader.read_exact(2)
+        if flg >> 6 != 1:
+            raise ValueError("Unsupported LZ4 frame version.")
+        block_independent = flg & 0x20
+        block_checksum = flg & 0x10
+        content_size = flg & 0x08
+        content_checksum = flg & 0x04
+        dict_id = flg & 0x01
+        max_block = block_sizes.get((bd >> 4) & 7)
+        if max_block is None:
+            raise ValueError("Invalid LZ4 frame block size.")
+        reader.skip((8 if content_size else 0) + (4 if dict_id else 0) + 1)
+
+        history = b''
+        while True:
+            block_size = struct.unpack('<I', reader.read_exact(4))[0]
+            if block_size == 0:
+                break
+            uncompressed = block_size & 0x80000000
+            block = reader.read_exact(block_size & 0x7fffffff)
+            if block_checksum:
+                reader.skip(4)
+            out = block if uncompressed else _decompress_lz4_block(block, max_block, history)
+            if not block_independent:
+                history = (history + out)[-LZ4_WINDOW_SIZE:]
+            yield out
+        if content_checksum:
+            reader.skip(4)
+
+
+def _iter_stdlib(chunks, make_decompressor, is_member_start):
+    """
+    Drives a zlib/lzma/bz2 style decompressor over a chunk iterator,
+    restarting on concatenated members and bounding the output per call.
+    """
+    decompressor = make_decompressor()
+    for chunk in chunks:
+        data = bytes(chunk)
+        while data:
+            if decompressor.eof:
+                if not is_member_start(data):
+                    # Trailing padding after the last member
+                    return
+                decompressor = make_decompressor()
+            out = decompressor.decompress(data, OUTPUT_CHUNK_SIZE)
+            if out:
+                yield out
+            if decompressor.eof:
+                data = decompressor.unused_data
+            elif hasattr(decompressor, 'unconsumed_tail'):
+                data = decompressor.unconsumed_tail
+            else:
+                data = b''
+                # lzma/bz2 keep unconsumed input internally
+                while not decompressor.needs_input and not decompressor.eof:
+                    out = decompressor.decompress(b'', OUTPUT_CHUNK_SIZE)
+                    if out:
+                        yield out
+                if decompressor.eof:
+                    data = decompressor.unused_data
+
+
+def _iter_gzip(chunks):
+    """Decompresses one or more concatenated gzip members."""
+    return _iter_stdlib(chunks, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                        lambda data: data[:2] == b'\x1f\x8b')
+
+
+def _iter_lzma(chunks):
+    """Decompresses xz streams or legacy lzma-alone data."""
+    return _iter_stdlib(chunks, lambda: lzma.LZMADecompressor(lzma.FORMAT_AUTO),
+                        lambda data: detect_compression(data) in ('xz', 'lzma'))
+
+
+def _iter_bzip2(chunks):
+    """Decompresses one or more concatenated bzip2 streams."""
+    return _iter_stdlib(chunks, bz2.BZ2Decompressor, lambda data: data[:3] == b'BZh')
+
+
+def _iter_zstd(chunks):
+    """Decompresses zstd frames using the zstandard package."""
+    decompressor = zstandard.ZstdDecompressor()
+    try:
+        yield from decompressor.read_to_iter(_ChunkStream(chunks), read_size=OUTPUT_CHUNK_SIZE)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Corrupt zstd data: {e}")
+
+
+class _ChunkStream:
+    """Minimal file-like wrapper over a chunk iterator, for zstandard."""
+
+    def __init__(self, chunks):
+        self._reader = ChunkReader(chunks)
+
+    def read(self, size=-1):
+        return self._reader.read(size if size >= 0 else OUTPUT_CHUNK_SIZE)
+
+
+def _iter_passthrough(chunks):
+    """Yields uncompressed input unchanged."""
+    for chunk in chunks:
+        yield chunk
+
+
+_DECOMPRESSORS = {
+    'gzip': _iter_gzip,
+    'lz4_legacy': _iter_lz4_legacy,
+    'lz4_frame': _iter_lz4_frame,
+    'xz': _iter_lzma,
+    'lzma': _iter_lzma,
+    'bzip2': _iter_bzip2,
+    'zstd': _iter_zstd,
+    'cpio': _iter_passthrough,
+    None: _iter_passthrough,
+}
+
+
+def iter_decompress(chunks, compression='auto'):
+    """
+    Decompresses an iterator of byte chunks, yielding decompressed chunks.
+    With compression='auto' the format is detected from the first bytes;
+    unrecognised data is passed through unchanged.
+    """
+    chunks = iter(chunks)
+    if compression == 'auto':
+        reader = ChunkReader(chunks)
+        compression = detect_compression(reader.peek(16))
+        chunks = reader.iter_remaining()
+    try:
+        decompressor = _DECOMPRESSORS[compression]
+    except KeyError:
+        raise ValueError(f"Unsupported compression format: {compression}")
+    if compression == 'zstd' and zstandard is None:
+        raise EnvironmentError(
+            "zstd decompression requires the 'zstandard' Python package. "
+            "Please install it to continue."
+        )
+    try:
+        yield from decompressor(chunks)
+    except (zlib.error, lzma.LZMAError, OSError, IndexError) as e:
+        # bz2 reports corrupt input as OSError, the pure-Python LZ4 decoder
+        # as IndexError when a block is truncated. The lz4 and zstandard
+        # decoders raise ValueError themselves.
+        raise ValueError(f"Corrupt {compression} data: {e}")
+
+
+def _iter_blocks(chunks, block_size):
+    """Regroups a chunk iterator into blocks of exactly block_size (the last may be shorter)."""
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def compress_lz4_legacy(chunks, f_out, workers=None):
+    """
+    Writes chunks to f_out in the LZ4 legacy format used for ramdisks.
+
+    The input is split into independent 8 MiB blocks which are compressed
+    concurrently (threads when the lz4 package is available, since it
+    releases the GIL; processes for the pure-Python compressor) and written
+    in order. At most two blocks per worker are in flight, so memory use is
+    bounded regardless of input size.
+
+    The output only depends on the input and the block encoder, whatever
+    the worker count. The lz4 package (high compression, level 12) and the
+    pure-Python compressor produce different, equally valid blocks, so
+    output is reproducible byte for byte only between installations that
+    both have, or both lack, the lz4 package.
+    """
+    workers = workers or os.cpu_count() or 1
+    f_out.write(struct.pack('<I', LZ4_LEGACY_MAGIC))
+
+    def write_block(block):
+        f_out.write(struct.pack('<I', len(block)))
+        f_out.write(block)
+
+    blocks = _iter_blocks(chunks, LZ4_LEGACY_BLOCK_SIZE)
+    first_blocks = list(islice(blocks, 2))
+    blocks = chain(first_blocks, blocks)
+    if workers == 1 or len(first_blocks) < 2:
+        # Not worth starting a pool for a single block
+        for data in blocks:
+            write_block(_compress_lz4_block(data))
+        return
+
+    executor_class = ThreadPoolExecutor if lz4_block is not None else ProcessPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        in_flight = deque()
+        for data in blocks:
+            in_flight.append(executor.submit(_compress_lz4_block, data))
+            if len(in_flight) >= 2 * workers:
+                write_block(in_flight.popleft().result())
+        while in_flight:
+            write_block(in_flight.popleft().result())
+
+
+def compress_gzip(chunks, f_out, level=9):
+    """
+    Writes chunks to f_out as a single gzip member with a zero mtime, so the
+    output is reproducible.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        f_out.write(compressor.compress(chunk))
+    f_out.write(compressor.flush())
+
+
+def compress_stream(chunks, f_out, compression, workers=None):
+    """
+    Compresses an iterator of chunks into f_out.
+    Supported formats are 'lz4_legacy', 'gzip' and 'cpio' (no compression).
+    """
+    if compression == 'lz4_legacy':
+        compress_lz4_legacy(chunks, f_out, workers)
+    elif compression == 'gzip':
+        compress_gzip(chunks, f_out)
+    elif compression == 'cpio':
+        for chunk in chunks:
+            f_out.write(chunk)
+    else:
+        raise ValueError(f"Unsupported compression format for repacking: {compression}")
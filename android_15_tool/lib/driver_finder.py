@@ -1,28 +1,48 @@
-import os
 import re
 
+from android_15_tool.lib.walker import walk_tree
+
+INSMOD_PATTERN = re.compile(rb"insmod\s+([/\w.-]+ko)")
+
+class KernelModuleMatcher:
+    """Matches kernel module (.ko) files."""
+
+    name = "kernel_module"
+
+    def match(self, entry):
+        return [entry.path] if entry.name.endswith(".ko") else []
+
+class InsmodMatcher:
+    """Matches the modules loaded with insmod in .rc files."""
+
+    name = "insmod"
+
+    def match(self, entry):
+        if not entry.name.endswith(".rc"):
+            return []
+        try:
+            with open(entry.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            # Ignore files that can't be read
+            return []
+        return [m.group(1).decode("ascii") for m in INSMOD_PATTERN.finditer(data)]
+
+TOUCHSCREEN_DRIVER_MATCHERS = (KernelModuleMatcher(), InsmodMatcher())
+
+def iter_touchscreen_drivers(search_path=".", on_directory=None):
+    """
+    Yields touchscreen drivers under the specified path as they are found:
+    .ko files, and modules loaded with insmod in .rc files. Each is
+    yielded once. on_directory, if given, is called with each directory
+    before it is searched.
+    """
+    seen = set()
+    for _, driver in walk_tree(search_path, TOUCHSCREEN_DRIVER_MATCHERS, on_directory):
+        if driver not in seen:
+            seen.add(driver)
+            yield driver
+
 def find_touchscreen_drivers(search_path="."):
     """Finds touchscreen drivers in the specified path."""
-    driver_files = set()
-
-    # Find .ko files
-    for root, _, files in os.walk(search_path):
-        for file in files:
-            if file.endswith(".ko"):
-                driver_files.add(os.path.join(root, file))
-
-    # Find insmod commands in init.rc files
-    for root, _, files in os.walk(search_path):
-        for file in files:
-            if file.startswith("init") and file.endswith(".rc"):
-                try:
-                    with open(os.path.join(root, file), "r") as f:
-                        for line in f:
-                            match = re.search(r"insmod\s+([/\w\.-]+ko)", line)
-                            if match:
-                                driver_files.add(match.group(1))
-                except (IOError, UnicodeDecodeError):
-                    # Ignore files that can't be read
-                    continue
-
-    return sorted(list(driver_files))
+    return sorted(iter_touchscreen_drivers(search_path))
@@ -0,0 +1,226 @@
+"""
+Structural comparison of device trees. Each tree is indexed by node path
+with a hash of its properties and of its whole subtree, so identical
+branches are skipped without looking inside them. Phandle references are
+rewritten to the path of the node they point at, so renumbered phandles
+do not show up as changes.
+"""
+import hashlib
+import re
+import struct
+
+from android_15_tool.lib.dt_table import list_dtbs
+from android_15_tool.lib.fdt import Fdt, format_value
+
+# Generated nodes that only restate information found elsewhere in the tree
+IGNORED_NODES = {'__symbols__', '__local_fixups__'}
+IGNORED_PROPERTIES = {'phandle', 'linux,phandle'}
+
+# Properties whose cells hold phandles, for trees without fixup information
+PHANDLE_PROPERTY_PATTERN = re.compile(
+    r'^(interrupt-parent|interrupts-extended|clocks|assigned-clocks|assigned-clock-parents|resets|dmas|'
+    r'power-domains|iommus|phys|interconnects|mboxes|memory-region|nvmem-cells|io-channels|'
+    r'thermal-sensors|cooling-device|remote-endpoint|sound-dai|target|pinctrl-\d+|.*-supply|'
+    r'(.*-)?gpios?|.*-parent|.*-handle)$')
+# Properties of that kind holding phandle-plus-arguments specifiers, with
+# the #*-cells property of the referenced node that counts the arguments.
+# The others hold bare phandles.
+SPECIFIER_CELLS = {
+    'interrupts-extended': '#interrupt-cells',
+    'clocks': '#clock-cells',
+    'assigned-clocks': '#clock-cells',
+    'assigned-clock-parents': '#clock-cells',
+    'resets': '#reset-cells',
+    'dmas': '#dma-cells',
+    'power-domains': '#power-domain-cells',
+    'iommus': '#iommu-cells',
+    'phys': '#phy-cells',
+    'interconnects': '#interconnect-cells',
+    'mboxes': '#mbox-cells',
+    'io-channels': '#io-channel-cells',
+    'thermal-sensors': '#thermal-sensor-cells',
+    'cooling-device': '#cooling-cells',
+    'sound-dai': '#sound-dai-cells',
+}
+GPIO_PROPERTY_PATTERN = re.compile(r'^(.*-)?gpios?$')
+
+def _fixup_references(fdt):
+    """
+    Returns {(path, property): {offset: reference}} from the __fixups__ and
+    __local_fixups__ nodes of an overlay.
+    """
+    references = {}
+    fixups = fdt.root.children.get('__fixups__')
+    if fixups is not None:
+        for label, prop in fixups.properties.items():
+            for location in prop.as_strings():
+                path, name, offset = location.rsplit(':', 2)
+                references.setdefault((path, name), {})[int(offset)] = f'&{label}'
+
+    local = fdt.root.children.get('__local_fixups__')
+    if local is not None:
+        phandles = fdt.phandles
+        for fixup_node in local.walk():
+            path = '/' + fixup_node.path[len('/__local_fixups__'):].lstrip('/')
+            node = fdt.find(path)
+            for name, prop in fixup_node.properties.items():
+                value = node.get(name) if node is not None else None
+                for offset in prop.as_cells():
+                    if value is not None and offset + 4 <= len(value):
+                        target = phandles.get(struct.unpack_from('>I', value, offset)[0])
+                        if target is not None:
+                            references.setdefault((path, name), {})[offset] = f'&{{{target.path}}}'
+    return references
+
+def _phandle_references(name, value, phandles):
+    """
+    Returns {offset: reference} for the phandle cells of a property in a
+    tree without fixup information. In specifier lists only the first cell
+    of each specifier is a phandle; the arguments after it are stepped over
+    using the #*-cells of the node it references, and the search stops at
+    a specifier that cannot be resolved.
+    """
+    cells_property = SPECIFIER_CELLS.get(name)
+    if cells_property is None and GPIO_PROPERTY_PATTERN.match(name):
+        cells_property = '#gpio-cells'
+    references = {}
+    offset = 0
+    while offset + 4 <= len(value):
+        target = phandles.get(struct.unpack_from('>I', value, offset)[0])
+        if target is not None:
+            references[offset] = f'&{{{target.path}}}'
+        if cells_property is None:
+            offset += 4
+            continue
+        count = target.get(cells_property) if target is not None else None
+        if count is None or len(count) != 4:
+            break
+        offset += 4 * (1 + struct.unpack('>I', count)[0])
+    return references
+
+def _normalize(name, value, references, phandles):
+    """Formats a property value with its phandle cells replaced by references."""
+    if references is None and phandles and len(value) % 4 == 0 and PHANDLE_PROPERTY_PATTERN.match(name):
+        references = _phandle_references(name, value, phandles)
+    if not references:
+        return format_value(value) or ''
+    cells = []
+    for offset in range(0, len(value) // 4 * 4, 4):
+        cells.append(references.get(offset) or f'0x{struct.unpack_from(">I", value, offset)[0]:02x}')
+    return '<' + ' '.join(cells) + '>'
+
+class DtIndex:
+    """
+    A device tree indexed by node path: normalised properties, a hash of
+    those properties and a hash of the whole subtree under each node.
+    """
+
+    def __init__(self, fdt):
+        self.properties = {}
+        self.children = {}
+        self.node_hash = {}
+        self.subtree_hash = {}
+        references = _fixup_references(fdt)
+        phandles = fdt.phandles
+        self._index(fdt.root, '/', references, phandles)
+
+    def _index(self, node, path, references, phandles):
+        props = {}
+        for name, prop in node.properties.items():
+            if name not in IGNORED_PROPERTIES:
+                props[name] = _normalize(name, prop.value, references.get((path, name)), phandles)
+        node_hash = hashlib.sha256()
+        for name in sorted(props):
+            node_hash.update(f'{name}={props[name]};'.encode('utf-8'))
+        node_hash = node_hash.digest()
+
+        children = sorted(name for name in node.children if name not in IGNORED_NODES)
+        subtree_hash = hashlib.sha256(node_hash)
+        for name in children:
+            child_path = f"{path.rstrip('/')}/{name}"
+            self._index(node.children[name], child_path, references, phandles)
+            subtree_hash.update(name.encode('utf-8') + b'\x00' + self.subtree_hash[child_path])
+
+        self.properties[path] = props
+        self.children[path] = children
+        self.node_hash[path] = node_hash
+        self.subtree_hash[path] = subtree_hash.digest()
+
+def diff_trees(old, new):
+    """
+    Compares two DtIndex trees. Returns a list of changes, each a dict with
+    'change' ('added', 'removed' or 'changed'), 'path', and for property
+    changes 'property', 'old' and 'new'. An added or removed node is
+    reported once, not once per descendant.
+    """
+    changes = []
+
+    def walk(path):
+        if old.subtree_hash[path] == new.subtree_hash[path]:
+            return
+        if old.node_hash[path] != new.node_hash[path]:
+            old_props, new_props = old.properties[path], new.properties[path]
+            for name in sorted(set(old_props) | set(new_props)):
+                before, after = old_props.get(name), new_props.get(name)
+                if before == after:
+                    continue
+                change = 'added' if before is None else 'removed' if after is None else 'changed'
+                changes.append({'change': change, 'path': path, 'property': name, 'old': before, 'new': after})
+        old_children, new_children = set(old.children[path]), set(new.children[path])
+        for name in sorted(old_children | new_children):
+            child_path = f"{path.rstrip('/')}/{name}"
+            if name not in new_children:
+                changes.append({'change': 'removed', 'path': child_path, 'property': None})
+            elif name not in old_children:
+                changes.append({'change': 'added', 'path': child_path, 'property': None})
+            else:
+                walk(child_path)
+
+    walk('/')
+    return changes
+
+def _entry_keys(kind, entries):
+    """Keys entries by (id, rev, occurrence) for DT tables, by index otherwise."""
+    keys, seen = [], {}
+    for entry in entries:
+        if kind == 'dt_table':
+            base = (entry['id'], entry['rev'])
+            seen[base] = seen.get(base, -1) + 1
+            keys.append(base + (seen[base],))
+        else:
+            keys.append((entry['index'],))
+    return keys
+
+def diff_images(old_view, new_view):
+    """
+    Compares every device tree in two images (single DTBs, concatenated
+    DTBs or DT tables). DT table entries are matched by id and rev.
+    Returns a list of (old_entry, new_entry, changes); either entry is None
+    for a tree that exists on one side only, and changes is then None.
+    """
+    old_kind, old_entries = list_dtbs(old_view)
+    new_kind, new_entries = list_dtbs(new_view)
+    if not old_entries or not new_entries:
+        raise ValueError("No device trees found to compare.")
+    if old_kind != new_kind:
+        old_keys = [(e['index'],) for e in old_entries]
+        new_keys = [(e['index'],) for e in new_entries]
+    else:
+        old_keys, new_keys = _entry_keys(old_kind, old_entries), _entry_keys(new_kind, new_entries)
+
+    new_by_key = dict(zip(new_keys, new_entries))
+    results = []
+    for key, old_entry in zip(old_keys, old_entries):
+        new_entry = new_by_key.pop(key, None)
+        if new_entry is None:
+            results.append((old_entry, None, None))
+            continue
+        if bytes(old_entry['data']) == bytes(new_entry['data']):
+            changes = []
+        else:
+            changes = diff_trees(DtIndex(Fdt.from_bytes(old_entry['data'])),
+                                 DtIndex(Fdt.from_bytes(new_entry['data'])))
+        results.append((old_entry, new_entry, changes))
+    for new_entry in new_by_key.values():
+        results.append((None, new_entry, None))
+    return results
@@ -0,0 +1,121 @@
+"""
+Android DT table (dtbo.img / dtb.img) parsing and splitting of concatenated
+DTB blobs, such as those appended to Image.gz-dtb kernels.
+"""
+import struct
+import zlib
+
+from android_15_tool.lib.fdt import FDT_MAGIC, FDT_HEADER_FORMAT, FDT_HEADER_SIZE
+
+DT_TABLE_MAGIC = 0xd7b7ab1e
+# magic, total_size, header_size, dt_entry_size, dt_entry_count,
+# dt_entries_offset, page_size, version
+DT_TABLE_HEADER_FORMAT = '>8I'
+DT_TABLE_HEADER_SIZE = struct.calcsize(DT_TABLE_HEADER_FORMAT)
+# dt_size, dt_offset, id, rev, custom[4]; version 1 replaces custom[0] with
+# flags, whose low nibble is the compression of the entry
+DT_TABLE_ENTRY_FORMAT = '>8I'
+DT_TABLE_ENTRY_SIZE = struct.calcsize(DT_TABLE_ENTRY_FORMAT)
+
+DT_COMPRESSION = {0: None, 1: 'zlib', 2: 'gzip'}
+
+FIND_CHUNK_SIZE = 1024 * 1024
+
+def parse_dt_table(view):
+    """
+    Parses a DT table header and its entries from a bytes-like object.
+    Returns (header, entries); each entry is a dict with 'index', 'dt_offset',
+    'dt_size', 'id', 'rev', 'custom' and 'compression'.
+    """
+    if len(view) < DT_TABLE_HEADER_SIZE:
+        raise ValueError("Invalid DT table: too short.")
+    fields = struct.unpack_from(DT_TABLE_HEADER_FORMAT, view, 0)
+    header = dict(zip(['magic', 'total_size', 'header_size', 'dt_entry_size', 'dt_entry_count',
+                       'dt_entries_offset', 'page_size', 'version'], fields))
+    if header['magic'] != DT_TABLE_MAGIC:
+        raise ValueError("Invalid DT table: incorrect magic.")
+    if header['dt_entry_size'] < DT_TABLE_ENTRY_SIZE:
+        raise ValueError(f"Invalid DT table entry size: {header['dt_entry_size']}")
+    if header['dt_entries_offset'] + header['dt_entry_count'] * header['dt_entry_size'] > len(view):
+        raise ValueError("DT table is truncated.")
+
+    entries = []
+    for index in range(header['dt_entry_count']):
+        offset = header['dt_entries_offset'] + index * header['dt_entry_size']
+        dt_size, dt_offset, dt_id, rev, *custom = struct.unpack_from(DT_TABLE_ENTRY_FORMAT, view, offset)
+        compression = None
+        if header['version'] >= 1:
+            flags = custom.pop(0)
+            compression = DT_COMPRESSION.get(flags & 0xf)
+            if flags & 0xf and compression is None:
+                raise ValueError(f"Unknown compression {flags & 0xf} in DT table entry {index}.")
+        if dt_offset + dt_size > len(view):
+            raise ValueError(f"DT table entry {index} lies outside the image.")
+        entries.append({'index': index, 'dt_offset': dt_offset, 'dt_size': dt_size, 'id': dt_id,
+                        'rev': rev, 'custom': custom, 'compression': compression})
+    return header, entries
+
+def read_entry(view, entry):
+    """Returns the (decompressed) DTB of a DT table entry."""
+    data = view[entry['dt_offset']:entry['dt_offset'] + entry['dt_size']]
+    if entry['compression'] == 'zlib':
+        return zlib.decompress(data)
+    if entry['compression'] == 'gzip':
+        return zlib.decompress(data, 31)
+    return data
+
+def _find(view, needle, start):
+    """Finds needle in a bytes-like object without copying it whole."""
+    if isinstance(view, (bytes, bytearray)):
+        return view.find(needle, start)
+    while start < len(view):
+        found = bytes(view[start:start + FIND_CHUNK_SIZE + len(needle) - 1]).find(needle)
+        if found >= 0:
+            return start + found
+        start += FIND_CHUNK_SIZE
+    return -1
+
+def split_dtbs(view, start=0):
+    """
+    Finds the DTBs concatenated in a buffer, using each header's total size
+    to step over its body. Returns a list of (offset, size).
+    """
+    magic = struct.pack('>I', FDT_MAGIC)
+    blobs = []
+    offset = _find(view, magic, start)
+    while offset >= 0:
+        size = _fdt_size(view, offset)
+        if size:
+            blobs.append((offset, size))
+        offset = _find(view, magic, offset + (size or 1))
+    return blobs
+
+def _fdt_size(view, offset):
+    """Returns the total size of a plausible FDT header at offset, or 0."""
+    if offset + FDT_HEADER_SIZE > len(view):
+        return 0
+    (_, totalsize, off_struct, off_strings, _, version, last_comp_version,
+     _, size_strings, _) = struct.unpack_from(FDT_HEADER_FORMAT, view, offset)
+    if not 16 <= version <= 17 or last_comp_version > 17 or offset + totalsize > len(view):
+        return 0
+    if not FDT_HEADER_SIZE <= off_struct < totalsize or off_strings + size_strings > totalsize:
+        return 0
+    return totalsize
+
+def list_dtbs(view):
+    """
+    Lists the device trees in an image: the entries of a DT table, or the
+    DTBs concatenated in any other blob. Returns (kind, entries) where kind
+    is 'dt_table' or 'concatenated' and each entry carries its 'data'.
+    """
+    if len(view) >= 4 and struct.unpack_from('>I', view, 0)[0] == DT_TABLE_MAGIC:
+        _, entries = parse_dt_table(view)
+        for entry in entries:
+            entry['data'] = read_entry(view, entry)
+        return 'dt_table', entries
+
+    entries = []
+    for index, (offset, size) in enumerate(split_dtbs(view)):
+        entries.append({'index': index, 'dt_offset': offset, 'dt_size': size, 'id': None, 'rev': None,
+                        'custom': [], 'compression': None, 'data': view[offset:offset + size]})
+    return 'concatenated', entries
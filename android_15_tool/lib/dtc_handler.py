@@ -1,13 +1,44 @@
+import hashlib
+import os
 import subprocess
 import shutil
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
-class DtcHandler:
+from android_15_tool.lib.cache import ResultCache
+from android_15_tool.lib.dt_diff import diff_images
+from android_15_tool.lib.dt_table import list_dtbs
+from android_15_tool.lib.fdt import Fdt
+from android_15_tool.lib.stream_io import map_file
+
+# Bump when the DTS output changes so stale cache entries are ignored
+DTS_CACHE_VERSION = 1
+
+def _decompile_blob(blob):
     """
-    A wrapper for the dtc (Device Tree Compiler) tool.
+    Decompiles one DTB to DTS text, natively or with dtc as a fallback.
+    Module level so it can run in a worker process.
     """
+    try:
+        return Fdt.from_bytes(blob).to_dts()
+    except (ValueError, struct.error) as e:
+        if not shutil.which("dtc"):
+            raise RuntimeError(f"Error decompiling DTB: {e}")
+    try:
+        result = subprocess.run(["dtc", "-I", "dtb", "-O", "dts", "-"], input=bytes(blob),
+                                capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Error decompiling DTB: {e.stderr.decode('utf-8', errors='replace')}")
+    return result.stdout.decode('utf-8', errors='replace')
 
-    def __init__(self):
-        self._check_for_dtc()
+class DtcHandler:
+    """
+    Decompiles and compiles device trees. Blobs and plain DTS sources are
+    handled natively by the FDT module; the dtc (Device Tree Compiler) tool
+    is only needed for input the native code does not understand, such as
+    DTS files that still require the C preprocessor.
+    """
 
     def _check_for_dtc(self):
         """
@@ -24,30 +55,144 @@ class DtcHandler:
         Decompiles a Device Tree Blob (.dtb) to a Device Tree Source (.dts) file.
         """
         try:
-            subprocess.run(
-                ["dtc", "-I", "dtb", "-O", "dts", "-o", dts_path, dtb_path],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Error decompiling DTB: {e.stderr}")
+            with open(dtb_path, 'rb') as f:
+                dts = Fdt.from_bytes(f.read()).to_dts()
         except FileNotFoundError:
-            raise RuntimeError("dtc command not found.")
+            raise RuntimeError(f"Input file not found: {dtb_path}")
+        except (ValueError, struct.error) as e:
+            self._fallback("decompiling DTB", e)
+            self._run_dtc(["dtc", "-I", "dtb", "-O", "dts", "-o", dts_path, dtb_path], "decompiling DTB")
+            return
+        with open(dts_path, 'w') as f:
+            f.write(dts)
 
     def compile(self, dts_path, dtb_path):
         """
         Compiles a Device Tree Source (.dts) file to a Device Tree Blob (.dtb).
         """
         try:
-            # The -@ flag is important for Android 15 overlays
-            subprocess.run(
-                ["dtc", "-@", "-I", "dts", "-O", "dtb", "-o", dtb_path, dts_path],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            with open(dts_path, 'r') as f:
+                # Symbols are important for Android 15 overlays (dtc -@)
+                dtb = Fdt.from_dts(f.read(), symbols=True).to_dtb()
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {dts_path}")
+        except (ValueError, struct.error) as e:
+            self._fallback("compiling DTS", e)
+            self._run_dtc(["dtc", "-@", "-I", "dts", "-O", "dtb", "-o", dtb_path, dts_path], "compiling DTS")
+            return
+        with open(dtb_path, 'wb') as f:
+            f.write(dtb)
+
+    def _fallback(self, action, error):
+        """Raises the native error unless dtc is available to retry with."""
+        try:
+            self._check_for_dtc()
+        except EnvironmentError:
+            raise RuntimeError(f"Error {action}: {error}")
+
+    def _run_dtc(self, command, action):
+        try:
+            subprocess.run(command, capture_output=True, text=True, check=True)
         except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Error compiling DTS: {e.stderr}")
+            raise RuntimeError(f"Error {action}: {e.stderr}")
         except FileNotFoundError:
             raise RuntimeError("dtc command not found.")
+
+    def _list(self, image_path):
+        try:
+            with map_file(image_path) as view:
+                kind, entries = list_dtbs(view)
+                for entry in entries:
+                    entry['data'] = bytes(entry['data'])
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {image_path}")
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error reading DT table: {e}")
+        if not entries:
+            raise RuntimeError(f"No device trees found in {image_path}")
+        return kind, entries
+
+    def _write_dtbs(self, image_path, output_dir, entries):
+        """Writes each entry to <output_dir>/<image>.<index>.dtb, recording its 'dtb' path."""
+        os.makedirs(output_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        for entry in entries:
+            entry['dtb'] = os.path.join(output_dir, f"{stem}.{entry['index']:02d}.dtb")
+            with open(entry['dtb'], 'wb') as f:
+                f.write(entry.pop('data'))
+
+    def split(self, image_path, output_dir):
+        """
+        Writes each DTB of a DT table (dtbo.img/dtb.img), or of blobs
+        concatenated in any other file, to its own .dtb. Returns (kind,
+        entries) as from list_dtbs(), each entry with its 'dtb' path.
+        """
+        kind, entries = self._list(image_path)
+        self._write_dtbs(image_path, output_dir, entries)
+        return kind, entries
+
+    def decompile_all(self, image_path, output_dir, workers=None, use_cache=True, cache_dir=None):
+        """
+        Splits an image like split() and decompiles every DTB next to it as
+        a .dts. Entries are decompiled concurrently in worker processes and
+        results are cached by the SHA-256 of each blob, so unchanged overlays
+        are never decompiled twice. A failing entry records its 'error'
+        instead of stopping the others.
+        """
+        kind, entries = self._list(image_path)
+        cache = ResultCache(f'dts-v{DTS_CACHE_VERSION}', cache_dir) if use_cache else None
+        pending = []
+        for entry in entries:
+            entry['sha256'] = hashlib.sha256(entry['data']).hexdigest()
+            cached = cache.get(entry['sha256']) if cache else None
+            entry['cached'] = cached is not None
+            if cached is not None:
+                entry['dts_text'] = cached['dts']
+            else:
+                pending.append(entry)
+
+        workers = min(workers or os.cpu_count() or 1, len(pending))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_decompile_blob, entry['data']) for entry in pending]
+                for entry, future in zip(pending, futures):
+                    self._collect(entry, future.result, cache)
+        else:
+            for entry in pending:
+                self._collect(entry, lambda: _decompile_blob(entry['data']), cache)
+
+        self._write_dtbs(image_path, output_dir, entries)
+        for entry in entries:
+            dts = entry.pop('dts_text', None)
+            if dts is not None:
+                entry['dts'] = os.path.splitext(entry['dtb'])[0] + '.dts'
+                with open(entry['dts'], 'w') as f:
+                    f.write(dts)
+        return kind, entries
+
+    def _collect(self, entry, result, cache):
+        try:
+            entry['dts_text'] = result()
+        except RuntimeError as e:
+            entry['error'] = str(e)
+            return
+        if cache:
+            cache.put(entry['sha256'], {'dts': entry['dts_text']})
+
+    def diff(self, old_path, new_path):
+        """
+        Structurally compares the device trees of two images; see
+        dt_diff.diff_images() for the result format.
+        """
+        try:
+            with map_file(old_path) as old_view, map_file(new_path) as new_view:
+                results = diff_images(old_view, new_view)
+                for old_entry, new_entry, _ in results:
+                    for entry in (old_entry, new_entry):
+                        if entry is not None:
+                            entry.pop('data')
+                return results
+        except FileNotFoundError as e:
+            raise RuntimeError(f"Input file not found: {e.filename}")
+        except (ValueError, struct.error, zlib.error) as e:
+            raise RuntimeError(f"Error comparing device trees: {e}")
@@ -0,0 +1,141 @@
+"""
+Pure-Python read-only access to EROFS metadata: the superblock, inodes and
+directories, read through a random-access read(offset, size) callable so an
+image can be browsed in place, even inside a super partition. File data in
+compressed layouts is not decoded; use ErofsParser (dump.erofs) to extract.
+"""
+import stat
+import struct
+from collections import namedtuple
+
+EROFS_SUPER_OFFSET = 1024
+EROFS_SUPER_MAGIC = 0xE0F5E1E2
+# magic, checksum, feature_compat, blkszbits, sb_extslots, root_nid, inos,
+# build_time, build_time_nsec, blocks, meta_blkaddr, xattr_blkaddr
+EROFS_SUPER_FORMAT = '<IIIBBHQQIIII'
+
+EROFS_INODE_SLOT_SIZE = 32
+# i_format, i_xattr_icount, i_mode, i_nlink, i_size, i_reserved, i_u, i_ino,
+# i_uid, i_gid
+EROFS_INODE_COMPACT_FORMAT = '<HHHHIIIIHH'
+# i_format, i_xattr_icount, i_mode, i_reserved, i_size, i_u, i_ino, i_uid, i_gid
+EROFS_INODE_EXTENDED_FORMAT = '<HHHHQIIII'
+EROFS_INODE_COMPACT_SIZE = 32
+EROFS_INODE_EXTENDED_SIZE = 64
+EROFS_XATTR_IBODY_HEADER_SIZE = 12
+
+EROFS_INODE_FLAT_PLAIN = 0
+EROFS_INODE_FLAT_INLINE = 2
+EROFS_INODE_CHUNK_BASED = 4
+EROFS_CHUNK_FORMAT_BLKBITS_MASK = 0x1f
+EROFS_CHUNK_FORMAT_INDEXES = 0x20
+EROFS_NULL_ADDR = 0xffffffff
+
+# nid, nameoff, file_type, reserved
+EROFS_DIRENT_FORMAT = '<QHBB'
+EROFS_DIRENT_SIZE = struct.calcsize(EROFS_DIRENT_FORMAT)
+
+ErofsInode = namedtuple('ErofsInode', ['nid', 'mode', 'size', 'layout', 'raw_blkaddr', 'inline_offset'])
+DirEntry = namedtuple('DirEntry', ['name', 'inode', 'mode', 'size'])
+
+def is_erofs(head):
+    """Returns True if a buffer starting at offset 0 holds an EROFS superblock."""
+    end = EROFS_SUPER_OFFSET + 4
+    return len(head) >= end and struct.unpack_from('<I', head, EROFS_SUPER_OFFSET)[0] == EROFS_SUPER_MAGIC
+
+class ErofsImage:
+    """An EROFS filesystem read through read(offset, size)."""
+
+    def __init__(self, read):
+        self.read = read
+        superblock = read(EROFS_SUPER_OFFSET, struct.calcsize(EROFS_SUPER_FORMAT))
+        if len(superblock) < struct.calcsize(EROFS_SUPER_FORMAT):
+            raise ValueError("Image too small for an EROFS superblock.")
+        (magic, _, _, blkszbits, _, root_nid, _, _, _, _, meta_blkaddr,
+         _) = struct.unpack(EROFS_SUPER_FORMAT, superblock)
+        if magic != EROFS_SUPER_MAGIC:
+            raise ValueError("Not an EROFS image: bad superblock magic.")
+        if not 9 <= blkszbits <= 16:
+            raise ValueError(f"Invalid EROFS block size: 2^{blkszbits}")
+        self.block_size = 1 << blkszbits
+        self.meta_offset = meta_blkaddr * self.block_size
+        self.root = root_nid
+
+    def inode(self, nid):
+        """Reads the inode with the given nid."""
+        offset = self.meta_offset + nid * EROFS_INODE_SLOT_SIZE
+        raw = self.read(offset, EROFS_INODE_EXTENDED_SIZE)
+        if len(raw) < EROFS_INODE_COMPACT_SIZE:
+            raise ValueError(f"EROFS inode {nid} lies outside the image.")
+        i_format = struct.unpack_from('<H', raw)[0]
+        if i_format & 1:
+            if len(raw) < EROFS_INODE_EXTENDED_SIZE:
+                raise ValueError(f"EROFS inode {nid} lies outside the image.")
+            _, xattr_icount, mode, _, size, i_u, _, _, _ = struct.unpack_from(EROFS_INODE_EXTENDED_FORMAT, raw)
+            inode_size = EROFS_INODE_EXTENDED_SIZE
+        else:
+            _, xattr_icount, mode, _, size, _, i_u, _, _, _ = struct.unpack_from(EROFS_INODE_COMPACT_FORMAT, raw)
+            inode_size = EROFS_INODE_COMPACT_SIZE
+        xattr_size = EROFS_XATTR_IBODY_HEADER_SIZE + (xattr_icount - 1) * 4 if xattr_icount else 0
+        return ErofsInode(nid, mode, size, (i_format >> 1) & 0x7, i_u, offset + inode_size + xattr_size)
+
+    def _data_ranges(self, inode):
+        """Returns the (offset, length) runs holding an uncompressed inode's data."""
+        block_size = self.block_size
+        if inode.layout == EROFS_INODE_FLAT_PLAIN:
+            return [(inode.raw_blkaddr * block_size, inode.size)]
+        if inode.layout == EROFS_INODE_FLAT_INLINE:
+            full = inode.size // block_size * block_size
+            ranges = [(inode.raw_blkaddr * block_size, full)] if full else []
+            if inode.size > full:
+                ranges.append((inode.inline_offset, inode.size - full))
+            return ranges
+        if inode.layout == EROFS_INODE_CHUNK_BASED:
+            chunk_size = block_size << (inode.raw_blkaddr & EROFS_CHUNK_FORMAT_BLKBITS_MASK)
+            count = -(-inode.size // chunk_size)
+            if inode.raw_blkaddr & EROFS_CHUNK_FORMAT_INDEXES:
+                # advise, device_id, blkaddr; the index array is 8-byte aligned
+                table = self.read((inode.inline_offset + 7) & ~7, count * 8)
+                addresses = [struct.unpack_from('<HHI', table, i * 8)[2] for i in range(len(table) // 8)]
+            else:
+                table = self.read(inode.inline_offset, count * 4)
+                addresses = list(struct.unpack(f'<{len(table) // 4}I', table[:len(table) // 4 * 4]))
+            if len(addresses) < count:
+                raise ValueError(f"EROFS inode {inode.nid}: truncated chunk index.")
+            ranges = []
+            for i, address in enumerate(addresses):
+                length = min(chunk_size, inode.size - i * chunk_size)
+                ranges.append((None if address == EROFS_NULL_ADDR else address * block_size, length))
+            return ranges
+        raise ValueError(f"EROFS inode {inode.nid}: compressed data layout {inode.layout} is not supported.")
+
+    def read_data(self, inode):
+        """Returns the data of an uncompressed inode (directories, small files)."""
+        out = bytearray()
+        for offset, length in self._data_ranges(inode):
+            out += bytes(length) if offset is None else self.read(offset, length)
+        return bytes(out)
+
+    def listdir(self, nid):
+        """Returns the DirEntry list of a directory, without '.' and '..'."""
+        inode = self.inode(nid)
+        if not stat.S_ISDIR(inode.mode):
+            raise ValueError(f"EROFS inode {nid} is not a directory.")
+        data = self.read_data(inode)
+        entries = []
+        for block_start in range(0, len(data), self.block_size):
+            block = data[block_start:block_start + self.block_size]
+            if len(block) < EROFS_DIRENT_SIZE:
+                break
+            count = struct.unpack_from(EROFS_DIRENT_FORMAT, block)[1] // EROFS_DIRENT_SIZE
+            if count * EROFS_DIRENT_SIZE > len(block):
+                raise ValueError(f"EROFS directory {nid}: corrupt directory block.")
+            dirents = [struct.unpack_from(EROFS_DIRENT_FORMAT, block, i * EROFS_DIRENT_SIZE) for i in range(count)]
+            for i, (child, nameoff, _, _) in enumerate(dirents):
+                end = dirents[i + 1][1] if i + 1 < count else len(block)
+                name = block[nameoff:end].split(b'\x00', 1)[0].decode('utf-8', errors='surrogateescape')
+                if name in ('.', '..'):
+                    continue
+                child_inode = self.inode(child)
+                entries.append(DirEntry(name, child, child_inode.mode, child_inode.size))
+        return entries
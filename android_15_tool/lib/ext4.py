@@ -0,0 +1,175 @@
+"""
+Pure-Python read-only access to ext4 metadata: the superblock, group
+descriptors, inodes (extent trees and legacy block maps) and directories,
+read through a random-access read(offset, size) callable so a partition can
+be browsed in place without mounting or extracting it.
+"""
+import stat
+import struct
+from collections import namedtuple
+
+EXT4_SUPER_OFFSET = 1024
+EXT4_SUPER_SIZE = 1024
+EXT4_SUPER_MAGIC = 0xEF53
+EXT4_MAGIC_OFFSET = 0x38
+EXT4_ROOT_INODE = 2
+
+EXT4_FEATURE_INCOMPAT_64BIT = 0x80
+EXT4_EXTENTS_FL = 0x80000
+EXT4_INLINE_DATA_FL = 0x10000000
+
+EXT4_EXTENT_MAGIC = 0xF30A
+# magic, entries, max, depth, generation
+EXT4_EXTENT_HEADER_FORMAT = '<HHHHI'
+# ee_block, ee_len, ee_start_hi, ee_start_lo
+EXT4_EXTENT_FORMAT = '<IHHI'
+# ei_block, ei_leaf_lo, ei_leaf_hi, unused
+EXT4_EXTENT_INDEX_FORMAT = '<IIHH'
+EXT4_EXTENT_ENTRY_SIZE = 12
+EXT4_INIT_MAX_LEN = 32768
+
+# Legacy block maps: 12 direct pointers, then single, double and triple indirect
+EXT4_NDIR_BLOCKS = 12
+
+# inode, rec_len, name_len, file_type
+EXT4_DIR_ENTRY_FORMAT = '<IHBB'
+EXT4_DIR_ENTRY_SIZE = struct.calcsize(EXT4_DIR_ENTRY_FORMAT)
+
+Ext4Inode = namedtuple('Ext4Inode', ['number', 'mode', 'size', 'flags', 'block'])
+DirEntry = namedtuple('DirEntry', ['name', 'inode', 'mode', 'size'])
+
+def is_ext4(head):
+    """Returns True if a buffer starting at offset 0 holds an ext2/3/4 superblock."""
+    offset = EXT4_SUPER_OFFSET + EXT4_MAGIC_OFFSET
+    return len(head) >= offset + 2 and struct.unpack_from('<H', head, offset)[0] == EXT4_SUPER_MAGIC
+
+class Ext4Image:
+    """An ext4 filesystem read through read(offset, size)."""
+
+    def __init__(self, read):
+        self.read = read
+        sb = read(EXT4_SUPER_OFFSET, EXT4_SUPER_SIZE)
+        if len(sb) < EXT4_SUPER_SIZE or struct.unpack_from('<H', sb, EXT4_MAGIC_OFFSET)[0] != EXT4_SUPER_MAGIC:
+            raise ValueError("Not an ext4 image: bad superblock magic.")
+        first_data_block, log_block_size = struct.unpack_from('<II', sb, 20)
+        self.inodes_per_group = struct.unpack_from('<I', sb, 40)[0]
+        rev_level = struct.unpack_from('<I', sb, 76)[0]
+        self.inode_size = struct.unpack_from('<H', sb, 88)[0] if rev_level else 128
+        incompat = struct.unpack_from('<I', sb, 96)[0]
+        desc_size = struct.unpack_from('<H', sb, 254)[0]
+        if log_block_size > 6 or not self.inodes_per_group or not self.inode_size:
+            raise ValueError("Invalid ext4 superblock.")
+        self.block_size = 1024 << log_block_size
+        self.desc_size = desc_size if incompat & EXT4_FEATURE_INCOMPAT_64BIT and desc_size >= 64 else 32
+        self.gdt_offset = (first_data_block + 1) * self.block_size
+        self.root = EXT4_ROOT_INODE
+
+    def _inode_table(self, group):
+        desc = self.read(self.gdt_offset + group * self.desc_size, self.desc_size)
+        if len(desc) < 32:
+            raise ValueError(f"ext4 group descriptor {group} lies outside the image.")
+        table = struct.unpack_from('<I', desc, 8)[0]
+        if self.desc_size >= 64:
+            table |= struct.unpack_from('<I', desc, 0x28)[0] << 32
+        return table
+
+    def inode(self, number):
+        """Reads an inode by number."""
+        group, index = divmod(number - 1, self.inodes_per_group)
+        offset = self._inode_table(group) * self.block_size + index * self.inode_size
+        raw = self.read(offset, 128)
+        if len(raw) < 128:
+            raise ValueError(f"ext4 inode {number} lies outside the image.")
+        mode, _, size_lo = struct.unpack_from('<HHI', raw, 0)
+        flags = struct.unpack_from('<I', raw, 32)[0]
+        size_high = struct.unpack_from('<I', raw, 108)[0]
+        return Ext4Inode(number, mode, size_lo | size_high << 32, flags, raw[40:100])
+
+    def _extent_runs(self, node, depth_limit=8):
+        """Yields (logical_block, count, physical_block) from an extent tree node."""
+        magic, entries, _, depth, _ = struct.unpack_from(EXT4_EXTENT_HEADER_FORMAT, node)
+        if magic != EXT4_EXTENT_MAGIC or depth_limit < 0:
+            raise ValueError("Corrupt ext4 extent tree.")
+        for i in range(entries):
+            offset = EXT4_EXTENT_ENTRY_SIZE * (i + 1)
+            if depth:
+                _, leaf_lo, leaf_hi, _ = struct.unpack_from(EXT4_EXTENT_INDEX_FORMAT, node, offset)
+                child = self.read((leaf_hi << 32 | leaf_lo) * self.block_size, self.block_size)
+                yield from self._extent_runs(child, depth_limit - 1)
+            else:
+                block, length, start_hi, start_lo = struct.unpack_from(EXT4_EXTENT_FORMAT, node, offset)
+                if length > EXT4_INIT_MAX_LEN:
+                    # Uninitialised extents read as zeros
+                    yield block, length - EXT4_INIT_MAX_LEN, None
+                else:
+                    yield block, length, start_hi << 32 | start_lo
+
+    def _mapped_blocks(self, pointers, level, count):
+        """Yields the physical blocks of a legacy block map, level 0 being direct pointers."""
+        per_block = self.block_size // 4
+        for pointer in pointers:
+            if count[0] <= 0:
+                return
+            if level == 0:
+                count[0] -= 1
+                yield pointer or None
+            elif pointer == 0:
+                skipped = per_block ** level
+                for _ in range(min(skipped, count[0])):
+                    yield None
+                count[0] -= skipped
+            else:
+                raw = self.read(pointer * self.block_size, self.block_size)
+                yield from self._mapped_blocks(struct.unpack(f'<{per_block}I', raw), level - 1, count)
+
+    def _block_runs(self, inode):
+        """Yields (logical_block, count, physical_block or None) for an inode's data."""
+        if inode.flags & EXT4_EXTENTS_FL:
+            yield from self._extent_runs(inode.block)
+            return
+        pointers = struct.unpack('<15I', inode.block)
+        count = [-(-inode.size // self.block_size)]
+        logical = 0
+        sources = [(pointers[:EXT4_NDIR_BLOCKS], 0)] + [([pointers[EXT4_NDIR_BLOCKS + i]], i + 1) for i in range(3)]
+        for group, level in sources:
+            for physical in self._mapped_blocks(group, level, count):
+                yield logical, 1, physical
+                logical += 1
+
+    def read_data(self, inode):
+        """Returns the data of an inode (directories, small files)."""
+        if inode.flags & EXT4_INLINE_DATA_FL:
+            raise ValueError(f"ext4 inode {inode.number}: inline data is not supported.")
+        data = bytearray(inode.size)
+        for logical, count, physical in self._block_runs(inode):
+            start = logical * self.block_size
+            if physical is None or start >= inode.size:
+                continue
+            length = min(count * self.block_size, inode.size - start)
+            data[start:start + length] = self.read(physical * self.block_size, length).ljust(length, b'\x00')
+        return bytes(data)
+
+    def listdir(self, number):
+        """
+        Returns the DirEntry list of a directory, without '.' and '..'.
+        Hashed (htree) directories are read linearly; their index blocks
+        look like empty entries.
+        """
+        inode = self.inode(number)
+        if not stat.S_ISDIR(inode.mode):
+            raise ValueError(f"ext4 inode {number} is not a directory.")
+        data = self.read_data(inode)
+        entries = []
+        offset = 0
+        while offset + EXT4_DIR_ENTRY_SIZE <= len(data):
+            child, rec_len, name_len, _ = struct.unpack_from(EXT4_DIR_ENTRY_FORMAT, data, offset)
+            if rec_len < EXT4_DIR_ENTRY_SIZE or offset + rec_len > len(data):
+                raise ValueError(f"ext4 directory {number}: corrupt entry at offset {offset}.")
+            name = data[offset + EXT4_DIR_ENTRY_SIZE:offset + EXT4_DIR_ENTRY_SIZE + name_len]
+            name = name.decode('utf-8', errors='surrogateescape')
+            offset += rec_len
+            if child == 0 or name in ('.', '..'):
+                continue
+            child_inode = self.inode(child)
+            entries.append(DirEntry(name, child, child_inode.mode, child_inode.size))
+        return entries
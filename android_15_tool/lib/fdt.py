@@ -0,0 +1,795 @@
+"""
+Pure-Python flattened device tree support: reads DTB blobs from a
+memoryview, writes them back, emits DTS text and compiles plain DTS sources
+(without the C preprocessor), including the -@ __symbols__, __fixups__ and
+__local_fixups__ nodes used by Android overlays.
+"""
+import ast
+import operator
+import re
+import struct
+
+FDT_MAGIC = 0xd00dfeed
+# magic, totalsize, off_dt_struct, off_dt_strings, off_mem_rsvmap, version,
+# last_comp_version, boot_cpuid_phys, size_dt_strings, size_dt_struct
+FDT_HEADER_FORMAT = '>10I'
+FDT_HEADER_SIZE = struct.calcsize(FDT_HEADER_FORMAT)
+FDT_RESERVE_ENTRY_FORMAT = '>QQ'
+
+FDT_BEGIN_NODE = 0x1
+FDT_END_NODE = 0x2
+FDT_PROP = 0x3
+FDT_NOP = 0x4
+FDT_END = 0x9
+
+FDT_VERSION = 17
+FDT_LAST_COMP_VERSION = 16
+
+def _align4(offset):
+    return (offset + 3) & ~3
+
+def _cstring(view, offset):
+    """Reads a NUL-terminated string from a buffer."""
+    end = offset
+    while True:
+        chunk = bytes(view[end:end + 64])
+        nul = chunk.find(b'\x00')
+        if nul >= 0:
+            end += nul
+            break
+        if not chunk:
+            raise ValueError(f"Unterminated string at offset {offset}.")
+        end += len(chunk)
+    return bytes(view[offset:end]).decode('utf-8', errors='replace'), end
+
+class FdtProperty:
+    """
+    A device tree property. Values read from a blob stay as zero-copy slices
+    until first accessed.
+    """
+
+    __slots__ = ('name', '_value')
+
+    def __init__(self, name, value=b''):
+        self.name = name
+        self._value = value
+
+    @property
+    def value(self):
+        if isinstance(self._value, memoryview):
+            self._value = self._value.tobytes()
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    def as_cells(self):
+        """Returns the value as a list of 32-bit cells."""
+        value = self.value
+        return list(struct.unpack(f'>{len(value) // 4}I', value[:len(value) // 4 * 4]))
+
+    def as_strings(self):
+        """Returns the value as a list of strings."""
+        return [s.decode('utf-8', errors='replace') for s in self.value.rstrip(b'\x00').split(b'\x00')]
+
+def encode_value(value):
+    """
+    Encodes a Python value as a property value: bytes pass through, a str
+    (or list of str) becomes NUL-terminated strings, an int (or list of int)
+    becomes 32-bit cells.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str):
+        return value.encode('utf-8') + b'\x00'
+    if isinstance(value, int):
+        return struct.pack('>I', value & 0xffffffff)
+    if value and all(isinstance(v, str) for v in value):
+        return b''.join(v.encode('utf-8') + b'\x00' for v in value)
+    return b''.join(struct.pack('>I', v & 0xffffffff) for v in value)
+
+class FdtNode:
+    """
+    A device tree node with ordered properties and children.
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.properties = {}
+        self.children = {}
+        self.labels = []
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return '/'
+        parent_path = self.parent.path
+        return f"{parent_path.rstrip('/')}/{self.name}"
+
+    def get(self, name, default=None):
+        """Returns a property's raw value, or default."""
+        prop = self.properties.get(name)
+        return prop.value if prop is not None else default
+
+    def set_property(self, name, value):
+        """Sets a property from bytes, str, int or a list of either."""
+        self.properties[name] = FdtProperty(name, encode_value(value))
+
+    def add_subnode(self, name):
+        """Returns the named child, creating it if needed."""
+        child = self.children.get(name)
+        if child is None:
+            child = FdtNode(name, self)
+            self.children[name] = child
+        return child
+
+    def find(self, path):
+        """Looks up a node by a path relative to this node (or absolute)."""
+        node = self
+        if path.startswith('/'):
+            while node.parent is not None:
+                node = node.parent
+        for component in path.strip('/').split('/'):
+            if not component:
+                continue
+            child = node.children.get(component)
+            if child is None:
+                # Allow the unit address to be left out, as dtc does
+                matches = [c for n, c in node.children.items() if n.split('@', 1)[0] == component]
+                if len(matches) != 1:
+                    return None
+                child = matches[0]
+            node = child
+        return node
+
+    def walk(self):
+        """Yields this node and all its descendants, depth first."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+class Fdt:
+    """
+    A flattened device tree: a node tree, the memory reservation map and
+    the boot CPU id.
+    """
+
+    def __init__(self, root=None, memreserve=None, boot_cpuid_phys=0):
+        self.root = root if root is not None else FdtNode('')
+        self.memreserve = memreserve or []
+        self.boot_cpuid_phys = boot_cpuid_phys
+
+    def find(self, path):
+        return self.root.find(path)
+
+    @property
+    def phandles(self):
+        """Returns a dict of phandle -> node."""
+        result = {}
+        for node in self.root.walk():
+            for name in ('phandle', 'linux,phandle'):
+                value = node.get(name)
+                if value is not None and len(value) == 4:
+                    result[struct.unpack('>I', value)[0]] = node
+        return result
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Parses a DTB from bytes, an mmap or a memoryview. Property values
+        remain slices of the buffer until accessed.
+        """
+        view = memoryview(buf).cast('B') if isinstance(buf, memoryview) else memoryview(buf)
+        if len(view) < FDT_HEADER_SIZE:
+            raise ValueError("Invalid DTB: too short.")
+        (magic, totalsize, off_struct, off_strings, off_rsvmap, version, _,
+         boot_cpuid_phys, size_strings, size_struct) = struct.unpack_from(FDT_HEADER_FORMAT, view, 0)
+        if magic != FDT_MAGIC:
+            raise ValueError("Invalid DTB: incorrect magic.")
+        if totalsize > len(view):
+            raise ValueError("DTB is truncated.")
+        if version < 16:
+            raise ValueError(f"Unsupported DTB version: {version}")
+        if version < 17:
+            size_struct = totalsize - off_struct
+        if off_struct + size_struct > totalsize or off_strings + size_strings > totalsize:
+            raise ValueError("DTB blocks lie outside the blob.")
+
+        memreserve = []
+        offset = off_rsvmap
+        while offset + 16 <= totalsize:
+            address, size = struct.unpack_from(FDT_RESERVE_ENTRY_FORMAT, view, offset)
+            offset += 16
+            if address == 0 and size == 0:
+                break
+            memreserve.append((address, size))
+
+        strings = view[off_strings:off_strings + size_strings].tobytes()
+        names = {}
+        stack = []
+        root = None
+        pos, end = off_struct, off_struct + size_struct
+        while pos + 4 <= end:
+            token = struct.unpack_from('>I', view, pos)[0]
+            pos += 4
+            if token == FDT_BEGIN_NODE:
+                name, name_end = _cstring(view, pos)
+                pos = _align4(name_end + 1)
+                if stack:
+                    node = FdtNode(name, stack[-1])
+                    stack[-1].children[name] = node
+                elif root is None:
+                    node = root = FdtNode('')
+                else:
+                    raise ValueError("DTB has more than one root node.")
+                stack.append(node)
+            elif token == FDT_END_NODE:
+                if not stack:
+                    raise ValueError(f"Unbalanced FDT_END_NODE at offset {pos - 4}.")
+                stack.pop()
+            elif token == FDT_PROP:
+                if not stack:
+                    raise ValueError(f"Property outside a node at offset {pos - 4}.")
+                length, name_offset = struct.unpack_from('>II', view, pos)
+                pos += 8
+                if pos + length > end:
+                    raise ValueError(f"Property at offset {pos - 12} overruns the struct block.")
+                name = names.get(name_offset)
+                if name is None:
+                    nul = strings.find(b'\x00', name_offset)
+                    if nul < 0:
+                        raise ValueError(f"Invalid property name offset {name_offset}.")
+                    name = names[name_offset] = strings[name_offset:nul].decode('utf-8', errors='replace')
+                stack[-1].properties[name] = FdtProperty(name, view[pos:pos + length])
+                pos = _align4(pos + length)
+            elif token == FDT_NOP:
+                continue
+            elif token == FDT_END:
+                break
+            else:
+                raise ValueError(f"Invalid FDT token {token:#x} at offset {pos - 4}.")
+
+        if root is None or stack:
+            raise ValueError("DTB struct block is incomplete.")
+        return cls(root, memreserve, boot_cpuid_phys)
+
+    def to_dtb(self):
+        """Serialises the tree to a version 17 DTB."""
+        struct_block = bytearray()
+        strings = bytearray()
+        string_offsets = {}
+
+        def emit(node):
+            name = node.name.encode('utf-8') + b'\x00'
+            struct_block.extend(struct.pack('>I', FDT_BEGIN_NODE) + name + b'\x00' * (-len(name) % 4))
+            for prop in node.properties.values():
+                offset = string_offsets.get(prop.name)
+                if offset is None:
+                    offset = string_offsets[prop.name] = len(strings)
+                    strings.extend(prop.name.encode('utf-8') + b'\x00')
+                value = prop.value
+                struct_block.extend(struct.pack('>III', FDT_PROP, len(value), offset))
+                struct_block.extend(value + b'\x00' * (-len(value) % 4))
+            for child in node.children.values():
+                emit(child)
+            struct_block.extend(struct.pack('>I', FDT_END_NODE))
+
+        emit(self.root)
+        struct_block.extend(struct.pack('>I', FDT_END))
+
+        rsvmap = b''.join(struct.pack(FDT_RESERVE_ENTRY_FORMAT, a, s) for a, s in self.memreserve)
+        rsvmap += struct.pack(FDT_RESERVE_ENTRY_FORMAT, 0, 0)
+        off_rsvmap = FDT_HEADER_SIZE
+        off_struct = off_rsvmap + len(rsvmap)
+        off_strings = off_struct + len(struct_block)
+        totalsize = off_strings + len(strings)
+        header = struct.pack(FDT_HEADER_FORMAT, FDT_MAGIC, totalsize, off_struct, off_strings, off_rsvmap,
+                             FDT_VERSION, FDT_LAST_COMP_VERSION, self.boot_cpuid_phys,
+                             len(strings), len(struct_block))
+        return header + rsvmap + bytes(struct_block) + bytes(strings)
+
+    def to_dts(self):
+        """
+        Emits DTS source in the style of 'dtc -I dtb -O dts'. Labels are
+        restored from __symbols__ when present.
+        """
+        labels = {}
+        symbols = self.root.children.get('__symbols__')
+        if symbols is not None:
+            for prop in symbols.properties.values():
+                if _is_printable_strings(prop.value):
+                    labels.setdefault(prop.as_strings()[0], []).append(prop.name)
+
+        lines = ['/dts-v1/;', '']
+        for address, size in self.memreserve:
+            lines.append(f'/memreserve/\t0x{address:016x} 0x{size:016x};')
+        if self.memreserve:
+            lines.append('')
+
+        def emit(node, depth):
+            indent = '\t' * depth
+            name = node.name if node.parent is not None else '/'
+            label = ''.join(f'{l}: ' for l in labels.get(node.path, []))
+            lines.append(f'{indent}{label}{name} {{')
+            for prop in node.properties.values():
+                value = format_value(prop.value)
+                lines.append(f'{indent}\t{prop.name} = {value};' if value else f'{indent}\t{prop.name};')
+            for child in node.children.values():
+                lines.append('')
+                emit(child, depth + 1)
+            lines.append(f'{indent}}};')
+
+        emit(self.root, 0)
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def from_dts(cls, text, symbols=True):
+        """
+        Compiles DTS source. With symbols, __symbols__ is generated for every
+        label (and __fixups__/__local_fixups__ for overlays), like 'dtc -@'.
+        Raises ValueError for syntax this compiler does not handle, such as
+        C preprocessor directives.
+        """
+        return _DtsParser(text).compile(symbols)
+
+def _is_printable_strings(value):
+    """True if a value is one or more non-empty, printable, NUL-terminated strings."""
+    if len(value) < 2 or value[-1] != 0:
+        return False
+    for s in value[:-1].split(b'\x00'):
+        if not s or any(c < 0x20 and c not in (0x09, 0x0a, 0x0d) or c > 0x7e for c in s):
+            return False
+    return True
+
+_ESCAPES = {ord('"'): '\\"', ord('\\'): '\\\\', 0x0a: '\\n', 0x09: '\\t', 0x0d: '\\r'}
+
+def format_value(value):
+    """Formats a property value as DTS: strings, <cells> or [bytes]."""
+    if not value:
+        return None
+    if _is_printable_strings(value):
+        return ', '.join('"' + ''.join(_ESCAPES.get(c, chr(c)) for c in s) + '"'
+                         for s in value[:-1].split(b'\x00'))
+    if len(value) % 4 == 0:
+        cells = struct.unpack(f'>{len(value) // 4}I', value)
+        return '<' + ' '.join(f'0x{c:02x}' for c in cells) + '>'
+    return '[' + ' '.join(f'{b:02x}' for b in value) + ']'
+
+PREPROCESSOR_PATTERN = re.compile(r'^\s*#\s*(include|define|undef|if|ifdef|ifndef|elif|else|endif)\b', re.M)
+LABEL_PATTERN = re.compile(r'([A-Za-z_][A-Za-z0-9_]*):(?!:)')
+NAME_PATTERN = re.compile(r'[A-Za-z0-9,._+*#?@-]+')
+REF_LABEL_PATTERN = re.compile(r'[A-Za-z0-9_]+')
+NUMBER_PATTERN = re.compile(r'(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*')
+
+# Expressions are evaluated in unsigned 64-bit arithmetic, as dtc does
+EXPRESSION_MASK = (1 << 64) - 1
+EXPRESSION_BITS = 64
+
+_EXPR_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.BitOr: operator.or_,
+    ast.BitAnd: operator.and_,
+    ast.BitXor: operator.xor,
+}
+
+def _parse_number(digits):
+    """Parses a C integer literal without its suffix: hex, octal or decimal."""
+    if len(digits) > 1 and digits[0] == '0' and digits[1] not in 'xX':
+        return int(digits, 8)
+    return int(digits, 0)
+
+def _eval_node(node, text):
+    """Evaluates one node of a parsed C integer expression."""
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body, text)
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value & EXPRESSION_MASK
+    if isinstance(node, ast.UnaryOp):
+        value = _eval_node(node.operand, text)
+        if isinstance(node.op, ast.USub):
+            return -value & EXPRESSION_MASK
+        if isinstance(node.op, ast.Invert):
+            return ~value & EXPRESSION_MASK
+        if isinstance(node.op, ast.UAdd):
+            return value
+    elif isinstance(node, ast.BinOp):
+        op = type(node.op)
+        left, right = _eval_node(node.left, text), _eval_node(node.right, text)
+        if op in _EXPR_OPERATORS:
+            return _EXPR_OPERATORS[op](left, right) & EXPRESSION_MASK
+        if op in (ast.FloorDiv, ast.Mod):
+            if right == 0:
+                raise ValueError(f"Division by zero in expression: ({text})")
+            # Both operands are unsigned, so // and % truncate as in C
+            return left // right if op is ast.FloorDiv else left % right
+        if op in (ast.LShift, ast.RShift):
+            if right >= EXPRESSION_BITS:
+                raise ValueError(f"Shift count out of range in expression: ({text})")
+            return (left << right) & EXPRESSION_MASK if op is ast.LShift else left >> right
+    raise ValueError(f"Unsupported expression: ({text})")
+
+def _eval_expression(text):
+    """Evaluates a C integer expression limited to arithmetic and bit operators."""
+    expression = re.sub(r'\b' + NUMBER_PATTERN.pattern, lambda m: str(_parse_number(m.group(1))), text)
+    try:
+        tree = ast.parse(expression.replace('/', '//'), mode='eval')
+        return _eval_node(tree, text)
+    except (SyntaxError, RecursionError):
+        raise ValueError(f"Unsupported expression: ({text})")
+
+class _DtsParser:
+    """
+    A recursive descent parser for DTS source. Property values are kept as
+    lists of byte pieces and references until the whole tree is known.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.plugin = False
+        self.memreserve = []
+        self.root = FdtNode('')
+        self.labels = {}
+        self.fragments = 0
+
+    def error(self, message):
+        line = self.text.count('\n', 0, self.pos) + 1
+        raise ValueError(f"DTS line {line}: {message}")
+
+    def skip(self):
+        """Skips whitespace and comments."""
+        text = self.text
+        while self.pos < len(text):
+            if text[self.pos].isspace():
+                self.pos += 1
+            elif text.startswith('//', self.pos):
+                end = text.find('\n', self.pos)
+                self.pos = len(text) if end < 0 else end + 1
+            elif text.startswith('/*', self.pos):
+                end = text.find('*/', self.pos + 2)
+                if end < 0:
+                    self.error("unterminated comment")
+                self.pos = end + 2
+            else:
+                break
+
+    def peek(self, token):
+        self.skip()
+        return self.text.startswith(token, self.pos)
+
+    def accept(self, token):
+        if self.peek(token):
+            self.pos += len(token)
+            return True
+        return False
+
+    def expect(self, token):
+        if not self.accept(token):
+            self.error(f"expected '{token}'")
+
+    def match(self, pattern):
+        self.skip()
+        m = pattern.match(self.text, self.pos)
+        if m:
+            self.pos = m.end()
+        return m
+
+    def read_labels(self):
+        labels = []
+        while True:
+            m = self.match(LABEL_PATTERN)
+            if not m:
+                return labels
+            labels.append(m.group(1))
+
+    def add_labels(self, node, labels):
+        for label in labels:
+            existing = self.labels.get(label)
+            if existing is not None and existing is not node:
+                self.error(f"duplicate label '{label}'")
+            self.labels[label] = node
+            if label not in node.labels:
+                node.labels.append(label)
+
+    def read_reference(self):
+        """Reads &label or &{/path} and returns the label or path."""
+        self.expect('&')
+        if self.text.startswith('{', self.pos):
+            end = self.text.find('}', self.pos)
+            if end < 0:
+                self.error("unterminated path reference")
+            path = self.text[self.pos + 1:end]
+            self.pos = end + 1
+            return path
+        m = REF_LABEL_PATTERN.match(self.text, self.pos)
+        if not m:
+            self.error("expected a label after '&'")
+        self.pos = m.end()
+        return m.group(0)
+
+    def read_number(self):
+        self.skip()
+        if self.text.startswith('(', self.pos):
+            depth, start = 0, self.pos
+            while self.pos < len(self.text):
+                c = self.text[self.pos]
+                self.pos += 1
+                depth += c == '('
+                depth -= c == ')'
+                if depth == 0:
+                    return _eval_expression(self.text[start:self.pos])
+            self.error("unbalanced parentheses")
+        if self.text.startswith("'", self.pos):
+            end = self.text.find("'", self.pos + 1)
+            literal = self.read_string_body(self.pos + 1, end)
+            self.pos = end + 1
+            if len(literal) != 1:
+                self.error("invalid character literal")
+            return literal[0]
+        m = self.match(NUMBER_PATTERN)
+        if not m:
+            self.error("expected a number")
+        return _parse_number(m.group(1))
+
+    def read_string_body(self, start, end):
+        out = bytearray()
+        text = self.text
+        i = start
+        simple = {'n': 0x0a, 't': 0x09, 'r': 0x0d, 'a': 0x07, 'b': 0x08, 'f': 0x0c, 'v': 0x0b,
+                  '\\': 0x5c, '"': 0x22, "'": 0x27}
+        while i < end:
+            c = text[i]
+            if c != '\\':
+                out += c.encode('utf-8')
+                i += 1
+                continue
+            i += 1
+            c = text[i]
+            if c in simple:
+                out.append(simple[c])
+                i += 1
+            elif c == 'x':
+                m = re.compile(r'[0-9a-fA-F]{1,2}').match(text, i + 1)
+                if not m:
+                    self.error("invalid \\x escape")
+                out.append(int(m.group(0), 16))
+                i = m.end()
+            elif c in '01234567':
+                m = re.compile(r'[0-7]{1,3}').match(text, i)
+                out.append(int(m.group(0), 8) & 0xff)
+                i = m.end()
+            else:
+                out += c.encode('utf-8')
+                i += 1
+        return bytes(out)
+
+    def read_string(self):
+        self.expect('"')
+        i = self.pos
+        while i < len(self.text) and self.text[i] != '"':
+            i += 2 if self.text[i] == '\\' else 1
+        if i >= len(self.text):
+            self.error("unterminated string")
+        value = self.read_string_body(self.pos, i)
+        self.pos = i + 1
+        return value
+
+    def read_cells(self, bits):
+        fmt = {8: '>B', 16: '>H', 32: '>I', 64: '>Q'}[bits]
+        mask = (1 << bits) - 1
+        pieces = []
+        self.expect('<')
+        while not self.accept('>'):
+            self.read_labels()
+            if self.peek('&'):
+                if bits != 32:
+                    self.error("phandle references need 32-bit cells")
+                pieces.append(('phandle', self.read_reference()))
+            else:
+                pieces.append(struct.pack(fmt, self.read_number() & mask))
+        return pieces
+
+    def read_bytestring(self):
+        self.expect('[')
+        end = self.text.find(']', self.pos)
+        if end < 0:
+            self.error("unterminated byte string")
+        digits = re.sub(r'\s+', '', self.text[self.pos:end])
+        self.pos = end + 1
+        if len(digits) % 2 or not re.fullmatch(r'[0-9a-fA-F]*', digits):
+            self.error("invalid byte string")
+        return bytes.fromhex(digits)
+
+    def read_value(self):
+        """Reads a comma separated property value up to the ';'."""
+        pieces = []
+        while True:
+            self.read_labels()
+            if self.peek('"'):
+                pieces.append(self.read_string() + b'\x00')
+            elif self.peek('/bits/'):
+                self.pos += len('/bits/')
+                bits = self.read_number()
+                if bits not in (8, 16, 32, 64):
+                    self.error(f"invalid /bits/ size {bits}")
+                pieces.extend(self.read_cells(bits))
+            elif self.peek('<'):
+                pieces.extend(self.read_cells(32))
+            elif self.peek('['):
+                pieces.append(self.read_bytestring())
+            elif self.peek('&'):
+                pieces.append(('path', self.read_reference()))
+            else:
+                self.error("expected a property value")
+            self.read_labels()
+            if not self.accept(','):
+                self.expect(';')
+                return pieces
+
+    def read_node_body(self, node):
+        self.expect('{')
+        while not self.accept('}'):
+            if self.accept('/delete-property/'):
+                name = self.match(NAME_PATTERN)
+                self.expect(';')
+                if name:
+                    node.properties.pop(name.group(0), None)
+                continue
+            if self.accept('/delete-node/'):
+                name = self.match(NAME_PATTERN)
+                self.expect(';')
+                if name:
+                    node.children.pop(name.group(0), None)
+                continue
+            if self.peek('/omit-if-no-ref/'):
+                self.error("/omit-if-no-ref/ is not supported")
+
+            labels = self.read_labels()
+            name = self.match(NAME_PATTERN)
+            if not name:
+                self.error("expected a node or property name")
+            name = name.group(0)
+            if self.peek('{'):
+                child = node.add_subnode(name)
+                self.add_labels(child, labels)
+                self.read_node_body(child)
+            elif self.accept('='):
+                node.properties[name] = FdtProperty(name, self.read_value())
+            else:
+                self.expect(';')
+                node.properties[name] = FdtProperty(name, b'')
+        self.expect(';')
+
+    def lookup(self, ref):
+        return self.root.find(ref) if ref.startswith('/') else self.labels.get(ref)
+
+    def read_top_level(self):
+        labels = self.read_labels()
+        if self.accept('/delete-node/'):
+            ref = self.read_reference()
+            self.expect(';')
+            node = self.lookup(ref)
+            if node is None or node.parent is None:
+                self.error(f"cannot delete '{ref}'")
+            del node.parent.children[node.name]
+            return
+        if self.peek('&'):
+            ref = self.read_reference()
+            if self.plugin:
+                # Overlay sugar: &target { ... } becomes a fragment
+                fragment = self.root.add_subnode(f'fragment@{self.fragments}')
+                self.fragments += 1
+                if ref.startswith('/'):
+                    fragment.properties['target-path'] = FdtProperty('target-path', [ref.encode('utf-8') + b'\x00'])
+                else:
+                    fragment.properties['target'] = FdtProperty('target', [('phandle', ref)])
+                node = fragment.add_subnode('__overlay__')
+            else:
+                node = self.lookup(ref)
+                if node is None:
+                    self.error(f"reference to non-existent node or label '{ref}'")
+        elif self.accept('/'):
+            node = self.root
+        else:
+            self.error("expected '/' or a node reference")
+        self.add_labels(node, labels)
+        self.read_node_body(node)
+
+    def parse(self):
+        if PREPROCESSOR_PATTERN.search(self.text):
+            raise ValueError("DTS uses C preprocessor directives; it must be compiled with dtc.")
+        if not self.accept('/dts-v1/'):
+            self.error("missing /dts-v1/ tag")
+        self.expect(';')
+        while self.accept('/dts-v1/'):
+            self.expect(';')
+        if self.accept('/plugin/'):
+            self.expect(';')
+            self.plugin = True
+        while self.accept('/memreserve/'):
+            address, size = self.read_number(), self.read_number()
+            self.expect(';')
+            self.memreserve.append((address, size))
+        self.skip()
+        while self.pos < len(self.text):
+            self.read_top_level()
+            self.skip()
+
+    def phandle_of(self, node, state):
+        value = node.get('phandle')
+        if isinstance(value, bytes) and len(value) == 4:
+            return struct.unpack('>I', value)[0]
+        state['next'] += 1
+        node.properties['phandle'] = FdtProperty('phandle', struct.pack('>I', state['next']))
+        return state['next']
+
+    def compile(self, symbols):
+        self.parse()
+
+        # Explicit phandles are kept; new ones continue after the largest
+        state = {'next': 0}
+        for node in self.root.walk():
+            value = node.get('phandle')
+            if isinstance(value, list):
+                node.properties['phandle'].value = self.resolve(node, 'phandle', value, state, {}, [])
+                value = node.get('phandle')
+            if isinstance(value, bytes) and len(value) == 4:
+                state['next'] = max(state['next'], struct.unpack('>I', value)[0])
+
+        fixups = {}
+        local_fixups = []
+        for node in list(self.root.walk()):
+            for name, prop in list(node.properties.items()):
+                if isinstance(prop.value, list):
+                    prop.value = self.resolve(node, name, prop.value, state, fixups, local_fixups)
+
+        if symbols and self.labels:
+            symbols_node = self.root.add_subnode('__symbols__')
+            for label, node in self.labels.items():
+                symbols_node.set_property(label, node.path)
+        if self.plugin and fixups:
+            fixups_node = self.root.add_subnode('__fixups__')
+            for label, locations in fixups.items():
+                fixups_node.set_property(label, locations)
+        if self.plugin and local_fixups:
+            local_node = self.root.add_subnode('__local_fixups__')
+            offsets = {}
+            for node, name, offset in local_fixups:
+                target = local_node
+                for component in node.path.strip('/').split('/'):
+                    if component:
+                        target = target.add_subnode(component)
+                offsets.setdefault((id(target), name), (target, []))[1].append(offset)
+            for (_, name), (target, values) in offsets.items():
+                target.set_property(name, values)
+
+        return Fdt(self.root, self.memreserve)
+
+    def resolve(self, node, name, pieces, state, fixups, local_fixups):
+        out = bytearray()
+        for piece in pieces:
+            if isinstance(piece, bytes):
+                out += piece
+                continue
+            kind, ref = piece
+            target = self.lookup(ref)
+            if kind == 'path':
+                if target is None:
+                    raise ValueError(f"Reference to non-existent node or label '{ref}' in {node.path}:{name}")
+                out += target.path.encode('utf-8') + b'\x00'
+            elif target is None:
+                if not self.plugin:
+                    raise ValueError(f"Reference to non-existent node or label '{ref}' in {node.path}:{name}")
+                fixups.setdefault(ref, []).append(f"{node.path}:{name}:{len(out)}")
+                out += b'\xff\xff\xff\xff'
+            else:
+                if self.plugin:
+                    local_fixups.append((node, name, len(out)))
+                out += struct.pack('>I', self.phandle_of(target, state))
+        return bytes(out)
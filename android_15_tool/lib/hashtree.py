@@ -0,0 +1,166 @@
+"""
+dm-verity hash tree generation and verification, compatible with the trees
+avbtool writes for AVB hashtree descriptors.
+
+Level 0 covers the data blocks of the image and dominates the cost, so it is
+hashed in parallel over a memory-mapped view of the image. hashlib releases
+the GIL while digesting, so a thread pool scales with the available cores.
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from android_15_tool.lib.stream_io import COPY_CHUNK_SIZE, map_file
+
+DEFAULT_BLOCK_SIZE = 4096
+
+def _round_to_multiple(size, multiple):
+    """Rounds a size up to a multiple."""
+    return (size + multiple - 1) // multiple * multiple
+
+def _round_to_pow2(value):
+    """Rounds a value up to the next power of two."""
+    return 1 << (value - 1).bit_length()
+
+def calc_hash_level_offsets(image_size, block_size, digest_size):
+    """
+    Computes the offset of every tree level and the total tree size.
+    Levels are stored top-first, so level 0 (hashes of the data blocks) is
+    placed last. Returns a tuple of (level_offsets, tree_size).
+    """
+    level_sizes = []
+    size = image_size
+    while size > block_size:
+        num_blocks = (size + block_size - 1) // block_size
+        level_size = _round_to_multiple(num_blocks * digest_size, block_size)
+        level_sizes.append(level_size)
+        size = level_size
+
+    level_offsets = [sum(level_sizes[n + 1:]) for n in range(len(level_sizes))]
+    return level_offsets, sum(level_sizes)
+
+def calc_hash_tree_size(image_size, block_size=DEFAULT_BLOCK_SIZE, hash_algorithm='sha256'):
+    """Returns the size of the hash tree for an image."""
+    digest_size = hashlib.new(hash_algorithm).digest_size
+    return calc_hash_level_offsets(image_size, block_size, _round_to_pow2(digest_size))[1]
+
+def _hash_blocks(view, start, end, block_size, salted, digest_padding):
+    """
+    Hashes the blocks of view[start:end] with a pre-salted hasher. A short
+    final block is zero-padded to the block size.
+    Returns the concatenated (padded) digests.
+    """
+    digests = []
+    padding = b'\x00' * digest_padding
+    for offset in range(start, end, block_size):
+        hasher = salted.copy()
+        block = view[offset:min(offset + block_size, end)]
+        hasher.update(block)
+        if len(block) < block_size:
+            hasher.update(b'\x00' * (block_size - len(block)))
+        digests.append(hasher.digest())
+        if digest_padding:
+            digests.append(padding)
+    return b''.join(digests)
+
+def _hash_level(executor, view, size, block_size, salted, digest_padding):
+    """
+    Hashes one level in parallel, splitting it into runs of blocks that are
+    large enough to amortise the task overhead.
+    """
+    run_size = max(block_size, COPY_CHUNK_SIZE // block_size * block_size)
+    starts = range(0, size, run_size)
+    if len(starts) == 1:
+        return _hash_blocks(view, 0, size, block_size, salted, digest_padding)
+    results = executor.map(
+        lambda start: _hash_blocks(view, start, min(start + run_size, size), block_size, salted, digest_padding),
+        starts)
+    return b''.join(results)
+
+def generate_hash_tree(view, image_size, block_size=DEFAULT_BLOCK_SIZE, hash_algorithm='sha256',
+                       salt=b'', workers=None):
+    """
+    Builds the hash tree over the first image_size bytes of a buffer.
+    Returns a tuple of (root_digest, tree) where tree is laid out exactly as
+    avbtool appends it to an image.
+    """
+    salted = hashlib.new(hash_algorithm, salt)
+    digest_size = salted.digest_size
+    digest_padding = _round_to_pow2(digest_size) - digest_size
+    level_offsets, tree_size = calc_hash_level_offsets(image_size, block_size, digest_size + digest_padding)
+
+    tree = bytearray(tree_size)
+    level_input = view[:image_size]
+    level_size = image_size
+    level_num = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        while level_size > block_size:
+            level_output = _hash_level(executor, level_input, level_size, block_size, salted, digest_padding)
+            level_output += b'\x00' * (-len(level_output) % block_size)
+            offset = level_offsets[level_num]
+            tree[offset:offset + len(level_output)] = level_output
+            level_input = memoryview(tree)[offset:offset + len(level_output)]
+            level_size = len(level_output)
+            level_num += 1
+
+    # The root digest covers the single top level block (or the whole
+    # image, zero-padded, when it fits in one block)
+    root = salted.copy()
+    top = bytes(level_input[:level_size])
+    root.update(top + b'\x00' * (block_size - len(top)) if level_num == 0 else top)
+    return root.digest(), bytes(tree)
+
+def verify_hash_tree(filepath, descriptor, workers=None):
+    """
+    Verifies an image against an AVB hashtree descriptor by rebuilding the
+    tree from the data blocks and comparing both the root digest and the tree
+    stored in the image. FEC data is not checked.
+    Returns a tuple of (status, detail) where status is 'ok' or 'mismatch'.
+    """
+    image_size = descriptor['image_size']
+    tree_offset = descriptor['tree_offset']
+    tree_size = descriptor['tree_size']
+    with map_file(filepath) as view:
+        if image_size > len(view) or tree_offset + tree_size > len(view):
+            return 'mismatch', "image is smaller than the hashtree descriptor expects"
+        root_digest, tree = generate_hash_tree(
+            view, image_size, descriptor['data_block_size'], descriptor['hash_algorithm'],
+            descriptor['salt'], workers)
+        if root_digest != descriptor['root_digest']:
+            return 'mismatch', f"root digest {root_digest.hex()} does not match"
+        if len(tree) != tree_size or view[tree_offset:tree_offset + tree_size] != tree:
+            return 'mismatch', "stored hash tree does not match the image data"
+    return 'ok', filepath
+
+def append_hash_tree(filepath, block_size=DEFAULT_BLOCK_SIZE, hash_algorithm='sha256', salt=None,
+                     workers=None):
+    """
+    Pads an image to the block size and appends its hash tree.
+    Returns a dict with the fields of the matching AVB hashtree descriptor.
+    """
+    if salt is None:
+        salt = os.urandom(hashlib.new(hash_algorithm).digest_size)
+
+    with open(filepath, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        image_size = _round_to_multiple(f.tell(), block_size)
+        f.truncate(image_size)
+
+    with map_file(filepath) as view:
+        root_digest, tree = generate_hash_tree(view, image_size, block_size, hash_algorithm, salt, workers)
+
+    with open(filepath, 'r+b') as f:
+        f.seek(image_size)
+        f.write(tree)
+
+    return {
+        'dm_verity_version': 1,
+        'image_size': image_size,
+        'tree_offset': image_size,
+        'tree_size': len(tree),
+        'data_block_size': block_size,
+        'hash_block_size': block_size,
+        'hash_algorithm': hash_algorithm,
+        'salt': salt,
+        'root_digest': root_digest,
+    }
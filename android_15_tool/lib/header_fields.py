@@ -0,0 +1,122 @@
+"""
+Locates the header fields of boot, vendor boot and super images in the
+file, using the struct formats of the parsers, so a hex view can label the
+bytes it shows.
+"""
+import re
+import struct
+from collections import namedtuple
+
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.super_unpacker import SuperUnpacker
+from android_15_tool.lib.vendor_boot import VendorBootImage
+
+HeaderField = namedtuple('HeaderField', ['offset', 'size', 'name', 'value'])
+
+_FORMAT_ITEM = re.compile(r'(\d*)([xcbB?hHiIlLqQnNefdspP])')
+
+def struct_fields(fmt, names, buf, base, prefix=''):
+    """
+    Returns a HeaderField for every named field of a little-endian struct
+    stored at base. names holds one name per field, None for reserved
+    fields; 'x' padding has no field. Fields past the end of buf are left
+    out.
+    """
+    fields = []
+    offset = base
+    values = iter(names)
+    for count, code in _FORMAT_ITEM.findall(fmt[1:]):
+        count = int(count) if count else 1
+        if code == 'x':
+            offset += count
+            continue
+        # A string is one field; any other code with a count is count fields
+        repeat, size = (1, count) if code in 'sp' else (count, struct.calcsize('<' + code))
+        for _ in range(repeat):
+            name = next(values, None)
+            if name is not None and offset + size <= len(buf):
+                value = struct.unpack_from('<' + (f'{size}s' if code in 'sp' else code), buf, offset)[0]
+                fields.append(HeaderField(offset, size, prefix + name, _format_value(value)))
+            offset += size
+    return fields
+
+def _format_value(value):
+    if isinstance(value, bytes):
+        text = value.rstrip(b'\x00')
+        if all(32 <= byte < 127 for byte in text):
+            return repr(text.decode('ascii'))
+        return text[:16].hex() + ('...' if len(text) > 16 else '')
+    return f"{value} (0x{value:x})"
+
+def _boot_fields(buf):
+    header_version = struct.unpack_from('<I', buf, BootImage.HEADER_VERSION_OFFSET)[0]
+    if header_version >= 3:
+        layouts = [(BootImage.HEADER_V3_FORMAT, BootImage.HEADER_V3_FIELDS)]
+        if header_version >= 4:
+            layouts.append((BootImage.HEADER_V4_FORMAT, BootImage.HEADER_V4_FIELDS))
+    else:
+        layouts = [(BootImage.HEADER_V0_FORMAT, BootImage.HEADER_V0_FIELDS)]
+        if header_version >= 1:
+            layouts.append((BootImage.HEADER_V1_FORMAT, BootImage.HEADER_V1_FIELDS))
+        if header_version >= 2:
+            layouts.append((BootImage.HEADER_V2_FORMAT, BootImage.HEADER_V2_FIELDS))
+    return _layout_fields(buf, layouts)
+
+def _vendor_boot_fields(buf):
+    layouts = [(VendorBootImage.HEADER_V3_FORMAT, VendorBootImage.HEADER_V3_FIELDS)]
+    if struct.unpack_from('<I', buf, len(VendorBootImage.VENDOR_BOOT_MAGIC))[0] >= 4:
+        layouts.append((VendorBootImage.HEADER_V4_FORMAT, VendorBootImage.HEADER_V4_FIELDS))
+    return _layout_fields(buf, layouts)
+
+def _layout_fields(buf, layouts):
+    """Fields of header structs that follow each other from offset 0."""
+    fields = []
+    offset = 0
+    for fmt, names in layouts:
+        fields += struct_fields(fmt, names, buf, offset)
+        offset += struct.calcsize(fmt)
+    return fields
+
+def _super_fields(f, buf):
+    unpacker = SuperUnpacker(None)
+    unpacker._parse_metadata(f)
+    fields = struct_fields(SuperUnpacker.LP_METADATA_GEOMETRY_FORMAT, SuperUnpacker.LP_METADATA_GEOMETRY_FIELDS,
+                           buf, unpacker.geometry["offset"], 'geometry.')
+    header_offset = unpacker.metadata["header_offset"]
+    header_size = struct.unpack_from('<I', buf, header_offset + 8)[0]
+    if header_size < SuperUnpacker.LP_METADATA_HEADER_V1_0_SIZE:
+        # Legacy header: only the start of it is known
+        return fields + struct_fields(SuperUnpacker.LP_METADATA_HEADER_FORMAT,
+                                      SuperUnpacker.LP_METADATA_HEADER_FIELDS[:7], buf, header_offset, 'header.')
+    fields += struct_fields(SuperUnpacker.LP_METADATA_HEADER_FORMAT, SuperUnpacker.LP_METADATA_HEADER_FIELDS,
+                            buf, header_offset, 'header.')
+    descriptors = struct.unpack_from('<6I', buf, header_offset + SuperUnpacker.LP_METADATA_TABLE_DESCRIPTORS_OFFSET)
+    tables = header_offset + header_size
+    for table, (offset, num_entries, entry_size), fmt, names in (
+            ('partitions', descriptors[:3], SuperUnpacker.LP_METADATA_PARTITION_FORMAT,
+             SuperUnpacker.LP_METADATA_PARTITION_FIELDS),
+            ('extents', descriptors[3:], SuperUnpacker.LP_METADATA_EXTENT_FORMAT,
+             SuperUnpacker.LP_METADATA_EXTENT_FIELDS)):
+        for i in range(num_entries):
+            fields += struct_fields(fmt, names, buf, tables + offset + i * entry_size, f'{table}[{i}].')
+    return fields
+
+def header_fields(f, buf):
+    """
+    Returns the HeaderFields of a boot, vendor boot or super image, sorted
+    by offset, given the open file and a buffer (bytes or an mmap) over its
+    contents. Returns an empty list for other files. Raises ValueError if
+    the header is recognised but cannot be read.
+    """
+    try:
+        if buf[:len(BootImage.BOOT_MAGIC)] == BootImage.BOOT_MAGIC:
+            fields = _boot_fields(buf)
+        elif buf[:len(VendorBootImage.VENDOR_BOOT_MAGIC)] == VendorBootImage.VENDOR_BOOT_MAGIC:
+            fields = _vendor_boot_fields(buf)
+        elif struct.pack('<I', SuperUnpacker.LP_METADATA_GEOMETRY_MAGIC) in (buf[4096:4100], buf[16384:16388]):
+            fields = _super_fields(f, buf)
+        else:
+            return []
+    except struct.error as e:
+        raise ValueError(f"Truncated header: {e}")
+    return sorted(fields)
@@ -0,0 +1,206 @@
+"""
+Read-only browsing of firmware images as virtual directory trees: a super
+image as its logical partitions, EROFS and ext4 filesystems as their
+directories, boot and vendor boot images as their sections, and ramdisks
+as their cpio entries. Nothing is extracted. Every read goes through an
+ExtentReader onto the original file, and the children of an entry are read
+the first time they are asked for and then kept on the entry.
+"""
+import os
+import posixpath
+import stat
+import struct
+import threading
+
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.compression import detect_compression
+from android_15_tool.lib.erofs import ErofsImage, is_erofs
+from android_15_tool.lib.ext4 import Ext4Image, is_ext4
+from android_15_tool.lib.ramdisk import list_cpio
+from android_15_tool.lib.stream_io import ExtentReader
+from android_15_tool.lib.super_unpacker import SuperUnpacker
+from android_15_tool.lib.vendor_boot import VendorBootImage
+
+# Enough of the start of an image to find every magic that probe() checks
+PROBE_SIZE = 16384 + 4
+
+class VirtualEntry:
+    """
+    A node in a virtual image tree. Entries with a loader can be expanded;
+    children() runs the loader once and caches its result. Loaders raise
+    ValueError for data they cannot read.
+    """
+
+    def __init__(self, name, size, kind, loader=None):
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self._loader = loader
+        self._children = None
+        self._lock = threading.Lock()
+
+    @property
+    def expandable(self):
+        return self._loader is not None
+
+    def children(self):
+        """Returns the child entries, loading them on first use."""
+        if self._loader is None:
+            return []
+        with self._lock:
+            if self._children is None:
+                self._children = self._loader()
+            return self._children
+
+    def describe(self):
+        return f"{self.name}: {self.kind}, {self.size} bytes"
+
+def _sorted_entries(entries):
+    """Orders entries like the file browser: expandable first, then by name."""
+    return sorted(entries, key=lambda e: (not e.expandable, e.name.lower()))
+
+def _filesystem_children(fs, inode):
+    entries = []
+    for entry in fs.listdir(inode):
+        if stat.S_ISDIR(entry.mode):
+            entries.append(VirtualEntry(entry.name, entry.size, 'directory',
+                                        lambda child=entry.inode: _filesystem_children(fs, child)))
+        elif stat.S_ISLNK(entry.mode):
+            entries.append(VirtualEntry(entry.name, entry.size, 'symlink'))
+        elif stat.S_ISREG(entry.mode):
+            entries.append(VirtualEntry(entry.name, entry.size, 'file'))
+        else:
+            entries.append(VirtualEntry(entry.name, entry.size, 'special'))
+    return _sorted_entries(entries)
+
+def _cpio_children(reader):
+    """Lists a (compressed) ramdisk and arranges its entries as a tree."""
+    try:
+        archive = list_cpio(reader.iter_chunks())
+    except EnvironmentError as e:
+        raise ValueError(str(e))
+    # Directory path -> {name: path}; directories without an entry of their
+    # own are implied by the paths below them
+    directories = {'': {}}
+    entries = {}
+    for entry in archive:
+        path = posixpath.normpath(entry.name).lstrip('/')
+        if path in ('', '.') or path.startswith('..'):
+            continue
+        entries[path] = entry
+        parts = path.split('/')
+        for depth in range(1, len(parts) + 1):
+            parent = '/'.join(parts[:depth - 1])
+            directories.setdefault(parent, {})[parts[depth - 1]] = '/'.join(parts[:depth])
+
+    def build(path):
+        children = []
+        for name, child in directories.get(path, {}).items():
+            entry = entries.get(child)
+            if child in directories or entry is None or stat.S_ISDIR(entry.mode):
+                children.append(VirtualEntry(name, 0, 'directory', lambda child=child: build(child)))
+            elif stat.S_ISLNK(entry.mode):
+                children.append(VirtualEntry(name, entry.size, 'symlink'))
+            elif stat.S_ISREG(entry.mode):
+                children.append(VirtualEntry(name, entry.size, 'file'))
+            else:
+                children.append(VirtualEntry(name, entry.size, 'special'))
+        return _sorted_entries(children)
+
+    return build('')
+
+def _section_entry(reader, name, offset, size):
+    """An image section; ramdisks can be opened further."""
+    if 'ramdisk' in name:
+        return VirtualEntry(name, size, 'ramdisk', lambda: _cpio_children(reader.slice(offset, size)))
+    return VirtualEntry(name, size, 'section')
+
+def _boot_children(reader):
+    image = BootImage(reader.path)
+    try:
+        image.parse()
+    except RuntimeError as e:
+        raise ValueError(str(e))
+    return [_section_entry(reader, name, offset, size) for name, (offset, size) in image.sections.items()]
+
+def _vendor_boot_children(reader):
+    image = VendorBootImage(reader.path)
+    try:
+        image.parse()
+    except RuntimeError as e:
+        raise ValueError(str(e))
+    entries = []
+    for name, (offset, size) in image.sections.items():
+        if name == 'vendor_ramdisk' and image.ramdisk_table:
+            continue
+        if name != 'vendor_ramdisk_table':
+            entries.append(_section_entry(reader, name, offset, size))
+    for i, fragment in enumerate(image.ramdisk_table):
+        name = f"vendor_ramdisk_{fragment['ramdisk_name'] or f'{i:02d}'}"
+        entries.append(_section_entry(reader, name, fragment['offset'], fragment['ramdisk_size']))
+    return entries
+
+def _super_children(reader):
+    unpacker = SuperUnpacker(reader.path)
+    with open(reader.path, 'rb') as f:
+        try:
+            unpacker._parse_metadata(f)
+        except struct.error as e:
+            raise ValueError(f"Truncated super metadata: {e}")
+    entries = []
+    for partition in unpacker.metadata["partitions"]:
+        def load(partition=partition):
+            return _probe_children(reader.remap(unpacker.extent_map(partition)))
+        entries.append(VirtualEntry(partition["name"], partition["size"], 'partition', load))
+    return entries
+
+def probe(reader, whole_file=False):
+    """
+    Identifies a browsable image. Returns (kind, loader), where loader
+    returns the top-level entries, or None if the data is not recognised.
+    Boot, vendor boot and super images are only recognised as whole files.
+    """
+    head = reader.read(0, PROBE_SIZE)
+    if head[:4] == struct.pack('<I', SuperUnpacker.SPARSE_HEADER_MAGIC):
+        raise ValueError("Sparse images cannot be browsed. Please unsparse the image first.")
+    if whole_file:
+        if head.startswith(BootImage.BOOT_MAGIC):
+            return 'boot', lambda: _boot_children(reader)
+        if head.startswith(VendorBootImage.VENDOR_BOOT_MAGIC):
+            return 'vendor_boot', lambda: _vendor_boot_children(reader)
+        geometry_magic = struct.pack('<I', SuperUnpacker.LP_METADATA_GEOMETRY_MAGIC)
+        if geometry_magic in (head[4096:4100], head[16384:16388]):
+            return 'super', lambda: _super_children(reader)
+    if is_erofs(head):
+        fs = ErofsImage(reader.read)
+        return 'erofs', lambda: _filesystem_children(fs, fs.root)
+    if is_ext4(head):
+        fs = Ext4Image(reader.read)
+        return 'ext4', lambda: _filesystem_children(fs, fs.root)
+    if detect_compression(head) is not None:
+        return 'ramdisk', lambda: _cpio_children(reader)
+    return None
+
+def _probe_children(reader):
+    found = probe(reader)
+    if found is None:
+        raise ValueError("No filesystem or archive recognised.")
+    return found[1]()
+
+def browse_image(path):
+    """
+    Opens an image file for browsing. Returns its root VirtualEntry, whose
+    children are read on first use. Raises ValueError if the file is not a
+    browsable image.
+    """
+    reader = ExtentReader(path)
+    try:
+        found = probe(reader, whole_file=True)
+    except (ValueError, struct.error, OSError):
+        reader.close()
+        raise
+    if found is None:
+        reader.close()
+        raise ValueError("Not a super, boot, vendor boot, EROFS, ext4 or ramdisk image.")
+    kind, loader = found
+    return VirtualEntry(os.path.basename(path), reader.size, kind, loader)
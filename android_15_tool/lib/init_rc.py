@@ -0,0 +1,455 @@
+"""
+Parses the init .rc scripts of an extracted firmware tree the way init
+finds them: from init.rc and the system, system_ext, vendor, odm and
+product init directories, following import statements, with ${property}
+references filled in from the tree's build.prop files. Files are parsed in
+parallel, and the services, actions and triggers they define are indexed so
+queries such as "what starts on post-fs-data and which modules does it
+load" are dictionary lookups. Indexes are cached per tree, in memory and on
+disk, until one of the files they were built from changes.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shlex
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from android_15_tool.lib.cache import ResultCache
+from android_15_tool.lib.walker import WALKER_THREADS
+
+# Bump when the cached index format changes so stale cache entries are ignored
+INIT_RC_VERSION = 3
+
+# The first of these that exists is the main init script
+INIT_RC_ROOTS = ('/system/etc/init/hw/init.rc', '/init.rc')
+# Every .rc file in these directories is loaded after it
+INIT_RC_DIRECTORIES = ('/system/etc/init', '/system_ext/etc/init', '/vendor/etc/init', '/odm/etc/init',
+                       '/product/etc/init')
+# Read in this order; the first definition of a property wins, as for ro. properties
+BUILD_PROP_FILES = ('/system/build.prop', '/system_ext/etc/build.prop', '/vendor/build.prop',
+                    '/vendor/default.prop', '/odm/etc/build.prop', '/vendor/odm/etc/build.prop',
+                    '/product/etc/build.prop', '/default.prop', '/prop.default')
+
+PROPERTY_PATTERN = re.compile(r'\$\{([^}:]+)(?::-([^}]*))?\}')
+# Commands that start the service named by their first argument
+START_COMMANDS = ('start', 'restart', 'exec_start', 'enable')
+MODULE_LOADERS = ('insmod', 'modprobe')
+# modprobe options that take a value as the next argument
+MODPROBE_VALUE_OPTIONS = ('-d', '--dirname')
+
+def expand_properties(text, properties):
+    """
+    Replaces ${name} and ${name:-default} references. Returns the expanded
+    text and the names of the properties that were undefined, whose
+    references are left as they were.
+    """
+    missing = []
+
+    def replace(match):
+        name, default = match.group(1), match.group(2)
+        if name in properties:
+            return properties[name]
+        if default is not None:
+            return default
+        missing.append(name)
+        return match.group(0)
+
+    return PROPERTY_PATTERN.sub(replace, text), missing
+
+def _logical_lines(text):
+    """Yields (line number, line) with comments dropped and continuations joined."""
+    buffer, start = [], None
+    for number, line in enumerate(text.splitlines(), 1):
+        stripped = line.strip()
+        if not buffer and (not stripped or stripped.startswith('#')):
+            continue
+        if start is None:
+            start = number
+        if stripped.endswith('\\'):
+            buffer.append(stripped[:-1])
+            continue
+        buffer.append(stripped)
+        yield start, ' '.join(buffer)
+        buffer, start = [], None
+    if buffer:
+        yield start, ' '.join(buffer)
+
+def _tokenize(line):
+    try:
+        return shlex.split(line, comments=True)
+    except ValueError:
+        # Unbalanced quotes; init would reject the line, keep what is there
+        return line.split()
+
+def parse_rc(text, source):
+    """
+    Parses one .rc file. Returns a dict with its services, actions and
+    imports. Services have a name, args (the program first), options and
+    source; actions have their triggers (each condition of an '&&'
+    trigger), commands and source. A source is [path, line].
+    """
+    result = {'path': source, 'services': [], 'actions': [], 'imports': []}
+    section = None
+    for number, line in _logical_lines(text):
+        tokens = _tokenize(line)
+        if not tokens:
+            continue
+        keyword = tokens[0]
+        if keyword == 'on':
+            section = {'triggers': [t for t in tokens[1:] if t != '&&'], 'commands': [], 'source': [source, number]}
+            result['actions'].append(section)
+        elif keyword == 'service':
+            section = None
+            if len(tokens) >= 3:
+                section = {'name': tokens[1], 'args': tokens[2:], 'options': [], 'source': [source, number]}
+                result['services'].append(section)
+        elif keyword == 'import':
+            section = None
+            if len(tokens) == 2:
+                result['imports'].append([tokens[1], number])
+        elif keyword == 'subsystem':
+            # ueventd sections; nothing init runs
+            section = None
+        elif section is not None:
+            section['commands' if 'triggers' in section else 'options'].append(tokens)
+    return result
+
+def _stat_entry(path):
+    """What a cached index remembers about a path: [size, mtime_ns], ['dir', mtime_ns] or None."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return ['dir' if os.path.isdir(path) else st.st_size, st.st_mtime_ns]
+
+def _stats_match(stats):
+    return all(_stat_entry(path) == entry for path, entry in stats.items())
+
+class _TreeFiles:
+    """Maps device paths into an extracted tree, recording every path it looks at."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.root = os.path.realpath(tree)
+        self.stats = {}
+
+    def inside(self, path):
+        """Whether a host path, with every symlink resolved, is still in the tree."""
+        return self.contains(os.path.realpath(path))
+
+    def contains(self, real):
+        """Whether an already resolved host path is in the tree."""
+        return real == self.root or real.startswith(self.root + os.sep)
+
+    def _stat(self, path):
+        entry = _stat_entry(path)
+        self.stats[path] = entry
+        return entry
+
+    def locate(self, device_path):
+        """
+        Returns the host path of a device path, or None. /system is also
+        looked for under system/system. Paths that lead out of the tree,
+        with .. or through a symlink such as vendor -> /vendor, are never
+        found.
+        """
+        relative = posixpath.normpath(device_path).lstrip('/')
+        if relative == '..' or relative.startswith('../'):
+            return None
+        candidates = [os.path.join(self.tree, relative)]
+        if relative.startswith('system/'):
+            candidates.append(os.path.join(self.tree, 'system', relative))
+        for candidate in candidates:
+            if self.inside(candidate) and self._stat(candidate) is not None:
+                return candidate
+        return None
+
+    def rc_files(self, device_path, host_path):
+        """Returns (device path, host path) of a file, or of the .rc files in a directory."""
+        if self.stats[host_path][0] != 'dir':
+            return [(device_path, host_path)]
+        try:
+            names = sorted(name for name in os.listdir(host_path) if name.endswith('.rc'))
+        except OSError:
+            return []
+        found = []
+        for name in names:
+            path = os.path.join(host_path, name)
+            entry = self._stat(path)
+            if entry is not None and entry[0] != 'dir':
+                found.append((posixpath.join(device_path, name), path))
+        return found
+
+def read_build_props(files):
+    """Reads the properties of a tree's build.prop files."""
+    properties = {}
+    for device_path in BUILD_PROP_FILES:
+        host_path = files.locate(device_path)
+        if host_path is None:
+            continue
+        try:
+            with open(host_path, 'r', errors='replace') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#') or '=' not in line:
+                        continue
+                    name, value = line.split('=', 1)
+                    properties.setdefault(name.strip(), value.strip())
+        except OSError:
+            continue
+    return properties
+
+def _parse_file(device_path, host_path):
+    try:
+        with open(host_path, 'r', errors='replace') as f:
+            return parse_rc(f.read(), device_path)
+    except OSError as e:
+        return dict(parse_rc('', device_path), error=str(e))
+
+def _command_modules(tokens):
+    """Returns the modules an insmod or modprobe invocation loads."""
+    if tokens and tokens[0] == 'exec' and '--' in tokens:
+        tokens = tokens[tokens.index('--') + 1:]
+    if not tokens or posixpath.basename(tokens[0]) not in MODULE_LOADERS:
+        return []
+    args = tokens[1:]
+    if posixpath.basename(tokens[0]) == 'insmod':
+        # insmod [-f] <path> [module options]
+        paths = [arg for arg in args if not arg.startswith('-')]
+        return paths[:1]
+    modules, skip = [], False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in MODPROBE_VALUE_OPTIONS:
+            skip = True
+        elif not arg.startswith('-'):
+            modules.append(arg)
+    return modules
+
+class RcIndex:
+    """
+    The services, actions, triggers and service classes of a tree's init
+    scripts. Services keep their first definition. Services without a
+    class option are in the 'default' class, as in init.
+    """
+
+    def __init__(self, files, properties, unresolved):
+        self.files = files
+        self.properties = properties
+        self.unresolved = unresolved
+        self.cached = False
+        self.services = {}
+        self.actions = []
+        self.triggers = {}
+        self.classes = {}
+        for parsed in files:
+            for service in parsed['services']:
+                self.services.setdefault(service['name'], service)
+            for action in parsed['actions']:
+                self.actions.append(action)
+                for trigger in action['triggers']:
+                    self.triggers.setdefault(trigger, []).append(action)
+        for name, service in self.services.items():
+            classes = [c for option in service['options'] if option[0] == 'class' for c in option[1:]]
+            for service_class in classes or ['default']:
+                self.classes.setdefault(service_class, []).append(name)
+
+    def to_json(self):
+        return {'files': self.files, 'properties': self.properties, 'unresolved': self.unresolved}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['files'], data['properties'], data['unresolved'])
+
+    def actions_on(self, trigger):
+        """Returns the actions with trigger as one of their conditions."""
+        return self.triggers.get(trigger, [])
+
+    def _started(self, commands):
+        """Yields the names of the services a list of commands starts."""
+        for tokens in commands:
+            if tokens[0] in START_COMMANDS and len(tokens) > 1:
+                yield tokens[1]
+            elif tokens[0] == 'class_start' and len(tokens) > 1:
+                yield from self.classes.get(tokens[1], [])
+
+    def services_started_on(self, trigger):
+        """Returns the names of the services that actions on a trigger start, in order."""
+        names = []
+        for action in self.actions_on(trigger):
+            for name in self._started(action['commands']):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def triggers_starting(self, name):
+        """Returns the triggers of the actions that start a service."""
+        triggers = []
+        for action in self.actions:
+            if name in self._started(action['commands']):
+                triggers += [t for t in action['triggers'] if t not in triggers]
+        return triggers
+
+    def modules_loaded_on(self, trigger):
+        """
+        Returns (module, source) for the modules loaded on a trigger: by
+        insmod commands, exec'd insmod or modprobe, and services started
+        then that run insmod or modprobe.
+        """
+        found = []
+        for action in self.actions_on(trigger):
+            for tokens in action['commands']:
+                for module in _command_modules(tokens):
+                    found.append((expand_properties(module, self.properties)[0], action['source']))
+        for name in self.services_started_on(trigger):
+            service = self.services.get(name)
+            if service is not None:
+                for module in _command_modules(service['args']):
+                    found.append((expand_properties(module, self.properties)[0], service['source']))
+        return found
+
+    def summary(self):
+        """Returns report lines describing what was parsed."""
+        lines = [f"Init scripts: {len(self.files)} files, {len(self.services)} services, "
+                 f"{len(self.actions)} actions, {len(self.triggers)} triggers"
+                 f"{' (cached)' if self.cached else ''}"]
+        for parsed in self.files:
+            if parsed.get('error'):
+                lines.append(f"Unreadable: {parsed['path']}: {parsed['error']}")
+        for entry in self.unresolved:
+            lines.append(f"Unresolved import {entry['import']} ({_source(entry['source'])}): {entry['reason']}")
+        return lines
+
+def _source(source):
+    return f"{source[0]}:{source[1]}"
+
+def query_rc_index(index, text):
+    """
+    Answers a query as report lines: a service name describes the service
+    and what starts it; anything else is taken as a trigger, such as
+    post-fs-data or property:sys.boot_completed=1.
+    """
+    text = text.strip()
+    service = index.services.get(text)
+    if service is not None:
+        lines = [f"Service {text}: {' '.join(service['args'])}", f"Defined at {_source(service['source'])}"]
+        lines += [f"  {' '.join(option)}" for option in service['options']]
+        triggers = index.triggers_starting(text)
+        lines.append(f"Started on: {', '.join(triggers)}" if triggers else "Not started by any action.")
+        return lines
+
+    actions = index.actions_on(text)
+    if not actions:
+        return [f"No service or trigger named '{text}'."]
+    lines = [f"Actions on {text}: {len(actions)}"]
+    lines += [f"- on {' && '.join(action['triggers'])} ({_source(action['source'])})" for action in actions]
+    services = index.services_started_on(text)
+    lines.append("Services started:" if services else "Services started: none")
+    for name in services:
+        service = index.services.get(name)
+        lines.append(f"- {name}: {' '.join(service['args'])}" if service else f"- {name} (not defined)")
+    modules = index.modules_loaded_on(text)
+    lines.append("Modules loaded:" if modules else "Modules loaded: none")
+    lines += [f"- {module} ({_source(source)})" for module, source in modules]
+    return lines
+
+def build_rc_index(tree, properties=None, workers=WALKER_THREADS):
+    """
+    Parses the init scripts of an extracted tree in parallel. properties
+    are added to (and override) those of the tree's build.prop files, for
+    values such as ro.hardware that come from the kernel command line.
+    Returns the RcIndex and the stats of every path looked at.
+    """
+    files = _TreeFiles(tree)
+    props = read_build_props(files)
+    props.update(properties or {})
+    # Files are keyed by real path: the parsed result, and the files each
+    # one's imports resolved to, in order
+    results, imported, roots, unresolved, pending, seen = {}, {}, [], [], {}, set()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="init_rc") as pool:
+        def queue(device_path):
+            """Returns the real paths of the .rc files a device path names, or None if it is not in the tree."""
+            host_path = files.locate(device_path)
+            if host_path is None:
+                return None
+            found = []
+            for rc_device_path, rc_host_path in files.rc_files(device_path, host_path):
+                real = os.path.realpath(rc_host_path)
+                if not files.contains(real):
+                    continue
+                if real not in seen:
+                    seen.add(real)
+                    pending[pool.submit(_parse_file, rc_device_path, rc_host_path)] = real
+                found.append(real)
+            return found
+
+        for root in INIT_RC_ROOTS:
+            found = queue(root)
+            if found is not None:
+                roots += found
+                break
+        for directory in INIT_RC_DIRECTORIES:
+            roots += queue(directory) or []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                real = pending.pop(future)
+                result = results[real] = future.result()
+                imported[real] = []
+                for path, line in result['imports']:
+                    expanded, missing = expand_properties(path, props)
+                    source = [result['path'], line]
+                    found = None if missing else queue(expanded)
+                    if missing:
+                        unresolved.append({'import': path, 'source': source,
+                                           'reason': f"undefined property {', '.join(missing)}"})
+                    elif found is None:
+                        unresolved.append({'import': expanded, 'source': source, 'reason': "not in the tree"})
+                    else:
+                        imported[real] += found
+
+    # Parsing finishes in any order; list the files in the order init loads
+    # them. Each file is followed by its imports, depth first, before the
+    # next file, and a file already loaded is skipped.
+    parsed, loaded, stack = [], set(), roots[::-1]
+    while stack:
+        real = stack.pop()
+        if real not in loaded:
+            loaded.add(real)
+            parsed.append(results[real])
+            stack += imported[real][::-1]
+    unresolved.sort(key=lambda u: u['source'])
+    return RcIndex(parsed, props, unresolved), files.stats
+
+# Cache key -> (stats, RcIndex), for repeated queries in one process
+_INDEX_CACHE = {}
+
+def load_rc_index(tree, properties=None, use_cache=True, cache_dir=None):
+    """
+    Returns the RcIndex of a tree, reusing the one from memory or from the
+    on-disk cache while none of the files and directories it was built from
+    have changed.
+    """
+    tree = os.path.realpath(tree)
+    key = hashlib.sha256(json.dumps([tree, sorted((properties or {}).items())]).encode()).hexdigest()
+    cache = ResultCache(f'init-rc-v{INIT_RC_VERSION}', cache_dir) if use_cache else None
+    if cache:
+        in_memory = _INDEX_CACHE.get(key)
+        if in_memory is not None and _stats_match(in_memory[0]):
+            return in_memory[1]
+        stored = cache.get(key)
+        if stored is not None and _stats_match(stored['stats']):
+            index = RcIndex.from_json(stored['index'])
+            index.cached = True
+            _INDEX_CACHE[key] = (stored['stats'], index)
+            return index
+
+    index, stats = build_rc_index(tree, properties)
+    if cache:
+        _INDEX_CACHE[key] = (stats, index)
+        cache.put(key, {'stats': stats, 'index': index.to_json()})
+    return index
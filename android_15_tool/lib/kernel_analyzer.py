@@ -0,0 +1,225 @@
+"""
+Kernel image introspection: identifies the image format, and streams the
+(decompressed) kernel just far enough to recover the Linux version banner
+and the embedded IKCFG configuration.
+"""
+import hashlib
+import re
+import struct
+import zlib
+
+from android_15_tool.lib.cache import ResultCache
+from android_15_tool.lib.compression import detect_compression, iter_decompress
+from android_15_tool.lib.stream_io import iter_view_chunks, map_file
+
+# Bump when the result format changes so stale cache entries are ignored
+ANALYZER_VERSION = 1
+
+ARM64_IMAGE_MAGIC = b'ARM\x64'
+ARM64_IMAGE_MAGIC_OFFSET = 56
+ZIMAGE_MAGIC = 0x016f2818
+ZIMAGE_MAGIC_OFFSET = 0x24
+BZIMAGE_MAGIC = b'HdrS'
+BZIMAGE_MAGIC_OFFSET = 0x202
+
+IKCFG_START = b'IKCFG_ST'
+IKCFG_END = b'IKCFG_ED'
+# config.gz is typically 30-60 KB; give up on a start marker without an end
+IKCFG_MAX_SIZE = 4 * 1024 * 1024
+
+BANNER_PATTERN = re.compile(rb'Linux version (\S+) \([^\x00\n]*')
+# Longer than any banner, so one split across chunks is seen whole next time
+SCAN_OVERLAP = 1024
+# Decompressed output is scanned in slices of this size, so a match can
+# stop decompression early
+SCAN_CHUNK_SIZE = 256 * 1024
+
+# Self-decompressing images hide the payload behind a stub; these magics
+# are precise enough to locate it
+EMBEDDED_PAYLOAD_MAGICS = [
+    ('gzip', b'\x1f\x8b\x08'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('lz4_legacy', b'\x02\x21\x4c\x18'),
+    ('zstd', b'\x28\xb5\x2f\xfd'),
+    ('lzma', b'\x5d\x00\x00'),
+]
+
+# Bytes detect_compression looks at; chunks overlap by this much so a
+# payload header split across chunks is seen whole
+PAYLOAD_HEAD_SIZE = 16
+
+def _find_embedded_payload(view, start):
+    """
+    Returns (offset, compression) of the first compressed payload at or
+    after start, or (None, None). The view is searched in overlapping
+    chunks rather than copied whole.
+    """
+    for chunk_start in range(start, len(view), SCAN_CHUNK_SIZE):
+        data = bytes(view[chunk_start:chunk_start + SCAN_CHUNK_SIZE + PAYLOAD_HEAD_SIZE - 1])
+        best = (None, None)
+        for compression, magic in EMBEDDED_PAYLOAD_MAGICS:
+            # Matches in the overlap are left to the next chunk
+            offset = data.find(magic, 0, SCAN_CHUNK_SIZE + len(magic) - 1)
+            while offset >= 0 and detect_compression(data[offset:offset + PAYLOAD_HEAD_SIZE]) is None:
+                offset = data.find(magic, offset + 1, SCAN_CHUNK_SIZE + len(magic) - 1)
+            if offset >= 0 and (best[0] is None or chunk_start + offset < best[0]):
+                best = (chunk_start + offset, compression)
+        if best[0] is not None:
+            return best
+    return None, None
+
+def identify_kernel(view):
+    """
+    Identifies a kernel image from its first bytes.
+    Returns a dict with 'format', 'arch', 'compression' and 'payload_offset'
+    (where the compressed or raw kernel begins).
+    """
+    head = bytes(view[:0x260])
+    compression = detect_compression(head)
+    if compression in ('gzip', 'lz4_legacy', 'lz4_frame', 'xz', 'lzma', 'bzip2', 'zstd'):
+        suffix = {'gzip': 'gz', 'lz4_legacy': 'lz4', 'lz4_frame': 'lz4'}.get(compression, compression)
+        return {'format': f'Image.{suffix}', 'arch': None, 'compression': compression, 'payload_offset': 0}
+
+    if head[ARM64_IMAGE_MAGIC_OFFSET:ARM64_IMAGE_MAGIC_OFFSET + 4] == ARM64_IMAGE_MAGIC:
+        return {'format': 'Image', 'arch': 'arm64', 'compression': None, 'payload_offset': 0}
+
+    if len(head) >= ZIMAGE_MAGIC_OFFSET + 4 and \
+            struct.unpack_from('<I', head, ZIMAGE_MAGIC_OFFSET)[0] == ZIMAGE_MAGIC:
+        offset, compression = _find_embedded_payload(view, ZIMAGE_MAGIC_OFFSET + 4)
+        return {'format': 'zImage', 'arch': 'arm', 'compression': compression, 'payload_offset': offset}
+
+    if head[BZIMAGE_MAGIC_OFFSET:BZIMAGE_MAGIC_OFFSET + 4] == BZIMAGE_MAGIC:
+        setup_sects = head[0x1f1] or 4
+        payload_offset = struct.unpack_from('<I', head, 0x248)[0]
+        offset = (setup_sects + 1) * 512 + payload_offset
+        compression = detect_compression(bytes(view[offset:offset + 16]))
+        if compression is None:
+            offset, compression = _find_embedded_payload(view, (setup_sects + 1) * 512)
+        return {'format': 'bzImage', 'arch': 'x86', 'compression': compression, 'payload_offset': offset}
+
+    return {'format': 'unknown', 'arch': None, 'compression': None, 'payload_offset': 0}
+
+def _iter_kernel(view, info):
+    """Yields the decompressed kernel in SCAN_CHUNK_SIZE slices."""
+    offset = info['payload_offset']
+    if offset is None:
+        return
+    chunks = iter_view_chunks(view[offset:], SCAN_CHUNK_SIZE)
+    if info['compression'] is None:
+        yield from chunks
+        return
+    try:
+        for chunk in iter_decompress(chunks, info['compression']):
+            yield from iter_view_chunks(memoryview(chunk), SCAN_CHUNK_SIZE)
+    except ValueError:
+        # Self-decompressing images append size words and padding after
+        # the payload, which decoders report as trailing garbage
+        if info['format'] in ('Image.gz', 'Image.lz4', 'Image.xz', 'Image.lzma',
+                              'Image.bzip2', 'Image.zstd'):
+            raise
+
+def scan_kernel(chunks, want_config=True):
+    """
+    Scans decompressed kernel chunks for the version banner and the IKCFG
+    block, consuming input only until both are found (or just the banner
+    without want_config). Returns a dict with 'banner', 'version', 'config'
+    and 'scanned_bytes'.
+    """
+    result = {'banner': None, 'version': None, 'config': None, 'scanned_bytes': 0}
+    tail = b''
+    collecting = None
+    config_done = not want_config
+
+    for chunk in chunks:
+        result['scanned_bytes'] += len(chunk)
+        window = tail + bytes(chunk)
+
+        if result['banner'] is None:
+            match = BANNER_PATTERN.search(window)
+            if match and match.end() < len(window):
+                result['banner'] = match.group(0).decode('utf-8', errors='replace')
+                result['version'] = match.group(1).decode('utf-8', errors='replace')
+
+        if not config_done:
+            if collecting is None:
+                start = window.find(IKCFG_START)
+                if start >= 0:
+                    collecting = bytearray(window[start + len(IKCFG_START):])
+            else:
+                collecting += chunk
+            if collecting is not None:
+                end = collecting.find(IKCFG_END)
+                if end >= 0:
+                    try:
+                        result['config'] = zlib.decompress(bytes(collecting[:end]), 31).decode(
+                            'utf-8', errors='replace')
+                    except zlib.error:
+                        pass
+                    collecting = None
+                    config_done = True
+                elif len(collecting) > IKCFG_MAX_SIZE:
+                    collecting = None
+                    config_done = True
+
+        if result['banner'] is not None and config_done:
+            break
+        tail = window[-SCAN_OVERLAP:]
+
+    return result
+
+class KernelAnalyzer:
+    """
+    Reports the format, compression, version banner and IKCFG config of a
+    kernel image. Results are cached by the SHA-256 of the kernel, so
+    analysing the same kernel in many images is a hash and a lookup.
+    """
+
+    def __init__(self, use_cache=True, cache_dir=None):
+        self.cache = ResultCache(f'kernel-v{ANALYZER_VERSION}', cache_dir) if use_cache else None
+
+    def analyze(self, source, want_config=True):
+        """
+        Analyses a kernel given as a path or a bytes-like object (such as
+        the kernel section view of a mapped boot image).
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return self._analyze_view(memoryview(source).cast('B'), want_config)
+        try:
+            with map_file(source) as view:
+                return self._analyze_view(view, want_config)
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {source}")
+
+    def _analyze_view(self, view, want_config):
+        key = hashlib.sha256(view).hexdigest()
+        if self.cache:
+            cached = self.cache.get(key)
+            if cached and (cached['config'] is not None or not want_config or cached['config_searched']):
+                cached['cached'] = True
+                return cached
+
+        info = identify_kernel(view)
+        head = []
+
+        def keep_head(chunks):
+            for chunk in chunks:
+                if not head:
+                    head.append(bytes(chunk[:ARM64_IMAGE_MAGIC_OFFSET + 4]))
+                yield chunk
+
+        try:
+            result = scan_kernel(keep_head(_iter_kernel(view, info)), want_config)
+        except ValueError as e:
+            raise RuntimeError(f"Error decompressing kernel: {e}")
+        except EnvironmentError as e:
+            raise RuntimeError(str(e))
+
+        # A compressed Image reveals its architecture once decompressed
+        if info['arch'] is None and head and head[0][ARM64_IMAGE_MAGIC_OFFSET:] == ARM64_IMAGE_MAGIC:
+            info['arch'] = 'arm64'
+
+        result.update(info)
+        result.update({'sha256': key, 'size': len(view), 'config_searched': want_config, 'cached': False})
+        if self.cache:
+            self.cache.put(key, result)
+        return result
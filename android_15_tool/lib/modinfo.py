@@ -0,0 +1,242 @@
+"""
+Kernel module (.ko) metadata: the .modinfo section of each module is read
+through a memory mapping (only the ELF section headers, their names and
+.modinfo itself are touched), cached by the module's SHA-256, and indexed
+by name and alias. Unchanged files are recognised by path, size and
+mtime and not read at all on later runs. The index orders modules so that
+dependencies load first.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import struct
+
+from android_15_tool.lib.cache import ResultCache
+from android_15_tool.lib.stream_io import map_file
+from android_15_tool.lib.walker import walk_tree
+
+# Bump when the result format changes so stale cache entries are ignored
+MODINFO_VERSION = 1
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+# Offset of e_shoff, then the format of e_shoff through e_shstrndx
+ELF_SECTION_TABLE_INFO = {
+    ELFCLASS32: (0x20, 'I I 6H'),
+    ELFCLASS64: (0x28, 'Q I 6H'),
+}
+# sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size
+ELF_SECTION_HEADER_FORMATS = {
+    ELFCLASS32: 'IIIIII',
+    ELFCLASS64: 'IIQQQQ',
+}
+MODINFO_SECTION = b'.modinfo'
+
+# Matched against module names, and against aliases and descriptions
+TOUCHSCREEN_NAME_PATTERNS = ('*touch*', '*_ts', '*_ts_*')
+TOUCHSCREEN_PATTERNS = ('*touch*',)
+
+def _elf_sections(view):
+    """Yields (name, offset, size) for the sections of an ELF file."""
+    if len(view) < 0x40 or bytes(view[:4]) != ELF_MAGIC:
+        raise ValueError("Not an ELF file.")
+    elf_class, data = view[4], view[5]
+    if elf_class not in ELF_SECTION_TABLE_INFO or data not in (ELFDATA2LSB, ELFDATA2MSB):
+        raise ValueError(f"Unsupported ELF class {elf_class} or data encoding {data}.")
+    order = '<' if data == ELFDATA2LSB else '>'
+    info_offset, info_format = ELF_SECTION_TABLE_INFO[elf_class]
+    shoff, _, _, _, _, shentsize, shnum, shstrndx = struct.unpack_from(order + info_format, view, info_offset)
+    header_format = order + ELF_SECTION_HEADER_FORMATS[elf_class]
+    if shentsize < struct.calcsize(header_format) or shoff + shnum * shentsize > len(view):
+        raise ValueError("ELF section header table lies outside the file.")
+    headers = [struct.unpack_from(header_format, view, shoff + i * shentsize) for i in range(shnum)]
+    if shstrndx >= shnum:
+        raise ValueError("ELF section name table is missing.")
+    names_offset, names_size = headers[shstrndx][4], headers[shstrndx][5]
+    names = bytes(view[names_offset:names_offset + names_size])
+    for sh_name, _, _, _, sh_offset, sh_size in headers:
+        yield names[sh_name:].split(b'\x00', 1)[0], sh_offset, sh_size
+
+def parse_modinfo(view):
+    """
+    Returns the modinfo of a module given as a bytes-like object: name,
+    depends, aliases, vermagic, description and license. Raises ValueError
+    if it is not an ELF file with a .modinfo section.
+    """
+    for name, offset, size in _elf_sections(view):
+        if name == MODINFO_SECTION:
+            if offset + size > len(view):
+                raise ValueError(".modinfo section lies outside the file.")
+            section = bytes(view[offset:offset + size])
+            break
+    else:
+        raise ValueError("No .modinfo section.")
+
+    fields = {}
+    for item in section.split(b'\x00'):
+        key, sep, value = item.partition(b'=')
+        if sep:
+            fields.setdefault(key.decode('utf-8', errors='replace'), []).append(
+                value.decode('utf-8', errors='replace'))
+
+    def first(key):
+        return fields[key][0] if key in fields else None
+
+    return {
+        'name': first('name'),
+        'depends': [dep for value in fields.get('depends', []) for dep in value.split(',') if dep],
+        'aliases': fields.get('alias', []),
+        'vermagic': first('vermagic'),
+        'description': first('description'),
+        'license': first('license'),
+    }
+
+def _stat_key(path):
+    """The cache key of a file's path, size and mtime, which maps to its sha256."""
+    st = os.stat(path)
+    identity = json.dumps([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    return 'stat-' + hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def read_module(path, cache=None):
+    """
+    Returns the modinfo of a module file, with its sha256 and whether it
+    came from the cache. A file whose path, size and mtime are in the cache
+    is not read; otherwise it is hashed, and a copy of a module seen before
+    still comes from the cache. Raises ValueError for files that are not
+    modules.
+    """
+    stat_key = None
+    if cache:
+        stat_key = _stat_key(path)
+        entry = cache.get(stat_key)
+        cached = cache.get(entry['sha256']) if entry is not None else None
+        if cached is not None:
+            cached['cached'] = True
+            return cached
+
+    with map_file(path) as view:
+        key = hashlib.sha256(view).hexdigest()
+        info = cache.get(key) if cache else None
+        if info is None:
+            info = parse_modinfo(view)
+            info.update({'sha256': key, 'cached': False})
+            if cache:
+                cache.put(key, info)
+        else:
+            info['cached'] = True
+    if cache:
+        cache.put(stat_key, {'sha256': key})
+    return info
+
+def module_name(name):
+    """The kernel treats - and _ in module names alike; use _."""
+    return name.replace('-', '_')
+
+class ModinfoMatcher:
+    """A walk_tree matcher that reads the modinfo of .ko files."""
+
+    name = "modinfo"
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def match(self, entry):
+        if not entry.name.endswith('.ko'):
+            return []
+        try:
+            return [(entry.path, read_module(entry.path, self.cache), None)]
+        except (ValueError, OSError, struct.error) as e:
+            return [(entry.path, None, str(e))]
+
+class ModuleIndex:
+    """
+    The modules of a tree by name, with their aliases and dependencies.
+    Each module maps to its modinfo plus its path. When several files hold
+    a module of the same name, the first path in sorted order is used.
+    """
+
+    def __init__(self, modules, unreadable=None):
+        self.modules = {}
+        for path, info in sorted(modules, key=lambda m: m[0]):
+            name = module_name(info['name'] or os.path.basename(path)[:-len('.ko')])
+            if name not in self.modules:
+                self.modules[name] = dict(info, path=path)
+        self.unreadable = unreadable or []
+        self._aliases = sorted((alias, name) for name, info in self.modules.items() for alias in info['aliases'])
+
+    @classmethod
+    def build(cls, search_path, use_cache=True, cache_dir=None, on_directory=None):
+        """
+        Indexes every .ko file under search_path in one parallel walk.
+        Modules that cannot be read are listed in unreadable as (path, error).
+        """
+        cache = ResultCache(f'modinfo-v{MODINFO_VERSION}', cache_dir) if use_cache else None
+        modules, unreadable = [], []
+        for _, (path, info, error) in walk_tree(search_path, [ModinfoMatcher(cache)], on_directory):
+            if info is None:
+                unreadable.append((path, error))
+            else:
+                modules.append((path, info))
+        return cls(modules, sorted(unreadable))
+
+    def find_alias(self, pattern):
+        """Returns the names of the modules with an alias matching a glob pattern, such as 'i2c:*touch*'."""
+        return sorted({name for alias, name in self._aliases if fnmatch.fnmatchcase(alias, pattern)})
+
+    def dependencies(self, name):
+        """Returns the normalised names a module depends on directly."""
+        return [module_name(dep) for dep in self.modules[name]['depends']]
+
+    def load_order(self, names):
+        """
+        Returns the given modules and everything they depend on, each after
+        its dependencies. Dependencies missing from the index are left out;
+        see missing_dependencies. Raises ValueError for unknown modules and
+        dependency cycles.
+        """
+        order, state = [], {}
+        for root in names:
+            root = module_name(root)
+            if root not in self.modules:
+                raise ValueError(f"Unknown module: {root}")
+            # Iterative depth-first search; state is 1 while a module's
+            # dependencies are being visited and 2 once it is placed
+            if state.get(root) == 2:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self.dependencies(root)))]
+            while stack:
+                name, deps = stack[-1]
+                dep = next(deps, None)
+                if dep is None:
+                    stack.pop()
+                    state[name] = 2
+                    order.append(name)
+                elif dep not in self.modules or state.get(dep) == 2:
+                    continue
+                elif state.get(dep) == 1:
+                    cycle = [entry[0] for entry in stack] + [dep]
+                    raise ValueError(f"Dependency cycle: {' -> '.join(cycle[cycle.index(dep):])}")
+                else:
+                    state[dep] = 1
+                    stack.append((dep, iter(self.dependencies(dep))))
+        return order
+
+    def missing_dependencies(self, names):
+        """Returns the dependencies of the given modules' load order that are not in the index."""
+        return sorted({dep for name in self.load_order(names) for dep in self.dependencies(name)
+                       if dep not in self.modules})
+
+    def touchscreen_modules(self):
+        """Returns the modules that look like touchscreen drivers by name, alias or description."""
+        found = []
+        for name, info in self.modules.items():
+            texts = [alias.lower() for alias in info['aliases']] + [(info['description'] or '').lower()]
+            if (any(fnmatch.fnmatchcase(name.lower(), p) for p in TOUCHSCREEN_NAME_PATTERNS)
+                    or any(fnmatch.fnmatchcase(text, p) for text in texts for p in TOUCHSCREEN_PATTERNS)):
+                found.append(name)
+        return sorted(found)
@@ -11,10 +11,9 @@ def analyze_partition_image(image_path: str) -> dict:
             unpacker._parse_metadata(f)
 
         if unpacker.metadata and unpacker.metadata["partitions"]:
-            # For now, we are not calculating the size.
-            # This can be added later by parsing the extents.
+            # Headers without table descriptors carry no extents to size from
             partitions = [
-                {"name": p["name"], "size": "N/A"}
+                {"name": p["name"], "size": p["size"] or "N/A"}
                 for p in unpacker.metadata["partitions"]
             ]
             return {
@@ -0,0 +1,358 @@
+"""
+In-process handling of ramdisk cpio archives (newc format).
+
+Ramdisks are decompressed as a stream (see compression.py) and fed straight
+into the cpio reader, so no intermediate .cpio file, external tool or
+whole-archive buffer is needed. The writer side builds reproducible
+archives from a directory tree for repacking.
+"""
+import os
+import shutil
+import stat
+from collections import namedtuple
+
+from android_15_tool.lib.compression import detect_compression, iter_decompress, compress_stream
+from android_15_tool.lib.stream_io import ChunkReader, iter_file_chunks
+
+CPIO_NEWC_MAGIC = b'070701'
+CPIO_NEWC_CRC_MAGIC = b'070702'
+CPIO_HEADER_SIZE = 110
+CPIO_HEADER_FIELDS = 13
+CPIO_TRAILER = 'TRAILER!!!'
+
+# Output names used when unpacking a ramdisk next to the other sections
+RAMDISK_DIR = 'ramdisk_root'
+FS_CONFIG_FILE = 'ramdisk_fs_config.txt'
+COMPRESSION_FILE = 'ramdisk_compression'
+
+# First inode number handed out by the writer, as mkbootfs does
+CPIO_FIRST_INODE = 300000
+
+CpioEntry = namedtuple('CpioEntry', [
+    'name', 'ino', 'mode', 'uid', 'gid', 'nlink', 'mtime', 'size',
+    'devmajor', 'devminor', 'rdevmajor', 'rdevminor',
+])
+
+def _align4(size):
+    """Rounds a size up to the 4-byte alignment used by newc."""
+    return (size + 3) & ~3
+
+class CpioReader:
+    """
+    Iterates over the entries of a newc cpio stream.
+
+    While an entry is current its data can be consumed with iter_data() or
+    read_data(); unread data is skipped when iteration moves on. Concatenated
+    archives separated by zero padding are read as one.
+    """
+
+    def __init__(self, chunks):
+        self._reader = ChunkReader(chunks)
+        self._remaining = 0
+        self._padding = 0
+
+    def _skip_zero_padding(self):
+        """Skips zero bytes between concatenated archives."""
+        while True:
+            head = self._reader.peek(512)
+            if not head:
+                return
+            zeros = len(head) - len(head.lstrip(b'\x00'))
+            if zeros == 0:
+                return
+            self._reader.skip(zeros)
+
+    def __iter__(self):
+        while True:
+            self._reader.skip(self._remaining + self._padding)
+            self._remaining = self._padding = 0
+
+            header = self._reader.read_exact(CPIO_HEADER_SIZE)
+            if header[:6] not in (CPIO_NEWC_MAGIC, CPIO_NEWC_CRC_MAGIC):
+                raise ValueError(f"Invalid cpio header at offset {self._reader.offset - CPIO_HEADER_SIZE}.")
+            try:
+                fields = [int(header[6 + 8 * i:14 + 8 * i], 16) for i in range(CPIO_HEADER_FIELDS)]
+            except ValueError:
+                raise ValueError("Invalid cpio header: malformed field.")
+            (ino, mode, uid, gid, nlink, mtime, filesize, devmajor, devminor,
+             rdevmajor, rdevminor, namesize, _) = fields
+
+            raw_name = self._reader.read_exact(_align4(CPIO_HEADER_SIZE + namesize) - CPIO_HEADER_SIZE)
+            name = raw_name[:namesize].rstrip(b'\x00').decode('utf-8', errors='surrogateescape')
+            self._remaining = filesize
+            self._padding = _align4(filesize) - filesize
+
+            if name == CPIO_TRAILER:
+                self._reader.skip(self._remaining + self._padding)
+                self._remaining = self._padding = 0
+                self._skip_zero_padding()
+                if self._reader.at_eof():
+                    return
+                continue
+
+            yield CpioEntry(name, ino, mode, uid, gid, nlink, mtime, filesize,
+                            devmajor, devminor, rdevmajor, rdevminor)
+
+    def iter_data(self):
+        """Yields the data of the current entry in bounded pieces."""
+        for data in self._reader.iter_read(self._remaining):
+            self._remaining -= len(data)
+            yield data
+
+    def read_data(self):
+        """Returns the data of the current entry (for small entries such as symlinks)."""
+        return b''.join(self.iter_data())
+
+def _safe_relpath(name):
+    """
+    Converts an archive member name to a relative path, rejecting absolute
+    paths and '..' components. Returns None for the archive root.
+    """
+    parts = [p for p in name.split('/') if p not in ('', '.')]
+    if any(p == '..' for p in parts):
+        raise ValueError(f"Unsafe path in cpio archive: {name}")
+    if not parts:
+        return None
+    return os.path.join(*parts)
+
+def write_fs_config(fs_config_path, entries):
+    """
+    Records the ownership, mode and device numbers of every archive entry,
+    which cannot all be represented on the host filesystem. Each line is
+    '<mode> <uid> <gid> <rdevmajor> <rdevminor> <path>' with an octal mode.
+    """
+    with open(fs_config_path, 'w') as f:
+        for entry in entries:
+            f.write(f"{entry.mode:06o} {entry.uid} {entry.gid} "
+                    f"{entry.rdevmajor} {entry.rdevminor} {entry.name}\n")
+
+def read_fs_config(fs_config_path):
+    """
+    Reads a file written by write_fs_config().
+    Returns a dict mapping archive paths to (mode, uid, gid, rdevmajor, rdevminor).
+    """
+    fs_config = {}
+    with open(fs_config_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            mode, uid, gid, rdevmajor, rdevminor, name = line.split(' ', 5)
+            fs_config[name] = (int(mode, 8), int(uid), int(gid), int(rdevmajor), int(rdevminor))
+    return fs_config
+
+def extract_cpio(chunks, output_dir, fs_config_path=None):
+    """
+    Extracts a newc cpio stream into output_dir.
+
+    Regular files are written as their data arrives, so memory use is bounded
+    by the input chunk size. Device nodes, FIFOs and sockets are not created
+    (that needs root) but, like ownership, are recorded in the fs_config file.
+    Returns the list of archive entries.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    root = os.path.realpath(output_dir)
+    entries = []
+    hardlinks = {}
+    dir_modes = []
+
+    reader = CpioReader(chunks)
+    for entry in reader:
+        entries.append(entry)
+        relpath = _safe_relpath(entry.name)
+        if relpath is None:
+            continue
+        path = os.path.join(output_dir, relpath)
+
+        # Refuse to follow symlinks extracted earlier out of the tree
+        parent = os.path.dirname(path)
+        real_parent = os.path.realpath(parent)
+        if real_parent != root and not real_parent.startswith(root + os.sep):
+            raise ValueError(f"Unsafe path in cpio archive: {entry.name}")
+        os.makedirs(parent, exist_ok=True)
+
+        file_type = stat.S_IFMT(entry.mode)
+        if file_type == stat.S_IFDIR:
+            if os.path.islink(path):
+                # Replace a symlink extracted earlier rather than follow it
+                os.remove(path)
+            os.makedirs(path, exist_ok=True)
+            dir_modes.append((path, entry.mode))
+        elif file_type == stat.S_IFREG:
+            if os.path.islink(path):
+                os.remove(path)
+            with open(path, 'wb') as f:
+                for data in reader.iter_data():
+                    f.write(data)
+            # Keep extracted files owner-writable; the real mode is in fs_config
+            os.chmod(path, (entry.mode & 0o777) | 0o600)
+            if entry.nlink > 1:
+                hardlinks.setdefault((entry.devmajor, entry.devminor, entry.ino), []).append((path, entry.size))
+        elif file_type == stat.S_IFLNK:
+            target = reader.read_data().decode('utf-8', errors='surrogateescape')
+            if os.path.lexists(path):
+                os.remove(path)
+            try:
+                os.symlink(target, path)
+            except OSError:
+                # No symlink support (e.g. unprivileged Windows); keep the target as text
+                with open(path, 'w') as f:
+                    f.write(target)
+
+    # newc stores hard-linked data once, on the last link
+    for links in hardlinks.values():
+        sources = [path for path, size in links if size]
+        if not sources:
+            continue
+        for path, size in links:
+            if size == 0:
+                os.remove(path)
+                try:
+                    os.link(sources[0], path)
+                except OSError:
+                    shutil.copy2(sources[0], path)
+
+    for path, mode in reversed(dir_modes):
+        # os.chmod cannot skip symlinks everywhere, so check again in case a
+        # later entry replaced the directory
+        if not os.path.islink(path) and os.path.isdir(path):
+            os.chmod(path, (mode & 0o777) | 0o700)
+
+    if fs_config_path:
+        write_fs_config(fs_config_path, entries)
+    return entries
+
+def list_cpio(chunks):
+    """
+    Returns the entries of a (possibly compressed) cpio stream without
+    writing anything to disk.
+    """
+    return list(CpioReader(iter_decompress(chunks)))
+
+def extract_ramdisk(chunks, output_dir, fs_config_path=None):
+    """
+    Detects the ramdisk compression, decompresses it as a stream and extracts
+    the cpio archive into output_dir.
+    Returns a tuple of (compression, entries).
+    """
+    reader = ChunkReader(chunks)
+    compression = detect_compression(reader.peek(16))
+    if compression is None:
+        raise ValueError("Unrecognised ramdisk format.")
+    data = iter_decompress(reader.iter_remaining(), compression)
+    return compression, extract_cpio(data, output_dir, fs_config_path)
+
+def _cpio_header(entry):
+    """Encodes a newc header and padded name for an entry."""
+    name = entry.name.encode('utf-8', errors='surrogateescape') + b'\x00'
+    header = CPIO_NEWC_MAGIC + b''.join(b'%08x' % value for value in (
+        entry.ino, entry.mode, entry.uid, entry.gid, entry.nlink, entry.mtime,
+        entry.size, entry.devmajor, entry.devminor, entry.rdevmajor,
+        entry.rdevminor, len(name), 0,
+    ))
+    return header + name + b'\x00' * (_align4(len(header) + len(name)) - len(header) - len(name))
+
+def _collect_tree(root_dir, fs_config):
+    """
+    Returns the sorted archive paths for a directory tree, plus any device
+    nodes, FIFOs or sockets that exist only in the fs_config.
+    Sorting by path keeps every directory ahead of its contents.
+    """
+    paths = set()
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        rel_dir = os.path.relpath(dirpath, root_dir)
+        for name in dirnames + filenames:
+            rel = name if rel_dir == '.' else os.path.join(rel_dir, name)
+            paths.add(rel.replace(os.sep, '/'))
+
+    for name, (mode, _, _, _, _) in fs_config.items():
+        if name == '.' or stat.S_IFMT(mode) in (stat.S_IFCHR, stat.S_IFBLK, stat.S_IFIFO, stat.S_IFSOCK):
+            paths.add(name)
+    return sorted(paths)
+
+def iter_cpio_archive(root_dir, fs_config=None, mtime=0):
+    """
+    Yields a newc cpio archive of root_dir as a stream of chunks.
+
+    The archive is deterministic: entries are sorted, inode numbers are
+    assigned sequentially, mtimes are fixed and hard links are stored as
+    separate files. Modes and ownership come from fs_config (as returned by
+    read_fs_config()) when an entry is listed there, otherwise from the
+    file's mode with root ownership. Device nodes are taken from fs_config.
+    """
+    fs_config = fs_config or {}
+    ino = CPIO_FIRST_INODE
+
+    for name in _collect_tree(root_dir, fs_config):
+        path = root_dir if name == '.' else os.path.join(root_dir, *name.split('/'))
+        config = fs_config.get(name)
+
+        if os.path.lexists(path):
+            st = os.lstat(path)
+            mode = config[0] if config else st.st_mode
+            disk_type = stat.S_IFMT(st.st_mode)
+            if disk_type == stat.S_IFLNK:
+                data = os.readlink(path).encode('utf-8', errors='surrogateescape')
+                size = len(data)
+            elif disk_type == stat.S_IFREG:
+                data = None
+                size = st.st_size
+            else:
+                data = b''
+                size = 0
+            if stat.S_IFMT(mode) != disk_type:
+                # e.g. a symlink stored as text on a filesystem without symlinks
+                if stat.S_IFMT(mode) == stat.S_IFLNK and disk_type == stat.S_IFREG:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    size = len(data)
+                else:
+                    mode = st.st_mode
+        else:
+            mode = config[0]
+            data = b''
+            size = 0
+
+        uid, gid, rdevmajor, rdevminor = config[1:] if config else (0, 0, 0, 0)
+        entry = CpioEntry(name, ino, mode, uid, gid,
+                          2 if stat.S_ISDIR(mode) else 1, mtime, size,
+                          0, 0, rdevmajor, rdevminor)
+        ino += 1
+
+        yield _cpio_header(entry)
+        if data is None:
+            written = 0
+            with open(path, 'rb') as f:
+                for chunk in iter_file_chunks(f):
+                    written += len(chunk)
+                    yield chunk
+            if written != size:
+                raise ValueError(f"File changed while archiving: {name}")
+        else:
+            yield data
+        yield b'\x00' * (_align4(size) - size)
+
+    yield _cpio_header(CpioEntry(CPIO_TRAILER, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0))
+
+def build_ramdisk(root_dir, output_path, compression='lz4_legacy', fs_config_path=None, mtime=0, workers=None):
+    """
+    Builds a compressed ramdisk from a directory tree.
+
+    Args:
+        root_dir: The extracted ramdisk tree.
+        output_path: Where to write the compressed ramdisk.
+        compression: 'lz4_legacy' (compressed in parallel 8 MiB blocks),
+                     'gzip' or 'cpio' for an uncompressed archive.
+        fs_config_path: Optional fs_config written during extraction, used to
+                        restore modes, ownership and device nodes.
+        mtime: The modification time stored for every entry.
+        workers: Number of parallel compression workers (default: CPU count).
+    """
+    if not os.path.isdir(root_dir):
+        raise RuntimeError(f"Ramdisk directory not found: {root_dir}")
+    try:
+        fs_config = read_fs_config(fs_config_path) if fs_config_path else None
+        with open(output_path, 'wb') as f:
+            compress_stream(iter_cpio_archive(root_dir, fs_config, mtime), f, compression, workers)
+    except ValueError as e:
+        raise RuntimeError(f"Error building ramdisk: {e}")
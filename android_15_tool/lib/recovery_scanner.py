@@ -1,16 +1,40 @@
-import os
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.vendor_boot import VendorBootImage
+from android_15_tool.lib.walker import walk_tree
+
+# Only files with these suffixes are opened to check their magic
+RECOVERY_IMAGE_SUFFIXES = (".img", ".bin")
+RECOVERY_IMAGE_MAGICS = (BootImage.BOOT_MAGIC, VendorBootImage.VENDOR_BOOT_MAGIC)
+
+class RecoveryImageMatcher:
+    """
+    Matches boot, init_boot, recovery and vendor boot images by their magic,
+    whatever they are called.
+    """
+
+    name = "recovery_image"
+
+    def match(self, entry):
+        if not entry.name.endswith(RECOVERY_IMAGE_SUFFIXES):
+            return []
+        try:
+            with open(entry.path, "rb") as f:
+                magic = f.read(max(len(m) for m in RECOVERY_IMAGE_MAGICS))
+        except OSError:
+            return []
+        if magic.startswith(RECOVERY_IMAGE_MAGICS):
+            return [entry.path]
+        return []
+
+def iter_recovery_images(search_path=".", on_directory=None):
+    """
+    Yields recovery images under the specified path as they are found.
+    on_directory, if given, is called with each directory before it is
+    searched.
+    """
+    for _, path in walk_tree(search_path, [RecoveryImageMatcher()], on_directory):
+        yield path
 
 def find_recovery_images(search_path="."):
     """Finds recovery images in the specified path."""
-    recovery_image_names = [
-        "recovery.img",
-        "boot.img",
-        "vendor_boot.img",
-        "init_boot.img",
-    ]
-    found_images = []
-    for root, _, files in os.walk(search_path):
-        for file in files:
-            if file in recovery_image_names:
-                found_images.append(os.path.join(root, file))
-    return found_images
+    return sorted(iter_recovery_images(search_path))
@@ -1,12 +1,43 @@
+import hashlib
 import struct
 import os
-import subprocess
 import shutil
+import tempfile
+
+from android_15_tool.lib.avb import (
+    _resolve_algorithm, add_hash_footer, add_hashtree_footer, load_private_key, read_footer_metadata,
+)
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.hashtree import append_hash_tree
+from android_15_tool.lib.stream_io import copy_into, hash_file, iter_file_chunks, map_file, pad_to, source_size
+from android_15_tool.lib.vendor_boot import VendorBootImage
 
 def _get_padded_size(size, page_size):
     """Calculates the size padded to the page size."""
     return (size + page_size - 1) // page_size * page_size
 
+# header_info.txt fields that stay strings even when they look numeric
+HEADER_INFO_STRING_FIELDS = ('name',)
+
+def _read_header_info(header_info_path):
+    """
+    Reads the header info from the file saved during unpacking. Values are
+    integers, except for HEADER_INFO_STRING_FIELDS and non-numeric values
+    such as the AVB-derived avb_security_patch.
+    """
+    header_info = {}
+    with open(header_info_path, 'r') as f:
+        for line in f:
+            key, value = line.rstrip('\r\n').split(':', 1)
+            if key in HEADER_INFO_STRING_FIELDS:
+                header_info[key] = value
+                continue
+            try:
+                header_info[key] = int(value)
+            except ValueError:
+                header_info[key] = value
+    return header_info
+
 class Repacker:
     """
     Repacks boot and recovery images.
@@ -17,86 +48,447 @@ class Repacker:
     BOOT_EXTRA_ARGS_SIZE = 1024
     CMDLINE_SIZE = BOOT_ARGS_SIZE + BOOT_EXTRA_ARGS_SIZE
 
+    # Every section a boot image header (v0 to v4) can describe
+    SECTIONS = ['kernel', 'ramdisk', 'second', 'recovery_dtbo', 'dtb', 'boot_signature']
+
     def __init__(self, output_path="new_boot.img"):
         self.output_path = output_path
-        self._check_for_avbtool()
 
-    def _check_for_avbtool(self):
+    def _pack_header(self, header_info, sizes, cmdline, name, page_size, image_id):
         """
-        Checks if avbtool is installed.
+        Packs a boot image header (v0 to v4) with the BootImage layouts.
         """
-        if not shutil.which("avbtool"):
-            print("Warning: avbtool not found. AVB signing will be skipped.")
+        header_version = header_info.get('header_version', 4)
+        cmdline_bytes = cmdline.encode('utf-8')
+        if len(cmdline_bytes) >= self.CMDLINE_SIZE:
+            raise RuntimeError("Kernel cmdline is too long.")
 
-    def _read_header_info(self, header_info_path):
+        if header_version >= 3:
+            header_size = struct.calcsize(BootImage.HEADER_V3_FORMAT)
+            if header_version >= 4:
+                header_size += struct.calcsize(BootImage.HEADER_V4_FORMAT)
+            header = struct.pack(
+                BootImage.HEADER_V3_FORMAT,
+                self.BOOT_MAGIC,
+                sizes['kernel'],
+                sizes['ramdisk'],
+                header_info.get('os_version', 0),
+                header_size,
+                0, 0, 0, 0, # reserved
+                header_version,
+                cmdline_bytes,
+            )
+            if header_version >= 4:
+                header += struct.pack(BootImage.HEADER_V4_FORMAT, sizes['boot_signature'])
+            return header
+
+        # Legacy headers split the cmdline across two fields
+        name_bytes = name.encode('utf-8')
+        if len(name_bytes) >= BootImage.BOOT_NAME_SIZE:
+            raise RuntimeError(f"Boot image name is too long: {name}")
+        base = 0x10000000
+        header = struct.pack(
+            BootImage.HEADER_V0_FORMAT,
+            self.BOOT_MAGIC,
+            sizes['kernel'], header_info.get('kernel_addr', base + 0x00008000),
+            sizes['ramdisk'], header_info.get('ramdisk_addr', base + 0x01000000),
+            sizes['second'], header_info.get('second_addr', base + 0x00f00000),
+            header_info.get('tags_addr', base + 0x00000100),
+            page_size,
+            header_version,
+            header_info.get('os_version', 0),
+            name_bytes,
+            cmdline_bytes[:self.BOOT_ARGS_SIZE - 1],
+            image_id,
+            cmdline_bytes[self.BOOT_ARGS_SIZE - 1:],
+        )
+        if header_version >= 1:
+            header_size = struct.calcsize(BootImage.HEADER_V0_FORMAT) + struct.calcsize(BootImage.HEADER_V1_FORMAT)
+            if header_version >= 2:
+                header_size += struct.calcsize(BootImage.HEADER_V2_FORMAT)
+            recovery_dtbo_offset = 0
+            if sizes['recovery_dtbo']:
+                recovery_dtbo_offset = page_size + sum(
+                    _get_padded_size(sizes[section], page_size) for section in ('kernel', 'ramdisk', 'second'))
+            header += struct.pack(BootImage.HEADER_V1_FORMAT, sizes['recovery_dtbo'],
+                                  recovery_dtbo_offset, header_size)
+        if header_version >= 2:
+            header += struct.pack(BootImage.HEADER_V2_FORMAT, sizes['dtb'],
+                                  header_info.get('dtb_addr', base + 0x01f00000))
+        return header
+
+    @staticmethod
+    def _image_id(sources, names, sizes):
         """
-        Reads the header info from the file saved during unpacking.
+        Computes the legacy header id field the way mkbootimg does: a SHA-1
+        over each section followed by its size.
         """
-        header_info = {}
-        with open(header_info_path, 'r') as f:
-            for line in f:
-                key, value = line.strip().split(':', 1)
-                header_info[key] = int(value)
-        return header_info
+        sha = hashlib.sha1()
+        for section in names:
+            source = sources.get(section)
+            if isinstance(source, (str, os.PathLike)):
+                hash_file(source, sha)
+            elif isinstance(source, (bytes, bytearray, memoryview)):
+                sha.update(source)
+            elif source is not None:
+                pos = source.tell()
+                for chunk in iter_file_chunks(source):
+                    sha.update(chunk)
+                source.seek(pos)
+            sha.update(struct.pack('<I', sizes[section]))
+        return sha.digest().ljust(32, b'\x00')
+
+    def repack(self, header_info_path, kernel_path, ramdisk_path, dtb_path=None, cmdline="", page_size=4096,
+               second_path=None, recovery_dtbo_path=None, signature_path=None, name=""):
+        """
+        Repacks the image using the original header info.
+
+        Every section may be given as a path, a binary file object (read
+        from its current position) or a bytes-like object such as a
+        memoryview slice of a mapped image, so sections can be taken straight
+        from an unpacked image without temp files. Files are copied by the
+        kernel and padding is skipped with seeks, so memory use stays flat
+        regardless of section size.
+
+        Header versions 0 to 2 use the page size from the header info (or
+        page_size) and may carry second, recovery_dtbo and dtb sections;
+        versions 3 and 4 use 4096 byte pages and only a boot signature.
+        """
+        header_info = _read_header_info(header_info_path)
+        sources = {
+            'kernel': kernel_path, 'ramdisk': ramdisk_path, 'second': second_path,
+            'recovery_dtbo': recovery_dtbo_path, 'dtb': dtb_path, 'boot_signature': signature_path,
+        }
+        self._write_image(self.output_path, header_info, sources, cmdline, name, page_size)
+
+    @staticmethod
+    def _layout(header_info, sources, page_size):
+        """
+        Returns the section order and page size for a header version, after
+        checking that only sections the header can describe are present.
+        """
+        header_version = header_info.get('header_version', 4)
+        if header_version >= 3:
+            if sources.get('dtb') or sources.get('second') or sources.get('recovery_dtbo'):
+                raise RuntimeError("v3/v4 boot images carry no second, recovery_dtbo or dtb section; "
+                                   "the DTB belongs in vendor_boot.")
+            if sources.get('boot_signature') and header_version < 4:
+                raise RuntimeError("A boot signature requires a v4 header.")
+            return ['kernel', 'ramdisk', 'boot_signature'], BootImage.HEADER_V3_PAGE_SIZE
+
+        names = ['kernel', 'ramdisk', 'second', 'recovery_dtbo', 'dtb'][:header_version + 3]
+        if sources.get('boot_signature') or any(sources.get(section) for section in
+                                                ('recovery_dtbo', 'dtb') if section not in names):
+            raise RuntimeError(f"Section not supported by a v{header_version} boot image header.")
+        return names, header_info.get('page_size', page_size)
+
+    def _write_image(self, output_path, header_info, sources, cmdline, name, page_size):
+        """
+        Writes a complete boot image from a dict of section sources.
+        """
+        names, page_size = self._layout(header_info, sources, page_size)
+        output = os.path.abspath(output_path)
+        for source in sources.values():
+            if isinstance(source, (str, os.PathLike)) and os.path.abspath(source) == output:
+                raise RuntimeError(f"Input and output are the same file: {source}")
+
+        try:
+            sizes = {section: source_size(sources[section]) if sources.get(section) is not None else 0
+                     for section in self.SECTIONS}
+            image_id = self._image_id(sources, names, sizes) if header_info.get('header_version', 4) < 3 else b''
+            header = self._pack_header(header_info, sizes, cmdline, name, page_size, image_id)
+
+            with open(output_path, 'wb') as f:
+                f.write(header)
+                pad_to(f, page_size)
+                for section in names:
+                    if sources.get(section) is not None and sizes[section]:
+                        copy_into(f, sources[section])
+                        pad_to(f, page_size)
+                # Padding was skipped with seeks; extend the file over it
+                f.truncate(f.tell())
+        except FileNotFoundError as e:
+            raise RuntimeError(f"Input file not found: {e.filename}")
+        except struct.error as e:
+            raise RuntimeError(f"Invalid header info: {e}")
+
+    @staticmethod
+    def _same_content(source, view):
+        """Compares a section source against the bytes currently in the image."""
+        if source_size(source) != len(view):
+            return False
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return memoryview(source).cast('B') == view
+        current = hashlib.sha256(view).digest()
+        if isinstance(source, (str, os.PathLike)):
+            return hash_file(source, hashlib.sha256()).digest() == current
+        pos = source.tell()
+        sha = hashlib.sha256()
+        for chunk in iter_file_chunks(source):
+            sha.update(chunk)
+        source.seek(pos)
+        return sha.digest() == current
+
+    def patch(self, kernel_path=None, ramdisk_path=None, dtb_path=None, cmdline=None, second_path=None,
+              recovery_dtbo_path=None, signature_path=None, key_path=None, algorithm=None):
+        """
+        Replaces sections of the existing image at output_path.
+
+        Each given section is compared by content hash with the one in the
+        image and skipped if unchanged. When every changed section still
+        fits its padded page slot, only those sections and the header are
+        rewritten in place; otherwise the image is rebuilt in full from the
+        new sections and memory-mapped slices of the old ones. An AVB hash
+        footer is then re-signed with key_path, keeping the partition size.
+
+        Returns a tuple of (mode, changed_sections) where mode is 'unchanged',
+        'in_place' or 'full'.
+        """
+        boot_image = BootImage(self.output_path)
+        header_info = boot_image.parse()
+        new_sources = {
+            'kernel': kernel_path, 'ramdisk': ramdisk_path, 'second': second_path,
+            'recovery_dtbo': recovery_dtbo_path, 'dtb': dtb_path, 'boot_signature': signature_path,
+        }
+        new_sources = {section: source for section, source in new_sources.items() if source is not None}
+        names, page_size = self._layout(header_info, new_sources, boot_image.page_size)
+        if cmdline is None:
+            cmdline = boot_image.cmdline
+
+        try:
+            with open(self.output_path, 'rb') as f:
+                footer, vbmeta, partition_size = read_footer_metadata(f)
+        except (ValueError, struct.error):
+            footer = vbmeta = None
+        if footer and vbmeta.header['algorithm_type'] and not key_path:
+            raise RuntimeError("The image is AVB-signed; a key is needed to re-sign it after patching.")
+        if footer and vbmeta.header['algorithm_type'] and algorithm is None:
+            algorithm = vbmeta.header['algorithm']
 
-    def repack(self, header_info_path, kernel_path, ramdisk_path, dtb_path=None, cmdline="", page_size=4096):
+        def resign(path):
+            """Signs a patched image like the original: same partition size, properties and vbmeta fields."""
+            partition_name = next((d['partition_name'] for d in vbmeta.descriptors if d['type'] == 'hash'), 'boot')
+            add_hash_footer(path, partition_name, key_path, algorithm, partition_size,
+                            props=vbmeta.properties, rollback_index=vbmeta.header['rollback_index'],
+                            flags=vbmeta.header['flags'],
+                            rollback_index_location=vbmeta.header['rollback_index_location'])
+
+        try:
+            if footer:
+                # Fail on a bad key or algorithm before the image is touched
+                _resolve_algorithm(algorithm, load_private_key(key_path) if key_path else None)
+            with map_file(self.output_path) as view:
+                sources = {section: view[offset:offset + size]
+                           for section, (offset, size) in boot_image.sections.items()}
+                changed = [section for section, source in new_sources.items()
+                           if not self._same_content(source, sources.get(section, view[0:0]))]
+                sources.update({section: new_sources[section] for section in changed})
+
+                if not changed and cmdline == boot_image.cmdline:
+                    return 'unchanged', []
+
+                # The layout holds if every changed section keeps its padded size
+                in_place = all(
+                    section in boot_image.sections and
+                    _get_padded_size(source_size(sources[section]), page_size) ==
+                    _get_padded_size(boot_image.sections[section][1], page_size)
+                    for section in changed)
+
+                if in_place:
+                    sizes = {section: source_size(sources[section]) if section in sources else 0
+                             for section in self.SECTIONS}
+                    image_id = self._image_id(sources, names, sizes) if header_info['header_version'] < 3 else b''
+                    header = self._pack_header(header_info, sizes, cmdline, boot_image.name, page_size, image_id)
+                    mode = 'in_place'
+                else:
+                    fd, rebuilt = tempfile.mkstemp(suffix='.img', dir=os.path.dirname(os.path.abspath(self.output_path)))
+                    os.close(fd)
+                    try:
+                        self._write_image(rebuilt, header_info, sources, cmdline, boot_image.name, page_size)
+                        shutil.copymode(self.output_path, rebuilt)
+                    except BaseException:
+                        os.remove(rebuilt)
+                        raise
+                    mode = 'full'
+
+            if mode == 'in_place':
+                with open(self.output_path, 'r+b') as f:
+                    f.write(header)
+                    for section in changed:
+                        offset, old_size = boot_image.sections[section]
+                        f.seek(offset)
+                        new_size = copy_into(f, sources[section])
+                        if new_size < old_size:
+                            f.write(b'\x00' * (old_size - new_size))
+                if footer:
+                    resign(self.output_path)
+            else:
+                try:
+                    # A rebuilt image has no footer, so it is signed before
+                    # it replaces the original; if signing fails (say the
+                    # image outgrew the partition) the original stays intact
+                    if footer:
+                        resign(rebuilt)
+                    os.replace(rebuilt, self.output_path)
+                except BaseException:
+                    os.remove(rebuilt)
+                    raise
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error patching image: {e}")
+
+        return mode, changed
+
+    def add_hashtree(self, image_path=None, block_size=4096, hash_algorithm='sha256', salt=None):
+        """
+        Appends a dm-verity hash tree to an image (the repacked output by
+        default). Returns the fields of the matching AVB hashtree descriptor.
+        """
+        try:
+            return append_hash_tree(image_path or self.output_path, block_size, hash_algorithm, salt)
+        except ValueError as e:
+            raise RuntimeError(f"Error generating hash tree: {e}")
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {image_path or self.output_path}")
+
+    def sign_with_avb(self, key_path, partition_name="boot", partition_size=None, algorithm=None,
+                      hashtree=False):
+        """
+        Signs the repacked image in place with an AVB hash footer (or a
+        hashtree footer for filesystem images), using an RSA key in PEM form.
+        Re-signing reuses the existing footer.
+        """
+        try:
+            if hashtree:
+                return add_hashtree_footer(self.output_path, partition_name, key_path, algorithm, partition_size)
+            return add_hash_footer(self.output_path, partition_name, key_path, algorithm, partition_size)
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error signing image: {e}")
+        except FileNotFoundError as e:
+            raise RuntimeError(f"Input file not found: {e.filename}")
+
+
+class VendorBootRepacker:
+    """
+    Repacks vendor_boot images (v3/v4), rebuilding the vendor ramdisk table.
+    """
+
+    def __init__(self, output_path="new_vendor_boot.img"):
+        self.output_path = output_path
+
+    @staticmethod
+    def _pad(f, page_size):
+        """Skips ahead to the next page boundary; the gap is zero-filled on truncate."""
+        pad_to(f, page_size)
+
+    def repack(self, header_info_path, ramdisks, dtb_path=None, bootconfig_path=None, cmdline=None, name=None):
         """
         Repacks the image using the original header info.
+
+        Args:
+            header_info_path: The header_info.txt written by VendorBootImage.unpack.
+            ramdisks: Either a single ramdisk path (v3), or a list of entry dicts
+                      as returned by read_ramdisk_table() (v4). The fragments are
+                      concatenated and a new ramdisk table is built from them.
+            dtb_path: Optional DTB to embed.
+            bootconfig_path: Optional bootconfig to embed (v4 only).
+            cmdline: The vendor cmdline; defaults to the 'cmdline' file saved
+                     next to header_info.txt, if any.
+            name: The board name; defaults to the one in the header info.
         """
-        header_info = self._read_header_info(header_info_path)
+        header_info = _read_header_info(header_info_path)
+        if cmdline is None:
+            cmdline_path = os.path.join(os.path.dirname(header_info_path), 'cmdline')
+            cmdline = ""
+            if os.path.exists(cmdline_path):
+                with open(cmdline_path, 'r') as f:
+                    cmdline = f.read()
+        if name is None:
+            name = header_info.get('name', '')
+        header_version = header_info.get('header_version', 4)
+        page_size = header_info.get('page_size', 4096)
+
+        if isinstance(ramdisks, (str, os.PathLike)):
+            ramdisks = [{'path': ramdisks, 'ramdisk_type': 1, 'ramdisk_name': '',
+                         'board_id': [0] * VendorBootImage.VENDOR_RAMDISK_TABLE_ENTRY_BOARD_ID_SIZE}]
+        if header_version < 4 and len(ramdisks) > 1:
+            raise RuntimeError("Multiple vendor ramdisks require a v4 header.")
+
+        # Build the ramdisk table from the fragment sizes
+        table = b''
+        ramdisk_offset = 0
+        for entry in ramdisks:
+            size = os.path.getsize(entry['path'])
+            ramdisk_name = entry['ramdisk_name'].encode('utf-8')
+            if len(ramdisk_name) > VendorBootImage.VENDOR_RAMDISK_NAME_SIZE:
+                raise RuntimeError(f"Vendor ramdisk name is too long: {entry['ramdisk_name']}")
+            table += struct.pack(
+                VendorBootImage.VENDOR_RAMDISK_TABLE_ENTRY_FORMAT,
+                size, ramdisk_offset, entry['ramdisk_type'],
+                ramdisk_name,
+                *entry['board_id'],
+            )
+            ramdisk_offset += size
+        vendor_ramdisk_size = ramdisk_offset
 
-        kernel_size = os.path.getsize(kernel_path)
-        ramdisk_size = os.path.getsize(ramdisk_path)
         dtb_size = os.path.getsize(dtb_path) if dtb_path else 0
+        bootconfig_size = os.path.getsize(bootconfig_path) if bootconfig_path else 0
+
+        cmdline_bytes = cmdline.encode('utf-8')
+        if len(cmdline_bytes) >= VendorBootImage.VENDOR_BOOT_ARGS_SIZE:
+            raise RuntimeError("Vendor boot cmdline is too long.")
+        name_bytes = name.encode('utf-8')
+        if len(name_bytes) > VendorBootImage.VENDOR_BOOT_NAME_SIZE:
+            raise RuntimeError(f"Vendor boot name is too long: {name}")
+
+        header_size = struct.calcsize(VendorBootImage.HEADER_V3_FORMAT)
+        if header_version >= 4:
+            header_size += struct.calcsize(VendorBootImage.HEADER_V4_FORMAT)
 
-        # Create the main header
         header = struct.pack(
-            '<8s9I',
-            self.BOOT_MAGIC,
-            kernel_size,
-            ramdisk_size,
-            header_info.get('os_version', 0),
-            header_info.get('header_size', 1648),
-            0, 0, 0, 0, # reserved
-            header_info.get('header_version', 4)
+            VendorBootImage.HEADER_V3_FORMAT,
+            VendorBootImage.VENDOR_BOOT_MAGIC,
+            header_version,
+            page_size,
+            header_info.get('kernel_addr', 0),
+            header_info.get('ramdisk_addr', 0),
+            vendor_ramdisk_size,
+            cmdline_bytes,
+            header_info.get('tags_addr', 0),
+            name_bytes,
+            header_size,
+            dtb_size,
+            header_info.get('dtb_addr', 0),
         )
-
-        # Pack cmdline
-        cmdline_bytes = cmdline.encode('utf-8')
-        cmdline_padded = cmdline_bytes + b'\x00' * (self.CMDLINE_SIZE - len(cmdline_bytes))
+        if header_version >= 4:
+            header += struct.pack(
+                VendorBootImage.HEADER_V4_FORMAT,
+                len(table),
+                len(ramdisks),
+                struct.calcsize(VendorBootImage.VENDOR_RAMDISK_TABLE_ENTRY_FORMAT),
+                bootconfig_size,
+            )
 
         with open(self.output_path, 'wb') as f:
-            # Write header, cmdline, and padding
             f.write(header)
-            f.write(cmdline_padded)
-
-            if header_info.get('header_version', 4) >= 4:
-                f.write(struct.pack('<I', dtb_size))
-
-            # Pad to the first page
-            current_size = f.tell()
-            f.write(b'\x00' * (page_size - current_size))
-
-            # Write kernel and padding
-            with open(kernel_path, 'rb') as k:
-                f.write(k.read())
-            f.write(b'\x00' * (_get_padded_size(kernel_size, page_size) - kernel_size))
+            self._pad(f, page_size)
 
-            # Write ramdisk and padding
-            with open(ramdisk_path, 'rb') as r:
-                f.write(r.read())
-            f.write(b'\x00' * (_get_padded_size(ramdisk_size, page_size) - ramdisk_size))
+            for entry in ramdisks:
+                with open(entry['path'], 'rb') as r:
+                    copy_into(f, r)
+            self._pad(f, page_size)
 
-            # Write dtb and padding
             if dtb_path:
                 with open(dtb_path, 'rb') as d:
-                    f.write(d.read())
-                f.write(b'\x00' * (_get_padded_size(dtb_size, page_size) - dtb_size))
+                    copy_into(f, d)
+                self._pad(f, page_size)
 
-    def sign_with_avb(self, key_path):
-        """
-        Signs the image with AVB (placeholder).
-        """
-        if not shutil.which("avbtool"):
-            raise EnvironmentError("avbtool not found.")
-        print(f"Placeholder for AVB signing with key: {key_path}")
+            if header_version >= 4:
+                f.write(table)
+                self._pad(f, page_size)
+
+                if bootconfig_path:
+                    with open(bootconfig_path, 'rb') as b:
+                        copy_into(f, b)
+                    self._pad(f, page_size)
+
+            f.truncate(f.tell())
@@ -1,5 +1,31 @@
+import mmap
 import struct
 
+# Whole-file searches look at this much of a mapping per find() call, so a
+# caller can stop a search of a multi-GB image between windows
+SEARCH_WINDOW = 64 * 1024 * 1024
+
+def iter_find(buf, pattern, start=0, end=None, should_stop=None, window=SEARCH_WINDOW):
+    """
+    Yields every offset of pattern in buf (bytes or an mmap) from start
+    onwards, searching one window at a time. Stops early once should_stop()
+    returns True.
+    """
+    end = len(buf) if end is None else min(end, len(buf))
+    if not pattern:
+        return
+    while start < end:
+        if should_stop is not None and should_stop():
+            return
+        # Windows overlap by len(pattern) - 1 so no match is split between two
+        window_end = min(end, start + window + len(pattern) - 1)
+        found = buf.find(pattern, start, window_end)
+        if found == -1:
+            start += window
+        else:
+            yield found
+            start = found + 1
+
 class MagicScanner:
     """
     Identifies firmware and recovery image types based on magic bytes and offsets.
@@ -11,10 +37,17 @@ class MagicScanner:
         'EROFS Filesystem':    {'magic': b'\xE2\xE1\xF5\xE0', 'offset': 1024},
         'OTA Payload':         {'magic': b'PAYLOAD',        'offset': 0},
         'Android Boot':        {'magic': b'ANDROID!',       'offset': 0},
+        'Android Vendor Boot': {'magic': b'VNDRBOOT',       'offset': 0},
         'DTB':                 {'magic': b'\xd0\x0d\xfe\xed', 'offset': -1},
         'AVB 2.0 Footer':      {'magic': b'AVBb',           'offset': -1},
         'LZ4 Ramdisk':         {'magic': b'\x04\x22\x4d\x18', 'offset': -1},
         'DTC Table':           {'magic': b'TDBL',           'offset': -1},
+        'DTBO Table':          {'magic': b'\xd7\xb7\xab\x1e', 'offset': 0},
+    }
+
+    # Extra fixed offsets a signature is also checked at
+    ALTERNATE_OFFSETS = {
+        'Super Partition': (4096,),
     }
 
     def search_for_magic(self, f, magic):
@@ -71,3 +104,33 @@ class MagicScanner:
             return ["Unknown"]
 
         return results
+
+    def find_offsets(self, filepath, limit=1000, should_stop=None):
+        """
+        Returns a sorted list of (offset, name) for every signature found in
+        a file. Fixed-offset signatures are checked where they belong;
+        variable ones are searched for through a memory mapping, keeping at
+        most limit matches of each. should_stop is passed on to iter_find.
+        """
+        found = []
+        with open(filepath, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return found
+            try:
+                for name, sig in self.MAGIC_SIGNATURES.items():
+                    magic = sig['magic']
+                    if sig['offset'] >= 0:
+                        for offset in (sig['offset'],) + self.ALTERNATE_OFFSETS.get(name, ()):
+                            if buf[offset:offset + len(magic)] == magic:
+                                found.append((offset, name))
+                        continue
+                    for count, offset in enumerate(iter_find(buf, magic, should_stop=should_stop)):
+                        if count >= limit:
+                            break
+                        found.append((offset, name))
+            finally:
+                buf.close()
+        return sorted(found)
@@ -0,0 +1,410 @@
+import bisect
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no ioctl; clone_file always copies there
+    fcntl = None
+
+# Large enough to amortise syscalls, small enough that a single write never
+# forces a whole multi-hundred-MB section to be resident at once.
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# ioctl(dest_fd, FICLONE, src_fd) shares all extents of src with dest
+FICLONE = 0x40049409
+
+# Zero runs at least this long are skipped by write_sparse
+SPARSE_BLOCK_SIZE = 64 * 1024
+_ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+
+
+@contextmanager
+def map_file(filepath):
+    """
+    Memory-maps a file read-only and yields a memoryview over the mapping.
+
+    Slicing the view never copies data; pages are faulted in by the kernel
+    only when a slice is actually read or written out. Empty files cannot be
+    mapped, so an empty memoryview is yielded for them instead.
+    """
+    with open(filepath, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield memoryview(b'')
+            return
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # A caller still holds a slice; the mapping is released
+                # when the last view onto it is garbage collected.
+                pass
+
+
+def write_view(f_out, view, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Writes a memoryview to a file object in bounded chunks.
+    """
+    for start in range(0, len(view), chunk_size):
+        f_out.write(view[start:start + chunk_size])
+
+
+def iter_view_chunks(view, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Yields successive zero-copy slices of a memoryview.
+    """
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def iter_file_chunks(f, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Yields successive chunks read from a binary file object until EOF.
+    """
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+class ChunkReader:
+    """
+    Presents an iterator of byte chunks as a sequential reader, so that
+    record-oriented formats can be parsed from a stream without ever holding
+    more than one input chunk plus a partial record in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._pos = 0
+        self.offset = 0
+
+    def _fill(self, size):
+        """Buffers input until at least `size` bytes are available or EOF."""
+        while len(self._buffer) - self._pos < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                return False
+            if self._pos:
+                del self._buffer[:self._pos]
+                self._pos = 0
+            self._buffer += chunk
+        return True
+
+    def peek(self, size):
+        """Returns up to `size` bytes without consuming them."""
+        self._fill(size)
+        return bytes(self._buffer[self._pos:self._pos + size])
+
+    def read(self, size):
+        """Reads up to `size` bytes; fewer are returned only at EOF."""
+        self._fill(size)
+        data = bytes(self._buffer[self._pos:self._pos + size])
+        self._pos += len(data)
+        self.offset += len(data)
+        return data
+
+    def read_exact(self, size):
+        """Reads exactly `size` bytes or raises ValueError at EOF."""
+        data = self.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of stream.")
+        return data
+
+    def iter_read(self, size, chunk_size=COPY_CHUNK_SIZE):
+        """
+        Yields the next `size` bytes in pieces of at most `chunk_size`,
+        so large records are never buffered in one piece.
+        """
+        while size > 0:
+            if not self._fill(1):
+                raise ValueError("Unexpected end of stream.")
+            # Hand out what is already buffered instead of merging chunks
+            available = len(self._buffer) - self._pos
+            data = self.read(min(size, available, chunk_size))
+            size -= len(data)
+            yield data
+
+    def iter_remaining(self):
+        """Yields everything left in the stream, buffered data first."""
+        if self._pos < len(self._buffer):
+            data = bytes(self._buffer[self._pos:])
+            self.offset += len(data)
+            yield data
+        self._buffer = bytearray()
+        self._pos = 0
+        for chunk in self._chunks:
+            self.offset += len(chunk)
+            yield chunk
+
+    def skip(self, size):
+        """Discards the next `size` bytes."""
+        for _ in self.iter_read(size):
+            pass
+
+    def at_eof(self):
+        """Returns True when no more input is available."""
+        return not self._fill(1)
+
+
+class ExtentReader:
+    """
+    Random-access reads from a file through a list of extents, so a region
+    of an image (a logical partition, a boot image section) can be read in
+    place without copying it out. Each extent is (length, file_offset);
+    a file_offset of None reads as zeros. Readers made with slice() share
+    the file handle. Reads use pread, or where it is missing (Windows) a
+    seek and read under a lock shared with those readers, so they are safe
+    across threads.
+    """
+
+    def __init__(self, path, extents=None, _file=None, _lock=None):
+        self.path = path
+        self._file = _file if _file is not None else open(path, 'rb')
+        self._lock = _lock if _lock is not None else threading.Lock()
+        if extents is None:
+            extents = [(os.fstat(self._file.fileno()).st_size, 0)]
+        self.extents = [(length, offset) for length, offset in extents if length > 0]
+        self._starts = []
+        position = 0
+        for length, _ in self.extents:
+            self._starts.append(position)
+            position += length
+        self.size = position
+
+    def read(self, offset, size):
+        """Returns up to size bytes at offset; short only at the end of the data."""
+        size = max(0, min(size, self.size - offset))
+        out = bytearray()
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while size > 0 and 0 <= index < len(self.extents):
+            length, file_offset = self.extents[index]
+            skip = offset - self._starts[index]
+            count = min(size, length - skip)
+            if file_offset is None:
+                data = bytes(count)
+            else:
+                data = self._read_at(file_offset + skip, count)
+                if len(data) < count:
+                    # The extent runs past the end of a truncated image
+                    out += data
+                    break
+            out += data
+            offset += count
+            size -= count
+            index += 1
+        return bytes(out)
+
+    def _read_at(self, file_offset, count):
+        """Reads count bytes at file_offset without disturbing other threads' reads."""
+        if hasattr(os, 'pread'):
+            return os.pread(self._file.fileno(), count, file_offset)
+        with self._lock:
+            self._file.seek(file_offset)
+            return self._file.read(count)
+
+    def slice(self, offset, size):
+        """Returns a reader over size bytes starting at offset."""
+        extents = []
+        end = min(offset + size, self.size)
+        for start, (length, file_offset) in zip(self._starts, self.extents):
+            lo, hi = max(offset, start), min(end, start + length)
+            if lo < hi:
+                extents.append((hi - lo, None if file_offset is None else file_offset + lo - start))
+        return ExtentReader(self.path, extents, self._file, self._lock)
+
+    def remap(self, extents):
+        """
+        Returns a reader over extents given relative to this reader's data,
+        such as the extents of a logical partition inside a super image.
+        """
+        mapped = []
+        for length, offset in extents:
+            if offset is None:
+                mapped.append((length, None))
+            else:
+                mapped.extend(self.slice(offset, length).extents)
+        return ExtentReader(self.path, mapped, self._file, self._lock)
+
+    def iter_chunks(self, chunk_size=COPY_CHUNK_SIZE):
+        """Yields the data in order in bounded chunks."""
+        for offset in range(0, self.size, chunk_size):
+            data = self.read(offset, chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+def hash_file(filepath, hasher, offset=0, length=None, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Feeds a byte range of a file through a hashlib object using large reads
+    into a single reusable buffer, so hashing runs at disk speed with
+    constant memory. Reads to EOF when length is None.
+    Returns the hasher.
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    with open(filepath, 'rb', buffering=0) as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            view = buffer if remaining is None or remaining >= chunk_size else buffer[:remaining]
+            n = f.readinto(view)
+            if not n:
+                break
+            hasher.update(view[:n])
+            if remaining is not None:
+                remaining -= n
+    if remaining:
+        raise ValueError(f"File is {remaining} bytes shorter than expected: {filepath}")
+    return hasher
+
+
+def source_size(source):
+    """
+    Returns the number of bytes copy_into would copy from a source: a path,
+    a bytes-like object, or a binary file object (from its current position).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    pos = source.tell()
+    end = source.seek(0, os.SEEK_END)
+    source.seek(pos)
+    return end - pos
+
+
+def _copy_fd_range(in_fd, offset, out_fd, count):
+    """
+    Copies count bytes from in_fd at offset to out_fd's current position
+    inside the kernel, preferring copy_file_range (which may reflink on
+    filesystems that support it) and falling back to sendfile.
+    Returns the number of bytes copied, which is short only when neither
+    call is usable.
+    """
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        func = getattr(os, method, None)
+        if func is None:
+            continue
+        try:
+            while copied < count:
+                size = min(count - copied, 1 << 30)
+                if method == 'copy_file_range':
+                    n = func(in_fd, out_fd, size, offset + copied)
+                else:
+                    n = func(out_fd, in_fd, offset + copied, size)
+                if not n:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            # EXDEV, ENOSYS, EINVAL etc.: try the next mechanism from where
+            # this one stopped
+            continue
+    return copied
+
+
+def copy_into(f_out, source, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Appends a source (path, bytes-like object or binary file object read
+    from its current position) to f_out at its current position.
+
+    Regular files are copied by the kernel without passing through user
+    space; anything else is streamed in bounded chunks through a single
+    reusable buffer. Returns the number of bytes written.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source).cast('B')
+        write_view(f_out, view, chunk_size)
+        return len(view)
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return copy_into(f_out, f, chunk_size)
+
+    size = source_size(source)
+    start = source.tell()
+    copied = 0
+    try:
+        in_fd, out_fd = source.fileno(), f_out.fileno()
+    except (AttributeError, OSError):
+        in_fd = out_fd = None
+
+    if in_fd is not None:
+        f_out.flush()
+        # Buffered file objects cache their position, so resync after
+        # moving the descriptor behind their back
+        os.lseek(out_fd, f_out.tell(), os.SEEK_SET)
+        copied = _copy_fd_range(in_fd, start, out_fd, size)
+        f_out.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+        source.seek(start + copied)
+
+    if copied < size:
+        buffer = memoryview(bytearray(min(chunk_size, size - copied)))
+        while copied < size:
+            n = source.readinto(buffer[:min(len(buffer), size - copied)])
+            if not n:
+                break
+            f_out.write(buffer[:n])
+            copied += n
+    return copied
+
+
+def pad_to(f_out, alignment):
+    """
+    Moves f_out forward to the next multiple of alignment without writing.
+    The skipped range reads back as zeros once the file is extended past it;
+    callers truncate to the final size when done.
+    """
+    pos = f_out.tell()
+    f_out.seek((pos + alignment - 1) // alignment * alignment)
+
+
+def clone_file(src_path, dst_path):
+    """
+    Creates dst_path as a copy of src_path, as a copy-on-write clone (a
+    reflink) where the filesystem supports it, so no data is duplicated
+    until either file is modified. Falls back to a kernel-side copy.
+    Returns 'reflink' or 'copy'.
+    """
+    with open(src_path, 'rb') as f_in, open(dst_path, 'wb') as f_out:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+        copy_into(f_out, f_in)
+    return 'copy'
+
+
+def write_sparse(f_out, view, block_size=SPARSE_BLOCK_SIZE):
+    """
+    Writes a memoryview to f_out, seeking over all-zero blocks instead of
+    writing them, so they remain holes in a file that was created or
+    truncated to size beforehand. Callers that write past the end of the
+    file truncate it to its final size when done.
+    """
+    zero = _ZERO_BLOCK if block_size == SPARSE_BLOCK_SIZE else bytes(block_size)
+    for offset in range(0, len(view), block_size):
+        block = view[offset:offset + block_size]
+        if block == zero[:len(block)]:
+            f_out.seek(len(block), os.SEEK_CUR)
+        else:
+            f_out.write(block)
@@ -10,7 +10,32 @@ class SuperUnpacker:
     LP_METADATA_GEOMETRY_MAGIC = 0x616c7067
     LP_METADATA_HEADER_MAGIC = 0x414C5030
     LP_METADATA_GEOMETRY_SIZE = 52
+    LP_METADATA_GEOMETRY_FORMAT = '<II32sIII'
+    LP_METADATA_GEOMETRY_FIELDS = ('magic', 'struct_size', 'checksum', 'metadata_max_size', 'metadata_slot_count',
+                                   'logical_block_size')
+    # magic, version, sizes and checksums, then offset/count/entry size for
+    # the partition, extent, group and block device tables
+    LP_METADATA_HEADER_FORMAT = '<IHHI32sI32s12I'
+    LP_METADATA_HEADER_FIELDS = ('magic', 'major_version', 'minor_version', 'header_size', 'header_checksum',
+                                 'tables_size', 'tables_checksum',
+                                 'partitions.offset', 'partitions.num_entries', 'partitions.entry_size',
+                                 'extents.offset', 'extents.num_entries', 'extents.entry_size',
+                                 'groups.offset', 'groups.num_entries', 'groups.entry_size',
+                                 'block_devices.offset', 'block_devices.num_entries', 'block_devices.entry_size')
     LP_METADATA_HEADER_MIN_SIZE = 104
+    LP_METADATA_HEADER_V1_0_SIZE = 128
+    LP_METADATA_TABLE_DESCRIPTORS_OFFSET = 80
+    # Size reserved for each of the two geometry copies
+    LP_METADATA_GEOMETRY_RESERVED = 4096
+    LP_SECTOR_SIZE = 512
+    # name, attributes, first_extent_index, num_extents, group_index
+    LP_METADATA_PARTITION_FORMAT = '<36sIIII'
+    LP_METADATA_PARTITION_FIELDS = ('name', 'attributes', 'first_extent_index', 'num_extents', 'group_index')
+    # num_sectors, target_type, target_data, target_source
+    LP_METADATA_EXTENT_FORMAT = '<QIQI'
+    LP_METADATA_EXTENT_FIELDS = ('num_sectors', 'target_type', 'target_data', 'target_source')
+    LP_TARGET_TYPE_LINEAR = 0
+    LP_TARGET_TYPE_ZERO = 1
 
     def __init__(self, filepath):
         self.filepath = filepath
@@ -28,62 +53,136 @@ class SuperUnpacker:
             raise ValueError("Sparse images are not supported. Please unsparse the image first.")
 
         # 1. Find and parse the LpMetadataGeometry
-        f.seek(4096)
+        geometry_offset = 4096
+        f.seek(geometry_offset)
         geo_data = f.read(self.LP_METADATA_GEOMETRY_SIZE)
         if len(geo_data) < self.LP_METADATA_GEOMETRY_SIZE:
             raise ValueError("File too small to contain Geometry")
 
-        geo = struct.unpack('<II32sIII', geo_data)
+        geo = struct.unpack(self.LP_METADATA_GEOMETRY_FORMAT, geo_data)
 
         if geo[0] != self.LP_METADATA_GEOMETRY_MAGIC:
             # Check for 16KB alignment (Android 15)
-            f.seek(16384)
+            geometry_offset = 16384
+            f.seek(geometry_offset)
             geo_data = f.read(self.LP_METADATA_GEOMETRY_SIZE)
-            geo = struct.unpack('<II32sIII', geo_data)
+            geo = struct.unpack(self.LP_METADATA_GEOMETRY_FORMAT, geo_data)
             if geo[0] != self.LP_METADATA_GEOMETRY_MAGIC:
                 raise ValueError("Invalid Geometry Magic. Is this a Sparse image?")
 
         self.geometry = {
+            "offset": geometry_offset,
             "metadata_max_size": geo[3],
             "metadata_slot_count": geo[4],
         }
 
-        # 2. Find and parse the active LpMetadataHeader
-        for i in range(self.geometry["metadata_slot_count"]):
-            slot_offset = 8192 + (i * self.geometry["metadata_max_size"])
-            f.seek(slot_offset)
-            header_data = f.read(self.LP_METADATA_HEADER_MIN_SIZE)
+        # 2. Find and parse the active LpMetadataHeader. The primary slots
+        # follow the primary and backup geometry copies (lpmake's layout);
+        # slots straight after the first copy are still accepted.
+        bases = [geometry_offset + 2 * self.LP_METADATA_GEOMETRY_RESERVED, 8192]
+        for base in bases:
+            for i in range(self.geometry["metadata_slot_count"]):
+                slot_offset = base + (i * self.geometry["metadata_max_size"])
+                f.seek(slot_offset)
+                header_data = f.read(self.LP_METADATA_HEADER_V1_0_SIZE)
+
+                header_format = '<IHH I 32s I 32s I 20x'
+                if len(header_data) < struct.calcsize(header_format):
+                    continue
+
+                header = struct.unpack(header_format, header_data[:struct.calcsize(header_format)])
+
+                if header[0] != self.LP_METADATA_HEADER_MAGIC:
+                    continue
+
+                header_size = header[3]
+                if header_size >= self.LP_METADATA_HEADER_V1_0_SIZE:
+                    self._parse_tables(f, slot_offset + header_size, header_data)
+                else:
+                    self._parse_legacy_partitions(f, slot_offset + header_size, header[5])
+                self.metadata["header_offset"] = slot_offset
+                return
 
-            header_format = '<IHH I 32s I 32s I 20x'
-            if len(header_data) < struct.calcsize(header_format):
-                raise ValueError("Header data too small to unpack")
-
-            header = struct.unpack(header_format, header_data)
+        raise ValueError("No active LpMetadataHeader found in any slot.")
 
-            if header[0] != self.LP_METADATA_HEADER_MAGIC:
+    def _parse_tables(self, f, tables_offset, header_data):
+        """
+        Parses the partition and extent tables located by the table
+        descriptors of a v10 LpMetadataHeader.
+        """
+        descriptors = struct.unpack_from('<12I', header_data, self.LP_METADATA_TABLE_DESCRIPTORS_OFFSET)
+        tables = {}
+        for index, table in enumerate(('partitions', 'extents', 'groups', 'block_devices')):
+            offset, num_entries, entry_size = descriptors[index * 3:index * 3 + 3]
+            f.seek(tables_offset + offset)
+            data = f.read(num_entries * entry_size)
+            if len(data) < num_entries * entry_size:
+                raise ValueError(f"Metadata {table} table extends past the end of the image.")
+            tables[table] = [data[i * entry_size:(i + 1) * entry_size] for i in range(num_entries)]
+
+        extents = []
+        for raw in tables['extents']:
+            num_sectors, target_type, target_data, target_source = struct.unpack_from(
+                self.LP_METADATA_EXTENT_FORMAT, raw)
+            extents.append({
+                "num_sectors": num_sectors,
+                "target_type": target_type,
+                "target_data": target_data,
+                "target_source": target_source,
+            })
+
+        self.metadata = {"partitions": []}
+        for raw in tables['partitions']:
+            name_bin, attributes, first_extent, num_extents, group_index = struct.unpack_from(
+                self.LP_METADATA_PARTITION_FORMAT, raw)
+            name = name_bin.decode('utf-8').rstrip('\x00')
+            if not name:
                 continue
-
-            self.metadata = {"partitions": []}
-            header_size = header[3]
-            partitions_size = header[5]
-
-            # The partition table is immediately after the header.
-            partitions_offset = header_size
-
-            partition_entry_size = 52 # sizeof(LpMetadataPartition)
-            partition_table_count = partitions_size // partition_entry_size
-
-            f.seek(slot_offset + partitions_offset)
-            for _ in range(partition_table_count):
-                part_bin = f.read(partition_entry_size)
-                # We only need the name, so we don't unpack the whole struct.
-                name_bin = struct.unpack('<36s', part_bin[:36])[0]
-                name = name_bin.decode('utf-8').rstrip('\x00')
-                if name:
-                    self.metadata["partitions"].append({"name": name})
-            return
-
-        raise ValueError("No active LpMetadataHeader found in any slot.")
+            if first_extent + num_extents > len(extents):
+                raise ValueError(f"Partition '{name}' refers to missing extents.")
+            part_extents = extents[first_extent:first_extent + num_extents]
+            self.metadata["partitions"].append({
+                "name": name,
+                "attributes": attributes,
+                "group_index": group_index,
+                "extents": part_extents,
+                "size": sum(e["num_sectors"] for e in part_extents) * self.LP_SECTOR_SIZE,
+            })
+
+    def _parse_legacy_partitions(self, f, partitions_offset, partitions_size):
+        """
+        Reads partition names from a header without table descriptors, where
+        the partition table directly follows the header.
+        """
+        self.metadata = {"partitions": []}
+        partition_entry_size = 52 # sizeof(LpMetadataPartition)
+        partition_table_count = partitions_size // partition_entry_size
+
+        f.seek(partitions_offset)
+        for _ in range(partition_table_count):
+            part_bin = f.read(partition_entry_size)
+            # We only need the name, so we don't unpack the whole struct.
+            name_bin = struct.unpack('<36s', part_bin[:36])[0]
+            name = name_bin.decode('utf-8').rstrip('\x00')
+            if name:
+                self.metadata["partitions"].append({"name": name, "extents": [], "size": 0})
+
+    def extent_map(self, partition):
+        """
+        Returns a partition's extents as (length, offset) byte pairs for
+        ExtentReader; zero extents have an offset of None. Raises
+        ValueError for extents on other block devices (retrofit images).
+        """
+        extents = []
+        for extent in partition["extents"]:
+            length = extent["num_sectors"] * self.LP_SECTOR_SIZE
+            if extent["target_type"] == self.LP_TARGET_TYPE_ZERO:
+                extents.append((length, None))
+            elif extent["target_type"] == self.LP_TARGET_TYPE_LINEAR and extent["target_source"] == 0:
+                extents.append((length, extent["target_data"] * self.LP_SECTOR_SIZE))
+            else:
+                raise ValueError(f"Partition '{partition['name']}' has data outside this image.")
+        return extents
 
     def unpack(self, output_dir):
         """
@@ -1,18 +1,75 @@
 import os
+import time
 
+from textual import work
 from textual.app import App
-from textual.widgets import Header, Footer, Log, RadioSet, RadioButton, Label, Tree
+from textual.worker import WorkerCancelled, get_current_worker
+from textual.widgets import Header, Footer, Input, Log, RadioSet, RadioButton, Label, Tree
 from textual.containers import VerticalScroll
 
-from android_15_tool.lib.driver_finder import find_touchscreen_drivers
+from android_15_tool.lib.driver_finder import TOUCHSCREEN_DRIVER_MATCHERS
+from android_15_tool.lib.image_browser import VirtualEntry
+from android_15_tool.lib.init_rc import load_rc_index, query_rc_index
 from android_15_tool.lib.partition_analyzer import analyze_partition_image
-from android_15_tool.lib.recovery_scanner import find_recovery_images
+from android_15_tool.lib.recovery_scanner import RecoveryImageMatcher
 from android_15_tool.lib.tui.widgets.file_browser import FileBrowser
+from android_15_tool.lib.tui.widgets.hex_view import HexView, parse_query
+from android_15_tool.lib.walker import walk_tree
+
+# Scan output is handed to the UI thread in batches at most this often, so
+# a scan of a huge tree does not flood the event loop with one call per line
+SCAN_FLUSH_INTERVAL = 0.1
+RECOVERY_SECTION = "Recovery Images Found:"
+DRIVER_SECTION = "Touchscreen Drivers Found:"
+
+
+class ScanOutput:
+    """
+    Collects log lines and progress from a background worker and passes
+    them to the app in batches. Raises WorkerCancelled once the worker has
+    been cancelled, which stops a scan between directories.
+    """
+
+    def __init__(self, app, worker):
+        self.app = app
+        self.worker = worker
+        self.lines = []
+        self.status = None
+        self.directories = 0
+        self.matches = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, line):
+        self.lines.append(line)
+        self.maybe_flush()
+
+    def directory(self, path):
+        """Counts a searched directory; used as the scanners' on_directory callback."""
+        self.directories += 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if self.worker.is_cancelled:
+            raise WorkerCancelled("Scan cancelled.")
+        if time.monotonic() - self.last_flush >= SCAN_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self, status=None):
+        """Sends the pending lines and the current progress to the app."""
+        if self.worker.is_cancelled:
+            return
+        lines, self.lines = self.lines, []
+        status = status or f"Scanning: {self.directories} directories searched, {self.matches} matches"
+        self.app.call_from_thread(self.app.show_scan_output, lines, status)
+        self.last_flush = time.monotonic()
 
 
 class TuiApp(App):
     """The main application for the TUI."""
 
+    # The directory whose init scripts the rc_query box searches
+    rc_tree = "."
+
     def compose(self):
         """Compose the layout of the application."""
         yield Header()
@@ -25,7 +82,14 @@ class TuiApp(App):
                 RadioButton("Init Scripts (*.rc)", id="rc"),
                 id="filter_radio_set",
             )
+        yield Label("", id="scan_status")
         yield Log(id="log")
+        # Shown once a file is selected
+        hex_view = HexView(id="hex_view")
+        hex_view.display = False
+        yield hex_view
+        yield Input(placeholder='Search the hex view: hex bytes, "text" or @offset', id="hex_search")
+        yield Input(placeholder="Init scripts of the selected directory: trigger or service name", id="rc_query")
         yield Footer()
 
     def on_mount(self):
@@ -42,48 +106,143 @@ class TuiApp(App):
             return
 
         log.clear()
+        if isinstance(path, VirtualEntry):
+            # An entry inside a browsed image; its details are already known
+            log.write(path.describe())
+            return
+        # Both workers share the "scan" group and are exclusive, so a new
+        # selection cancels whatever the previous one started
         if os.path.isdir(path):
+            self.rc_tree = str(path)
             log.write(f"Scanning directory: {path}")
-            try:
-                recovery_images = find_recovery_images(str(path))
-                drivers = find_touchscreen_drivers(str(path))
-
-                log.write("\n--- Directory Scan Results ---")
-                if recovery_images:
-                    log.write("Recovery Images Found:")
-                    for image in recovery_images:
-                        log.write(f"- {image}")
-                else:
-                    log.write("No potential recovery images found.")
-
-                if drivers:
-                    log.write("\nTouchscreen Drivers Found:")
-                    for driver in drivers:
-                        log.write(f"- {driver}")
-                else:
-                    log.write("No potential touchscreen drivers found.")
-                log.write("--- End of Scan ---")
-            except Exception as e:
-                log.write(f"[ERROR] Failed to scan directory: {e}")
+            self.scan_directory(str(path))
         elif os.path.isfile(path):
             log.write(f"Analyzing file: {path}")
-            results = analyze_partition_image(str(path))
+            self.analyze_file(str(path))
+            self.open_hex_view(str(path))
 
-            log.write("\n--- Partition Analysis Results ---")
+    def open_hex_view(self, path: str) -> None:
+        """Shows a file in the hex view."""
+        hex_view = self.query_one(HexView)
+        try:
+            hex_view.open(path)
+        except OSError as e:
+            self.query_one(Log).write(f"[ERROR] Cannot open {path} in the hex view: {e}")
+            return
+        hex_view.display = True
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        """Runs a hex view search or jump, or an init script query."""
+        if event.input.id == "rc_query":
+            if event.value.strip():
+                self.query_one(Log).clear()
+                self.query_init_rc(self.rc_tree, event.value)
+            return
+        if event.input.id != "hex_search":
+            return
+        hex_view = self.query_one(HexView)
+        if hex_view.path is None:
+            return
+        try:
+            action, value = parse_query(event.value)
+        except ValueError as e:
+            hex_view.border_subtitle = str(e)
+            return
+        if action == "goto":
+            hex_view.goto(value)
+        else:
+            hex_view.search(value)
+
+    def show_scan_output(self, lines, status) -> None:
+        """Appends lines from a worker to the log and updates the scan status."""
+        if lines:
+            self.query_one(Log).write_lines(lines)
+        self.query_one("#scan_status", Label).update(status)
+
+    @work(thread=True, exclusive=True, group="scan")
+    def scan_directory(self, path: str) -> None:
+        """
+        Searches a directory tree in a thread, reporting progress as it
+        goes. Recovery images and touchscreen drivers are found in one
+        walk and each match is written to the log as soon as it is found,
+        labelled with its kind. The walk finishes directories in no
+        particular order, so the matches are repeated sorted under one
+        heading per kind once it is done.
+        """
+        output = ScanOutput(self, get_current_worker())
+        # Matcher name -> section heading; both driver matchers share one
+        sections = {RecoveryImageMatcher.name: RECOVERY_SECTION}
+        sections.update((matcher.name, DRIVER_SECTION) for matcher in TOUCHSCREEN_DRIVER_MATCHERS)
+        labels = {RECOVERY_SECTION: "Recovery image", DRIVER_SECTION: "Touchscreen driver"}
+        empty = {RECOVERY_SECTION: "No potential recovery images found.",
+                 DRIVER_SECTION: "No potential touchscreen drivers found."}
+        try:
+            output.write("\n--- Directory Scan Results ---")
+            found = {RECOVERY_SECTION: set(), DRIVER_SECTION: set()}
+            matchers = [RecoveryImageMatcher(), *TOUCHSCREEN_DRIVER_MATCHERS]
+            for name, result in walk_tree(path, matchers, output.directory):
+                section = sections[name]
+                if result not in found[section]:
+                    found[section].add(result)
+                    output.matches += 1
+                    output.write(f"{labels[section]}: {result}")
+            output.write("--- Summary ---")
+            for section, results in found.items():
+                if results:
+                    output.write(section)
+                    for result in sorted(results):
+                        output.write(f"- {result}")
+                else:
+                    output.write(empty[section])
+            output.write("--- End of Scan ---")
+        except WorkerCancelled:
+            return
+        except Exception as e:
+            output.write(f"[ERROR] Failed to scan directory: {e}")
+        output.flush(f"Scan finished: {output.directories} directories searched, {output.matches} matches")
+
+    @work(thread=True, exclusive=True, group="scan")
+    def analyze_file(self, path: str) -> None:
+        """Analyzes a partition image in a thread and writes the results to the log."""
+        output = ScanOutput(self, get_current_worker())
+        output.flush(f"Analyzing {os.path.basename(path)}...")
+        try:
+            results = analyze_partition_image(path)
+
+            output.write("\n--- Partition Analysis Results ---")
             if results["status"] == "success":
                 if results.get("note"):
-                    log.write(f"NOTE: {results['note']}")
+                    output.write(f"NOTE: {results['note']}")
 
                 if results["partitions"]:
-                    log.write("Partitions Found:")
+                    output.write("Partitions Found:")
                     for part in results["partitions"]:
-                        log.write(f"- Name: {part['name']}, Size: {part['size']}")
+                        output.write(f"- Name: {part['name']}, Size: {part['size']}")
                 else:
-                    log.write("No partition information found (this may not be a super.img).")
+                    output.write("No partition information found (this may not be a super.img).")
             else:
-                log.write(f"[ERROR] {results['message']}")
-            log.write("--- End of Analysis ---")
+                output.write(f"[ERROR] {results['message']}")
+            output.write("--- End of Analysis ---")
+        except WorkerCancelled:
+            return
+        output.flush("Analysis finished.")
 
+    @work(thread=True, exclusive=True, group="rc_query")
+    def query_init_rc(self, tree: str, query: str) -> None:
+        """Answers an init script query in a thread; the tree's index is built once and cached."""
+        output = ScanOutput(self, get_current_worker())
+        output.flush(f"Reading init scripts under {tree}...")
+        try:
+            index = load_rc_index(tree)
+            output.write(f"\n--- Init Scripts: {query} ---")
+            for line in index.summary() + query_rc_index(index, query):
+                output.write(line)
+            output.write("--- End of Query ---")
+        except WorkerCancelled:
+            return
+        except Exception as e:
+            output.write(f"[ERROR] Failed to read init scripts: {e}")
+        output.flush("Query finished.")
 
     def on_radio_set_changed(self, event: RadioSet.Changed) -> None:
         """Called when the radio button selection changes."""
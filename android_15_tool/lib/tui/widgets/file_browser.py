@@ -1,7 +1,20 @@
 import os
+import struct
 
+from rich.text import Text
+from textual import work
 from textual.widgets import Tree
-from textual.widgets.tree import TreeNode
+from textual.widgets.tree import TreeNode, UnknownNodeID
+
+from android_15_tool.lib.image_browser import VirtualEntry, browse_image
+
+LOADING_LABEL = "Loading..."
+# Files that can be expanded to browse inside them (super, boot, vendor
+# boot, EROFS, ext4 and ramdisk images)
+BROWSABLE_SUFFIXES = (".img", ".cpio")
+# Entries are added to the tree in batches of this size, one batch per
+# refresh, so opening a directory with thousands of entries does not block
+POPULATE_BATCH_SIZE = 200
 
 
 class FileBrowser(Tree):
@@ -11,6 +24,17 @@ class FileBrowser(Tree):
         super().__init__(label=os.path.basename(path), data=path, **kwargs)
         self.path = path
         self.filter_extensions: list[str] | None = None
+        # Directory path -> (mtime_ns, [(name, path, is_dir), ...]), sorted
+        # with directories first
+        self._listings = {}
+        # Directory path -> node, for every directory whose entries are shown
+        self._loaded = {}
+        # Node id -> generation; a pending batch only runs if the node has
+        # not been repopulated or refiltered since it was scheduled
+        self._generations = {}
+        # Image path -> (mtime_ns, root VirtualEntry), so an image that is
+        # collapsed or refiltered is not read again
+        self._images = {}
 
     def set_filter(self, extensions: list[str] | None) -> None:
         """
@@ -20,49 +44,155 @@ class FileBrowser(Tree):
                         Set to None to show all files.
         """
         self.filter_extensions = extensions
-        # Clear the current tree and re-populate from the root to apply the filter
-        self.root.remove_children()
-        self._populate_directory(self.root)
+        # Only the file leaves of loaded directories change; directory nodes
+        # and their expanded state are kept, and listings come from the cache
+        for dir_path, node in list(self._loaded.items()):
+            listing = self._listings.get(dir_path)
+            if listing is not None:
+                self._apply_listing(node, listing[1])
+
+    def _list_directory(self, dir_path: str):
+        """
+        Returns the sorted entries of a directory, read with a single scandir
+        pass and cached until the directory's mtime changes. Returns None if
+        it cannot be read.
+        """
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._listings.get(dir_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        entries = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry.name, entry.path, is_dir))
+        except OSError:
+            return None
+        entries.sort(key=lambda e: (not e[2], e[0].lower()))
+        self._listings[dir_path] = (mtime, entries)
+        return entries
+
+    def _matches_filter(self, name: str) -> bool:
+        return not self.filter_extensions or any(name.endswith(ext) for ext in self.filter_extensions)
 
     def _populate_directory(self, node: TreeNode) -> None:
         """Populates a node with the contents of its directory."""
         dir_path = node.data
-        if not dir_path or not os.path.isdir(dir_path):
+        if not dir_path:
+            return
+        entries = self._list_directory(dir_path)
+        if entries is None:
             return
 
         node.remove_children()
+        # Nodes below this one are gone, so stop tracking them
+        prefix = os.path.join(dir_path, "")
+        for path in [p for p in self._loaded if p.startswith(prefix)]:
+            del self._loaded[path]
+        self._loaded[dir_path] = node
+        self._apply_listing(node, entries)
 
-        try:
-            paths = sorted(
-                os.listdir(dir_path),
-                key=lambda p: (not os.path.isdir(os.path.join(dir_path, p)), p.lower()),
-            )
-        except OSError:
-            return
+    def _apply_listing(self, node: TreeNode, entries) -> None:
+        """
+        Brings a loaded node's children in line with its listing and the
+        current filter. Directory nodes already in the tree are kept; file
+        leaves are rebuilt. Entries are added in listing order, so
+        directories stay ahead of files.
+        """
+        directories = {entry[1] for entry in entries if entry[2]}
+        existing = set()
+        for child in list(node.children):
+            if child.data in directories:
+                existing.add(child.data)
+            else:
+                child.remove()
+        pending = []
+        for name, path, is_dir in entries:
+            if is_dir:
+                if path not in existing:
+                    pending.append((name, path, True))
+            elif self._matches_filter(name):
+                pending.append((name, path, name.endswith(BROWSABLE_SUFFIXES)))
+        self._add_entries(node, pending)
 
-        for name in paths:
-            path = os.path.join(dir_path, name)
-            is_dir = os.path.isdir(path)
+    def _add_entries(self, node: TreeNode, entries) -> None:
+        """Adds (label, data, expandable) entries to a node in batches."""
+        generation = self._generations.get(node.id, 0) + 1
+        self._generations[node.id] = generation
+        self._add_batch(node, entries, 0, generation)
 
-            if is_dir:
-                child_node = node.add(name, data=path)
-                child_node.add_leaf("Loading...")
+    def _add_batch(self, node: TreeNode, entries, start: int, generation: int) -> None:
+        """Adds one batch of entries to a node and schedules the next."""
+        if self._generations.get(node.id) != generation:
+            return
+        for label, data, expandable in entries[start:start + POPULATE_BATCH_SIZE]:
+            # Text labels, so names containing [ are not read as markup
+            if expandable:
+                child_node = node.add(Text(label), data=data)
+                child_node.add_leaf(LOADING_LABEL)
             else:
-                # If a filter is set, only show files with matching extensions
-                if self.filter_extensions:
-                    if any(name.endswith(ext) for ext in self.filter_extensions):
-                        node.add_leaf(name, data=path)
-                else:
-                    # If no filter, show all files
-                    node.add_leaf(name, data=path)
+                node.add_leaf(Text(label), data=data)
+        start += POPULATE_BATCH_SIZE
+        if start < len(entries):
+            self.call_after_refresh(self._add_batch, node, entries, start, generation)
 
     def on_mount(self) -> None:
         """Called when the widget is mounted."""
         self._populate_directory(self.root)
         self.root.expand()
 
-    def on_tree_node_expand(self, event: Tree.NodeExpanded) -> None:
+    def on_tree_node_expanded(self, event: Tree.NodeExpanded) -> None:
         """Called when a user expands a node in the tree."""
         node = event.node
-        if node.children and node.children[0].label == "Loading...":
-            self._populate_directory(node)
+        if node.children and node.children[0].label.plain == LOADING_LABEL:
+            if isinstance(node.data, str) and os.path.isdir(node.data):
+                self._populate_directory(node)
+            else:
+                self._load_image_node(node)
+        elif node.data in self._loaded:
+            # Re-read a directory that changed since it was listed
+            cached = self._listings.get(node.data)
+            entries = self._list_directory(node.data)
+            if entries is not None and (cached is None or entries is not cached[1]):
+                self._populate_directory(node)
+
+    def _open_image(self, path: str) -> VirtualEntry:
+        """Returns the root entry of an image file, reusing it until the file changes."""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._images.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        root = browse_image(path)
+        self._images[path] = (mtime, root)
+        return root
+
+    @work(thread=True, group="image_browser")
+    def _load_image_node(self, node: TreeNode) -> None:
+        """
+        Reads the children of an image, or of an entry inside one, in a
+        thread and adds them to the node.
+        """
+        try:
+            entry = node.data if isinstance(node.data, VirtualEntry) else self._open_image(node.data)
+            children = [(child.name, child, child.expandable) for child in entry.children()]
+        except (ValueError, RuntimeError, OSError, struct.error) as e:
+            self.app.call_from_thread(self._show_image_children, node, [(f"[cannot open: {e}]", None, False)])
+            return
+        self.app.call_from_thread(self._show_image_children, node, children)
+
+    def _show_image_children(self, node: TreeNode, children) -> None:
+        try:
+            self.get_node_by_id(node.id)
+        except UnknownNodeID:
+            # The node was removed (refiltered or collapsed away) meanwhile
+            return
+        node.remove_children()
+        self._add_entries(node, children)
@@ -0,0 +1,231 @@
+import bisect
+import mmap
+import os
+
+from rich.segment import Segment
+from rich.style import Style
+from textual import work
+from textual.geometry import Size
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+from textual.worker import get_current_worker
+
+from android_15_tool.lib.header_fields import header_fields
+from android_15_tool.lib.scanner import MagicScanner, iter_find
+
+BYTES_PER_LINE = 16
+# Adjacent header fields alternate between these styles
+FIELD_STYLES = (Style(color="cyan"), Style(color="green"))
+SIGNATURE_STYLE = Style(color="black", bgcolor="yellow")
+MATCH_STYLE = Style(color="black", bgcolor="magenta")
+CURSOR_STYLE = Style(reverse=True)
+
+
+def parse_query(text: str):
+    """
+    Parses the hex view's search box. Returns ('goto', offset) for
+    '@offset' (decimal or 0x hex), otherwise ('search', pattern): text in
+    double quotes is searched for as UTF-8, hex pairs as bytes and anything
+    else as UTF-8. Raises ValueError for an empty query or a bad offset.
+    """
+    text = text.strip()
+    if not text:
+        raise ValueError("Empty search.")
+    if text.startswith("@"):
+        return "goto", int(text[1:].strip(), 0)
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return "search", text[1:-1].encode("utf-8")
+    try:
+        return "search", bytes.fromhex(text)
+    except ValueError:
+        return "search", text.encode("utf-8")
+
+
+class _Spans:
+    """Sorted, non-nested (offset, size, label) spans with lookup by byte offset."""
+
+    def __init__(self, spans=()):
+        self.spans = sorted(spans)
+        self.starts = [span[0] for span in self.spans]
+
+    def index_at(self, offset: int):
+        """Returns the index of the span covering offset, or None."""
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if i >= 0 and offset < self.spans[i][0] + self.spans[i][1]:
+            return i
+        return None
+
+
+class HexView(ScrollView, can_focus=True):
+    """
+    A hex dump of a file, read through a memory mapping. Only the lines in
+    view are rendered, so scrolling costs the same for any file size.
+    Header fields of boot, vendor boot and super images are coloured, and
+    signatures found by MagicScanner are highlighted and can be stepped
+    through with n and p.
+    """
+
+    BINDINGS = [
+        ("n", "next_signature", "Next signature"),
+        ("p", "previous_signature", "Previous signature"),
+    ]
+
+    DEFAULT_CSS = """
+    HexView {
+        height: 18;
+        border: round $accent;
+    }
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.path = None
+        self.cursor = 0
+        self._buf = b""
+        self._file_size = 0
+        self._offset_digits = 8
+        self._fields = _Spans()
+        self._signatures = _Spans()
+        self._match = None
+
+    def open(self, path: str) -> None:
+        """
+        Shows a file from its first byte. Header fields are read at once;
+        signatures are searched for in the background. Raises OSError if
+        the file cannot be opened.
+        """
+        with open(path, "rb") as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                buf = b""
+            try:
+                fields = header_fields(f, buf)
+                note = None
+            except ValueError as e:
+                fields, note = [], str(e)
+        # The old mapping is not closed here: a search may still be reading
+        # it, and it is unmapped once the last reference to it is dropped
+        self._buf = buf
+        self._file_size = len(buf)
+        self.path = path
+        self._offset_digits = max(8, len(f"{self._file_size:x}"))
+        self._fields = _Spans((field.offset, field.size, f"{field.name} = {field.value}") for field in fields)
+        self._signatures = _Spans()
+        self._match = None
+        self.border_title = os.path.basename(path)
+        self.virtual_size = Size(self._line_width(), -(-self._file_size // BYTES_PER_LINE))
+        self.scroll_to(0, 0, animate=False)
+        self.goto(0)
+        if note:
+            self.border_subtitle = f"Header not read: {note}"
+        self._scan_signatures(path)
+
+    def _line_width(self) -> int:
+        return self._offset_digits + 2 + BYTES_PER_LINE * 3 + 1 + 1 + BYTES_PER_LINE
+
+    @work(thread=True, exclusive=True, group="hex_signatures")
+    def _scan_signatures(self, path: str) -> None:
+        worker = get_current_worker()
+        try:
+            found = MagicScanner().find_offsets(path, should_stop=lambda: worker.is_cancelled)
+        except OSError:
+            return
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self._show_signatures, path, found)
+
+    def _show_signatures(self, path: str, found) -> None:
+        if path != self.path:
+            return
+        magics = {name: len(sig["magic"]) for name, sig in MagicScanner.MAGIC_SIGNATURES.items()}
+        self._signatures = _Spans((offset, magics[name], name) for offset, name in found)
+        self.border_subtitle = self.describe(self.cursor)
+        self.refresh()
+
+    def goto(self, offset: int) -> None:
+        """Moves the cursor to a byte offset and scrolls it into view."""
+        self.cursor = max(0, min(offset, self._file_size - 1)) if self._file_size else 0
+        line = self.cursor // BYTES_PER_LINE
+        top = round(self.scroll_offset.y)
+        if not top <= line < top + max(1, self.scrollable_content_region.height):
+            self.scroll_to(y=max(0, line - 2), animate=False)
+        self.border_subtitle = self.describe(self.cursor)
+        self.refresh()
+
+    def describe(self, offset: int) -> str:
+        """Names the offset, the header field it belongs to and any signature starting there."""
+        parts = [f"0x{offset:x}"]
+        i = self._fields.index_at(offset)
+        if i is not None:
+            parts.append(self._fields.spans[i][2])
+        i = self._signatures.index_at(offset)
+        if i is not None:
+            parts.append(self._signatures.spans[i][2])
+        return " | ".join(parts)
+
+    def action_next_signature(self) -> None:
+        i = bisect.bisect_right(self._signatures.starts, self.cursor)
+        if i < len(self._signatures.starts):
+            self.goto(self._signatures.starts[i])
+
+    def action_previous_signature(self) -> None:
+        i = bisect.bisect_left(self._signatures.starts, self.cursor) - 1
+        if i >= 0:
+            self.goto(self._signatures.starts[i])
+
+    @work(thread=True, exclusive=True, group="hex_search")
+    def search(self, pattern: bytes) -> None:
+        """Searches forward from the byte after the cursor in a thread and moves to the match."""
+        worker = get_current_worker()
+        buf, path, start = self._buf, self.path, self.cursor + 1
+        found = next(iter_find(buf, pattern, start, should_stop=lambda: worker.is_cancelled), None)
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self._show_match, path, pattern, found)
+
+    def _show_match(self, path: str, pattern: bytes, found) -> None:
+        if path != self.path:
+            return
+        if found is None:
+            self.border_subtitle = f"{pattern.hex(' ')} not found after 0x{self.cursor:x}"
+            return
+        self._match = (found, len(pattern))
+        self.goto(found)
+
+    def _byte_style(self, offset: int) -> Style:
+        style = Style()
+        i = self._fields.index_at(offset)
+        if i is not None:
+            style = FIELD_STYLES[i % len(FIELD_STYLES)]
+        if self._signatures.index_at(offset) is not None:
+            style = SIGNATURE_STYLE
+        if self._match and self._match[0] <= offset < self._match[0] + self._match[1]:
+            style = MATCH_STYLE
+        if offset == self.cursor:
+            style += CURSOR_STYLE
+        return style
+
+    def render_line(self, y: int) -> Strip:
+        """Renders one line of the dump: offset, hex bytes and their ASCII."""
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.scrollable_content_region.width
+        start = (scroll_y + y) * BYTES_PER_LINE
+        if start >= self._file_size:
+            return Strip.blank(width, self.rich_style)
+        data = self._buf[start:start + BYTES_PER_LINE]
+        styles = [self._byte_style(start + i) for i in range(len(data))]
+
+        segments = [Segment(f"{start:0{self._offset_digits}x}  ", Style(dim=True))]
+        for i in range(BYTES_PER_LINE):
+            if i == BYTES_PER_LINE // 2:
+                segments.append(Segment(" "))
+            if i < len(data):
+                segments.append(Segment(f"{data[i]:02x}", styles[i]))
+                segments.append(Segment(" "))
+            else:
+                segments.append(Segment("   "))
+        segments.append(Segment(" "))
+        for i, byte in enumerate(data):
+            segments.append(Segment(chr(byte) if 32 <= byte < 127 else ".", styles[i]))
+        strip = Strip(Segment.simplify(segments)).apply_style(self.rich_style)
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
@@ -0,0 +1,281 @@
+import os
+import re
+import struct
+
+from android_15_tool.lib.boot_image import _get_padded_size
+from android_15_tool.lib.ramdisk import extract_ramdisk
+from android_15_tool.lib.stream_io import map_file, write_view, iter_view_chunks
+
+VENDOR_RAMDISK_TYPES = {
+    0: 'none',
+    1: 'platform',
+    2: 'recovery',
+    3: 'dlkm',
+}
+
+VENDOR_RAMDISK_TABLE_FILE = 'vendor_ramdisk_table.txt'
+# Replaced with '_' in fragment file names
+FRAGMENT_NAME_UNSAFE = re.compile(r'[^A-Za-z0-9._-]')
+
+def read_ramdisk_table(table_path):
+    """
+    Reads the vendor ramdisk table written during unpacking.
+    Each line is '<file>:<type>:<board_id words>:<name>', with file paths
+    relative to the directory containing the table. The name comes last, so
+    it may itself contain ':'.
+    Returns a list of entry dicts.
+    """
+    base_dir = os.path.dirname(table_path)
+    entries = []
+    with open(table_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            file_name, ramdisk_type, board_id, name = line.split(':', 3)
+            entries.append({
+                'path': os.path.join(base_dir, file_name),
+                'ramdisk_type': int(ramdisk_type),
+                'board_id': [int(word, 16) for word in board_id.split(',')],
+                'ramdisk_name': name,
+            })
+    return entries
+
+def write_ramdisk_table(table_path, entries):
+    """
+    Writes the vendor ramdisk table in the format read by read_ramdisk_table().
+    Raises ValueError for entries that the format cannot hold: a file name
+    containing ':' or a line break, or a name containing a line break.
+    """
+    for entry in entries:
+        file_name = os.path.basename(entry['path'])
+        if ':' in file_name or '\n' in file_name or '\n' in entry['ramdisk_name']:
+            raise ValueError(f"Vendor ramdisk {entry['ramdisk_name']!r} cannot be stored in {VENDOR_RAMDISK_TABLE_FILE}.")
+    with open(table_path, 'w') as f:
+        for entry in entries:
+            board_id = ','.join(f'{word:08x}' for word in entry['board_id'])
+            f.write(f"{os.path.basename(entry['path'])}:{entry['ramdisk_type']}:"
+                    f"{board_id}:{entry['ramdisk_name']}\n")
+
+class VendorBootImage:
+    """
+    Parses vendor_boot.img files (header versions 3 and 4).
+    """
+
+    VENDOR_BOOT_MAGIC = b'VNDRBOOT'
+    VENDOR_BOOT_ARGS_SIZE = 2048
+    VENDOR_BOOT_NAME_SIZE = 16
+
+    # v3: page_size, load addresses, vendor ramdisk, cmdline, name and dtb
+    HEADER_V3_FORMAT = '<8s5I2048sI16sIIQ'
+    HEADER_V3_FIELDS = ('magic', 'header_version', 'page_size', 'kernel_addr', 'ramdisk_addr',
+                        'vendor_ramdisk_size', 'cmdline', 'tags_addr', 'name', 'header_size', 'dtb_size',
+                        'dtb_addr')
+    # v4 appends the vendor ramdisk table geometry and bootconfig size
+    HEADER_V4_FORMAT = '<4I'
+    HEADER_V4_FIELDS = ('vendor_ramdisk_table_size', 'vendor_ramdisk_table_entry_num',
+                        'vendor_ramdisk_table_entry_size', 'bootconfig_size')
+
+    VENDOR_RAMDISK_NAME_SIZE = 32
+    VENDOR_RAMDISK_TABLE_ENTRY_BOARD_ID_SIZE = 16
+    # ramdisk_size, ramdisk_offset, ramdisk_type, ramdisk_name, board_id
+    VENDOR_RAMDISK_TABLE_ENTRY_FORMAT = '<3I32s16I'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.header = None
+        self.cmdline = ""
+        self.name = ""
+        self.sections = {}
+        self.ramdisk_table = []
+
+    @staticmethod
+    def _cstr(raw):
+        """Decodes a NUL-padded header string."""
+        return raw.split(b'\x00', 1)[0].decode('utf-8', errors='replace')
+
+    def _parse_ramdisk_table(self, buf):
+        """
+        Parses the v4 vendor ramdisk table into absolute fragment offsets.
+        """
+        table_offset, _ = self.sections['vendor_ramdisk_table']
+        ramdisk_offset, ramdisk_size = self.sections.get('vendor_ramdisk', (0, 0))
+        entry_size = self.header['vendor_ramdisk_table_entry_size']
+        if entry_size < struct.calcsize(self.VENDOR_RAMDISK_TABLE_ENTRY_FORMAT):
+            raise ValueError(f"Invalid vendor ramdisk table entry size: {entry_size}")
+
+        self.ramdisk_table = []
+        for i in range(self.header['vendor_ramdisk_table_entry_num']):
+            fields = struct.unpack_from(
+                self.VENDOR_RAMDISK_TABLE_ENTRY_FORMAT, buf, table_offset + i * entry_size)
+            size, offset, ramdisk_type, name = fields[:4]
+            if offset + size > ramdisk_size:
+                raise ValueError(f"Vendor ramdisk fragment {i} lies outside the ramdisk section.")
+            self.ramdisk_table.append({
+                'ramdisk_size': size,
+                'ramdisk_offset': offset,
+                'ramdisk_type': ramdisk_type,
+                'ramdisk_name': self._cstr(name),
+                'board_id': list(fields[4:]),
+                'offset': ramdisk_offset + offset,
+            })
+
+    def _parse_header(self, buf):
+        """
+        Parses the vendor boot header from a buffer and computes the section
+        layout. No section data is copied.
+        """
+        if bytes(buf[:len(self.VENDOR_BOOT_MAGIC)]) != self.VENDOR_BOOT_MAGIC:
+            raise ValueError("Invalid vendor boot image: incorrect magic.")
+        if len(buf) < struct.calcsize(self.HEADER_V3_FORMAT):
+            raise ValueError("Invalid vendor boot image header: too short.")
+
+        (_, header_version, page_size, kernel_addr, ramdisk_addr, vendor_ramdisk_size,
+         cmdline, tags_addr, name, header_size, dtb_size,
+         dtb_addr) = struct.unpack_from(self.HEADER_V3_FORMAT, buf, 0)
+
+        if header_version < 3:
+            raise ValueError(f"Unsupported vendor boot header version: {header_version}")
+        if page_size == 0 or page_size & (page_size - 1):
+            raise ValueError(f"Invalid page size in header: {page_size}")
+
+        self.header = {
+            'header_version': header_version,
+            'page_size': page_size,
+            'kernel_addr': kernel_addr,
+            'ramdisk_addr': ramdisk_addr,
+            'vendor_ramdisk_size': vendor_ramdisk_size,
+            'tags_addr': tags_addr,
+            'header_size': header_size,
+            'dtb_size': dtb_size,
+            'dtb_addr': dtb_addr,
+        }
+        self.cmdline = self._cstr(cmdline)
+        self.name = self._cstr(name)
+
+        if header_version >= 4:
+            (table_size, entry_num, entry_size, bootconfig_size) = struct.unpack_from(
+                self.HEADER_V4_FORMAT, buf, struct.calcsize(self.HEADER_V3_FORMAT))
+            self.header.update({
+                'vendor_ramdisk_table_size': table_size,
+                'vendor_ramdisk_table_entry_num': entry_num,
+                'vendor_ramdisk_table_entry_size': entry_size,
+                'bootconfig_size': bootconfig_size,
+            })
+
+        # Sections follow the page-aligned header in this order
+        self.sections = {}
+        offset = _get_padded_size(header_size, page_size)
+        for section, size_key in [('vendor_ramdisk', 'vendor_ramdisk_size'),
+                                  ('dtb', 'dtb_size'),
+                                  ('vendor_ramdisk_table', 'vendor_ramdisk_table_size'),
+                                  ('bootconfig', 'bootconfig_size')]:
+            size = self.header.get(size_key, 0)
+            if size:
+                if offset + size > len(buf):
+                    raise ValueError(f"Section '{section}' extends past the end of the image.")
+                self.sections[section] = (offset, size)
+                offset += _get_padded_size(size, page_size)
+
+        self.ramdisk_table = []
+        if 'vendor_ramdisk_table' in self.sections:
+            self._parse_ramdisk_table(buf)
+
+    def parse(self):
+        """
+        Parses the header, section layout and ramdisk table without
+        extracting anything.
+        """
+        try:
+            with map_file(self.filepath) as view:
+                self._parse_header(view)
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error processing vendor boot image: {e}")
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {self.filepath}")
+        return self.header
+
+    @staticmethod
+    def _fragment_file_name(index, entry):
+        """
+        Returns the output file name for a vendor ramdisk fragment. Characters
+        other than letters, digits, '.', '_' and '-' in the ramdisk name
+        become '_', so the name is a valid file name and table field.
+        """
+        suffix = FRAGMENT_NAME_UNSAFE.sub('_', entry['ramdisk_name']) or f'{index:02d}'
+        return f"vendor_ramdisk_{suffix}"
+
+    @staticmethod
+    def _extract_fragment(view, output_dir, file_name):
+        """
+        Extracts a ramdisk fragment's cpio archive into '<file_name>_root',
+        recording ownership and modes in '<file_name>_fs_config.txt'.
+        """
+        compression, _ = extract_ramdisk(
+            iter_view_chunks(view),
+            os.path.join(output_dir, f'{file_name}_root'),
+            os.path.join(output_dir, f'{file_name}_fs_config.txt'),
+        )
+        with open(os.path.join(output_dir, f'{file_name}_compression'), 'w') as f:
+            f.write(compression)
+
+    def unpack(self, output_dir, extract_ramdisk_files=False):
+        """
+        Extracts every vendor ramdisk fragment, the DTB and bootconfig to the
+        output directory, streaming each one from a memory-mapped view.
+        v3 images, which have no ramdisk table, produce a single
+        'vendor_ramdisk' file.
+
+        With extract_ramdisk_files, each fragment's cpio archive is also
+        decompressed and extracted in-process.
+        """
+        try:
+            with map_file(self.filepath) as view:
+                self._parse_header(view)
+
+                for name in ('dtb', 'bootconfig'):
+                    if name in self.sections:
+                        offset, size = self.sections[name]
+                        with open(os.path.join(output_dir, name), 'wb') as f:
+                            write_view(f, view[offset:offset + size])
+
+                if self.ramdisk_table:
+                    table = []
+                    used_names = set()
+                    for i, entry in enumerate(self.ramdisk_table):
+                        file_name = self._fragment_file_name(i, entry)
+                        if file_name in used_names:
+                            file_name = f'{file_name}_{i:02d}'
+                        used_names.add(file_name)
+                        path = os.path.join(output_dir, file_name)
+                        fragment = view[entry['offset']:entry['offset'] + entry['ramdisk_size']]
+                        with open(path, 'wb') as f:
+                            write_view(f, fragment)
+                        if extract_ramdisk_files and entry['ramdisk_size']:
+                            self._extract_fragment(fragment, output_dir, file_name)
+                        del fragment
+                        table.append(dict(entry, path=path))
+                    write_ramdisk_table(os.path.join(output_dir, VENDOR_RAMDISK_TABLE_FILE), table)
+                elif 'vendor_ramdisk' in self.sections:
+                    offset, size = self.sections['vendor_ramdisk']
+                    with open(os.path.join(output_dir, 'vendor_ramdisk'), 'wb') as f:
+                        write_view(f, view[offset:offset + size])
+                    if extract_ramdisk_files:
+                        self._extract_fragment(view[offset:offset + size], output_dir, 'vendor_ramdisk')
+
+            if self.cmdline:
+                with open(os.path.join(output_dir, 'cmdline'), 'w') as f:
+                    f.write(self.cmdline)
+
+            # Save header info for repacking
+            with open(os.path.join(output_dir, 'header_info.txt'), 'w') as f:
+                for key, value in self.header.items():
+                    f.write(f"{key}:{value}\n")
+                f.write(f"name:{self.name}\n")
+
+        except (ValueError, struct.error) as e:
+            raise RuntimeError(f"Error processing vendor boot image: {e}")
+        except FileNotFoundError:
+            raise RuntimeError(f"Input file not found: {self.filepath}")
+        except IOError as e:
+            raise RuntimeError(f"I/O error: {e}")
@@ -0,0 +1,66 @@
+"""
+A single-pass directory walker. Directories are listed with os.scandir on a
+thread pool, one task per directory, and every file is offered to a set of
+matchers, so several searches of the same tree share one walk.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Directory listing and matching is mostly waiting on the filesystem, so
+# more threads than CPUs pay off
+WALKER_THREADS = 8
+
+def _scan_directory(path, matchers):
+    """
+    Lists one directory and runs the matchers on its files. Returns the
+    subdirectories to descend into and the (name, result) matches. Like
+    os.walk, unreadable directories are skipped and symlinks to directories
+    are not followed.
+    """
+    subdirectories, matches = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                for matcher in matchers:
+                    for result in matcher.match(entry):
+                        matches.append((matcher.name, result))
+    except OSError:
+        pass
+    return subdirectories, matches
+
+def walk_tree(search_path, matchers, on_directory=None, workers=WALKER_THREADS):
+    """
+    Walks a directory tree once and yields (matcher name, result) for every
+    result of every matcher, as directories finish. A matcher has a name
+    and a match(entry) method that takes the os.DirEntry of a file and
+    returns an iterable of results; it runs in a worker thread. Results
+    come in no particular order. on_directory, if given, is called with each
+    directory before it is searched, in the caller's thread; an exception
+    it raises stops the walk.
+    """
+    matchers = list(matchers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walker")
+    pending = set()
+    try:
+        if on_directory is not None:
+            on_directory(search_path)
+        pending.add(pool.submit(_scan_directory, search_path, matchers))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirectories, matches = future.result()
+                yield from matches
+                for path in subdirectories:
+                    if on_directory is not None:
+                        on_directory(path)
+                    pending.add(pool.submit(_scan_directory, path, matchers))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
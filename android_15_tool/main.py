@@ -1,17 +1,34 @@
 import argparse
 import os
+import subprocess
 import sys
+import tempfile
+import time
 
 from android_15_tool.lib.scanner import MagicScanner
 from android_15_tool.lib.unsparse import SparseImage
 from android_15_tool.lib.super_unpacker import SuperUnpacker
 from android_15_tool.lib.erofs_parser import ErofsParser
 from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.vendor_boot import VendorBootImage, VENDOR_RAMDISK_TABLE_FILE, read_ramdisk_table
 from android_15_tool.lib.dtc_handler import DtcHandler
-from android_15_tool.lib.repacker import Repacker
+from android_15_tool.lib.kernel_analyzer import KernelAnalyzer
+from android_15_tool.lib.init_rc import load_rc_index, query_rc_index
+from android_15_tool.lib.modinfo import ModuleIndex
+from android_15_tool.lib.avb import AvbImage, AVB_ALGORITHMS, add_hash_footer, add_hashtree_footer
+from android_15_tool.lib.repacker import Repacker, VendorBootRepacker
+from android_15_tool.lib.ramdisk import build_ramdisk
+from android_15_tool.lib.stream_io import map_file
+from android_15_tool.lib.adb_client import AdbClient
 from android_15_tool.lib.tui.app import TuiApp
+from android_15_tool.device_dumper import (
+    DEVICE_COMPRESSORS, DUMP_RANGE_SIZE, DUMP_WORKERS, differential_dump, dump_partition, dump_partitions,
+    list_partitions,
+)
 
 
+AVB_ALGORITHM_NAMES = [name for name, _, _, _ in AVB_ALGORITHMS.values()]
+
 def handle_tui(args):
     """Handles the 'tui' command."""
     app = TuiApp()
@@ -59,8 +76,18 @@ def handle_extract(args):
         elif 'Android Boot' in image_types:
             print("Handling as a boot/recovery image...")
             boot_image = BootImage(args.file)
-            boot_image.unpack(args.output_dir)
+            boot_image.unpack(args.output_dir, args.extract_ramdisk)
             print(f"Boot image components extracted to {args.output_dir}")
+
+        elif 'Android Vendor Boot' in image_types:
+            print("Handling as a vendor_boot image...")
+            vendor_boot_image = VendorBootImage(args.file)
+            vendor_boot_image.unpack(args.output_dir, args.extract_ramdisk)
+            print(f"Vendor boot image components extracted to {args.output_dir}")
+        elif 'DTBO Table' in image_types:
+            print("Handling as a DT table...")
+            _, entries = DtcHandler().split(args.file, args.output_dir)
+            print(f"{len(entries)} device trees extracted to {args.output_dir}")
         else:
             print("No supported image type found for extraction.")
 
@@ -70,20 +97,196 @@ def handle_extract(args):
 
 def handle_repack(args):
     """Handles the 'repack' command."""
+    built_ramdisk = None
     try:
+        ramdisk = args.ramdisk
+        if args.ramdisk_dir:
+            print(f"Building {args.ramdisk_compression} ramdisk from {args.ramdisk_dir}...")
+            fd, built_ramdisk = tempfile.mkstemp(suffix=".ramdisk", dir=os.path.dirname(os.path.abspath(args.output)))
+            os.close(fd)
+            build_ramdisk(args.ramdisk_dir, built_ramdisk, args.ramdisk_compression, args.ramdisk_fs_config)
+            ramdisk = built_ramdisk
+
         repacker = Repacker(args.output)
-        repacker.repack(args.header_info, args.kernel, args.ramdisk, args.dtb, args.cmdline, args.page_size)
+        repacker.repack(args.header_info, args.kernel, ramdisk, args.dtb, args.cmdline, args.page_size)
         print(f"Image repacked to {args.output}")
 
         if args.avb_key:
             print("Signing with AVB...")
-            repacker.sign_with_avb(args.avb_key)
-            print("AVB signing complete (placeholder).")
+            footer = repacker.sign_with_avb(args.avb_key, args.partition_name, args.partition_size, args.avb_algorithm)
+            print(f"AVB hash footer written ({footer['partition_size']} byte partition).")
+
+    except (RuntimeError, EnvironmentError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if built_ramdisk and os.path.exists(built_ramdisk):
+            os.remove(built_ramdisk)
+
+def handle_patch(args):
+    """Handles the 'patch' command."""
+    try:
+        repacker = Repacker(args.image)
+        mode, changed = repacker.patch(args.kernel, args.ramdisk, args.dtb, args.cmdline,
+                                       signature_path=args.boot_signature, key_path=args.avb_key,
+                                       algorithm=args.avb_algorithm)
+        if mode == 'unchanged':
+            print(f"{args.image} is already up to date.")
+        elif mode == 'in_place':
+            print(f"Patched {', '.join(changed) or 'header'} in place in {args.image}")
+        else:
+            print(f"Layout changed; rebuilt {args.image} with new {', '.join(changed)}")
 
     except (RuntimeError, EnvironmentError) as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
 
+def handle_repack_vendor_boot(args):
+    """Handles the 'repack-vendor-boot' command."""
+    try:
+        if args.ramdisk_table:
+            ramdisks = read_ramdisk_table(args.ramdisk_table)
+        elif args.ramdisk:
+            ramdisks = args.ramdisk
+        else:
+            raise RuntimeError("Either --ramdisk or --ramdisk_table is required.")
+
+        repacker = VendorBootRepacker(args.output)
+        repacker.repack(args.header_info, ramdisks, args.dtb, args.bootconfig, args.cmdline, args.name)
+        print(f"Vendor boot image repacked to {args.output}")
+
+    except (RuntimeError, EnvironmentError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_kernel(args):
+    """Handles the 'kernel' command."""
+    try:
+        analyzer = KernelAnalyzer(use_cache=not args.no_cache)
+        want_config = not args.no_config
+        with open(args.file, 'rb') as f:
+            is_boot_image = f.read(len(BootImage.BOOT_MAGIC)) == BootImage.BOOT_MAGIC
+
+        if is_boot_image:
+            boot_image = BootImage(args.file)
+            boot_image.parse()
+            if 'kernel' not in boot_image.sections:
+                raise RuntimeError(f"{args.file} has no kernel section.")
+            offset, size = boot_image.sections['kernel']
+            with map_file(args.file) as view:
+                result = analyzer.analyze(view[offset:offset + size], want_config)
+        else:
+            result = analyzer.analyze(args.file, want_config)
+
+        print(f"Format: {result['format']}")
+        print(f"Architecture: {result['arch'] or 'unknown'}")
+        print(f"Compression: {result['compression'] or 'none'}")
+        print(f"Version: {result['version'] or 'not found'}")
+        if result['banner']:
+            print(f"Banner: {result['banner']}")
+        if want_config:
+            if result['config']:
+                print(f"Config: {len(result['config'].splitlines())} lines (IKCFG)")
+            else:
+                print("Config: not embedded")
+        print(f"SHA-256: {result['sha256']}{' (cached)' if result['cached'] else ''}")
+
+        if args.config_out:
+            if not result['config']:
+                raise RuntimeError("The kernel has no embedded config to write.")
+            with open(args.config_out, 'w') as f:
+                f.write(result['config'])
+            print(f"Config written to {args.config_out}")
+
+    except (RuntimeError, EnvironmentError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _print_load_order(index, names):
+    order = index.load_order(names)
+    print("Load order:")
+    for i, name in enumerate(order, 1):
+        print(f"{i:4d}. {name} ({index.modules[name]['path']})")
+    missing = index.missing_dependencies(names)
+    if missing:
+        print(f"Missing dependencies (not under the searched path): {', '.join(missing)}")
+
+def handle_modules(args):
+    """Handles the 'modules' command."""
+    try:
+        start = time.monotonic()
+        index = ModuleIndex.build(args.path, use_cache=not args.no_cache)
+        cached = sum(1 for info in index.modules.values() if info['cached'])
+        print(f"Indexed {len(index.modules)} modules in {time.monotonic() - start:.2f}s ({cached} cached)")
+        for path, error in index.unreadable:
+            print(f"Skipped {path}: {error}")
+
+        if args.alias:
+            names = index.find_alias(args.alias)
+            print(f"Modules with an alias matching {args.alias}:")
+        elif args.touchscreen:
+            names = index.touchscreen_modules()
+            print("Touchscreen modules:")
+        elif args.order:
+            names = args.order
+        else:
+            names = sorted(index.modules)
+
+        if not args.order:
+            for name in names:
+                info = index.modules[name]
+                depends = f" [depends: {', '.join(info['depends'])}]" if info['depends'] else ""
+                description = f" - {info['description']}" if info['description'] else ""
+                print(f"- {name}{description}{depends}")
+            if not names:
+                print("No matching modules found.")
+        if names and (args.order or args.alias or args.touchscreen):
+            _print_load_order(index, names)
+    except (RuntimeError, EnvironmentError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_init_rc(args):
+    """Handles the 'init-rc' command."""
+    try:
+        properties = {}
+        for assignment in args.prop or []:
+            name, sep, value = assignment.partition("=")
+            if not sep:
+                raise RuntimeError(f"Expected NAME=VALUE, got '{assignment}'.")
+            properties[name] = value
+        start = time.monotonic()
+        index = load_rc_index(args.tree, properties, use_cache=not args.no_cache)
+        for line in index.summary():
+            print(line)
+        print(f"Loaded in {time.monotonic() - start:.2f}s")
+        for query in args.queries:
+            print()
+            for line in query_rc_index(index, query):
+                print(line)
+    except (RuntimeError, EnvironmentError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _describe_dt_entry(entry):
+    """Formats a DT table entry for display."""
+    text = f"[{entry['index']:02d}] {entry['dtb']}"
+    if entry['id'] is not None:
+        text += f" (id {entry['id']:#x}, rev {entry['rev']:#x})"
+    return text
+
+DT_CHANGE_MARKERS = {'added': '+', 'removed': '-', 'changed': '~'}
+
+def _describe_dt_change(change):
+    """Formats a device tree change for display."""
+    marker = DT_CHANGE_MARKERS[change['change']]
+    if change['property'] is None:
+        return f"  {marker} {change['path']}"
+    if change['change'] == 'changed':
+        return f"  {marker} {change['path']}: {change['property']}: {change['old']} -> {change['new']}"
+    value = change['new'] if change['change'] == 'added' else change['old']
+    return f"  {marker} {change['path']}: {change['property']}" + (f" = {value}" if value else "")
+
 def handle_dtc(args):
     """Handles the 'dtc' command."""
     try:
@@ -94,6 +297,143 @@ def handle_dtc(args):
         elif args.subcommand == "compile":
             handler.compile(args.dts, args.dtb)
             print(f"Compiled {args.dts} to {args.dtb}")
+        elif args.subcommand == "split":
+            kind, entries = handler.split(args.image, args.output_dir)
+            for entry in entries:
+                print(_describe_dt_entry(entry))
+            print(f"Split {len(entries)} device trees ({kind}) to {args.output_dir}")
+        elif args.subcommand == "decompile-all":
+            kind, entries = handler.decompile_all(args.image, args.output_dir, args.workers, not args.no_cache)
+            failed = [entry for entry in entries if 'error' in entry]
+            for entry in entries:
+                status = entry.get('error') or ("cached" if entry['cached'] else "decompiled")
+                print(f"{_describe_dt_entry(entry)}: {status}")
+            print(f"Decompiled {len(entries) - len(failed)} of {len(entries)} device trees ({kind}) to {args.output_dir}")
+            if failed:
+                sys.exit(1)
+        elif args.subcommand == "diff":
+            results = handler.diff(args.old, args.new)
+            identical = True
+            for old_entry, new_entry, changes in results:
+                entry = old_entry or new_entry
+                title = f"[{entry['index']:02d}]"
+                if entry['id'] is not None:
+                    title += f" id {entry['id']:#x}, rev {entry['rev']:#x}"
+                if changes == []:
+                    continue
+                identical = False
+                if changes is None:
+                    print(f"{title}: only in {args.old if new_entry is None else args.new}")
+                    continue
+                print(f"{title}:")
+                for change in changes:
+                    print(_describe_dt_change(change))
+            if identical:
+                print("No differences.")
+
+    except (RuntimeError, EnvironmentError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_dump(args):
+    """Handles the 'dump' command."""
+    try:
+        if args.all == bool(args.partitions):
+            raise RuntimeError("Name the partitions to dump, or pass --all.")
+        if args.staged and (args.all or len(args.partitions) != 1):
+            raise RuntimeError("--staged dumps a single partition.")
+        if args.staged and args.compress:
+            raise RuntimeError("--compress applies to streamed dumps, not --staged.")
+        # Talk to a running ADB server directly; the adb binary is only
+        # needed when there is none (it starts the server itself)
+        client = None if args.adb_binary else AdbClient.available()
+        try:
+            if args.staged:
+                dump_partition(args.partitions[0], args.output_dir, client)
+                return
+            if args.differential or args.since:
+                partitions = list_partitions(client) if args.all else args.partitions
+                results = [differential_dump(partition, args.output_dir, args.since, workers=args.jobs, client=client,
+                                             compression=args.compress)
+                           for partition in partitions]
+            else:
+                results = dump_partitions(None if args.all else args.partitions, args.output_dir,
+                                          args.jobs, args.range_size * 1024 * 1024, client, args.compress)
+        finally:
+            if client is not None:
+                client.close()
+        failed = 0
+        for result in results:
+            if result['error']:
+                failed += 1
+                print(f"{result['partition']}: failed: {result['error']}", file=sys.stderr)
+                continue
+            if result.get('changed_chunks') is not None:
+                detail = (f"{result['changed_chunks']} of {result['chunks']} chunks changed, "
+                          f"{result['pulled']} bytes pulled, {result['clone']}")
+            elif result.get('resumed'):
+                detail = f"{result['resumed']} bytes resumed"
+            else:
+                detail = None
+            print(f"{result['partition']}: {result['path']} ({result['size']} bytes" + (f", {detail})" if detail else ")"))
+            print(f"  SHA-256: {result['sha256']}")
+            if result.get('transferred'):
+                fetched = result['size'] - result['resumed']
+                rate = fetched / (1024 * 1024) / result['elapsed'] if result['elapsed'] else 0
+                print(f"  Transferred: {result['transferred']} bytes (ratio {fetched / result['transferred']:.2f}, "
+                      f"{rate:.1f} MiB/s)")
+        if failed:
+            raise RuntimeError(f"{failed} of {len(results)} partitions failed; run the same command again to resume.")
+
+    except (RuntimeError, EnvironmentError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error: adb failed: {e.stderr}", file=sys.stderr)
+        sys.exit(1)
+
+def handle_avb(args):
+    """Handles the 'avb' command."""
+    try:
+        if args.subcommand in ("add-hash-footer", "add-hashtree-footer"):
+            sign = add_hash_footer if args.subcommand == "add-hash-footer" else add_hashtree_footer
+            try:
+                footer = sign(args.image, args.partition_name, args.key, args.algorithm, args.partition_size)
+            except ValueError as e:
+                raise RuntimeError(f"Error signing image: {e}")
+            print(f"Signed {args.image}: vbmeta at {footer['vbmeta_offset']}, "
+                  f"partition size {footer['partition_size']}")
+            return
+
+        image = AvbImage(args.image)
+        vbmeta = image.parse()
+
+        if args.subcommand == "info":
+            if image.footer:
+                print("Footer:")
+                for key, value in image.footer.items():
+                    print(f"  {key}: {value}")
+            print("VBMeta:")
+            for key, value in vbmeta.header.items():
+                print(f"  {key}: {value}")
+            if vbmeta.public_key_digest:
+                print(f"  public_key_sha1: {vbmeta.public_key_digest}")
+            print("Descriptors:")
+            for descriptor in vbmeta.descriptors:
+                details = {k: (v.hex() if isinstance(v, bytes) and k != 'value' else v)
+                           for k, v in descriptor.items() if k not in ('tag', 'type')}
+                if 'value' in details:
+                    details['value'] = details['value'].rstrip(b'\x00').decode('utf-8', errors='replace')
+                print(f"  {descriptor['type']}: " + ", ".join(f"{k}={v}" for k, v in details.items()))
+
+        elif args.subcommand == "verify":
+            failed = False
+            for check, status, detail in image.verify(args.image_dir):
+                print(f"{check}: {status} ({detail})")
+                failed |= status in ('mismatch', 'missing')
+            if failed:
+                raise RuntimeError("AVB verification failed.")
+            print("AVB verification passed.")
 
     except (RuntimeError, EnvironmentError) as e:
         print(f"Error: {e}", file=sys.stderr)
@@ -112,20 +452,60 @@ def main():
     parser_extract = subparsers.add_parser("extract", help="Extract a firmware or recovery image.")
     parser_extract.add_argument("file", help="The image file to extract.")
     parser_extract.add_argument("output_dir", help="The directory to extract the files to.")
+    parser_extract.add_argument("--extract_ramdisk", action="store_true", help="Also decompress and extract the ramdisk cpio archive(s).")
     parser_extract.set_defaults(func=handle_extract)
 
     # Repack command
     parser_repack = subparsers.add_parser("repack", help="Repack a boot/recovery image.")
     parser_repack.add_argument("--header_info", required=True, help="Path to the header_info.txt file.")
     parser_repack.add_argument("--kernel", required=True, help="Path to the kernel file.")
-    parser_repack.add_argument("--ramdisk", required=True, help="Path to the ramdisk file.")
+    ramdisk_source = parser_repack.add_mutually_exclusive_group(required=True)
+    ramdisk_source.add_argument("--ramdisk", help="Path to the ramdisk file.")
+    ramdisk_source.add_argument("--ramdisk_dir", help="Path to an extracted ramdisk tree to rebuild into a ramdisk.")
+    parser_repack.add_argument("--ramdisk_fs_config", help="fs_config file from extraction, used with --ramdisk_dir to restore modes, owners and device nodes.")
+    parser_repack.add_argument("--ramdisk_compression", default="lz4_legacy", choices=["lz4_legacy", "gzip", "cpio"], help="Compression used with --ramdisk_dir.")
     parser_repack.add_argument("--dtb", help="Path to the DTB file.")
     parser_repack.add_argument("--cmdline", default="", help="Command line arguments for the kernel.")
     parser_repack.add_argument("--output", default="image-new.img", help="Output file path.")
     parser_repack.add_argument("--page_size", type=int, default=4096, help="Page size for alignment.")
     parser_repack.add_argument("--avb_key", help="Path to the AVB signing key.")
+    parser_repack.add_argument("--avb_algorithm", choices=AVB_ALGORITHM_NAMES, help="AVB signing algorithm (defaults to SHA256 with the key's size).")
+    parser_repack.add_argument("--partition_name", default="boot", help="Partition name recorded in the AVB hash descriptor.")
+    parser_repack.add_argument("--partition_size", type=int, help="Size of the target partition; the footer is placed at its end.")
     parser_repack.set_defaults(func=handle_repack)
 
+    # Patch command
+    parser_patch = subparsers.add_parser("patch", help="Replace sections of an existing boot image in place.")
+    parser_patch.add_argument("image", help="The boot/recovery image to patch.")
+    parser_patch.add_argument("--kernel", help="New kernel.")
+    parser_patch.add_argument("--ramdisk", help="New ramdisk.")
+    parser_patch.add_argument("--dtb", help="New DTB (header v2 only).")
+    parser_patch.add_argument("--boot_signature", help="New boot signature (header v4 only).")
+    parser_patch.add_argument("--cmdline", help="New kernel command line.")
+    parser_patch.add_argument("--avb_key", help="Key used to re-sign an AVB-signed image.")
+    parser_patch.add_argument("--avb_algorithm", choices=AVB_ALGORITHM_NAMES, help="AVB signing algorithm (defaults to SHA256 with the key's size).")
+    parser_patch.set_defaults(func=handle_patch)
+
+    # Repack vendor_boot command
+    parser_repack_vendor = subparsers.add_parser("repack-vendor-boot", help="Repack a vendor_boot image.")
+    parser_repack_vendor.add_argument("--header_info", required=True, help="Path to the header_info.txt file.")
+    parser_repack_vendor.add_argument("--ramdisk", help="Path to a single vendor ramdisk (v3).")
+    parser_repack_vendor.add_argument("--ramdisk_table", help=f"Path to the {VENDOR_RAMDISK_TABLE_FILE} file listing the ramdisk fragments (v4).")
+    parser_repack_vendor.add_argument("--dtb", help="Path to the DTB file.")
+    parser_repack_vendor.add_argument("--bootconfig", help="Path to the bootconfig file (v4).")
+    parser_repack_vendor.add_argument("--cmdline", help="Vendor command line arguments for the kernel (defaults to the unpacked cmdline file).")
+    parser_repack_vendor.add_argument("--name", help="Board name (defaults to the one in the header info).")
+    parser_repack_vendor.add_argument("--output", default="vendor_boot-new.img", help="Output file path.")
+    parser_repack_vendor.set_defaults(func=handle_repack_vendor_boot)
+
+    # Kernel command
+    parser_kernel = subparsers.add_parser("kernel", help="Show the version, compression and config of a kernel or boot image.")
+    parser_kernel.add_argument("file", help="A kernel image (Image, Image.gz, Image.lz4, zImage) or a boot image.")
+    parser_kernel.add_argument("--config_out", help="Write the embedded kernel config to this file.")
+    parser_kernel.add_argument("--no_config", action="store_true", help="Stop at the version banner without looking for the config.")
+    parser_kernel.add_argument("--no_cache", action="store_true", help="Do not read or write the result cache.")
+    parser_kernel.set_defaults(func=handle_kernel)
+
     # DTC command
     parser_dtc = subparsers.add_parser("dtc", help="Decompile or recompile a Device Tree Blob.")
     dtc_subparsers = parser_dtc.add_subparsers(dest="subcommand", required=True)
@@ -137,8 +517,74 @@ def main():
     parser_compile = dtc_subparsers.add_parser("compile", help="Compile a .dts to a .dtb file.")
     parser_compile.add_argument("dts", help="Path to the input .dts file.")
     parser_compile.add_argument("dtb", help="Path to the output .dtb file.")
+
+    parser_split = dtc_subparsers.add_parser("split", help="Split a dtbo.img/dtb.img DT table, or concatenated DTBs, into .dtb files.")
+    parser_split.add_argument("image", help="Path to a DT table image or a file with appended DTBs.")
+    parser_split.add_argument("output_dir", help="Directory to write the .dtb files to.")
+
+    parser_decompile_all = dtc_subparsers.add_parser("decompile-all", help="Split an image and decompile every DTB in parallel.")
+    parser_decompile_all.add_argument("image", help="Path to a DT table image or a file with appended DTBs.")
+    parser_decompile_all.add_argument("output_dir", help="Directory to write the .dtb and .dts files to.")
+    parser_decompile_all.add_argument("--workers", type=int, help="Number of worker processes (defaults to the CPU count).")
+    parser_decompile_all.add_argument("--no_cache", action="store_true", help="Do not read or write the result cache.")
+
+    parser_diff = dtc_subparsers.add_parser("diff", help="Compare the device trees of two DTBs or DT table images.")
+    parser_diff.add_argument("old", help="Path to the old .dtb, dtbo.img or file with appended DTBs.")
+    parser_diff.add_argument("new", help="Path to the new .dtb, dtbo.img or file with appended DTBs.")
     parser_dtc.set_defaults(func=handle_dtc)
 
+    # AVB command
+    parser_avb = subparsers.add_parser("avb", help="Inspect or verify Android Verified Boot metadata.")
+    avb_subparsers = parser_avb.add_subparsers(dest="subcommand", required=True)
+
+    parser_avb_info = avb_subparsers.add_parser("info", help="Print the AVB footer, vbmeta header and descriptors.")
+    parser_avb_info.add_argument("image", help="Path to a partition image with an AVB footer, or a vbmeta image.")
+
+    parser_avb_verify = avb_subparsers.add_parser("verify", help="Verify the vbmeta signature and partition digests.")
+    parser_avb_verify.add_argument("image", help="Path to a partition image with an AVB footer, or a vbmeta image.")
+    parser_avb_verify.add_argument("--image_dir", help="Directory holding the <partition>.img files referenced by the vbmeta (defaults to the image's directory).")
+
+    for name, kind in (("add-hash-footer", "a hash"), ("add-hashtree-footer", "a dm-verity hashtree")):
+        parser_avb_sign = avb_subparsers.add_parser(name, help=f"Sign an image in place with {kind} footer.")
+        parser_avb_sign.add_argument("image", help="Path to the image to sign.")
+        parser_avb_sign.add_argument("--partition_name", required=True, help="Partition name recorded in the descriptor.")
+        parser_avb_sign.add_argument("--key", help="RSA private key in PEM form (unsigned if omitted).")
+        parser_avb_sign.add_argument("--algorithm", choices=AVB_ALGORITHM_NAMES, help="Signing algorithm (defaults to SHA256 with the key's size).")
+        parser_avb_sign.add_argument("--partition_size", type=int, help="Size of the target partition; the footer is placed at its end.")
+    parser_avb.set_defaults(func=handle_avb)
+
+    # Dump command
+    parser_dump = subparsers.add_parser("dump", help="Dump partitions from a rooted device over adb.")
+    parser_dump.add_argument("partitions", nargs="*", help="Partition names under /dev/block/by-name (e.g. boot vendor_boot).")
+    parser_dump.add_argument("output_dir", help="Directory to save the <partition>.img files to.")
+    parser_dump.add_argument("--all", action="store_true", help="Dump every partition under /dev/block/by-name.")
+    parser_dump.add_argument("--jobs", type=int, default=DUMP_WORKERS, help=f"Maximum number of concurrent adb streams (default {DUMP_WORKERS}).")
+    parser_dump.add_argument("--range_size", type=int, default=DUMP_RANGE_SIZE // (1024 * 1024), help="Size in MiB of the ranges a partition is read in; completed ranges are kept when a dump is resumed.")
+    parser_dump.add_argument("--differential", action="store_true", help="Only fetch the chunks whose hash changed since the dump already in output_dir.")
+    parser_dump.add_argument("--since", metavar="PREVIOUS_DIR", help="Like --differential, comparing with (and cloning) the dump in PREVIOUS_DIR.")
+    parser_dump.add_argument("--adb_binary", action="store_true", help="Run the adb binary for every command instead of talking to the ADB server directly.")
+    parser_dump.add_argument("--compress", choices=sorted(DEVICE_COMPRESSORS), help="Compress the streams on the device (gzip, or an lz4 in the PATH or /data/local/tmp) and decompress them on the host.")
+    parser_dump.add_argument("--staged", action="store_true", help="Copy a single partition to /data/local/tmp and pull it instead of streaming it.")
+    parser_dump.set_defaults(func=handle_dump)
+
+    # Modules command
+    parser_modules = subparsers.add_parser("modules", help="Index the kernel modules (.ko) under a directory by their modinfo.")
+    parser_modules.add_argument("path", help="Directory to search for .ko files, such as an extracted vendor or vendor_dlkm.")
+    modules_query = parser_modules.add_mutually_exclusive_group()
+    modules_query.add_argument("--alias", help="Show the modules with an alias matching this pattern (e.g. 'i2c:*touch*') and their load order.")
+    modules_query.add_argument("--touchscreen", action="store_true", help="Show the touchscreen modules and their load order.")
+    modules_query.add_argument("--order", nargs="+", metavar="MODULE", help="Show the load order of these modules and their dependencies.")
+    parser_modules.add_argument("--no_cache", action="store_true", help="Do not read or write the result cache.")
+    parser_modules.set_defaults(func=handle_modules)
+
+    # Init-rc command
+    parser_init_rc = subparsers.add_parser("init-rc", help="Parse the init .rc scripts of an extracted firmware tree and query its services and triggers.")
+    parser_init_rc.add_argument("tree", help="Root of the extracted tree, holding system/, vendor/, odm/ and so on.")
+    parser_init_rc.add_argument("queries", nargs="*", help="Triggers (e.g. post-fs-data) or service names to look up.")
+    parser_init_rc.add_argument("--prop", action="append", metavar="NAME=VALUE", help="Set a property used in ${...} references, such as ro.hardware, which is not in build.prop. May be repeated.")
+    parser_init_rc.add_argument("--no_cache", action="store_true", help="Do not read or write the index cache.")
+    parser_init_rc.set_defaults(func=handle_init_rc)
+
     # TUI command
     parser_tui = subparsers.add_parser("tui", help="Launch the interactive TUI.")
     parser_tui.set_defaults(func=handle_tui)
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import socketserver
+import struct
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from android_15_tool.device_dumper import DD_BLOCK_SIZE, dump_partitions
+from android_15_tool.lib.adb_client import AdbClient
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _okay(payload=None):
+    if payload is None:
+        return b'OKAY'
+    return b'OKAY' + f"{len(payload):04x}".encode() + payload
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    """Answers host, exec:, shell,v2,raw: and sync: requests for one device."""
+
+    def handle(self):
+        server, sock = self.server, self.request
+        server.connections += 1
+        while True:
+            header = _recv_exact(sock, 4)
+            if header is None:
+                return
+            request = _recv_exact(sock, int(header, 16)).decode()
+            server.requests.append(request)
+            if request == 'host:version':
+                sock.sendall(_okay(b'0029'))
+                return
+            if request == 'host:devices':
+                sock.sendall(_okay(b'FAKE123\tdevice\n'))
+                return
+            if request.startswith('host:transport'):
+                if request not in ('host:transport-any', 'host:transport:FAKE123'):
+                    sock.sendall(b'FAIL' + b'000e' + b'no such device')
+                    return
+                sock.sendall(_okay())
+            elif request.startswith('exec:'):
+                sock.sendall(_okay() + server.exec(request[len('exec:'):]))
+                return
+            elif request.startswith('shell,v2,raw:'):
+                code, out, err = server.shell(request[len('shell,v2,raw:'):])
+                sock.sendall(_okay() + struct.pack('<BI', 1, len(out)) + out + struct.pack('<BI', 2, len(err)) + err
+                             + struct.pack('<BI', 3, 1) + bytes([code]))
+                return
+            elif request == 'sync:':
+                sock.sendall(_okay())
+                self.sync(sock)
+                return
+
+    def sync(self, sock):
+        while True:
+            header = _recv_exact(sock, 8)
+            if header is None:
+                return
+            request, length = struct.unpack('<4sI', header)
+            path = _recv_exact(sock, length).decode() if length else ''
+            data = self.server.files.get(path)
+            if request == b'QUIT':
+                return
+            if request == b'STAT':
+                sock.sendall(struct.pack('<4sIII', b'STAT', 0o100644 if data is not None else 0,
+                                         len(data or b''), 1700000000))
+            elif request == b'RECV':
+                if data is None:
+                    message = b'No such file or directory'
+                    sock.sendall(struct.pack('<4sI', b'FAIL', len(message)) + message)
+                    return
+                for offset in range(0, len(data), 65536):
+                    chunk = data[offset:offset + 65536]
+                    sock.sendall(struct.pack('<4sI', b'DATA', len(chunk)) + chunk)
+                sock.sendall(struct.pack('<4sI', b'DONE', 0))
+
+
+@pytest.fixture
+def adb_server():
+    """Runs a fake ADB server on a free local port."""
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeAdbHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    server.files = {}
+    server.exec = lambda command: b''
+    server.shell = lambda command: (0, b'', b'')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_host_and_shell_requests(adb_server):
+    """Host queries and shell commands are answered without an adb process."""
+    adb_server.shell = lambda command: (3, b'out:' + command.encode(), b'oops')
+    client = AdbClient(port=adb_server.server_address[1])
+    assert client.version() == 0x29
+    assert client.devices() == [('FAKE123', 'device')]
+    assert client.shell('ls /') == (3, b'out:ls /', b'oops')
+    assert adb_server.requests[-2:] == ['host:transport-any', 'shell,v2,raw:ls /']
+
+    with pytest.raises(RuntimeError, match='no such device'):
+        AdbClient('OTHER', port=adb_server.server_address[1]).shell('true')
+    assert AdbClient.available(port=adb_server.server_address[1]) is not None
+
+
+def test_exec_streams_binary_data(adb_server):
+    """exec: output is returned byte for byte, with no text decoding."""
+    data = os.urandom(3 * 1024 * 1024 + 5)
+    adb_server.exec = lambda command: data
+    client = AdbClient('FAKE123', port=adb_server.server_address[1])
+    assert client.exec_out('cat /dev/block/by-name/boot') == data
+
+
+def test_sync_connections_are_reused(tmpdir, adb_server):
+    """Pulls and stats share one pooled sync connection."""
+    adb_server.files = {'/sdcard/a.bin': os.urandom(200000), '/sdcard/b.bin': b'small'}
+    with AdbClient(port=adb_server.server_address[1]) as client:
+        for name in ('a.bin', 'b.bin'):
+            with open(tmpdir.join(name), 'wb') as f:
+                assert client.pull(f'/sdcard/{name}', f) == len(adb_server.files[f'/sdcard/{name}'])
+            with open(tmpdir.join(name), 'rb') as f:
+                assert f.read() == adb_server.files[f'/sdcard/{name}']
+        assert client.stat('/sdcard/b.bin')[1] == 5
+        assert adb_server.connections == 1
+
+        with open(os.devnull, 'wb') as f, pytest.raises(RuntimeError, match='No such file'):
+            client.pull('/sdcard/missing', f)
+
+
+def test_dump_partitions_over_client(tmpdir, adb_server):
+    """A partition dump runs entirely over the ADB server protocol."""
+    image = os.urandom(2 * DD_BLOCK_SIZE + 17)
+
+    def exec_dd(command):
+        m = re.search(r'bs=(\d+) skip=(\d+) count=(\d+)', command)
+        bs, skip, count = (int(g) for g in m.groups())
+        return image[skip * bs:(skip + count) * bs]
+
+    adb_server.exec = exec_dd
+    adb_server.shell = lambda command: (0, f'{len(image)}\n'.encode(), b'')
+    output_dir = str(tmpdir.join("out"))
+    with patch('subprocess.Popen', side_effect=AssertionError), patch('subprocess.run', side_effect=AssertionError):
+        with AdbClient(port=adb_server.server_address[1]) as client:
+            result = dump_partitions(['boot'], output_dir, workers=2, range_size=DD_BLOCK_SIZE, client=client)[0]
+    assert result['error'] is None
+    assert result['sha256'] == hashlib.sha256(image).hexdigest()
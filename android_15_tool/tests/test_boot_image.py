@@ -0,0 +1,189 @@
+import os
+import struct
+import pytest
+
+from android_15_tool.lib.boot_image import BootImage, _get_padded_size, decode_os_version
+from android_15_tool.lib.repacker import Repacker
+from android_15_tool.lib.stream_io import map_file
+
+
+def _write_sections(f, page_size, sections):
+    """Writes each section at the next page-aligned offset after the header page."""
+    offset = page_size
+    for data in sections:
+        f.seek(offset)
+        f.write(data)
+        offset += _get_padded_size(len(data), page_size)
+
+
+@pytest.fixture
+def boot_v2_image(tmpdir):
+    """Creates a v2 boot image with a non-default page size and every section."""
+    page_size = 2048
+    kernel, ramdisk, second = b'K' * 3000, b'R' * 100, b'S' * 10
+    recovery_dtbo, dtb = b'O' * 20, b'D' * 30
+    os_version = (15 << 25) | ((2024 - 2000) << 4) | 8
+
+    header = struct.pack(
+        BootImage.HEADER_V0_FORMAT,
+        BootImage.BOOT_MAGIC,
+        len(kernel), 0x8000, len(ramdisk), 0x1000000, len(second), 0xf00000,
+        0x100, page_size, 2, os_version,
+        b'test', b'console=ttyMSM0', b'\x00' * 32, b' androidboot.hardware=qcom',
+    )
+    header += struct.pack(BootImage.HEADER_V1_FORMAT, len(recovery_dtbo), 0, 1660)
+    header += struct.pack(BootImage.HEADER_V2_FORMAT, len(dtb), 0x1f00000)
+
+    path = tmpdir.join("boot_v2.img")
+    with open(path, 'wb') as f:
+        f.write(header)
+        _write_sections(f, page_size, [kernel, ramdisk, second, recovery_dtbo, dtb])
+    return str(path), {'kernel': kernel, 'ramdisk': ramdisk, 'second': second,
+                       'recovery_dtbo': recovery_dtbo, 'dtb': dtb}
+
+
+@pytest.fixture
+def boot_v4_image(tmpdir):
+    """Creates a v4 boot image with a boot signature section."""
+    kernel, ramdisk, signature = b'K' * 5000, b'R' * 10, b'G' * 16
+    header = struct.pack(
+        BootImage.HEADER_V3_FORMAT,
+        BootImage.BOOT_MAGIC, len(kernel), len(ramdisk), 0, 1584,
+        0, 0, 0, 0, 4, b'console=ttyS0',
+    )
+    header += struct.pack(BootImage.HEADER_V4_FORMAT, len(signature))
+
+    path = tmpdir.join("boot_v4.img")
+    with open(path, 'wb') as f:
+        f.write(header)
+        _write_sections(f, 4096, [kernel, ramdisk, signature])
+    return str(path), {'kernel': kernel, 'ramdisk': ramdisk, 'boot_signature': signature}
+
+
+def test_unpack_v2_uses_header_page_size(boot_v2_image, tmpdir):
+    """Sections of a v2 image are located using the page size from the header."""
+    path, expected = boot_v2_image
+    output_dir = tmpdir.mkdir("out_v2")
+
+    boot_image = BootImage(path)
+    boot_image.unpack(str(output_dir))
+
+    assert boot_image.header['page_size'] == 2048
+    assert boot_image.cmdline == 'console=ttyMSM0 androidboot.hardware=qcom'
+    assert boot_image.name == 'test'
+    for name, data in expected.items():
+        with open(os.path.join(output_dir, name), 'rb') as f:
+            assert f.read() == data
+    with open(os.path.join(output_dir, 'cmdline')) as f:
+        assert f.read() == boot_image.cmdline
+
+
+def test_unpack_v4_extracts_boot_signature(boot_v4_image, tmpdir):
+    """A v4 image exposes its boot signature as a separate section."""
+    path, expected = boot_v4_image
+    output_dir = tmpdir.mkdir("out_v4")
+
+    BootImage(path).unpack(str(output_dir))
+
+    for name, data in expected.items():
+        with open(os.path.join(output_dir, name), 'rb') as f:
+            assert f.read() == data
+    with open(os.path.join(output_dir, 'header_info.txt')) as f:
+        assert "signature_size:16" in f.read()
+
+
+def test_truncated_image_is_rejected(boot_v4_image, tmpdir):
+    """A section that runs past the end of the file is an error."""
+    path, _ = boot_v4_image
+    with open(path, 'r+b') as f:
+        f.truncate(4096 + 100)
+
+    with pytest.raises(RuntimeError):
+        BootImage(path).parse()
+
+
+def test_decode_os_version():
+    """The packed os_version field decodes to a version and patch level."""
+    packed = (((15 << 14) | (0 << 7) | 0) << 11) | ((2024 - 2000) << 4) | 8
+    assert decode_os_version(packed) == ("15.0.0", "2024-08")
+
+
+def test_repack_v2_from_mapped_sections(boot_v2_image, tmpdir):
+    """Sections taken as memoryviews, file objects and paths repack into an equivalent v2 image."""
+    path, expected = boot_v2_image
+    boot_image = BootImage(path)
+    boot_image.unpack(str(tmpdir.mkdir("out")))
+    output = str(tmpdir.join("repacked.img"))
+
+    with map_file(path) as view, open(tmpdir.join("out", "ramdisk"), 'rb') as ramdisk:
+        def section(name):
+            offset, size = boot_image.sections[name]
+            return view[offset:offset + size]
+
+        Repacker(output).repack(
+            str(tmpdir.join("out", "header_info.txt")), section('kernel'), ramdisk,
+            dtb_path=str(tmpdir.join("out", "dtb")), cmdline=boot_image.cmdline,
+            second_path=section('second'), recovery_dtbo_path=section('recovery_dtbo'), name='test')
+
+    repacked = BootImage(output)
+    repacked.unpack(str(tmpdir.mkdir("out2")))
+    # The fixture leaves recovery_dtbo_offset unset; a repack fills it in
+    assert repacked.header.pop('recovery_dtbo_offset') == repacked.sections['recovery_dtbo'][0]
+    boot_image.header.pop('recovery_dtbo_offset')
+    assert repacked.header == boot_image.header
+    assert repacked.cmdline == boot_image.cmdline
+    assert repacked.name == 'test'
+    assert os.path.getsize(output) % 2048 == 0
+    for name, data in expected.items():
+        with open(tmpdir.join("out2", name), 'rb') as f:
+            assert f.read() == data
+
+    # The board name must leave room for its terminating NUL
+    with pytest.raises(RuntimeError, match="name is too long"):
+        Repacker(output).repack(str(tmpdir.join("out", "header_info.txt")), expected['kernel'],
+                                expected['ramdisk'], name='\u00e9' * 8)
+
+
+def test_repack_v4_with_signature(boot_v4_image, tmpdir):
+    """A v4 repack keeps the header fields and boot signature, and rejects a DTB."""
+    path, expected = boot_v4_image
+    boot_image = BootImage(path)
+    boot_image.unpack(str(tmpdir.mkdir("out")))
+    header_info = str(tmpdir.join("out", "header_info.txt"))
+    output = str(tmpdir.join("repacked.img"))
+
+    Repacker(output).repack(header_info, expected['kernel'], expected['ramdisk'], cmdline='console=ttyS0',
+                            signature_path=str(tmpdir.join("out", "boot_signature")))
+
+    repacked = BootImage(output)
+    assert repacked.parse() == boot_image.header
+    assert repacked.sections == boot_image.sections
+    with pytest.raises(RuntimeError):
+        Repacker(output).repack(header_info, expected['kernel'], expected['ramdisk'], dtb_path=path)
+
+
+def test_patch_in_place_and_full(boot_v4_image, tmpdir):
+    """A kernel that fits its slot is patched in place; a larger one rebuilds the image."""
+    path, expected = boot_v4_image
+    original = BootImage(path)
+    original.parse()
+
+    repacker = Repacker(path)
+    assert repacker.patch(kernel_path=expected['kernel']) == ('unchanged', [])
+
+    assert repacker.patch(kernel_path=b'k' * 6000) == ('in_place', ['kernel'])
+    patched = BootImage(path)
+    patched.unpack(str(tmpdir.mkdir("in_place")))
+    assert patched.sections['ramdisk'] == original.sections['ramdisk']
+    with open(tmpdir.join("in_place", "kernel"), 'rb') as f:
+        assert f.read() == b'k' * 6000
+    with open(tmpdir.join("in_place", "boot_signature"), 'rb') as f:
+        assert f.read() == expected['boot_signature']
+
+    assert repacker.patch(kernel_path=b'K' * 9000, cmdline='quiet') == ('full', ['kernel'])
+    patched = BootImage(path)
+    patched.unpack(str(tmpdir.mkdir("full")))
+    assert patched.cmdline == 'quiet'
+    for name, data in [('kernel', b'K' * 9000), ('ramdisk', expected['ramdisk'])]:
+        with open(tmpdir.join("full", name), 'rb') as f:
+            assert f.read() == data
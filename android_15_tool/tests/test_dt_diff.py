@@ -0,0 +1,97 @@
+import struct
+
+from android_15_tool.lib.dt_diff import DtIndex, diff_images, diff_trees
+from android_15_tool.lib.dt_table import DT_TABLE_MAGIC
+from android_15_tool.lib.fdt import Fdt
+
+OLD_DTS = """
+/dts-v1/;
+/ {
+	gpio: gpio@100 { gpio-controller; };
+	soc {
+		touch@20 {
+			reset-gpios = <&gpio 5 0>;
+			status = "okay";
+		};
+		old-sensor { compatible = "vendor,old"; };
+	};
+};
+"""
+
+# A new node with a label comes first, so every phandle is renumbered
+NEW_DTS = """
+/dts-v1/;
+/ {
+	clk: clock { #clock-cells = <0>; };
+	gpio: gpio@100 { gpio-controller; };
+	soc {
+		touch@20 {
+			reset-gpios = <&gpio 5 0>;
+			clocks = <&clk>;
+			status = "disabled";
+		};
+	};
+};
+"""
+
+
+def _index(dts):
+    return DtIndex(Fdt.from_bytes(Fdt.from_dts(dts).to_dtb()))
+
+
+def test_diff_ignores_renumbered_phandles():
+    """Only real changes are reported; references compare by the path they point at."""
+    old, new = _index(OLD_DTS), _index(NEW_DTS)
+    assert old.properties['/soc/touch@20']['reset-gpios'] == '<&{/gpio@100} 0x05 0x00>'
+    assert old.subtree_hash['/gpio@100'] == new.subtree_hash['/gpio@100']
+
+    changes = diff_trees(old, new)
+    assert [(c['change'], c['path'], c['property']) for c in changes] == [
+        ('added', '/clock', None),
+        ('removed', '/soc/old-sensor', None),
+        ('added', '/soc/touch@20', 'clocks'),
+        ('changed', '/soc/touch@20', 'status'),
+    ]
+    assert changes[2]['new'] == '<&{/clock}>'
+    assert changes[3]['old'] == '"okay"' and changes[3]['new'] == '"disabled"'
+    assert diff_trees(old, _index(OLD_DTS)) == []
+
+
+def test_specifier_arguments_are_not_references():
+    """Without fixups, only the first cell of each specifier is taken as a phandle."""
+    index = _index("""
+/dts-v1/;
+/ {
+	gpio: gpio@100 { gpio-controller; #gpio-cells = <2>; };
+	pmic: pmic { };
+	touch { reset-gpios = <&gpio 1 0>, <&gpio 2 1>; vdd-supply = <&pmic>; };
+};
+""")
+    assert index.properties['/touch']['reset-gpios'] == '<&{/gpio@100} 0x01 0x00 &{/gpio@100} 0x02 0x01>'
+    assert index.properties['/touch']['vdd-supply'] == '<&{/pmic}>'
+
+
+def _overlay(value):
+    return Fdt.from_dts(f'/dts-v1/;\n/plugin/;\n&touch {{ panel {{ value = <{value}>; }}; }};\n').to_dtb()
+
+
+def _dt_table(entries):
+    offset = 32 + 32 * len(entries)
+    table, payload = b'', b''
+    for dt_id, blob in entries:
+        table += struct.pack('>8I', len(blob), offset + len(payload), dt_id, 0, 0, 0, 0, 0)
+        payload += blob
+    header = struct.pack('>8I', DT_TABLE_MAGIC, offset + len(payload), 32, 32, len(entries), 32, 2048, 0)
+    return header + table + payload
+
+
+def test_diff_dt_tables():
+    """DT table entries are paired by id, whatever their order."""
+    old = _dt_table([(1, _overlay(1)), (2, _overlay(2)), (3, _overlay(3))])
+    new = _dt_table([(2, _overlay(2)), (1, _overlay(10)), (4, _overlay(4))])
+
+    results = {(o and o['id'], n and n['id']): changes for o, n, changes in diff_images(old, new)}
+    assert results[(2, 2)] == []
+    assert [(c['path'], c['old'], c['new']) for c in results[(1, 1)]] == [
+        ('/fragment@0/__overlay__/panel', '<0x01>', '<0x0a>')]
+    assert results[(3, None)] is None and results[(None, 4)] is None
@@ -0,0 +1,74 @@
+import struct
+import zlib
+
+import pytest
+
+from android_15_tool.lib.dt_table import DT_TABLE_MAGIC, list_dtbs, parse_dt_table, split_dtbs
+from android_15_tool.lib.dtc_handler import DtcHandler
+from android_15_tool.lib.fdt import Fdt
+
+
+def _overlay(n):
+    return Fdt.from_dts(f'/dts-v1/;\n/plugin/;\n&soc {{ board-{n} {{ value = <{n}>; }}; }};\n').to_dtb()
+
+
+def _dt_table(blobs, version=0, compression=0):
+    """Packs blobs into a DT table, one entry per blob with id 0x100+i and rev i."""
+    header_size, entry_size = 32, 32
+    offset = header_size + entry_size * len(blobs)
+    entries, payload = b'', b''
+    for i, blob in enumerate(blobs):
+        if compression:
+            blob = zlib.compress(blob)
+        first_custom = compression if version else 0xc0
+        entries += struct.pack('>8I', len(blob), offset + len(payload), 0x100 + i, i, first_custom, 1, 2, 3)
+        payload += blob
+    header = struct.pack('>8I', DT_TABLE_MAGIC, offset + len(payload), header_size, entry_size,
+                         len(blobs), header_size, 2048, version)
+    return header + entries + payload
+
+
+def test_parse_dt_table():
+    """Entries carry their id, rev and custom fields, and v1 entries are decompressed."""
+    blobs = [_overlay(n) for n in range(3)]
+    header, entries = parse_dt_table(_dt_table(blobs))
+    assert header['dt_entry_count'] == 3 and header['page_size'] == 2048
+    assert [(e['id'], e['rev'], e['custom']) for e in entries] == [
+        (0x100, 0, [0xc0, 1, 2, 3]), (0x101, 1, [0xc0, 1, 2, 3]), (0x102, 2, [0xc0, 1, 2, 3])]
+
+    kind, entries = list_dtbs(_dt_table(blobs, version=1, compression=1))
+    assert kind == 'dt_table'
+    assert entries[2]['compression'] == 'zlib' and entries[2]['custom'] == [1, 2, 3]
+    assert [bytes(e['data']) for e in entries] == blobs
+
+    with pytest.raises(ValueError):
+        parse_dt_table(_dt_table(blobs)[:100])
+
+
+def test_split_concatenated_dtbs():
+    """DTBs appended to a kernel are found by their headers; stray magics are skipped."""
+    blobs = [_overlay(n) for n in range(2)]
+    data = b'\x1f\x8b' + b'K' * 1000 + b'\xd0\x0d\xfe\xed junk' + blobs[0] + blobs[1]
+    offset = 1002 + 9
+    assert split_dtbs(memoryview(data)) == [(offset, len(blobs[0])), (offset + len(blobs[0]), len(blobs[1]))]
+    kind, entries = list_dtbs(data)
+    assert kind == 'concatenated' and [bytes(e['data']) for e in entries] == blobs
+
+
+def test_decompile_all_uses_cache(tmpdir):
+    """Every entry is decompiled in the worker pool, and a second run is served from the cache."""
+    image = str(tmpdir.join("dtbo.img"))
+    with open(image, 'wb') as f:
+        f.write(_dt_table([_overlay(n) for n in range(4)] + [b'\xd0\x0d\xfe\xed' + b'\x00' * 60]))
+    cache_dir = str(tmpdir.join("cache"))
+
+    kind, entries = DtcHandler().decompile_all(image, str(tmpdir.join("out")), workers=2, cache_dir=cache_dir)
+    assert kind == 'dt_table'
+    assert [e['cached'] for e in entries] == [False] * 5
+    assert 'error' in entries[4] and 'dts' not in entries[4]
+    with open(entries[3]['dts']) as f:
+        assert 'value = <0x03>;' in f.read()
+    assert entries[3]['dts'] == str(tmpdir.join("out", "dtbo.03.dts"))
+
+    _, entries = DtcHandler().decompile_all(image, str(tmpdir.join("out2")), workers=2, cache_dir=cache_dir)
+    assert [e['cached'] for e in entries] == [True] * 4 + [False]
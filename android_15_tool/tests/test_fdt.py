@@ -0,0 +1,146 @@
+import struct
+
+import pytest
+
+from android_15_tool.lib.dtc_handler import DtcHandler
+from android_15_tool.lib.fdt import Fdt, FDT_MAGIC
+
+BASE_DTS = """
+/dts-v1/;
+
+/memreserve/ 0x80000000 0x100000;
+
+/ {
+	model = "Test Board";
+	compatible = "vendor,board", "vendor,soc";
+	#address-cells = <1>;
+	#size-cells = <1>;
+
+	intc: interrupt-controller@1000 {
+		reg = <0x1000 0x100>;
+		interrupt-controller;
+	};
+
+	soc {
+		/* a comment */
+		uart0: serial@2000 {
+			reg = <0x2000 (0x10 * 2)>;
+			interrupt-parent = <&intc>;
+			mac = [00 11 22 33 44 55];
+			small = /bits/ 16 <0x1234 0xfffe>;
+			alias-path = &intc;
+		};
+	};
+};
+
+&uart0 {
+	status = "okay";
+};
+"""
+
+OVERLAY_DTS = """
+/dts-v1/;
+/plugin/;
+
+&uart0 {
+	dmas = <&dma 1>, <&local 2>;
+
+	local: child {
+		val = <7>;
+	};
+};
+"""
+
+
+def test_compile_and_read_back():
+    """A DTS with labels, references and expressions compiles to a DTB that parses back identically."""
+    dtb = Fdt.from_dts(BASE_DTS).to_dtb()
+    assert struct.unpack_from('>I', dtb)[0] == FDT_MAGIC
+
+    fdt = Fdt.from_bytes(dtb)
+    assert fdt.memreserve == [(0x80000000, 0x100000)]
+    assert fdt.root.get('compatible') == b'vendor,board\x00vendor,soc\x00'
+
+    uart = fdt.find('/soc/serial@2000')
+    assert uart.properties['reg'].as_cells() == [0x2000, 0x20]
+    assert uart.get('mac') == bytes.fromhex('001122334455')
+    assert uart.get('small') == b'\x12\x34\xff\xfe'
+    assert uart.get('status') == b'okay\x00'
+    assert uart.get('alias-path') == b'/interrupt-controller@1000\x00'
+
+    intc = fdt.find('/interrupt-controller')
+    assert fdt.phandles[uart.properties['interrupt-parent'].as_cells()[0]] is intc
+    assert fdt.find('/__symbols__').properties['uart0'].as_strings() == ['/soc/serial@2000']
+
+    assert fdt.to_dtb() == dtb
+
+
+def test_dts_round_trip():
+    """Decompiled output compiles back to the same blob, with labels restored from __symbols__."""
+    dtb = Fdt.from_dts(BASE_DTS).to_dtb()
+    dts = Fdt.from_bytes(dtb).to_dts()
+    assert 'uart0: serial@2000 {' in dts
+    assert '\tcompatible = "vendor,board", "vendor,soc";' in dts
+    assert '\t\t\tmac = [00 11 22 33 44 55];' in dts
+    assert '\t\tinterrupt-controller;' in dts
+
+    assert Fdt.from_dts(dts).to_dtb() == dtb
+
+
+def test_overlay_fixups():
+    """Overlay references produce fragments, __fixups__ and __local_fixups__ like dtc -@."""
+    fdt = Fdt.from_bytes(Fdt.from_dts(OVERLAY_DTS).to_dtb())
+
+    fragment = fdt.find('/fragment@0')
+    assert fragment.get('target') == b'\xff\xff\xff\xff'
+    fixups = fdt.find('/__fixups__')
+    assert fixups.properties['uart0'].as_strings() == ['/fragment@0:target:0']
+    assert fixups.properties['dma'].as_strings() == ['/fragment@0/__overlay__:dmas:0']
+
+    local = fdt.find('/__local_fixups__/fragment@0/__overlay__')
+    assert local.properties['dmas'].as_cells() == [8]
+    child = fdt.find('/fragment@0/__overlay__/child')
+    dmas = fdt.find('/fragment@0/__overlay__').properties['dmas'].as_cells()
+    assert fdt.phandles[dmas[2]] is child
+    assert fdt.find('/__symbols__').get('local') == b'/fragment@0/__overlay__/child\x00'
+
+
+def test_invalid_input_is_rejected():
+    """Corrupt blobs and preprocessor sources raise ValueError so callers can fall back to dtc."""
+    with pytest.raises(ValueError):
+        Fdt.from_bytes(b'not a device tree blob at all, really not')
+    with pytest.raises(ValueError):
+        Fdt.from_bytes(Fdt.from_dts(BASE_DTS).to_dtb()[:-16])
+    with pytest.raises(ValueError):
+        Fdt.from_dts('#include <dt-bindings/gpio/gpio.h>\n/dts-v1/;\n/ { };\n')
+    with pytest.raises(ValueError):
+        Fdt.from_dts('/dts-v1/;\n/ { p = <&missing>; };\n')
+
+
+def test_expressions_use_dtc_arithmetic():
+    """Cell expressions wrap at 64 bits, divide as C does and reject runaway shifts."""
+    fdt = Fdt.from_dts('/dts-v1/;\n/ { p = <(7 / 2) (-7 / 2) (010 + 1) ((1 << 63) * 2) (~0 >> 60)>; };\n')
+    assert fdt.root.properties['p'].as_cells() == [3, 0xfffffffc, 9, 0, 0xf]
+
+    for expression in ('(1 << 1000000000)', '(1 / 0)', '(2 ** 3)', '(1 < 2)'):
+        with pytest.raises(ValueError):
+            Fdt.from_dts(f'/dts-v1/;\n/ {{ p = <{expression}>; }};\n')
+
+
+def test_dtc_handler_without_dtc(tmpdir, monkeypatch):
+    """The DTC handler compiles and decompiles without the dtc binary."""
+    monkeypatch.setattr('shutil.which', lambda name: None)
+    dts_in, dtb, dts_out = (str(tmpdir.join(n)) for n in ("in.dts", "out.dtb", "out.dts"))
+    with open(dts_in, 'w') as f:
+        f.write(BASE_DTS)
+
+    handler = DtcHandler()
+    handler.compile(dts_in, dtb)
+    handler.decompile(dtb, dts_out)
+    with open(dts_out) as f:
+        assert 'model = "Test Board";' in f.read()
+
+    with open(dtb, 'wb') as f:
+        f.write(b'garbage')
+    with pytest.raises(RuntimeError):
+        handler.decompile(dtb, dts_out)
@@ -0,0 +1,68 @@
+import struct
+
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.header_fields import header_fields, struct_fields
+from android_15_tool.lib.super_unpacker import SuperUnpacker
+
+
+def _fields(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+        f.seek(0)
+        return {field.name: field for field in header_fields(f, data)}
+
+
+def test_struct_fields_offsets():
+    """Fields are placed by the struct format; padding and unnamed fields are skipped."""
+    buf = struct.pack('<4s2xIH', b'ABCD', 7, 9)
+    fields = struct_fields('<4s2xIH', ('magic', None, 'count'), buf, 0, 'h.')
+    assert [(f.offset, f.size, f.name, f.value) for f in fields] == [
+        (0, 4, 'h.magic', "'ABCD'"), (10, 2, 'h.count', '9 (0x9)')]
+
+
+def test_boot_v2_header_fields(tmpdir):
+    """A v2 boot header is labelled across its v0, v1 and v2 parts."""
+    header = struct.pack(BootImage.HEADER_V0_FORMAT, BootImage.BOOT_MAGIC, 100, 0x8000, 0, 0, 0, 0, 0, 2048, 2, 0,
+                         b'', b'console=ttyS0', b'', b'')
+    header += struct.pack(BootImage.HEADER_V1_FORMAT, 0, 0, 1660)
+    header += struct.pack(BootImage.HEADER_V2_FORMAT, 16, 0x1f00000)
+    path = tmpdir.join("boot.img")
+    path.write_binary(header.ljust(4096, b'\x00'))
+
+    fields = _fields(str(path))
+    assert fields['kernel_size'].offset == 8 and fields['kernel_size'].value == '100 (0x64)'
+    assert fields['cmdline'].offset == 64 and fields['cmdline'].value == "'console=ttyS0'"
+    assert fields['header_size'].offset == struct.calcsize(BootImage.HEADER_V0_FORMAT) + 12
+    assert fields['dtb_addr'].size == 8
+
+
+def test_super_header_fields(tmpdir):
+    """Geometry, metadata header and table entries of a super image are located."""
+    partitions = struct.pack(SuperUnpacker.LP_METADATA_PARTITION_FORMAT, b'system', 0, 0, 1, 0)
+    extents = struct.pack(SuperUnpacker.LP_METADATA_EXTENT_FORMAT, 8, 0, 2048, 0)
+    header = struct.pack('<IHH I 32s I 32s', SuperUnpacker.LP_METADATA_HEADER_MAGIC, 10, 2, 128, b'',
+                         len(partitions) + len(extents), b'')
+    header += struct.pack('<12I', 0, 1, 52, 52, 1, 24, 0, 0, 0, 0, 0, 0)
+    geometry = struct.pack(SuperUnpacker.LP_METADATA_GEOMETRY_FORMAT, SuperUnpacker.LP_METADATA_GEOMETRY_MAGIC, 52,
+                           b'', 65536, 2, 4096)
+    path = tmpdir.join("super.img")
+    with open(str(path), 'wb') as f:
+        f.seek(4096)
+        f.write(geometry)
+        f.seek(12288)
+        f.write(header + partitions + extents)
+        f.truncate(16384)
+
+    fields = _fields(str(path))
+    assert fields['geometry.metadata_slot_count'].offset == 4096 + 44
+    assert fields['header.header_size'].offset == 12288 + 8
+    assert fields['partitions[0].name'].offset == 12288 + 128
+    assert fields['partitions[0].name'].value == "'system'"
+    assert fields['extents[0].target_data'].offset == 12288 + 128 + 52 + 12
+
+
+def test_other_files_have_no_fields(tmpdir):
+    """Files without a known header yield no fields."""
+    path = tmpdir.join("data.bin")
+    path.write_binary(b'\x00' * 8192)
+    assert _fields(str(path)) == {}
@@ -0,0 +1,149 @@
+import gzip
+import os
+import shutil
+import stat
+import struct
+import subprocess
+
+import pytest
+
+from android_15_tool.lib.boot_image import BootImage
+from android_15_tool.lib.erofs import EROFS_SUPER_FORMAT, EROFS_SUPER_MAGIC, EROFS_SUPER_OFFSET
+from android_15_tool.lib.image_browser import browse_image
+from android_15_tool.lib.ramdisk import iter_cpio_archive
+from android_15_tool.lib.super_unpacker import SuperUnpacker
+
+EROFS_BLOCK_SIZE = 4096
+
+
+def _erofs_dir(entries):
+    """Encodes one directory block from (name, nid, file_type) entries."""
+    dirents, names = b'', b''
+    base = 12 * len(entries)
+    for name, nid, file_type in entries:
+        dirents += struct.pack('<QHBB', nid, base + len(names), file_type, 0)
+        names += name.encode()
+    return dirents + names
+
+
+def build_erofs(path):
+    """
+    Writes a small EROFS image: / holds 'init' (100 bytes) and 'etc/',
+    which holds 'init.rc' (5 bytes). Directories use the flat plain layout.
+    """
+    root = _erofs_dir([('.', 0, 2), ('..', 0, 2), ('etc', 4, 2), ('init', 2, 1)])
+    etc = _erofs_dir([('.', 4, 2), ('..', 0, 2), ('init.rc', 6, 1)])
+
+    def inode(mode, size, blkaddr):
+        return struct.pack('<HHHHIIIIHHI', 0, 0, mode, 1, size, 0, blkaddr, 0, 0, 0, 0)
+
+    image = bytearray(4 * EROFS_BLOCK_SIZE)
+    superblock = struct.pack(EROFS_SUPER_FORMAT, EROFS_SUPER_MAGIC, 0, 0, 12, 0, 0, 4, 0, 0, 4, 1, 0)
+    image[EROFS_SUPER_OFFSET:EROFS_SUPER_OFFSET + len(superblock)] = superblock
+    meta = EROFS_BLOCK_SIZE
+    for nid, raw in ((0, inode(stat.S_IFDIR | 0o755, len(root), 2)),
+                     (2, inode(stat.S_IFREG | 0o750, 100, 0)),
+                     (4, inode(stat.S_IFDIR | 0o755, len(etc), 3)),
+                     (6, inode(stat.S_IFREG | 0o644, 5, 0))):
+        image[meta + nid * 32:meta + nid * 32 + 32] = raw
+    image[2 * EROFS_BLOCK_SIZE:2 * EROFS_BLOCK_SIZE + len(root)] = root
+    image[3 * EROFS_BLOCK_SIZE:3 * EROFS_BLOCK_SIZE + len(etc)] = etc
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+def _names(entries):
+    return [(entry.name, entry.kind, entry.size) for entry in entries]
+
+
+def test_browse_erofs(tmpdir):
+    """Directories of an EROFS image are listed lazily from the image itself."""
+    path = str(tmpdir.join("system.img"))
+    build_erofs(path)
+    root = browse_image(path)
+    assert root.kind == 'erofs'
+    children = root.children()
+    assert [(entry.name, entry.kind) for entry in children] == [('etc', 'directory'), ('init', 'file')]
+    assert children[1].size == 100
+    assert _names(children[0].children()) == [('init.rc', 'file', 5)]
+    assert root.children() is children
+
+
+def test_browse_boot_ramdisk(tmpdir):
+    """A boot image opens into its sections and its ramdisk into cpio entries."""
+    tree = tmpdir.mkdir("root")
+    tree.mkdir("system").mkdir("etc").join("init.rc").write("on boot\n")
+    tree.join("init").write("binary")
+    os.symlink("/system/bin/init", str(tree.join("linker")))
+    ramdisk = gzip.compress(b''.join(iter_cpio_archive(str(tree))))
+    kernel = b'K' * 5000
+    header = struct.pack(BootImage.HEADER_V3_FORMAT, BootImage.BOOT_MAGIC, len(kernel), len(ramdisk), 0, 1580,
+                         0, 0, 0, 0, 3, b'')
+    path = str(tmpdir.join("boot.img"))
+    with open(path, 'wb') as f:
+        f.write(header.ljust(4096, b'\x00'))
+        f.write(kernel.ljust(8192, b'\x00'))
+        f.write(ramdisk)
+
+    root = browse_image(path)
+    assert root.kind == 'boot'
+    sections = {entry.name: entry for entry in root.children()}
+    assert sections['kernel'].size == len(kernel) and not sections['kernel'].expandable
+    entries = sections['ramdisk'].children()
+    assert _names(entries) == [('system', 'directory', 0), ('init', 'file', 6), ('linker', 'symlink', 16)]
+    assert _names(entries[0].children()[0].children()) == [('init.rc', 'file', 8)]
+
+
+@pytest.mark.skipif(shutil.which("mke2fs") is None, reason="mke2fs is needed to build an ext4 image")
+def test_browse_super_partitions(tmpdir):
+    """Logical partitions are read through their extents, in place inside the super image."""
+    source = tmpdir.mkdir("system")
+    source.mkdir("app").join("Settings.apk").write("apk")
+    source.join("build.prop").write("ro.build.version.release=15\n")
+    ext4_path = str(tmpdir.join("system_ext4.img"))
+    subprocess.run(["mke2fs", "-q", "-t", "ext4", "-b", "4096", "-d", str(source), ext4_path, "2M"],
+                   check=True, capture_output=True)
+    with open(ext4_path, 'rb') as f:
+        ext4 = f.read()
+    half = len(ext4) // 2
+    mib, sector = 1024 * 1024, SuperUnpacker.LP_SECTOR_SIZE
+
+    partitions = (struct.pack(SuperUnpacker.LP_METADATA_PARTITION_FORMAT, b'system', 0, 0, 2, 0)
+                  + struct.pack(SuperUnpacker.LP_METADATA_PARTITION_FORMAT, b'vendor', 0, 2, 1, 0))
+    # system's second half is stored first; vendor is all zeros
+    extents = (struct.pack(SuperUnpacker.LP_METADATA_EXTENT_FORMAT, half // sector, 0, 2 * mib // sector, 0)
+               + struct.pack(SuperUnpacker.LP_METADATA_EXTENT_FORMAT, half // sector, 0, mib // sector, 0)
+               + struct.pack(SuperUnpacker.LP_METADATA_EXTENT_FORMAT, 8, 1, 0, 0))
+    header = struct.pack('<IHH I 32s I 32s', SuperUnpacker.LP_METADATA_HEADER_MAGIC, 10, 2, 128, b'',
+                         len(partitions) + len(extents), b'')
+    header += struct.pack('<12I', 0, 2, 52, len(partitions), 3, 24, 0, 0, 0, 0, 0, 0)
+    geometry = struct.pack('<II32sIII', SuperUnpacker.LP_METADATA_GEOMETRY_MAGIC, 52, b'', 65536, 2, 4096)
+
+    path = str(tmpdir.join("super.img"))
+    with open(path, 'wb') as f:
+        f.seek(4096)
+        f.write(geometry)
+        f.seek(12288)
+        f.write(header + partitions + extents)
+        f.seek(mib)
+        f.write(ext4[half:])
+        f.seek(2 * mib)
+        f.write(ext4[:half])
+
+    root = browse_image(path)
+    assert root.kind == 'super'
+    system, vendor = root.children()
+    assert (system.name, system.size, vendor.name) == ('system', len(ext4), 'vendor')
+    names = [entry.name for entry in system.children()]
+    assert names == ['app', 'lost+found', 'build.prop']
+    assert _names(system.children()[0].children()) == [('Settings.apk', 'file', 3)]
+    with pytest.raises(ValueError, match="No filesystem"):
+        vendor.children()
+
+
+def test_browse_rejects_unknown_files(tmpdir):
+    """Files that are not images raise ValueError."""
+    path = tmpdir.join("notes.img")
+    path.write("just text")
+    with pytest.raises(ValueError):
+        browse_image(str(path))
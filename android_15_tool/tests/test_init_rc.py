@@ -0,0 +1,123 @@
+from android_15_tool.lib.init_rc import build_rc_index, load_rc_index, parse_rc, query_rc_index
+
+
+def make_tree(root):
+    """
+    Writes a small firmware tree: init.rc imports a hardware-specific script
+    by ${ro.hardware}, which starts a service directly and a class of
+    services that load modules.
+    """
+    root.mkdir("system").join("build.prop").write("# system\nro.hardware=qcom\nro.zygote=zygote64\n")
+    hw = root.join("system").mkdir("etc").mkdir("init").mkdir("hw")
+    hw.join("init.rc").write(
+        "import /vendor/etc/init/hw/init.${ro.hardware}.rc\n"
+        "import /init.${ro.boot.missing}.rc\n"
+        "import /system/etc/init/hw/init.absent.rc\n"
+        "on early-init\n"
+        "    start ueventd\n"
+        "service ueventd /system/bin/ueventd\n"
+        "    class core\n")
+    root.mkdir("vendor").mkdir("etc").mkdir("init").mkdir("hw").join("init.qcom.rc").write(
+        "on post-fs-data\n"
+        "    insmod /vendor/lib/modules/touch_core.ko\n"
+        "    start vendor.touchd\n"
+        "    class_start hal\n"
+        "on property:sys.boot_completed=1 && post-fs-data\n"
+        "    exec - root -- /vendor/bin/insmod -f /vendor/lib/modules/${ro.hardware}_late.ko\n")
+    root.join("vendor", "etc", "init").join("touch.rc").write(
+        "service vendor.touchd /vendor/bin/touchd --daemon\n"
+        "    class late_start\n"
+        "    user system\n"
+        "service vendor.modprobe /vendor/bin/modprobe -a -d /vendor/lib/modules \\\n"
+        "        goodix_ts nvt_ts\n"
+        "    class hal\n"
+        "    oneshot\n")
+
+
+def test_parse_rc_sections():
+    """Sections, continuations, comments and imports are parsed with their line numbers."""
+    parsed = parse_rc("# comment\nimport /a.rc\non boot && property:a=1\n    setprop x \"a b\"\n"
+                      "service s /bin/s \\\n    arg\n    class main\n", "/test.rc")
+    assert parsed['imports'] == [['/a.rc', 2]]
+    assert parsed['actions'] == [{'triggers': ['boot', 'property:a=1'], 'commands': [['setprop', 'x', 'a b']],
+                                  'source': ['/test.rc', 3]}]
+    assert parsed['services'] == [{'name': 's', 'args': ['/bin/s', 'arg'], 'options': [['class', 'main']],
+                                   'source': ['/test.rc', 5]}]
+
+
+def test_index_follows_imports_and_answers_queries(tmpdir):
+    """Imports are resolved with build.prop properties and triggers map to services and modules."""
+    make_tree(tmpdir)
+    index, _ = build_rc_index(str(tmpdir))
+    assert [parsed['path'] for parsed in index.files] == [
+        '/system/etc/init/hw/init.rc', '/vendor/etc/init/hw/init.qcom.rc', '/vendor/etc/init/touch.rc']
+    assert [(u['import'], u['reason']) for u in index.unresolved] == [
+        ('/init.${ro.boot.missing}.rc', 'undefined property ro.boot.missing'),
+        ('/system/etc/init/hw/init.absent.rc', 'not in the tree')]
+
+    assert index.services_started_on('post-fs-data') == ['vendor.touchd', 'vendor.modprobe']
+    assert [module for module, _ in index.modules_loaded_on('post-fs-data')] == [
+        '/vendor/lib/modules/touch_core.ko', '/vendor/lib/modules/qcom_late.ko', 'goodix_ts', 'nvt_ts']
+    assert index.triggers_starting('vendor.modprobe') == ['post-fs-data']
+
+    lines = query_rc_index(index, 'vendor.touchd')
+    assert lines[0] == "Service vendor.touchd: /vendor/bin/touchd --daemon"
+    assert "Started on: post-fs-data" in lines
+    assert query_rc_index(index, 'no-such-trigger') == ["No service or trigger named 'no-such-trigger'."]
+
+
+def test_files_are_listed_in_load_order(tmpdir):
+    """Files come in the order init loads them, so the first service definition wins as in init."""
+    make_tree(tmpdir)
+    tmpdir.join("system", "etc", "init", "atrace.rc").write(
+        "import /vendor/etc/init/touch.rc\n"
+        "service ueventd /system/bin/other_ueventd\n")
+    index, _ = build_rc_index(str(tmpdir))
+    assert [parsed['path'] for parsed in index.files] == [
+        '/system/etc/init/hw/init.rc', '/vendor/etc/init/hw/init.qcom.rc', '/system/etc/init/atrace.rc',
+        '/vendor/etc/init/touch.rc']
+    assert index.services['ueventd']['args'] == ['/system/bin/ueventd']
+
+
+def test_paths_outside_the_tree_are_not_found(tmpdir):
+    """Imports that climb out of the tree with .. are reported, not read."""
+    tree = tmpdir.mkdir("tree")
+    make_tree(tree)
+    tmpdir.join("outside.rc").write("service outside /bin/outside\n")
+    tree.join("system", "etc", "init", "escape.rc").write("import ../outside.rc\n")
+    index, _ = build_rc_index(str(tree))
+    assert 'outside' not in index.services
+    assert ('../outside.rc', 'not in the tree') in [(u['import'], u['reason']) for u in index.unresolved]
+
+
+def test_symlinks_out_of_the_tree_are_not_followed(tmpdir):
+    """Absolute symlinks in a tree, like vendor -> /vendor, never lead to host files."""
+    tree = tmpdir.mkdir("tree")
+    make_tree(tree)
+    host = tmpdir.mkdir("host")
+    host.mkdir("init").join("host.rc").write("service host /bin/host\n")
+    host.join("leak.rc").write("service leak /bin/leak\n")
+    tree.join("odm").mksymlinkto(host)
+    tree.join("vendor", "etc", "init").join("leak.rc").mksymlinkto(host.join("leak.rc"))
+    tree.join("system", "etc", "init").join("escape.rc").write("import /odm/init/host.rc\n")
+    index, _ = build_rc_index(str(tree))
+    assert 'host' not in index.services and 'leak' not in index.services
+    assert 'vendor.touchd' in index.services
+    assert ('/odm/init/host.rc', 'not in the tree') in [(u['import'], u['reason']) for u in index.unresolved]
+
+
+def test_index_cache_tracks_changes(tmpdir):
+    """A cached index is reused until a file or directory it came from changes."""
+    tree = tmpdir.mkdir("tree")
+    make_tree(tree)
+    cache_dir = str(tmpdir.join("cache"))
+    first = load_rc_index(str(tree), cache_dir=cache_dir)
+    assert load_rc_index(str(tree), cache_dir=cache_dir) is first
+
+    tree.join("vendor", "etc", "init", "extra.rc").write("on boot\n    start extra\n")
+    second = load_rc_index(str(tree), cache_dir=cache_dir)
+    assert second is not first and second.services_started_on('boot') == ['extra']
+
+    # A different properties set is a different index
+    third = load_rc_index(str(tree), {'ro.hardware': 'other'}, cache_dir=cache_dir)
+    assert '/vendor/etc/init/hw/init.qcom.rc' not in [parsed['path'] for parsed in third.files]
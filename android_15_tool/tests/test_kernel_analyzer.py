@@ -0,0 +1,83 @@
+import gzip
+import io
+import struct
+
+import pytest
+
+from android_15_tool.lib.compression import compress_lz4_legacy
+from android_15_tool.lib import kernel_analyzer
+from android_15_tool.lib.kernel_analyzer import KernelAnalyzer, ZIMAGE_MAGIC
+
+BANNER = (b'Linux version 6.1.75-android14-11-g1234abcd (build-user@build-host) '
+          b'(Android (11368308) clang version 17.0.4, LLD 17.0.4) #1 SMP PREEMPT Mon Jan 1 00:00:00 UTC 2024\n')
+CONFIG = b'CONFIG_ARM64=y\nCONFIG_IKCONFIG=y\nCONFIG_IKCONFIG_PROC=y\n'
+
+
+def _arm64_image(padding=4 * 1024 * 1024):
+    """A fake arm64 Image: header, banner, IKCFG block, then a large uncompressible-looking tail."""
+    header = bytearray(64)
+    header[56:60] = b'ARM\x64'
+    body = b'\x00' * 5000 + BANNER + b'\x00' + b'\x11' * 70000
+    body += b'IKCFG_ST' + gzip.compress(CONFIG) + b'IKCFG_ED'
+    return bytes(header) + body + bytes(range(256)) * (padding // 256)
+
+
+def test_image_gz_stops_early(tmpdir):
+    """A gzip kernel is only inflated until the banner and config are found."""
+    image = _arm64_image()
+    path = tmpdir.join("Image.gz")
+    path.write_binary(gzip.compress(image))
+
+    result = KernelAnalyzer(use_cache=False).analyze(str(path))
+    assert result['format'] == 'Image.gz'
+    assert result['arch'] == 'arm64'
+    assert result['version'] == '6.1.75-android14-11-g1234abcd'
+    assert result['banner'] == BANNER.rstrip(b'\n').decode()
+    assert result['config'] == CONFIG.decode()
+    assert result['scanned_bytes'] < len(image) // 2
+
+
+def test_zimage_and_lz4_payloads():
+    """Banners are found behind a zImage stub and inside an LZ4 legacy kernel."""
+    image = _arm64_image(padding=0)
+    stub = bytearray(0x400)
+    struct.pack_into('<I', stub, 0x24, ZIMAGE_MAGIC)
+    zimage = bytes(stub) + gzip.compress(image) + struct.pack('<I', len(image)) + b'\xff' * 64
+
+    result = KernelAnalyzer(use_cache=False).analyze(zimage)
+    assert (result['format'], result['compression']) == ('zImage', 'gzip')
+    assert result['version'] == '6.1.75-android14-11-g1234abcd'
+
+    out = io.BytesIO()
+    compress_lz4_legacy([image], out, workers=1)
+    result = KernelAnalyzer(use_cache=False).analyze(out.getvalue(), want_config=False)
+    assert (result['format'], result['compression']) == ('Image.lz4', 'lz4_legacy')
+    assert result['version'] == '6.1.75-android14-11-g1234abcd'
+    assert result['config'] is None
+
+
+def test_zimage_payload_across_chunks(monkeypatch):
+    """A payload whose header straddles two search chunks is still found at its exact offset."""
+    monkeypatch.setattr(kernel_analyzer, 'SCAN_CHUNK_SIZE', 4096)
+    stub = bytearray(3 * 4096 - 2)
+    struct.pack_into('<I', stub, 0x24, ZIMAGE_MAGIC)
+    zimage = memoryview(bytes(stub) + gzip.compress(_arm64_image(padding=0)))
+
+    info = kernel_analyzer.identify_kernel(zimage)
+    assert (info['compression'], info['payload_offset']) == ('gzip', len(stub))
+
+
+def test_results_are_cached(tmpdir):
+    """A second analysis of the same kernel is served from the cache."""
+    analyzer = KernelAnalyzer(cache_dir=str(tmpdir))
+    image = _arm64_image(padding=0)
+    first = analyzer.analyze(image)
+    second = KernelAnalyzer(cache_dir=str(tmpdir)).analyze(image)
+    assert not first['cached'] and second['cached']
+    assert second['config'] == CONFIG.decode()
+
+
+def test_missing_file_raises():
+    """A missing kernel file is reported as a RuntimeError."""
+    with pytest.raises(RuntimeError):
+        KernelAnalyzer(use_cache=False).analyze("/nonexistent/Image")
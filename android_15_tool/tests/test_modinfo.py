@@ -0,0 +1,106 @@
+import os
+import struct
+import time
+
+import pytest
+
+from android_15_tool.lib import modinfo
+from android_15_tool.lib.modinfo import ModuleIndex, parse_modinfo
+
+
+def build_module(path, modinfo, elf_class=2, order='<'):
+    """
+    Writes a minimal ELF relocatable whose .modinfo section holds the given
+    (key, value) pairs, after a .text section of padding.
+    """
+    section_names = b'\x00.text\x00.modinfo\x00.shstrtab\x00'
+    text = b'\x00' * 256
+    info = b''.join(f"{key}={value}".encode() + b'\x00' for key, value in modinfo)
+    header_size, entry_size = (64, 64) if elf_class == 2 else (52, 40)
+    sections = [(0, 0, 0), (1, header_size, len(text)), (7, header_size + len(text), len(info)),
+                (16, header_size + len(text) + len(info), len(section_names))]
+    shoff = header_size + len(text) + len(info) + len(section_names)
+    ident = b'\x7fELF' + bytes([elf_class, 1 if order == '<' else 2, 1]) + b'\x00' * 9
+    if elf_class == 2:
+        header = ident + struct.pack(order + 'HHIQQQIHHHHHH', 1, 183, 1, 0, 0, shoff, 0, header_size, 0, 0,
+                                     entry_size, len(sections), 3)
+        table = b''.join(struct.pack(order + 'IIQQQQIIQQ', name, 1, 0, 0, offset, size, 0, 0, 1, 0)
+                         for name, offset, size in sections)
+    else:
+        header = ident + struct.pack(order + 'HHIIIIIHHHHHH', 1, 40, 1, 0, 0, shoff, 0, header_size, 0, 0,
+                                     entry_size, len(sections), 3)
+        table = b''.join(struct.pack(order + 'IIIIIIIIII', name, 1, 0, 0, offset, size, 0, 0, 1, 0)
+                         for name, offset, size in sections)
+    with open(path, 'wb') as f:
+        f.write(header + text + info + section_names + table)
+
+
+@pytest.fixture
+def vendor_modules(tmpdir):
+    """A module directory with a small touchscreen stack."""
+    modules = tmpdir.mkdir("vendor").mkdir("lib").mkdir("modules")
+    build_module(str(modules.join("goodix_ts.ko")), [
+        ('alias', 'i2c:goodix-touch'), ('alias', 'of:N*T*Cgoodix,gt9896'), ('depends', 'touch-core,i2c_helper'),
+        ('description', 'Goodix touchscreen driver'), ('name', 'goodix_ts'), ('vermagic', '6.1.75 SMP preempt')])
+    build_module(str(modules.join("touch-core.ko")), [('depends', 'i2c_helper'), ('name', 'touch_core')],
+                 elf_class=1, order='>')
+    build_module(str(modules.join("i2c_helper.ko")), [('depends', ''), ('name', 'i2c_helper')])
+    build_module(str(modules.join("wlan.ko")), [('depends', 'cfg80211'), ('name', 'wlan')])
+    modules.join("broken.ko").write("not an elf")
+    return tmpdir
+
+
+def test_parse_modinfo_fields(vendor_modules):
+    """Repeated keys become lists and depends is split on commas."""
+    with open(str(vendor_modules.join("vendor", "lib", "modules", "goodix_ts.ko")), 'rb') as f:
+        info = parse_modinfo(f.read())
+    assert info['name'] == 'goodix_ts'
+    assert info['depends'] == ['touch-core', 'i2c_helper']
+    assert info['aliases'] == ['i2c:goodix-touch', 'of:N*T*Cgoodix,gt9896']
+    assert info['vermagic'] == '6.1.75 SMP preempt'
+    with pytest.raises(ValueError):
+        parse_modinfo(b'\x7fELF' + b'\x00' * 60)
+
+
+def test_index_alias_and_load_order(vendor_modules, tmpdir):
+    """Aliases are looked up by pattern and dependencies load first."""
+    cache_dir = str(tmpdir.join("cache"))
+    index = ModuleIndex.build(str(vendor_modules), cache_dir=cache_dir)
+    assert sorted(index.modules) == ['goodix_ts', 'i2c_helper', 'touch_core', 'wlan']
+    assert [path.endswith("broken.ko") for path, _ in index.unreadable] == [True]
+    assert index.find_alias('i2c:*touch*') == ['goodix_ts']
+    assert index.touchscreen_modules() == ['goodix_ts', 'touch_core']
+    assert index.load_order(['goodix_ts']) == ['i2c_helper', 'touch_core', 'goodix_ts']
+    assert index.missing_dependencies(['wlan', 'goodix_ts']) == ['cfg80211']
+    with pytest.raises(ValueError, match="Unknown module"):
+        index.load_order(['missing'])
+
+    start = time.monotonic()
+    cached = ModuleIndex.build(str(vendor_modules), cache_dir=cache_dir)
+    assert time.monotonic() - start < 1
+    assert all(info['cached'] for info in cached.modules.values())
+    assert cached.load_order(['goodix_ts']) == index.load_order(['goodix_ts'])
+
+
+def test_unchanged_modules_are_not_read(vendor_modules, tmpdir, monkeypatch):
+    """Cached modules are found by path, size and mtime; touched ones are hashed again."""
+    cache_dir = str(tmpdir.join("cache"))
+    index = ModuleIndex.build(str(vendor_modules), cache_dir=cache_dir)
+    goodix = index.modules['goodix_ts']['path']
+    os.utime(goodix, ns=(0, 0))
+
+    mapped = []
+    real_map_file = modinfo.map_file
+    monkeypatch.setattr(modinfo, 'map_file', lambda path: mapped.append(path) or real_map_file(path))
+    cached = ModuleIndex.build(str(vendor_modules), cache_dir=cache_dir)
+    assert all(info['cached'] for info in cached.modules.values())
+    assert [path for path in mapped if not path.endswith("broken.ko")] == [goodix]
+
+
+def test_dependency_cycle_is_reported(tmpdir):
+    """A dependency cycle raises ValueError naming the cycle."""
+    build_module(str(tmpdir.join("a.ko")), [('depends', 'b'), ('name', 'a')])
+    build_module(str(tmpdir.join("b.ko")), [('depends', 'a'), ('name', 'b')])
+    index = ModuleIndex.build(str(tmpdir), use_cache=False)
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        index.load_order(['a'])
@@ -0,0 +1,206 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import stat
+import struct
+import pytest
+
+from android_15_tool.lib import compression as compression_module
+from android_15_tool.lib.compression import detect_compression, iter_decompress, lz4_block_decompress
+from android_15_tool.lib.ramdisk import build_ramdisk, extract_ramdisk, list_cpio, read_fs_config
+
+
+def _cpio_entry(name, mode, data=b'', ino=1, nlink=1, rdev=(0, 0)):
+    """Builds a single newc cpio entry."""
+    name_bytes = name.encode() + b'\x00'
+    header = b'070701' + b''.join(b'%08x' % v for v in [
+        ino, mode, 0, 2000, nlink, 0, len(data), 0, 0, rdev[0], rdev[1], len(name_bytes), 0,
+    ])
+    entry = header + name_bytes
+    entry += b'\x00' * (-len(entry) % 4)
+    entry += data + b'\x00' * (-len(data) % 4)
+    return entry
+
+
+@pytest.fixture
+def cpio_archive():
+    """A small newc archive with a directory, files, a symlink and a device node."""
+    big = os.urandom(3000) * 50
+    archive = b''.join([
+        _cpio_entry('.', stat.S_IFDIR | 0o755, ino=1),
+        _cpio_entry('system', stat.S_IFDIR | 0o755, ino=2),
+        _cpio_entry('init', stat.S_IFREG | 0o750, b'#!/bin/init', ino=3),
+        _cpio_entry('system/big.bin', stat.S_IFREG | 0o644, big, ino=4),
+        _cpio_entry('sbin', stat.S_IFLNK | 0o777, b'system/bin', ino=5),
+        _cpio_entry('dev/console', stat.S_IFCHR | 0o600, ino=6, rdev=(5, 1)),
+        _cpio_entry('TRAILER!!!', 0),
+    ])
+    archive += b'\x00' * (-len(archive) % 512)
+    return archive, big
+
+
+def _lz4_legacy(data):
+    """Wraps data in an LZ4 legacy stream made of literal-only blocks."""
+    out = struct.pack('<I', 0x184C2102)
+    for start in range(0, len(data), 1 << 20):
+        chunk = data[start:start + (1 << 20)]
+        length = len(chunk) - 15
+        block = bytes([0xf0])
+        while length >= 255:
+            block += b'\xff'
+            length -= 255
+        block += bytes([length]) + chunk
+        out += struct.pack('<I', len(block)) + block
+    return out
+
+
+@pytest.mark.parametrize("compress,name", [
+    (lambda d: gzip.compress(d, mtime=0), 'gzip'),
+    (lambda d: lzma.compress(d, format=lzma.FORMAT_XZ), 'xz'),
+    (lambda d: lzma.compress(d, format=lzma.FORMAT_ALONE), 'lzma'),
+    (bz2.compress, 'bzip2'),
+    (_lz4_legacy, 'lz4_legacy'),
+    (lambda d: d, 'cpio'),
+])
+def test_extract_ramdisk(cpio_archive, tmpdir, compress, name):
+    """Each supported compression is detected and extracted in-process."""
+    archive, big = cpio_archive
+    data = compress(archive)
+    chunks = (data[i:i + 4096] for i in range(0, len(data), 4096))
+    root = str(tmpdir.join("root"))
+    fs_config = str(tmpdir.join("fs_config.txt"))
+
+    compression, entries = extract_ramdisk(chunks, root, fs_config)
+
+    assert compression == name
+    assert len(entries) == 6
+    with open(os.path.join(root, 'init'), 'rb') as f:
+        assert f.read() == b'#!/bin/init'
+    with open(os.path.join(root, 'system', 'big.bin'), 'rb') as f:
+        assert f.read() == big
+    assert os.readlink(os.path.join(root, 'sbin')) == 'system/bin'
+    assert not os.path.exists(os.path.join(root, 'dev', 'console'))
+
+    config = read_fs_config(fs_config)
+    assert config['init'] == (stat.S_IFREG | 0o750, 0, 2000, 0, 0)
+    assert config['dev/console'] == (stat.S_IFCHR | 0o600, 0, 2000, 5, 1)
+
+
+def test_concatenated_gzip_members(cpio_archive):
+    """Multi-member gzip ramdisks are decompressed as one stream."""
+    archive, _ = cpio_archive
+    half = len(archive) // 2
+    data = gzip.compress(archive[:half]) + gzip.compress(archive[half:])
+    assert b''.join(iter_decompress([data])) == archive
+
+
+def test_path_traversal_is_rejected(tmpdir):
+    """Archive members may not escape the output directory."""
+    archive = _cpio_entry('../evil', stat.S_IFREG | 0o644, b'x') + _cpio_entry('TRAILER!!!', 0)
+    with pytest.raises(ValueError):
+        extract_ramdisk([archive], str(tmpdir.join("root")))
+
+
+def test_directory_over_symlink_stays_inside(tmpdir):
+    """A directory entry on top of a symlink leading out of the tree replaces the link."""
+    outside = tmpdir.mkdir("outside")
+    os.chmod(str(outside), 0o755)
+    archive = (_cpio_entry('etc', stat.S_IFLNK | 0o777, str(outside).encode(), ino=1)
+               + _cpio_entry('etc', stat.S_IFDIR | 0o777, ino=2)
+               + _cpio_entry('TRAILER!!!', 0))
+    out = tmpdir.join("out")
+    extract_ramdisk([archive], str(out))
+
+    assert stat.S_IMODE(os.stat(str(outside)).st_mode) == 0o755
+    assert not os.path.islink(str(out.join("etc"))) and os.path.isdir(str(out.join("etc")))
+
+
+def test_list_cpio(cpio_archive):
+    """Entries can be listed without extracting anything."""
+    archive, _ = cpio_archive
+    names = [entry.name for entry in list_cpio([gzip.compress(archive)])]
+    assert names == ['.', 'system', 'init', 'system/big.bin', 'sbin', 'dev/console']
+
+
+def test_lz4_overlapping_match():
+    """An LZ4 match longer than its offset repeats the preceding bytes."""
+    # literal 'ab', then a 10-byte match at offset 2, then literal 'Z'
+    block = bytes([0x26]) + b'ab' + struct.pack('<H', 2) + bytes([0x10]) + b'Z'
+    assert lz4_block_decompress(block) == b'ab' * 6 + b'Z'
+
+
+def test_detect_compression_unknown():
+    """Unrecognised data is reported as None."""
+    assert detect_compression(b'\x00' * 16) is None
+
+
+@pytest.fixture
+def ramdisk_tree(tmpdir):
+    """An extracted ramdisk tree plus an fs_config with a device node and owners."""
+    root = tmpdir.mkdir("tree")
+    root.mkdir("system").mkdir("bin")
+    with open(root.join("init"), 'wb') as f:
+        f.write(b'#!/bin/init\n' * 1000)
+    with open(root.join("system", "bin", "sh"), 'wb') as f:
+        f.write(os.urandom(10000))
+    os.symlink("system/bin", str(root.join("bin")))
+
+    fs_config = tmpdir.join("fs_config.txt")
+    with open(fs_config, 'w') as f:
+        f.write(f"{stat.S_IFREG | 0o750:06o} 0 2000 0 0 init\n")
+        f.write(f"{stat.S_IFCHR | 0o600:06o} 0 0 5 1 dev/console\n")
+    return str(root), str(fs_config)
+
+
+@pytest.mark.parametrize("compression", ['lz4_legacy', 'gzip', 'cpio'])
+def test_build_ramdisk_round_trip(ramdisk_tree, tmpdir, compression):
+    """A rebuilt ramdisk is reproducible and extracts back to the same tree."""
+    root, fs_config = ramdisk_tree
+    first, second = str(tmpdir.join("r1")), str(tmpdir.join("r2"))
+
+    build_ramdisk(root, first, compression, fs_config)
+    os.utime(os.path.join(root, "init"), (1, 1))
+    build_ramdisk(root, second, compression, fs_config)
+    with open(first, 'rb') as a, open(second, 'rb') as b:
+        assert a.read() == b.read()
+
+    with open(first, 'rb') as f:
+        detected, entries = extract_ramdisk([f.read()], str(tmpdir.join("out")))
+    assert detected == compression
+    by_name = {entry.name: entry for entry in entries}
+    assert [entry.name for entry in entries] == sorted(by_name)
+    assert by_name['init'].mode == stat.S_IFREG | 0o750
+    assert by_name['init'].gid == 2000
+    assert by_name['init'].mtime == 0
+    assert (by_name['dev/console'].rdevmajor, by_name['dev/console'].rdevminor) == (5, 1)
+    with open(os.path.join(root, "system", "bin", "sh"), 'rb') as a, \
+            open(str(tmpdir.join("out", "system", "bin", "sh")), 'rb') as b:
+        assert a.read() == b.read()
+    assert os.readlink(str(tmpdir.join("out", "bin"))) == "system/bin"
+
+
+def test_lz4_legacy_blocks_are_independent(monkeypatch):
+    """Multi-block LZ4 legacy output compresses in parallel and decompresses intact."""
+    monkeypatch.setattr(compression_module, 'LZ4_LEGACY_BLOCK_SIZE', 4096)
+    data = (b'android ramdisk ' * 1000) + os.urandom(5000)
+    out = io.BytesIO()
+
+    compression_module.compress_lz4_legacy([data], out, workers=2)
+
+    assert out.getvalue()[:4] == b'\x02\x21\x4c\x18'
+    assert b''.join(iter_decompress([out.getvalue()])) == data
+
+
+def test_lz4_legacy_output_independent_of_workers(monkeypatch):
+    """With the same block encoder, LZ4 legacy output is identical for any worker count."""
+    monkeypatch.setattr(compression_module, 'LZ4_LEGACY_BLOCK_SIZE', 4096)
+    data = (b'android ramdisk ' * 2000) + bytes(range(256)) * 40
+    outputs = []
+    for workers in (1, 2, 3):
+        out = io.BytesIO()
+        compression_module.compress_lz4_legacy([data], out, workers=workers)
+        outputs.append(out.getvalue())
+
+    assert outputs[0] == outputs[1] == outputs[2]
@@ -45,6 +45,12 @@ def create_dummy_files(tmpdir_factory):
         f.write(b'ANDROID!')
     dummy_files['Android Boot'] = str(fn_boot)
 
+    # Android Vendor Boot
+    fn_vendor_boot = tmpdir_factory.mktemp("data").join("vendor_boot.img")
+    with open(fn_vendor_boot, 'wb') as f:
+        f.write(b'VNDRBOOT')
+    dummy_files['Android Vendor Boot'] = str(fn_vendor_boot)
+
     # DTB
     fn_dtb = tmpdir_factory.mktemp("data").join("dtb.img")
     with open(fn_dtb, 'wb') as f:
@@ -73,6 +79,12 @@ def create_dummy_files(tmpdir_factory):
         f.write(b'TDBL')
     dummy_files['DTC Table'] = str(fn_dtc)
 
+    # DTBO Table
+    fn_dtbo = tmpdir_factory.mktemp("data").join("dtbo.img")
+    with open(fn_dtbo, 'wb') as f:
+        f.write(b'\xd7\xb7\xab\x1e' + b'\x00' * 28)
+    dummy_files['DTBO Table'] = str(fn_dtbo)
+
     # Unknown
     fn_unknown = tmpdir_factory.mktemp("data").join("unknown.img")
     with open(fn_unknown, 'wb') as f:
@@ -91,3 +103,15 @@ def test_magic_scanner(create_dummy_files):
     for file_type, file_path in create_dummy_files.items():
         result = scanner.identify_image(file_path)
         assert file_type in result
+
+def test_find_offsets(tmpdir):
+    """
+    Tests that find_offsets reports fixed signatures where they belong and
+    every occurrence of variable ones, in file order.
+    """
+    path = tmpdir.join("boot.img")
+    path.write_binary(b'ANDROID!' + b'\x00' * 100 + b'\xd0\x0d\xfe\xed' + b'\x00' * 20 + b'\xd0\x0d\xfe\xed')
+    scanner = MagicScanner()
+    assert scanner.find_offsets(str(path)) == [(0, 'Android Boot'), (108, 'DTB'), (132, 'DTB')]
+    assert scanner.find_offsets(str(path), limit=1) == [(0, 'Android Boot'), (108, 'DTB')]
+    assert scanner.find_offsets(str(path), should_stop=lambda: True) == [(0, 'Android Boot')]
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from android_15_tool.lib import stream_io
+from android_15_tool.lib.stream_io import ExtentReader, clone_file
+
+
+def test_clone_file_without_fcntl(tmpdir, monkeypatch):
+    """Where fcntl is unavailable (Windows), clone_file falls back to a plain copy."""
+    monkeypatch.setattr(stream_io, 'fcntl', None)
+    src = tmpdir.join("src.img")
+    src.write_binary(b'\x00' * 4096 + b'payload' * 1000)
+
+    assert clone_file(str(src), str(tmpdir.join("dst.img"))) == 'copy'
+    assert tmpdir.join("dst.img").read_binary() == src.read_binary()
+
+
+def test_extent_reader_without_pread(tmpdir, monkeypatch):
+    """Without os.pread, readers sharing a file still read correctly from many threads."""
+    monkeypatch.delattr(stream_io.os, 'pread')
+    data = bytes(range(256)) * 256
+    path = tmpdir.join("image.img")
+    path.write_binary(data)
+
+    reader = ExtentReader(str(path), [(4096, 8192), (1000, None), (4096, 0)])
+    expected = data[8192:8192 + 4096] + bytes(1000) + data[:4096]
+    part = reader.slice(4000, 2000)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda i: (reader.read(i * 37, 300), part.read(i, 500)), range(200)))
+        for i, (whole, sliced) in enumerate(results):
+            assert whole == expected[i * 37:i * 37 + 300]
+            assert sliced == expected[4000 + i:4000 + i + 500][:max(0, 2000 - i)]
+    finally:
+        reader.close()
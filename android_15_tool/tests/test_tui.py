@@ -1,9 +1,16 @@
 import os
+import time
+from unittest.mock import patch
+
 import pytest
 from textual.pilot import Pilot
+from textual.widgets import Input, Log
+from textual.worker import WorkerState
 
-from android_15_tool.lib.tui.app import TuiApp
-from android_15_tool.lib.tui.widgets.file_browser import FileBrowser
+from android_15_tool.lib.tui.app import DRIVER_SECTION, RECOVERY_SECTION, TuiApp
+from android_15_tool.tests.test_image_browser import build_erofs
+from android_15_tool.lib.tui.widgets.file_browser import POPULATE_BATCH_SIZE, FileBrowser
+from android_15_tool.lib.tui.widgets.hex_view import HexView
 
 KO_FILE = "test.ko"
 RC_FILE = "init.test.rc"
@@ -87,3 +94,220 @@ async def test_file_browser_filtering(app: TuiApp):
         assert KO_FILE in all_leaves
         assert RC_FILE in all_leaves
         assert OTHER_FILE in all_leaves
+
+
+async def test_directory_scan_streams_into_log(app: TuiApp):
+    """Test that a directory scan runs in a worker and writes its results to the log."""
+    async with app.run_test() as pilot:
+        worker = pilot.app.scan_directory(".")
+        await worker.wait()
+        await pilot.pause()
+        lines = pilot.app.query_one(Log).lines
+        assert worker.state == WorkerState.SUCCESS
+        assert os.path.join(".", KO_FILE) in [line[2:] for line in lines if line.startswith("- ")]
+        assert "--- End of Scan ---" in lines
+
+
+async def test_directory_scan_groups_matches(app: TuiApp):
+    """Test that scan results are grouped under one heading per kind, in sorted order."""
+    for i in range(20):
+        os.makedirs(f"vendor{i}/modules", exist_ok=True)
+        with open(f"vendor{i}/modules/touch{i}.ko", "w") as f:
+            f.write("")
+        with open(f"vendor{i}/boot.img", "wb") as f:
+            f.write(b"ANDROID!")
+
+    try:
+        async with app.run_test() as pilot:
+            worker = pilot.app.scan_directory(".")
+            await worker.wait()
+            await pilot.pause()
+            lines = list(pilot.app.query_one(Log).lines)
+            assert lines.count(RECOVERY_SECTION) == 1 and lines.count(DRIVER_SECTION) == 1
+            recovery = lines.index(RECOVERY_SECTION)
+            drivers = lines.index(DRIVER_SECTION)
+            images = lines[recovery + 1:drivers]
+            assert images == sorted(images) and len(images) == 20
+            assert all(line.startswith("- ") and line.endswith("boot.img") for line in images)
+            modules = [line for line in lines[drivers + 1:] if line.startswith("- ")]
+            assert modules == sorted(modules) and len(modules) == 21
+    finally:
+        for i in range(20):
+            os.remove(f"vendor{i}/boot.img")
+            os.remove(f"vendor{i}/modules/touch{i}.ko")
+            os.removedirs(f"vendor{i}/modules")
+
+
+async def test_directory_scan_writes_matches_as_found(app: TuiApp):
+    """Test that a match reaches the log while the walk is still running."""
+    match = os.path.join(".", "recovery.img")
+
+    def slow_walk(path, matchers, on_directory):
+        yield "recovery_image", match
+        for _ in range(500):
+            on_directory(path)
+            time.sleep(0.01)
+
+    async with app.run_test() as pilot:
+        with patch("android_15_tool.lib.tui.app.walk_tree", side_effect=slow_walk):
+            scan = pilot.app.scan_directory(".")
+            await pilot.pause(0.5)
+            lines = list(pilot.app.query_one(Log).lines)
+            assert scan.is_running
+            assert f"Recovery image: {match}" in lines
+            assert "--- End of Scan ---" not in lines
+            scan.cancel()
+        await pilot.pause()
+
+
+async def test_new_selection_cancels_scan(app: TuiApp):
+    """Test that starting another scan cancels a scan that is still running."""
+    def slow_walk(path, matchers, on_directory):
+        for _ in range(500):
+            on_directory(path)
+            time.sleep(0.01)
+        yield "recovery_image", os.path.join(path, "recovery.img")
+
+    async with app.run_test() as pilot:
+        with patch("android_15_tool.lib.tui.app.walk_tree", side_effect=slow_walk):
+            scan = pilot.app.scan_directory(".")
+            await pilot.pause(0.1)
+            analysis = pilot.app.analyze_file(OTHER_FILE)
+            await analysis.wait()
+        await pilot.pause()
+        assert scan.state == WorkerState.CANCELLED
+        lines = pilot.app.query_one(Log).lines
+        assert "--- End of Analysis ---" in lines
+        assert "--- End of Scan ---" not in lines
+
+
+async def test_filter_keeps_expanded_directories(app: TuiApp):
+    """Test that filtering rebuilds file leaves in place without collapsing directories."""
+    os.makedirs("vendor/lib/modules", exist_ok=True)
+    with open("vendor/lib/modules/touch.ko", "w") as f:
+        f.write("dummy ko file")
+    try:
+        async with app.run_test() as pilot:
+            file_browser = pilot.app.query_one(FileBrowser)
+            vendor = next(node for node in file_browser.root.children if str(node.label) == "vendor")
+            vendor.expand()
+            await pilot.pause()
+            lib = vendor.children[0]
+            lib.expand()
+            await pilot.pause()
+
+            with patch("os.scandir", side_effect=AssertionError("listing re-read")):
+                file_browser.set_filter([".ko"])
+                await pilot.pause()
+            assert vendor.is_expanded and lib.is_expanded
+            assert [str(node.label) for node in file_browser.root.children] == ["vendor", KO_FILE]
+
+            with open("added.ko", "w") as f:
+                f.write("dummy ko file")
+            file_browser.root.collapse()
+            file_browser.root.expand()
+            await pilot.pause()
+            assert "added.ko" in [str(node.label) for node in file_browser.root.children]
+    finally:
+        if os.path.exists("added.ko"):
+            os.remove("added.ko")
+        os.remove("vendor/lib/modules/touch.ko")
+        os.removedirs("vendor/lib/modules")
+
+
+async def test_large_directory_is_added_in_batches(app: TuiApp):
+    """Test that a large directory shows its first batch at once and the rest after refreshes."""
+    os.makedirs("big", exist_ok=True)
+    names = [f"file{i:04}.bin" for i in range(POPULATE_BATCH_SIZE * 2 + 5)]
+    for name in names:
+        open(os.path.join("big", name), "w").close()
+    try:
+        async with app.run_test() as pilot:
+            file_browser = pilot.app.query_one(FileBrowser)
+            big = next(node for node in file_browser.root.children if str(node.label) == "big")
+            file_browser._populate_directory(big)
+            assert len(big.children) == POPULATE_BATCH_SIZE
+            for _ in range(10):
+                await pilot.pause()
+            assert [str(node.label) for node in big.children] == names
+    finally:
+        for name in names:
+            os.remove(os.path.join("big", name))
+        os.rmdir("big")
+
+
+async def test_browse_inside_image(app: TuiApp):
+    """Test that an image file expands into the directories stored inside it."""
+    build_erofs("system.img")
+    try:
+        async with app.run_test() as pilot:
+            file_browser = pilot.app.query_one(FileBrowser)
+            image = next(node for node in file_browser.root.children if str(node.label) == "system.img")
+            image.expand()
+            await pilot.pause()
+            await pilot.app.workers.wait_for_complete()
+            await pilot.pause()
+            assert [str(node.label) for node in image.children] == ["etc", "init"]
+
+            etc = image.children[0]
+            etc.expand()
+            await pilot.pause()
+            await pilot.app.workers.wait_for_complete()
+            await pilot.pause()
+            assert [str(node.label) for node in etc.children] == ["init.rc"]
+    finally:
+        os.remove("system.img")
+
+
+async def test_hex_view_signatures_and_search(app: TuiApp):
+    """Test that the hex view steps through signatures and searches forward in the background."""
+    with open("dtb.img", "wb") as f:
+        f.write(b"\x00" * 300 + b"\xd0\x0d\xfe\xed" + b"\x00" * 5000 + b"needle" + b"\x00" * 100)
+    try:
+        async with app.run_test() as pilot:
+            pilot.app.open_hex_view("dtb.img")
+            await pilot.app.workers.wait_for_complete()
+            await pilot.pause()
+            hex_view = pilot.app.query_one(HexView)
+            assert hex_view.display and hex_view.virtual_size.height == -(-5410 // 16)
+
+            hex_view.focus()
+            await pilot.press("n")
+            assert hex_view.cursor == 300 and "DTB" in hex_view.border_subtitle
+
+            search = pilot.app.query_one("#hex_search", Input)
+            search.value = '"needle"'
+            search.focus()
+            await pilot.press("enter")
+            await pilot.app.workers.wait_for_complete()
+            await pilot.pause()
+            assert hex_view.cursor == 5304
+            assert hex_view.scroll_offset.y > 0
+
+            search.value = "@0x10"
+            await pilot.press("enter")
+            assert hex_view.cursor == 16
+    finally:
+        os.remove("dtb.img")
+
+
+async def test_init_rc_query(app: TuiApp, tmp_path, monkeypatch):
+    """Test that an init script query from the search box writes its answer to the log."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    os.makedirs("system/etc/init/hw")
+    with open("system/etc/init/hw/init.rc", "w") as f:
+        f.write("on post-fs-data\n    start touchd\nservice touchd /vendor/bin/touchd\n")
+    try:
+        async with app.run_test() as pilot:
+            query = pilot.app.query_one("#rc_query", Input)
+            query.value = "post-fs-data"
+            query.focus()
+            await pilot.press("enter")
+            await pilot.app.workers.wait_for_complete()
+            await pilot.pause()
+            lines = pilot.app.query_one(Log).lines
+            assert "- touchd: /vendor/bin/touchd" in lines
+            assert "--- End of Query ---" in lines
+    finally:
+        os.remove("system/etc/init/hw/init.rc")
+        os.removedirs("system/etc/init/hw")
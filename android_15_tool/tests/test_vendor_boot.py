@@ -0,0 +1,118 @@
+import pytest
+
+from android_15_tool.lib.repacker import VendorBootRepacker
+from android_15_tool.lib.vendor_boot import (
+    VendorBootImage, VENDOR_RAMDISK_TABLE_FILE, read_ramdisk_table,
+)
+
+
+@pytest.fixture
+def vendor_boot_parts(tmpdir):
+    """Creates ramdisk fragments, a DTB, bootconfig and header info for a v4 vendor_boot."""
+    parts = {
+        'platform': b'P' * 5000,
+        'dlkm': b'M' * 123,
+        'dtb': b'\xd0\x0d\xfe\xed' + b'D' * 60,
+        'bootconfig': b'androidboot.hardware=qcom\n',
+    }
+    for name, data in parts.items():
+        with open(tmpdir.join(name), 'wb') as f:
+            f.write(data)
+
+    with open(tmpdir.join("header_info.txt"), 'w') as f:
+        f.write("header_version:4\n")
+        f.write("page_size:2048\n")
+        f.write("dtb_addr:31457280\n")
+
+    ramdisks = [
+        {'path': str(tmpdir.join('platform')), 'ramdisk_type': 1, 'ramdisk_name': '',
+         'board_id': [0] * 16},
+        {'path': str(tmpdir.join('dlkm')), 'ramdisk_type': 3, 'ramdisk_name': 'dlkm',
+         'board_id': [1] + [0] * 15},
+    ]
+    return tmpdir, parts, ramdisks
+
+
+def test_vendor_boot_round_trip(vendor_boot_parts):
+    """A repacked v4 vendor_boot unpacks back into the same fragments and table."""
+    tmpdir, parts, ramdisks = vendor_boot_parts
+    image = str(tmpdir.join("vendor_boot.img"))
+
+    VendorBootRepacker(image).repack(
+        str(tmpdir.join("header_info.txt")), ramdisks,
+        dtb_path=str(tmpdir.join('dtb')), bootconfig_path=str(tmpdir.join('bootconfig')),
+        cmdline="console=ttyMSM0", name="qcom",
+    )
+
+    output_dir = tmpdir.mkdir("out")
+    vendor_boot = VendorBootImage(image)
+    vendor_boot.unpack(str(output_dir))
+
+    assert vendor_boot.header['page_size'] == 2048
+    assert vendor_boot.header['vendor_ramdisk_table_entry_num'] == 2
+    assert vendor_boot.cmdline == "console=ttyMSM0"
+    assert vendor_boot.name == "qcom"
+    with open(output_dir.join('dtb'), 'rb') as f:
+        assert f.read() == parts['dtb']
+    with open(output_dir.join('bootconfig'), 'rb') as f:
+        assert f.read() == parts['bootconfig']
+
+    table = read_ramdisk_table(str(output_dir.join(VENDOR_RAMDISK_TABLE_FILE)))
+    assert [entry['ramdisk_type'] for entry in table] == [1, 3]
+    assert table[1]['ramdisk_name'] == 'dlkm'
+    assert table[1]['board_id'][0] == 1
+    with open(table[0]['path'], 'rb') as f:
+        assert f.read() == parts['platform']
+    with open(table[1]['path'], 'rb') as f:
+        assert f.read() == parts['dlkm']
+
+    # Repacking from the unpacked table reproduces the image byte for byte,
+    # taking the cmdline and board name from the unpacked files
+    image2 = str(tmpdir.join("vendor_boot2.img"))
+    VendorBootRepacker(image2).repack(
+        str(output_dir.join("header_info.txt")), table,
+        dtb_path=str(output_dir.join('dtb')), bootconfig_path=str(output_dir.join('bootconfig')),
+    )
+    with open(image, 'rb') as a, open(image2, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_ramdisk_name_with_separator_round_trips(vendor_boot_parts):
+    """A ramdisk name containing ':' or '/' survives the unpacked table unchanged."""
+    tmpdir, parts, ramdisks = vendor_boot_parts
+    ramdisks[1]['ramdisk_name'] = 'dlkm:odm/extra'
+    image = str(tmpdir.join("vendor_boot.img"))
+    VendorBootRepacker(image).repack(str(tmpdir.join("header_info.txt")), ramdisks)
+
+    output_dir = tmpdir.mkdir("out")
+    VendorBootImage(image).unpack(str(output_dir))
+    table = read_ramdisk_table(str(output_dir.join(VENDOR_RAMDISK_TABLE_FILE)))
+    assert [entry['ramdisk_name'] for entry in table] == ['', 'dlkm:odm/extra']
+    assert table[1]['path'] == str(output_dir.join('vendor_ramdisk_dlkm_odm_extra'))
+    with open(table[1]['path'], 'rb') as f:
+        assert f.read() == parts['dlkm']
+
+    image2 = str(tmpdir.join("vendor_boot2.img"))
+    VendorBootRepacker(image2).repack(str(output_dir.join("header_info.txt")), table)
+    with open(image, 'rb') as a, open(image2, 'rb') as b:
+        assert a.read() == b.read()
+
+
+def test_long_ramdisk_name_rejected(vendor_boot_parts):
+    """Ramdisk names longer than the 32 byte table field are rejected, not truncated."""
+    tmpdir, _, ramdisks = vendor_boot_parts
+    ramdisks[1]['ramdisk_name'] = 'd' * 33
+
+    with pytest.raises(RuntimeError):
+        VendorBootRepacker(str(tmpdir.join("vendor_boot.img"))).repack(
+            str(tmpdir.join("header_info.txt")), ramdisks)
+
+
+def test_invalid_magic(tmpdir):
+    """Files without the VNDRBOOT magic are rejected."""
+    path = tmpdir.join("not_vendor_boot.img")
+    with open(path, 'wb') as f:
+        f.write(b'ANDROID!' + b'\x00' * 4096)
+
+    with pytest.raises(RuntimeError):
+        VendorBootImage(str(path)).parse()
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from android_15_tool.lib.driver_finder import find_touchscreen_drivers
+from android_15_tool.lib.recovery_scanner import find_recovery_images
+from android_15_tool.lib.walker import walk_tree
+
+
+@pytest.fixture
+def firmware_tree(tmpdir):
+    """A small extracted firmware tree."""
+    tmpdir.join("boot_a.img").write_binary(b"ANDROID!" + b"\x00" * 64)
+    tmpdir.join("boot.img").write("not a boot image")
+    images = tmpdir.mkdir("images")
+    images.join("vendor_boot.bin").write_binary(b"VNDRBOOT" + b"\x00" * 64)
+    modules = tmpdir.mkdir("vendor").mkdir("lib").mkdir("modules")
+    modules.join("touch.ko").write("module")
+    init = tmpdir.join("vendor").mkdir("etc").mkdir("init")
+    init.join("touch.rc").write("on boot\n    insmod /vendor/lib/modules/touch.ko\n"
+                                "    insmod /vendor/lib/modules/extra-ts.ko\n")
+    return tmpdir
+
+
+def test_recovery_images_are_matched_by_magic(firmware_tree):
+    """Boot and vendor boot images are found by content, not by name."""
+    assert find_recovery_images(str(firmware_tree)) == [
+        str(firmware_tree.join("boot_a.img")), str(firmware_tree.join("images", "vendor_boot.bin"))]
+
+
+def test_touchscreen_drivers_from_modules_and_rc(firmware_tree):
+    """Module files and insmod lines are reported once each."""
+    modules = "/vendor/lib/modules/"
+    assert find_touchscreen_drivers(str(firmware_tree)) == sorted([
+        modules + "extra-ts.ko", modules + "touch.ko",
+        str(firmware_tree.join("vendor", "lib", "modules", "touch.ko"))])
+
+
+def test_walk_tree_visits_each_directory_once(firmware_tree):
+    """Every directory is reported to on_directory once, and a raising callback stops the walk."""
+    class Stop(Exception):
+        pass
+
+    visited = []
+    list(walk_tree(str(firmware_tree), [], visited.append))
+    expected = [root for root, _, _ in os.walk(str(firmware_tree))]
+    assert sorted(visited) == sorted(expected)
+
+    def stop(path):
+        if path != str(firmware_tree):
+            raise Stop()
+    with pytest.raises(Stop):
+        list(walk_tree(str(firmware_tree), [], stop))
@@ -1,11 +1,20 @@
 """
 Tests for the device_dumper module.
 """
+import gzip
+import hashlib
+import io
+import json
+import re
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 import os
 import subprocess
-from android_15_tool.device_dumper import dump_partition
+from android_15_tool.device_dumper import (
+    DD_BLOCK_SIZE, differential_dump, dump_partition, dump_partitions, stream_partition,
+)
 
 class TestDeviceDumper(unittest.TestCase):
 
@@ -67,5 +76,149 @@ class TestDeviceDumper(unittest.TestCase):
         local_path = os.path.join(output_dir, "system.img")
         self.assertFalse(os.path.exists(local_path)) # File should not be created
 
+    def _fake_stream(self, data, returncode=0):
+        process = MagicMock()
+        process.stdout = io.BytesIO(data)
+        process.stderr = io.BytesIO(b"")
+        process.wait.return_value = returncode
+        return process
+
+    @patch('subprocess.Popen')
+    def test_stream_partition_success(self, mock_popen):
+        """Test streaming a partition straight into the output file."""
+        data = os.urandom(5 * 1024 * 1024 + 123)
+        mock_popen.return_value = self._fake_stream(data)
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+
+        result = stream_partition("boot", output_dir)
+
+        command = mock_popen.call_args.args[0]
+        self.assertEqual(command[:4], ["adb", "exec-out", "su", "-c"])
+        self.assertIn("dd if=/dev/block/by-name/boot bs=", command[-1])
+        self.assertNotIn("/data/local/tmp", command[-1])
+        self.assertEqual(result['size'], len(data))
+        self.assertEqual(result['sha256'], hashlib.sha256(data).hexdigest())
+        with open(os.path.join(output_dir, "boot.img"), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    @patch('subprocess.Popen')
+    def test_stream_partition_empty(self, mock_popen):
+        """Test that an empty stream (missing partition or no root) leaves no file behind."""
+        mock_popen.return_value = self._fake_stream(b"")
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+
+        self.assertIsNone(stream_partition("missing", output_dir))
+        self.assertEqual(os.listdir(output_dir), [])
+
+    def test_dump_partitions_resumes(self):
+        """Test that an interrupted multi-partition dump only fetches the missing ranges."""
+        images = {"boot": os.urandom(2 * DD_BLOCK_SIZE + 500), "modem": os.urandom(DD_BLOCK_SIZE)}
+        streamed = []
+        broken = {("boot", 1)}
+
+        def fake_popen(command, **kwargs):
+            m = re.search(r"by-name/(\w+) bs=(\d+) skip=(\d+) count=(\d+)", command[-1])
+            name, bs, skip, count = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4))
+            streamed.append((name, skip))
+            data = images[name][skip * bs:(skip + count) * bs]
+            return self._fake_stream(data[:10] if (name, skip) in broken else data)
+
+        def fake_run(command, **kwargs):
+            name = re.search(r"by-name/(\w+)", command[-1]).group(1)
+            return MagicMock(stdout=f"{len(images[name])}\n", stderr="")
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with patch('subprocess.Popen', side_effect=fake_popen), patch('subprocess.run', side_effect=fake_run):
+            results = dump_partitions(["boot", "modem"], output_dir, workers=2, range_size=DD_BLOCK_SIZE)
+            self.assertIsNotNone(results[0]['error'])
+            self.assertIsNone(results[1]['error'])
+            with open(os.path.join(output_dir, "boot.img.journal")) as f:
+                self.assertEqual(sorted(json.load(f)['done']), ["0", "2"])
+
+            broken.clear()
+            streamed.clear()
+            results = dump_partitions(["boot"], output_dir, workers=2, range_size=DD_BLOCK_SIZE)
+
+        self.assertEqual(streamed, [("boot", 1)])
+        self.assertEqual(results[0]['resumed'], DD_BLOCK_SIZE + 500)
+        self.assertEqual(results[0]['sha256'], hashlib.sha256(images["boot"]).hexdigest())
+        self.assertEqual(sorted(os.listdir(output_dir)), ["boot.img", "boot.img.manifest", "modem.img", "modem.img.manifest"])
+        for name, data in images.items():
+            with open(os.path.join(output_dir, f"{name}.img"), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_dump_partitions_compressed(self):
+        """Test that a gzip-compressed stream is decompressed into a sparse image."""
+        image = os.urandom(1000) + bytes(2 * DD_BLOCK_SIZE) + os.urandom(1000)
+
+        def fake_popen(command, **kwargs):
+            self.assertIn("| gzip -c -1", command[-1])
+            m = re.search(r"bs=(\d+) skip=(\d+) count=(\d+)", command[-1])
+            bs, skip, count = (int(g) for g in m.groups())
+            return self._fake_stream(gzip.compress(image[skip * bs:(skip + count) * bs]))
+
+        def fake_run(command, **kwargs):
+            if "command -v" in command[-1]:
+                return MagicMock(stdout="gzip\n", stderr="")
+            return MagicMock(stdout=f"{len(image)}\n", stderr="")
+
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with patch('subprocess.Popen', side_effect=fake_popen), patch('subprocess.run', side_effect=fake_run):
+            result = dump_partitions(["userdata"], output_dir, workers=1, range_size=DD_BLOCK_SIZE,
+                                     compression='gzip')[0]
+
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['sha256'], hashlib.sha256(image).hexdigest())
+        self.assertLess(result['transferred'], len(image) // 2)
+        path = os.path.join(output_dir, "userdata.img")
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertLess(os.stat(path).st_blocks * 512, len(image))
+
+    def test_differential_dump(self):
+        """Test that only the chunks whose device-side hash changed are pulled."""
+        old_image = os.urandom(3 * DD_BLOCK_SIZE + 700)
+        new_image = old_image[:DD_BLOCK_SIZE] + os.urandom(DD_BLOCK_SIZE) + old_image[2 * DD_BLOCK_SIZE:] + b"tail"
+        streamed = []
+
+        def fake_popen(command, **kwargs):
+            m = re.search(r"bs=(\d+) skip=(\d+) count=(\d+)", command[-1])
+            bs, skip, count = (int(g) for g in m.groups())
+            streamed.append((skip, count))
+            return self._fake_stream(new_image[skip * bs:(skip + count) * bs])
+
+        def fake_run(command, **kwargs):
+            if "blockdev" in command[-1]:
+                return MagicMock(stdout=f"{len(new_image)}\n", stderr="")
+            self.assertIn("sha256sum", command[-1])
+            hashes = [hashlib.sha256(new_image[i:i + DD_BLOCK_SIZE]).hexdigest()
+                      for i in range(0, len(new_image), DD_BLOCK_SIZE)]
+            return MagicMock(stdout="".join(f"{h}  -\n" for h in hashes), stderr="")
+
+        previous_dir, output_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, previous_dir)
+        self.addCleanup(shutil.rmtree, output_dir)
+        with open(os.path.join(previous_dir, "super.img"), 'wb') as f:
+            f.write(old_image)
+
+        with patch('subprocess.Popen', side_effect=fake_popen), patch('subprocess.run', side_effect=fake_run):
+            result = differential_dump("super", output_dir, previous_dir, chunk_size=DD_BLOCK_SIZE)
+
+        self.assertIsNone(result['error'])
+        self.assertEqual(streamed, [(1, 1), (3, 1)])
+        self.assertEqual((result['changed_chunks'], result['chunks']), (2, 4))
+        self.assertEqual(result['pulled'], DD_BLOCK_SIZE + 704)
+        self.assertEqual(result['sha256'], hashlib.sha256(new_image).hexdigest())
+        with open(os.path.join(output_dir, "super.img"), 'rb') as f:
+            self.assertEqual(f.read(), new_image)
+        with open(os.path.join(output_dir, "super.img.manifest")) as f:
+            self.assertEqual(len(json.load(f)['chunks']), 4)
+        with open(os.path.join(previous_dir, "super.img"), 'rb') as f:
+            self.assertEqual(f.read(), old_image)
+
 if __name__ == '__main__':
     unittest.main()